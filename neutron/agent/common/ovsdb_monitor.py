@@ -13,9 +13,11 @@
 #    under the License.
 
 import collections
+import threading
 
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from ovsdbapp.backend.ovs_idl import event as idl_event
 
 from neutron.agent.common import async_process
 from neutron.agent.ovsdb import api as ovsdb
@@ -169,3 +171,148 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
                     events_filtered[etype].append(device)
 
         return events_filtered
+
+
+def _get_interface_device(row):
+    """Returns the event device of an IDL Interface row.
+
+    The device has the same format as the ones of SimpleInterfaceMonitor.
+    """
+    return {'name': row.name,
+            'ofport': row.ofport[0] if row.ofport else [],
+            'external_ids': dict(row.external_ids)}
+
+
+class InterfaceRowEvent(idl_event.RowEvent):
+    """Records the Interface table changes in an IdlInterfaceMonitor."""
+
+    COLUMNS = ('name', 'ofport', 'external_ids')
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        super(InterfaceRowEvent, self).__init__(
+            (self.ROW_CREATE, self.ROW_UPDATE, self.ROW_DELETE),
+            'Interface', None)
+        self.event_name = 'InterfaceRowEvent'
+
+    def match_fn(self, event, row, old):
+        if event != self.ROW_UPDATE:
+            return True
+        # 'old' only holds the columns changed by the update
+        for column in self.COLUMNS:
+            try:
+                getattr(old, column)
+            except (KeyError, AttributeError):
+                continue
+            return True
+        return False
+
+    def run(self, event, row, old):
+        self.monitor.record_event(event, _get_interface_device(row))
+
+
+class IdlInterfaceMonitor(object):
+    """Monitors the Interface table with the native OVSDB IDL connection.
+
+    The changes are received as row events of the IDL connection already
+    used by the agent, so no 'ovsdb-client monitor' process is run and the
+    bridge filtering is done on the IDL tables, without querying the ovsdb.
+    The events returned are the same as the ones of SimpleInterfaceMonitor.
+    """
+
+    def __init__(self, idl_monitor, bridge_names=None):
+        self._idl = idl_monitor
+        self._bridge_names = bridge_names or []
+        self._row_event = InterfaceRowEvent(self)
+        self._lock = threading.Lock()
+        self._started = False
+        # {interface name: bridge name} of the filtered interfaces
+        self._port_to_bridge = {}
+        self._reset_events()
+
+    def _reset_events(self):
+        self.new_events = {'added': [], 'removed': [], 'modified': []}
+        self._added_by_name = {}
+
+    def start(self, block=False, timeout=60):
+        # watch the events before reading the table so no change is missed,
+        # the interfaces created meanwhile are reported twice as added.
+        self._idl.notify_handler.watch_event(self._row_event)
+        with self._lock:
+            self._started = True
+            self._reset_events()
+            # the existing interfaces are reported as added, like the initial
+            # rows of 'ovsdb-client monitor'
+            for row in list(self._idl.tables['Interface'].rows.values()):
+                self._record_added(_get_interface_device(row))
+        if block:
+            utils.wait_until_true(self.is_active, timeout=timeout)
+
+    def stop(self):
+        self._idl.notify_handler.unwatch_event(self._row_event)
+        with self._lock:
+            self._started = False
+
+    def is_active(self):
+        return self._started and self._idl.is_connected()
+
+    def _record_added(self, device):
+        self.new_events['added'].append(device)
+        self._added_by_name[device['name']] = device
+
+    def record_event(self, event, device):
+        with self._lock:
+            if not self._started:
+                return
+            if event == InterfaceRowEvent.ROW_CREATE:
+                self._record_added(device)
+            elif event == InterfaceRowEvent.ROW_DELETE:
+                self.new_events['removed'].append(device)
+            elif device['name'] in self._added_by_name:
+                # the ofport of a new interface is usually set by a later
+                # update, report it with the added device
+                self._added_by_name[device['name']].update(device)
+            else:
+                self.new_events['modified'].append(device)
+
+    @property
+    def has_updates(self):
+        """Indicate whether the ovsdb Interface table has been updated."""
+        if not self.is_active():
+            LOG.error("Interface monitor is not active")
+        with self._lock:
+            return any(self.new_events.values())
+
+    def get_events(self):
+        with self._lock:
+            events = self.new_events
+            self._reset_events()
+        return self._filter_events(events)
+
+    def _get_interface_bridges(self):
+        """Returns the bridge of the interfaces of the filtered bridges."""
+        iface_to_bridge = {}
+        for bridge in list(self._idl.tables['Bridge'].rows.values()):
+            if bridge.name not in self._bridge_names:
+                continue
+            for port in bridge.ports:
+                for iface in port.interfaces:
+                    iface_to_bridge[iface.name] = bridge.name
+        return iface_to_bridge
+
+    def _filter_events(self, events):
+        if not self._bridge_names:
+            return events
+
+        iface_to_bridge = self._get_interface_bridges()
+        events_filtered = {'added': [], 'removed': [], 'modified': []}
+        for etype in ('added', 'modified'):
+            for device in events[etype]:
+                bridge_name = iface_to_bridge.get(device['name'])
+                if bridge_name:
+                    self._port_to_bridge[device['name']] = bridge_name
+                    events_filtered[etype].append(device)
+        for device in events['removed']:
+            if self._port_to_bridge.pop(device['name'], None):
+                events_filtered['removed'].append(device)
+        return events_filtered
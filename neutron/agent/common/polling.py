@@ -47,7 +47,11 @@ def get_polling_manager(minimize_polling=False,
 
 
 class InterfacePollingMinimizer(base_polling.BasePollingManager):
-    """Monitors ovsdb to determine when polling is required."""
+    """Monitors ovsdb to determine when polling is required.
+
+    If 'ovs' is given, the Interface table is monitored with its native
+    OVSDB IDL connection, otherwise with an 'ovsdb-client monitor' process.
+    """
 
     def __init__(
             self,
@@ -55,10 +59,14 @@ class InterfacePollingMinimizer(base_polling.BasePollingManager):
             bridge_names=None, ovs=None):
 
         super(InterfacePollingMinimizer, self).__init__()
-        self._monitor = ovsdb_monitor.SimpleInterfaceMonitor(
-            respawn_interval=ovsdb_monitor_respawn_interval,
-            ovsdb_connection=cfg.CONF.OVS.ovsdb_connection,
-            bridge_names=bridge_names, ovs=ovs)
+        if ovs is not None:
+            self._monitor = ovsdb_monitor.IdlInterfaceMonitor(
+                ovs.ovsdb.idl_monitor, bridge_names=bridge_names)
+        else:
+            self._monitor = ovsdb_monitor.SimpleInterfaceMonitor(
+                respawn_interval=ovsdb_monitor_respawn_interval,
+                ovsdb_connection=cfg.CONF.OVS.ovsdb_connection,
+                bridge_names=bridge_names)
 
     def start(self):
         self._monitor.start(block=True)
@@ -13,13 +13,22 @@
 #    under the License.
 #
 
+import collections
+import contextlib
 import datetime
+import heapq
 import queue
 import time
 
+import eventlet
+from oslo_log import log as logging
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
 
+from neutron.agent.common import utils
+
+LOG = logging.getLogger(__name__)
+
 
 class ResourceUpdate(object):
     """Encapsulates a resource update
@@ -163,26 +172,118 @@ class ResourceProcessingQueue(object):
     """Manager of the queue of resources to process."""
     def __init__(self):
         self._queue = queue.PriorityQueue()
+        # number of queued updates per resource
+        self._queued_ids = collections.Counter()
+        self._coalesced_updates = 0
+        self._timings = utils.PhaseTimings()
 
     def add(self, update):
         update.tries -= 1
+        self._queued_ids[update.id] += 1
         self._queue.put(update)
 
+    def _get(self):
+        update = self._queue.get()
+        self._forget_queued_id(update.id)
+        return update
+
+    def _forget_queued_id(self, resource_id, count=1):
+        self._queued_ids[resource_id] -= count
+        if self._queued_ids[resource_id] <= 0:
+            del self._queued_ids[resource_id]
+
+    def _pop_queued_updates(self, resource_id):
+        """Removes the queued updates of a resource from the queue."""
+        if resource_id not in self._queued_ids:
+            return []
+        # NOTE: the PriorityQueue keeps its items in the heap list 'queue'.
+        # The native queue guards it with its mutex; the green one used once
+        # eventlet monkey patches the agent has none, as it doesn't yield
+        # while the heap is rewritten.
+        with getattr(self._queue, 'mutex', contextlib.nullcontext()):
+            heap = self._queue.queue
+            updates = [u for u in heap if u.id == resource_id]
+            heap[:] = [u for u in heap if u.id != resource_id]
+            heapq.heapify(heap)
+        self._forget_queued_id(resource_id, len(updates))
+        return updates
+
     def each_update_to_next_resource(self):
         """Grabs the next resource from the queue and processes
 
         This method uses a for loop to process the resource repeatedly until
-        updates stop bubbling to the front of the queue.
+        updates stop bubbling to the front of the queue. The other updates
+        of the resource waiting in the queue are processed in the same loop,
+        so that they are coalesced with the first one.
         """
-        next_update = self._queue.get()
+        next_update = self._get()
 
         with ExclusiveResourceProcessor(next_update.id) as rp:
             # Queue the update whether this worker is the primary or not.
             rp.queue_update(next_update)
+            for update in self._pop_queued_updates(next_update.id):
+                self._coalesced_updates += 1
+                rp.queue_update(update)
 
             # Here, if the current worker is not the primary, the call to
             # rp.updates() will not yield and so this will essentially be a
             # noop.
             for update in rp.updates():
                 update.set_start_time()
+                self._timings.record('wait', update.time_elapsed_since_create)
                 yield (rp, update)
+
+    def get_stats(self):
+        """Returns the queue depth and the wait time of the updates.
+
+        The wait time is the 99th percentile of the number of seconds
+        between the creation of an update and the start of its processing.
+        The values are scalars, as they are reported in the agent state.
+        """
+        return {'depth': self._queue.qsize(),
+                'coalesced_updates': self._coalesced_updates,
+                'wait_time_p99': self._timings.get_percentile(99).get(
+                    'wait', 0.0)}
+
+
+class ResourceProcessingWorkers(object):
+    """Pool of greenthreads processing the queued resource updates.
+
+    Each worker calls the process function in a loop; the function blocks
+    on the ResourceProcessingQueue until an update is available. When the
+    pool is shrunk, the extra workers exit after their current update.
+    """
+
+    def __init__(self, process, size):
+        self._process = process
+        self._size = size
+        self._running = 0
+        self._started = False
+
+    @property
+    def size(self):
+        return self._size
+
+    def start(self):
+        self._started = True
+        self._spawn_workers()
+
+    def resize(self, size):
+        self._size = size
+        if self._started:
+            self._spawn_workers()
+
+    def _spawn_workers(self):
+        while self._running < self._size:
+            self._running += 1
+            eventlet.spawn_n(self._run)
+
+    def _run(self):
+        try:
+            while self._running <= self._size:
+                try:
+                    self._process()
+                except Exception:
+                    LOG.exception("Failed to process a resource update")
+        finally:
+            self._running -= 1
@@ -13,13 +13,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import bisect
+import collections
+import contextlib
+import math
 import os
 import socket
+import time
 
 from eventlet import patcher
 from neutron_lib.utils import runtime
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_reports.models import with_default_views
 from oslo_utils import eventletutils
 from oslo_utils import timeutils
 
@@ -156,3 +162,89 @@ def default_rp_hypervisors(hypervisors, device_mappings,
             else:
                 rv[device] = _default_hypervisor
     return rv
+
+
+class PhaseTimings(object):
+    """Latency histograms of the phases of a periodic agent loop.
+
+    The durations of each phase are counted in buckets, whose upper bounds
+    in seconds are BUCKETS, and the last 'window' durations are kept to
+    compute the percentiles.
+    """
+
+    BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, window=1000):
+        self._window = window
+        self._phases = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def measure(self, phase):
+        """Records the duration of the block as a duration of phase."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(phase, time.monotonic() - start)
+
+    def record(self, phase, duration):
+        stats = self._phases.get(phase)
+        if stats is None:
+            stats = self._phases[phase] = {
+                'count': 0, 'total': 0.0, 'max': 0.0,
+                'buckets': [0] * (len(self.BUCKETS) + 1),
+                'samples': collections.deque(maxlen=self._window)}
+        stats['count'] += 1
+        stats['total'] += duration
+        stats['max'] = max(stats['max'], duration)
+        stats['buckets'][bisect.bisect_left(self.BUCKETS, duration)] += 1
+        stats['samples'].append(duration)
+
+    @staticmethod
+    def _get_percentile(sorted_samples, percentile):
+        # nearest rank
+        rank = math.ceil(percentile / 100.0 * len(sorted_samples))
+        return sorted_samples[max(rank - 1, 0)]
+
+    def get_summary(self):
+        """Returns the count, percentiles and maximum duration per phase.
+
+        The durations are in seconds, rounded to the millisecond.
+        """
+        summary = {}
+        for phase, stats in self._phases.items():
+            samples = sorted(stats['samples'])
+            phase_summary = summary[phase] = {
+                'count': stats['count'],
+                'max': round(stats['max'], 3)}
+            for percentile in self.PERCENTILES:
+                phase_summary['p%d' % percentile] = round(
+                    self._get_percentile(samples, percentile), 3)
+        return summary
+
+    def get_percentile(self, percentile):
+        """Returns a percentile of the durations of each phase.
+
+        The durations are in seconds, rounded to the millisecond.
+        """
+        return {phase: round(self._get_percentile(
+                    sorted(stats['samples']), percentile), 3)
+                for phase, stats in self._phases.items()}
+
+    def get_report(self):
+        """Returns the summary with the mean duration and histogram.
+
+        The histogram is keyed by the upper bound of each bucket.
+        """
+        report = self.get_summary()
+        for phase, stats in self._phases.items():
+            bounds = ['<=%s' % b for b in self.BUCKETS]
+            bounds.append('>%s' % self.BUCKETS[-1])
+            report[phase]['mean'] = round(stats['total'] / stats['count'], 3)
+            report[phase]['histogram'] = dict(zip(bounds, stats['buckets']))
+        return report
+
+    def get_report_model(self):
+        """Guru Meditation Report section generator of the report."""
+        return with_default_views.ModelWithDefaultViews(self.get_report())
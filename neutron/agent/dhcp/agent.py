@@ -104,6 +104,32 @@ class DHCPResourceUpdate(queue.ResourceUpdate):
         return super().__lt__(other)
 
 
+class PendingNetworkReload(object):
+    """A dnsmasq reload deferred until the queued updates are processed.
+
+    The port updates of a network processed in one pass are merged in a
+    single reload_allocations call, their ports are marked as ready once
+    the reload is done.
+    """
+
+    def __init__(self):
+        self.requested = False
+        self.ready_ports = set()
+        self.prio_ready_ports = set()
+        self.coalesced = 0
+
+    def request(self, port_id=None, prio=False):
+        if self.requested:
+            self.coalesced += 1
+        self.requested = True
+        if port_id is None:
+            return
+        if prio:
+            self.prio_ready_ports.add(port_id)
+        else:
+            self.ready_ports.add(port_id)
+
+
 class DhcpAgent(manager.Manager):
     """DHCP agent service manager.
 
@@ -145,9 +171,13 @@ class DhcpAgent(manager.Manager):
             config=self.conf,
             resource_type='dhcp')
         self._pool_size = DHCP_PROCESS_GREENLET_MIN
-        self._pool = eventlet.GreenPool(size=self._pool_size)
+        self._pool = queue.ResourceProcessingWorkers(
+            self._process_resource_update, self._pool_size)
         self._queue = queue.ResourceProcessingQueue()
         self._network_bulk_allocations = {}
+        self._bulk_reload_event = threading.Event()
+        # {network_id: PendingNetworkReload} of the networks being processed
+        self._pending_reloads = {}
         # Each dhcp-agent restart should trigger a restart of all
         # metadata-proxies too. This way we can ensure that changes in
         # the metadata-proxy config we generate will be applied soon
@@ -195,6 +225,11 @@ class DhcpAgent(manager.Manager):
 
     def _reload_bulk_allocations(self):
         while True:
+            # Sleep until a reload is requested, then for the interval to
+            # batch the reloads requested meanwhile.
+            self._bulk_reload_event.wait()
+            self._bulk_reload_event.clear()
+            eventlet.greenthread.sleep(self.conf.bulk_reload_interval)
             # No need to lock access to _network_bulk_allocations because
             # greenthreads multi-task co-operatively.
             to_reload = self._network_bulk_allocations.keys()
@@ -204,7 +239,6 @@ class DhcpAgent(manager.Manager):
                 network = self.cache.get_network_by_id(network_id)
                 if network is not None:
                     self.call_driver('bulk_reload_allocations', network)
-            eventlet.greenthread.sleep(self.conf.bulk_reload_interval)
 
     def call_driver(self, action, network, **action_kwargs):
         """Invoke an action on a DHCP driver instance."""
@@ -213,6 +247,7 @@ class DhcpAgent(manager.Manager):
         if self.conf.bulk_reload_interval and action == 'reload_allocations':
             LOG.debug("Call deferred to bulk load")
             self._network_bulk_allocations[network.id] = True
+            self._bulk_reload_event.set()
             return True
         if action == 'bulk_reload_allocations':
             action = 'reload_allocations'
@@ -592,14 +627,36 @@ class DhcpAgent(manager.Manager):
 
     def _process_loop(self):
         LOG.debug("Starting _process_loop")
-
-        while True:
-            self._pool.spawn_n(self._process_resource_update)
+        self._pool.start()
 
     def _process_resource_update(self):
-        for tmp, update in self._queue.each_update_to_next_resource():
-            method = getattr(self, update.action)
-            method(update.resource)
+        network_id = None
+        try:
+            for tmp, update in self._queue.each_update_to_next_resource():
+                if network_id is None:
+                    network_id = update.id
+                    self._pending_reloads[network_id] = PendingNetworkReload()
+                method = getattr(self, update.action)
+                method(update.resource)
+        finally:
+            if network_id is not None:
+                self._reload_pending_network(network_id)
+
+    @_wait_if_syncing
+    def _reload_pending_network(self, network_id):
+        """Does the reload deferred while processing the network updates."""
+        pending = self._pending_reloads.pop(network_id)
+        if pending.requested:
+            network = self.cache.get_network_by_id(network_id)
+            if network:
+                if pending.coalesced:
+                    LOG.debug("Coalesced %(count)d reloads of network "
+                              "%(net)s", {'count': pending.coalesced + 1,
+                                          'net': network_id})
+                self.call_driver('reload_allocations', network)
+                self.update_isolated_metadata_proxy(network)
+        self.dhcp_ready_ports |= pending.ready_ports
+        self.dhcp_prio_ready_ports |= pending.prio_ready_ports
 
     def port_update_end(self, context, payload):
         """Handle the port.update.end notification event."""
@@ -655,6 +712,10 @@ class DhcpAgent(manager.Manager):
                           network.id, old_ips, new_ips)
                 driver_action = 'restart'
         self.cache.put_port(port)
+        pending = self._pending_reloads.get(network.id)
+        if pending is not None and driver_action == 'reload_allocations':
+            pending.request(port.id, prio)
+            return
         self.call_driver(driver_action, network)
         if prio:
             self.dhcp_prio_ready_ports.add(port.id)
@@ -739,6 +800,8 @@ class DhcpAgent(manager.Manager):
             # (or acquire a reserved) port.
             self.call_driver('disable', network)
             self.schedule_resync("Agent port was deleted", port.network_id)
+        elif network.id in self._pending_reloads:
+            self._pending_reloads[network.id].request()
         else:
             self.call_driver('reload_allocations', network)
             self.update_isolated_metadata_proxy(network)
@@ -1087,6 +1150,8 @@ class DhcpAgentWithStateReport(DhcpAgent):
         try:
             self.agent_state.get('configurations').update(
                 self.cache.get_state())
+            self.agent_state['configurations']['resource_queue'] = (
+                self._queue.get_stats())
             ctx = context.get_admin_context_without_session()
             agent_status = self.state_rpc.report_state(
                 ctx, self.agent_state, True)
@@ -328,7 +328,8 @@ class L3NATAgent(ha.AgentMixin,
 
         # L3 agent router processing green pool
         self._pool_size = ROUTER_PROCESS_GREENLET_MIN
-        self._pool = eventlet.GreenPool(size=self._pool_size)
+        self._pool = queue.ResourceProcessingWorkers(self._process_update,
+                                                     self._pool_size)
         self._queue = queue.ResourceProcessingQueue()
         super(L3NATAgent, self).__init__(host=self.conf.host)
 
@@ -869,8 +870,8 @@ class L3NATAgent(ha.AgentMixin,
 
     def _process_routers_loop(self):
         LOG.debug("Starting _process_routers_loop")
-        while not self._exiting:
-            self._pool.spawn_n(self._process_update)
+        if not self._exiting:
+            self._pool.start()
 
     # NOTE(kevinbenton): this is set to 1 second because the actual interval
     # is controlled by a FixedIntervalLoopingCall in neutron/service.py that
@@ -988,6 +989,7 @@ class L3NATAgent(ha.AgentMixin,
         LOG.info("Stopping L3 agent")
         if self.conf.cleanup_on_shutdown:
             self._exiting = True
+            self._pool.resize(0)
             for router in self.router_info.values():
                 router.delete()
 
@@ -1045,6 +1047,7 @@ class L3NATAgentWithStateReport(L3NATAgent):
         configurations['ex_gw_ports'] = num_ex_gw_ports
         configurations['interfaces'] = num_interfaces
         configurations['floating_ips'] = num_floating_ips
+        configurations['resource_queue'] = self._queue.get_stats()
         try:
             agent_status = self.state_rpc.report_state(self.context,
                                                        self.agent_state,
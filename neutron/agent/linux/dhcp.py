@@ -16,6 +16,7 @@
 import abc
 import collections
 import copy
+import functools
 import io
 import itertools
 import os
@@ -351,6 +352,77 @@ class DhcpLocalProcess(DhcpBase, metaclass=abc.ABCMeta):
         pass
 
 
+DnsmasqHostEntry = collections.namedtuple(
+    'DnsmasqHostEntry', 'revision hosts addn_hosts leases')
+
+
+class DnsmasqHostsModel(object):
+    """The dnsmasq hosts and addn_hosts file lines of a network, per port.
+
+    A port is rendered again only when its revision number changes, or when
+    the settings used to render every port change. The ports without a
+    revision number are always rendered again.
+    """
+
+    def __init__(self):
+        self.render_key = None
+        # [DnsmasqHostEntry], in the order of the network ports
+        self.entries = []
+        self._entries_by_port = {}
+        self._lease_counts = collections.Counter()
+
+    def update(self, ports, render_key, render):
+        """Updates the model with the current ports of the network.
+
+        :param ports: the ports of the network.
+        :param render_key: the settings used to render the ports.
+        :param render: a function rendering the DnsmasqHostEntry of a port,
+                       called with the port and its revision number.
+        :returns: the (ip, mac, client_id) leases of the ports removed or
+                  changed that no port owns anymore.
+        """
+        cached = self._entries_by_port
+        if render_key != self.render_key:
+            self.render_key = render_key
+            cached = {}
+        entries = []
+        entries_by_port = {}
+        for port in ports:
+            revision = getattr(port, 'revision_number', None)
+            entry = cached.get(port.id)
+            if (entry is None or revision is None or
+                    entry.revision != revision):
+                entry = render(port, revision)
+            entries.append(entry)
+            entries_by_port[port.id] = entry
+
+        old_entries = {id(entry): entry for entry in self.entries}
+        new_entries = {id(entry): entry for entry in entries}
+        removed_leases = set()
+        for key, entry in old_entries.items():
+            if key not in new_entries:
+                for lease in entry.leases:
+                    self._lease_counts[lease] -= 1
+                    if self._lease_counts[lease] <= 0:
+                        del self._lease_counts[lease]
+                removed_leases |= entry.leases
+        for key, entry in new_entries.items():
+            if key not in old_entries:
+                self._lease_counts.update(entry.leases)
+        self.entries = entries
+        self._entries_by_port = entries_by_port
+        return {lease for lease in removed_leases
+                if lease not in self._lease_counts}
+
+    def get_hosts_lines(self):
+        return itertools.chain.from_iterable(
+            entry.hosts for entry in self.entries)
+
+    def get_addn_hosts_lines(self):
+        return itertools.chain.from_iterable(
+            entry.addn_hosts for entry in self.entries)
+
+
 class Dnsmasq(DhcpLocalProcess):
     # The ports that need to be opened when security policies are active
     # on the Neutron port used for DHCP.  These are provided as a convenience
@@ -373,6 +445,9 @@ class Dnsmasq(DhcpLocalProcess):
     _IS_DHCP_RELEASE6_SUPPORTED = None
     _IS_HOST_TAG_SUPPORTED = None
 
+    # {network_id: DnsmasqHostsModel}, shared by the driver instances
+    _hosts_models = {}
+
     @classmethod
     def check_version(cls):
         pass
@@ -589,7 +664,7 @@ class Dnsmasq(DhcpLocalProcess):
                       'anymore, skipping reload: %s', self.network.id)
             return
 
-        self._release_unused_leases()
+        self._release_unused_leases(self._update_hosts_model())
         self._spawn_or_reload_process(reload_with_HUP=True)
         LOG.debug('Reloading allocations for network: %s', self.network.id)
         self.device_manager.update(self.network, self.interface_name)
@@ -731,41 +806,109 @@ class Dnsmasq(DhcpLocalProcess):
             tag,    # A dhcp-host tag to add to the configuration if supported
         )
         """
-        v6_nets = dict((subnet.id, subnet) for subnet in
-                       self._get_all_subnets(self.network)
-                       if subnet.ip_version == 6)
-
+        v6_nets = self._get_v6_nets()
         for port in self.network.ports:
-            if not port_requires_dhcp_configuration(port):
-                continue
+            yield from self._iter_port_hosts(port, v6_nets, merge_addr6_list)
 
-            fixed_ips = self._sort_fixed_ips_for_dnsmasq(port.fixed_ips,
-                                                         v6_nets)
-            # TODO(hjensas): Drop this conditional and option once distros
-            #  generally have dnsmasq supporting addr6 list and range.
-            if self.conf.dnsmasq_enable_addr6_list and merge_addr6_list:
-                fixed_ips = self._merge_alloc_addr6_list(fixed_ips, v6_nets)
-            # Confirm whether Neutron server supports dns_name attribute in the
-            # ports API
-            dns_assignment = getattr(port, 'dns_assignment', None)
-            for alloc in fixed_ips:
-                no_dhcp = False
-                no_opts = False
-                tag = ''
-                if alloc.subnet_id in v6_nets:
-                    addr_mode = v6_nets[alloc.subnet_id].ipv6_address_mode
-                    no_dhcp = addr_mode in (constants.IPV6_SLAAC,
-                                            constants.DHCPV6_STATELESS)
-                    if self._is_dnsmasq_host_tag_supported():
-                        tag = HOST_DHCPV6_TAG
-                    # we don't setup anything for SLAAC. It doesn't make sense
-                    # to provide options for a client that won't use DHCP
-                    no_opts = addr_mode == constants.IPV6_SLAAC
-
-                hostname, fqdn = self._get_dns_assignment(alloc.ip_address,
-                                                          dns_assignment)
-
-                yield (port, alloc, hostname, fqdn, no_dhcp, no_opts, tag)
+    def _get_v6_nets(self):
+        return dict((subnet.id, subnet) for subnet in
+                    self._get_all_subnets(self.network)
+                    if subnet.ip_version == 6)
+
+    def _iter_port_hosts(self, port, v6_nets, merge_addr6_list=False):
+        """Iterate over the hosts of a port, see _iter_hosts."""
+        if not port_requires_dhcp_configuration(port):
+            return
+
+        fixed_ips = self._sort_fixed_ips_for_dnsmasq(port.fixed_ips, v6_nets)
+        # TODO(hjensas): Drop this conditional and option once distros
+        #  generally have dnsmasq supporting addr6 list and range.
+        if self.conf.dnsmasq_enable_addr6_list and merge_addr6_list:
+            fixed_ips = self._merge_alloc_addr6_list(fixed_ips, v6_nets)
+        # Confirm whether Neutron server supports dns_name attribute in the
+        # ports API
+        dns_assignment = getattr(port, 'dns_assignment', None)
+        for alloc in fixed_ips:
+            no_dhcp = False
+            no_opts = False
+            tag = ''
+            if alloc.subnet_id in v6_nets:
+                addr_mode = v6_nets[alloc.subnet_id].ipv6_address_mode
+                no_dhcp = addr_mode in (constants.IPV6_SLAAC,
+                                        constants.DHCPV6_STATELESS)
+                if self._is_dnsmasq_host_tag_supported():
+                    tag = HOST_DHCPV6_TAG
+                # we don't setup anything for SLAAC. It doesn't make sense
+                # to provide options for a client that won't use DHCP
+                no_opts = addr_mode == constants.IPV6_SLAAC
+
+            hostname, fqdn = self._get_dns_assignment(alloc.ip_address,
+                                                      dns_assignment)
+
+            yield (port, alloc, hostname, fqdn, no_dhcp, no_opts, tag)
+
+    def _get_hosts_render_key(self, v6_nets):
+        """Returns the settings, other than the ports, the hosts depend on."""
+        subnets = frozenset(
+            (s.id, s.enable_dhcp, s.ip_version,
+             getattr(s, 'ipv6_address_mode', None))
+            for s in self._get_all_subnets(self.network))
+        return (subnets, self.conf.dns_domain,
+                self.conf.dnsmasq_enable_addr6_list,
+                bool(v6_nets) and self._is_dnsmasq_host_tag_supported())
+
+    def _render_host_entry(self, port, revision, v6_nets,
+                           dhcp_enabled_subnet_ids):
+        hosts = []
+        for host_tuple in self._iter_port_hosts(port, v6_nets,
+                                                merge_addr6_list=True):
+            line = self._format_hosts_file_line(dhcp_enabled_subnet_ids,
+                                                *host_tuple)
+            if line:
+                hosts.append(line)
+        addn_hosts = []
+        for host_tuple in self._iter_port_hosts(port, v6_nets):
+            port, alloc, hostname, fqdn, no_dhcp, no_opts, tag = host_tuple
+            # It is compulsory to write the `fqdn` before the `hostname` in
+            # order to obtain it in PTR responses.
+            if alloc:
+                addn_hosts.append(
+                    '%s\t%s %s\n' % (alloc.ip_address, fqdn, hostname))
+        client_id = self._get_client_id(port)
+        leases = frozenset((alloc.ip_address, port.mac_address, client_id)
+                           for alloc in port.fixed_ips)
+        return DnsmasqHostEntry(revision, tuple(hosts), tuple(addn_hosts),
+                                leases)
+
+    def _update_hosts_model(self):
+        """Updates the hosts model of the network with its current ports.
+
+        Only the ports added or changed since the previous update are
+        rendered.
+
+        :returns: the leases no port owns anymore, see
+                  DnsmasqHostsModel.update, or None if the model of the
+                  network was just created.
+        """
+        model = self._hosts_models.get(self.network.id)
+        created = model is None
+        if created:
+            model = self._hosts_models[self.network.id] = DnsmasqHostsModel()
+        v6_nets = self._get_v6_nets()
+        dhcp_enabled_subnet_ids = set(
+            s.id for s in self._get_all_subnets(self.network)
+            if s.enable_dhcp)
+        render = functools.partial(
+            self._render_host_entry, v6_nets=v6_nets,
+            dhcp_enabled_subnet_ids=dhcp_enabled_subnet_ids)
+        stale_leases = model.update(self.network.ports,
+                                    self._get_hosts_render_key(v6_nets),
+                                    render)
+        return None if created else stale_leases
+
+    def _remove_config_files(self):
+        self._hosts_models.pop(self.network.id, None)
+        super(Dnsmasq, self)._remove_config_files()
 
     def _get_port_extra_dhcp_opts(self, port):
         return getattr(port, edo_ext.EXTRADHCPOPTS, False)
@@ -877,49 +1020,46 @@ class Dnsmasq(DhcpLocalProcess):
         filename = self.get_conf_file_name('host')
 
         LOG.debug('Building host file: %s', filename)
-        dhcp_enabled_subnet_ids = [s.id for s in
-                                   self._get_all_subnets(self.network)
-                                   if s.enable_dhcp]
         # NOTE(ihrachyshka): the loop should not log anything inside it, to
         # avoid potential performance drop when lots of hosts are dumped
-        for host_tuple in self._iter_hosts(merge_addr6_list=True):
-            port, alloc, hostname, name, no_dhcp, no_opts, tag = host_tuple
-            if no_dhcp:
-                if not no_opts and self._get_port_extra_dhcp_opts(port):
-                    buf.write('%s,%s%s%s\n' % (
-                        port.mac_address, tag,
-                        'set:', self._PORT_TAG_PREFIX % port.id))
-                continue
-
-            # don't write ip address which belongs to a dhcp disabled subnet.
-            if alloc.subnet_id not in dhcp_enabled_subnet_ids:
-                continue
-
-            ip_address = self._format_address_for_dnsmasq(alloc.ip_address)
-
-            if self._get_port_extra_dhcp_opts(port):
-                client_id = self._get_client_id(port)
-                if client_id and len(port.extra_dhcp_opts) > 1:
-                    buf.write('%s,%s%s%s,%s,%s,%s%s\n' %
-                              (port.mac_address, tag, self._ID, client_id,
-                               name, ip_address, 'set:',
-                               self._PORT_TAG_PREFIX % port.id))
-                elif client_id and len(port.extra_dhcp_opts) == 1:
-                    buf.write('%s,%s%s%s,%s,%s\n' %
-                              (port.mac_address, tag, self._ID, client_id,
-                               name, ip_address))
-                else:
-                    buf.write('%s,%s%s,%s,%s%s\n' %
-                              (port.mac_address, tag, name, ip_address,
-                               'set:', self._PORT_TAG_PREFIX % port.id))
-            else:
-                buf.write('%s,%s%s,%s\n' %
-                          (port.mac_address, tag, name, ip_address))
+        self._update_hosts_model()
+        buf.writelines(
+            self._hosts_models[self.network.id].get_hosts_lines())
 
         file_utils.replace_file(filename, buf.getvalue())
         LOG.debug('Done building host file %s', filename)
         return filename
 
+    def _format_hosts_file_line(self, dhcp_enabled_subnet_ids, port, alloc,
+                                hostname, name, no_dhcp, no_opts, tag):
+        if no_dhcp:
+            if not no_opts and self._get_port_extra_dhcp_opts(port):
+                return '%s,%s%s%s\n' % (
+                    port.mac_address, tag,
+                    'set:', self._PORT_TAG_PREFIX % port.id)
+            return None
+
+        # don't write ip address which belongs to a dhcp disabled subnet.
+        if alloc.subnet_id not in dhcp_enabled_subnet_ids:
+            return None
+
+        ip_address = self._format_address_for_dnsmasq(alloc.ip_address)
+
+        if self._get_port_extra_dhcp_opts(port):
+            client_id = self._get_client_id(port)
+            if client_id and len(port.extra_dhcp_opts) > 1:
+                return '%s,%s%s%s,%s,%s,%s%s\n' % (
+                    port.mac_address, tag, self._ID, client_id, name,
+                    ip_address, 'set:', self._PORT_TAG_PREFIX % port.id)
+            elif client_id and len(port.extra_dhcp_opts) == 1:
+                return '%s,%s%s%s,%s,%s\n' % (
+                    port.mac_address, tag, self._ID, client_id, name,
+                    ip_address)
+            return '%s,%s%s,%s,%s%s\n' % (
+                port.mac_address, tag, name, ip_address,
+                'set:', self._PORT_TAG_PREFIX % port.id)
+        return '%s,%s%s,%s\n' % (port.mac_address, tag, name, ip_address)
+
     def _get_client_id(self, port):
         if self._get_port_extra_dhcp_opts(port):
             for opt in port.extra_dhcp_opts:
@@ -1021,14 +1161,7 @@ class Dnsmasq(DhcpLocalProcess):
                                   }
         return leases
 
-    def _release_unused_leases(self):
-        filename = self.get_conf_file_name('host')
-        old_leases = self._read_hosts_file_leases(filename)
-        leases_filename = self.get_conf_file_name('leases')
-        cur_leases = self._read_leases_file_leases(leases_filename)
-        if not cur_leases:
-            return
-
+    def _get_unused_leases(self, old_leases, cur_leases):
         v4_leases = set()
         for (k, v) in cur_leases.items():
             # IPv4 leases have a MAC, IPv6 ones do not, so we must ignore
@@ -1049,7 +1182,7 @@ class Dnsmasq(DhcpLocalProcess):
         # a fixed IP on a corresponding neutron port, consider it stale.
         entries_to_release = (v4_leases | old_leases) - new_leases
         if not entries_to_release:
-            return
+            return entries_to_release
 
         # If the VM advertises a client ID in its lease, but its not set in
         # the port's Extra DHCP Opts, the lease will not be filtered above.
@@ -1063,6 +1196,34 @@ class Dnsmasq(DhcpLocalProcess):
                         entry_no_client_id in new_leases):
                     entries_with_no_client_id.add((ip, mac, client_id))
         entries_to_release -= entries_with_no_client_id
+        return entries_to_release
+
+    def _release_unused_leases(self, stale_leases=None):
+        """Releases the leases of the hosts removed from the network.
+
+        :param stale_leases: the leases of the hosts removed since the
+                             previous reload, as returned by
+                             _update_hosts_model. If None, they are computed
+                             from the hosts and leases files.
+        """
+        leases_filename = self.get_conf_file_name('leases')
+        if stale_leases is not None:
+            if not stale_leases:
+                return
+            cur_leases = self._read_leases_file_leases(leases_filename)
+            if not cur_leases:
+                return
+            entries_to_release = set(stale_leases)
+        else:
+            old_leases = self._read_hosts_file_leases(
+                self.get_conf_file_name('host'))
+            cur_leases = self._read_leases_file_leases(leases_filename)
+            if not cur_leases:
+                return
+            entries_to_release = self._get_unused_leases(old_leases,
+                                                         cur_leases)
+            if not entries_to_release:
+                return
 
         # Try DHCP_RELEASE_TRIES times to release a lease, re-reading the
         # file each time to see if it's still there.  We loop +1 times to
@@ -1112,12 +1273,9 @@ class Dnsmasq(DhcpLocalProcess):
         file.
         """
         buf = io.StringIO()
-        for host_tuple in self._iter_hosts():
-            port, alloc, hostname, fqdn, no_dhcp, no_opts, tag = host_tuple
-            # It is compulsory to write the `fqdn` before the `hostname` in
-            # order to obtain it in PTR responses.
-            if alloc:
-                buf.write('%s\t%s %s\n' % (alloc.ip_address, fqdn, hostname))
+        self._update_hosts_model()
+        buf.writelines(
+            self._hosts_models[self.network.id].get_addn_hosts_lines())
         addn_hosts = self.get_conf_file_name('addn_hosts')
         file_utils.replace_file(addn_hosts, buf.getvalue())
         return addn_hosts
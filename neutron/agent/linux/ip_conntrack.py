@@ -11,6 +11,7 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import collections
 import re
 
 import eventlet
@@ -18,9 +19,12 @@ import netaddr
 from neutron_lib import constants
 from neutron_lib import exceptions
 from oslo_concurrency import lockutils
+from oslo_config import cfg
 from oslo_log import log as logging
 
 from neutron.agent.linux import utils as linux_utils
+from neutron.conf.agent import securitygroups_rpc as sc_cfg
+from neutron.privileged.agent.linux import netlink_lib
 
 LOG = logging.getLogger(__name__)
 CONTRACK_MGRS = {}
@@ -29,6 +33,21 @@ ZONE_START = 4097
 
 WORKERS = 8
 
+# Protocol names of the parsed netlink entries, by rule protocol.
+NETLINK_PROTOCOLS = {
+    constants.PROTO_NAME_TCP: 'tcp',
+    constants.PROTO_NAME_UDP: 'udp',
+    constants.PROTO_NAME_ICMP: 'icmp',
+    constants.PROTO_NAME_IPV6_ICMP: 'icmpv6',
+    constants.PROTO_NAME_IPV6_ICMP_LEGACY: 'icmpv6',
+    'icmp6': 'icmpv6',
+}
+# Position of the source and destination addresses in the netlink entries.
+NETLINK_SRC = 4
+NETLINK_DST = 5
+
+sc_cfg.register_securitygroups_opts()
+
 
 class IpConntrackUpdate(object):
     """Encapsulates a conntrack update
@@ -72,6 +91,9 @@ class IpConntrackManager(object):
         self.filtered_ports = filtered_ports
         self.unfiltered_ports = unfiltered_ports
         self.zone_per_port = zone_per_port  # zone per port vs per network
+        # netlink_lib only acts on the conntrack table of the agent namespace
+        self.use_netlink = (cfg.CONF.SECURITYGROUP.conntrack_netlink_flush and
+                            not namespace)
         self._populate_initial_zone_map()
         self._queue = eventlet.queue.LightQueue()
         self._start_process_queue()
@@ -95,17 +117,146 @@ class IpConntrackManager(object):
         try:
             # this will block until an entry gets added to the queue
             update = self._queue.get()
-            if update.remote_ips:
-                for remote_ip in update.remote_ips:
-                    self._delete_conntrack_state(
-                        update.device_info_list, update.rule, remote_ip)
+            if self.use_netlink:
+                self._process_updates_netlink([update] + self._drain_queue())
             else:
-                self._delete_conntrack_state(
-                    update.device_info_list, update.rule)
+                self._process_update(update)
         except Exception:
             LOG.exception("Failed to process ip_conntrack queue entry: %s",
                           update)
 
+    def _process_update(self, update):
+        if update.remote_ips:
+            for remote_ip in update.remote_ips:
+                self._delete_conntrack_state(
+                    update.device_info_list, update.rule, remote_ip)
+        else:
+            self._delete_conntrack_state(
+                update.device_info_list, update.rule)
+
+    def _drain_queue(self):
+        updates = []
+        while True:
+            try:
+                updates.append(self._queue.get_nowait())
+            except eventlet.queue.Empty:
+                return updates
+
+    def _process_updates_netlink(self, updates):
+        """Deletes the conntrack entries of several updates with netlink.
+
+        The entries of each zone are listed once, filtered in memory for all
+        the updates and deleted in a single call. The updates netlink_lib
+        cannot handle, or all of them if netlink fails, are processed with
+        the conntrack command.
+        """
+        # {zone: {(ip version, local IP position, local IP):
+        #         set((protocol, remote IP network))}}
+        matchers = collections.defaultdict(dict)
+        cli_updates = []
+        for update in updates:
+            update_matchers = self._get_netlink_matchers(update)
+            if update_matchers is None:
+                cli_updates.append(update)
+                continue
+            for zone_id, local, remote in update_matchers:
+                matchers[zone_id].setdefault(local, set()).add(remote)
+        if matchers:
+            try:
+                self._delete_netlink_entries(matchers)
+            except Exception:
+                LOG.exception("Failed to delete conntrack entries with "
+                              "netlink, using the conntrack command")
+                cli_updates = updates
+        for update in cli_updates:
+            try:
+                self._process_update(update)
+            except Exception:
+                LOG.exception("Failed to process ip_conntrack queue entry: "
+                              "%s", update)
+
+    @staticmethod
+    def _get_netlink_protocol(rule):
+        """Returns the netlink protocol of a rule, '' for any protocol.
+
+        Returns None if the entries of the protocol are not parsed by
+        netlink_lib.
+        """
+        protocol = rule.get('protocol')
+        if protocol is None or str(protocol) in ('0', 'ip'):
+            return ''
+        protocol = str(protocol).lower()
+        protocol = constants.IP_PROTOCOL_NUM_TO_NAME_MAP.get(protocol,
+                                                             protocol)
+        return NETLINK_PROTOCOLS.get(protocol)
+
+    def _get_netlink_matchers(self, update):
+        """Returns the matchers of the entries of an update.
+
+        A matcher is a tuple of the zone, a tuple of the IP version and the
+        position and address of the local IP, and a tuple of the protocol
+        and the remote IP network, or None. The matchers select the same
+        entries as the commands returned by _get_conntrack_cmds. Returns
+        None if the update cannot be processed with netlink.
+        """
+        rule = update.rule
+        protocol = self._get_netlink_protocol(rule)
+        if rule.get('mark') is not None or protocol is None:
+            return None
+        ethertype = rule.get('ethertype')
+        if rule.get('direction') == 'ingress':
+            local_pos = NETLINK_DST
+        else:
+            local_pos = NETLINK_SRC
+        remote_nets = []
+        for remote_ip in update.remote_ips or [None]:
+            if remote_ip is not None:
+                remote_ip = netaddr.IPNetwork(remote_ip)
+                if str(remote_ip.version) not in ethertype:
+                    remote_ip = None
+            remote_nets.append(remote_ip)
+        matchers = set()
+        for device_info in update.device_info_list:
+            zone_id = self.get_device_zone(device_info, create=False)
+            if not zone_id:
+                continue
+            for ip in device_info.get('fixed_ips', []):
+                net = netaddr.IPNetwork(ip)
+                if str(net.version) not in ethertype:
+                    continue
+                local = (net.version, local_pos, str(net.ip))
+                for remote_net in remote_nets:
+                    matchers.add((zone_id, local, (protocol, remote_net)))
+        return matchers
+
+    @staticmethod
+    def _match_netlink_entry(entry, matchers):
+        addresses = {NETLINK_SRC: netaddr.IPAddress(entry[NETLINK_SRC]),
+                     NETLINK_DST: netaddr.IPAddress(entry[NETLINK_DST])}
+        for local_pos, remote_pos in ((NETLINK_SRC, NETLINK_DST),
+                                      (NETLINK_DST, NETLINK_SRC)):
+            remotes = matchers.get(
+                (entry[0], local_pos, str(addresses[local_pos])), ())
+            for protocol, remote_net in remotes:
+                if protocol and entry[1] != protocol:
+                    continue
+                if remote_net is None or addresses[remote_pos] in remote_net:
+                    return True
+        return False
+
+    def _delete_netlink_entries(self, matchers):
+        """Deletes the entries matching the matchers of each zone."""
+        entries = []
+        for zone_id, zone_matchers in matchers.items():
+            entries.extend(
+                entry for entry in netlink_lib.list_entries(zone_id)
+                if self._match_netlink_entry(entry, zone_matchers))
+        LOG.debug("Deleting %(entries)d conntrack entries of %(zones)d "
+                  "zones with netlink", {'entries': len(entries),
+                                         'zones': len(matchers)})
+        if entries:
+            netlink_lib.delete_entries(entries)
+
     def _process(self, device_info_list, rule, remote_ips=None):
         # queue the update to allow the caller to resume its work
         update = IpConntrackUpdate(device_info_list, rule, remote_ips)
@@ -11,12 +11,17 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import contextlib
 import copy
 
 import netaddr
+from oslo_concurrency import lockutils
+from oslo_log import log as logging
+from oslo_utils import excutils
 
 from neutron.agent.linux import utils as linux_utils
-from oslo_concurrency import lockutils
+
+LOG = logging.getLogger(__name__)
 
 IPSET_ADD_BULK_THRESHOLD = 5
 NET_PREFIX = 'N'
@@ -29,12 +34,64 @@ class IpsetManager(object):
 
        Keeps track of ip addresses per set, using bulk
        or single ip add/remove for smaller changes.
+
+       When apply is deferred, the operations on all the sets are
+       accumulated and sent in a single "ipset restore" call by
+       defer_apply_off().
     """
 
     def __init__(self, execute=None, namespace=None):
         self.execute = execute or linux_utils.execute
         self.namespace = namespace
         self.ipset_sets = {}
+        self.ipset_apply_deferred = False
+        # list of (ipset restore line, set name) tuples
+        self._deferred_ops = []
+
+    @contextlib.contextmanager
+    def defer_apply(self):
+        """Defer apply context."""
+        self.defer_apply_on()
+        try:
+            yield
+        finally:
+            self.defer_apply_off()
+
+    def defer_apply_on(self):
+        self.ipset_apply_deferred = True
+
+    def defer_apply_off(self):
+        """Sends all the deferred operations in a single ipset restore."""
+        self.ipset_apply_deferred = False
+        ops, self._deferred_ops = self._deferred_ops, []
+        if not ops:
+            return
+        with lockutils.lock('neutron-ipset-%s' % self.namespace,
+                            external=True):
+            try:
+                self._restore_sets([line for line, _set_name in ops])
+            except RuntimeError:
+                with excutils.save_and_reraise_exception() as ctx:
+                    destroyed = [set_name for line, set_name in ops
+                                 if line.startswith('destroy ')]
+                    if len(destroyed) == len(ops):
+                        # a set can't be destroyed if it doesn't exist or
+                        # if it is still referenced, which must not prevent
+                        # destroying the other ones
+                        ctx.reraise = False
+                        for set_name in destroyed:
+                            self._apply(['ipset', 'destroy', set_name],
+                                        fail_on_errors=False)
+                    else:
+                        # the state of the sets is unknown, forget them so
+                        # they are created and refreshed again
+                        LOG.error("Failed to apply the deferred ipset "
+                                  "operations")
+                        for _line, set_name in ops:
+                            self.ipset_sets.pop(set_name, None)
+
+    def _defer_op(self, line, set_name):
+        self._deferred_ops.append((line, set_name))
 
     def _sanitize_addresses(self, addresses):
         """This method converts any address to ipset format.
@@ -113,8 +170,11 @@ class IpsetManager(object):
             self._destroy(set_name, forced)
 
     def _add_member_to_set(self, set_name, member_ip):
-        cmd = ['ipset', 'add', '-exist', set_name, member_ip]
-        self._apply(cmd)
+        if self.ipset_apply_deferred:
+            self._defer_op('add %s %s' % (set_name, member_ip), set_name)
+        else:
+            cmd = ['ipset', 'add', '-exist', set_name, member_ip]
+            self._apply(cmd)
         self.ipset_sets[set_name].append(member_ip)
 
     def _refresh_set(self, set_name, member_ips, ethertype):
@@ -125,20 +185,34 @@ class IpsetManager(object):
         for ip in member_ips:
             process_input.append("add %s %s" % (new_set_name, ip))
 
-        self._restore_sets(process_input)
+        if self.ipset_apply_deferred:
+            for line in process_input:
+                self._defer_op(line, new_set_name)
+        else:
+            self._restore_sets(process_input)
         self._swap_sets(new_set_name, set_name)
         self._destroy(new_set_name, True)
         self.ipset_sets[set_name] = copy.copy(member_ips)
 
     def _del_member_from_set(self, set_name, member_ip):
-        cmd = ['ipset', 'del', set_name, member_ip]
-        self._apply(cmd, fail_on_errors=False)
+        if self.ipset_apply_deferred:
+            # "ipset restore -exist" ignores the deletion of missing entries
+            self._defer_op('del %s %s' % (set_name, member_ip), set_name)
+        else:
+            cmd = ['ipset', 'del', set_name, member_ip]
+            self._apply(cmd, fail_on_errors=False)
         self.ipset_sets[set_name].remove(member_ip)
 
     def _create_set(self, set_name, ethertype):
-        cmd = ['ipset', 'create', '-exist', set_name, 'hash:net', 'family',
-               self._get_ipset_set_type(ethertype)]
-        self._apply(cmd)
+        set_type = self._get_ipset_set_type(ethertype)
+        if self.ipset_apply_deferred:
+            self._defer_op('create %s hash:net family %s' % (set_name,
+                                                             set_type),
+                           set_name)
+        else:
+            cmd = ['ipset', 'create', '-exist', set_name, 'hash:net',
+                   'family', set_type]
+            self._apply(cmd)
         self.ipset_sets[set_name] = []
 
     def _apply(self, cmd, input=None, fail_on_errors=True):
@@ -178,11 +252,17 @@ class IpsetManager(object):
         self._apply(cmd, process_input)
 
     def _swap_sets(self, src_set, dest_set):
+        if self.ipset_apply_deferred:
+            self._defer_op('swap %s %s' % (src_set, dest_set), dest_set)
+            return
         cmd = ['ipset', 'swap', src_set, dest_set]
         self._apply(cmd)
 
     def _destroy(self, set_name, forced=False):
         if set_name in self.ipset_sets or forced:
-            cmd = ['ipset', 'destroy', set_name]
-            self._apply(cmd, fail_on_errors=False)
+            if self.ipset_apply_deferred:
+                self._defer_op('destroy %s' % set_name, set_name)
+            else:
+                cmd = ['ipset', 'destroy', set_name]
+                self._apply(cmd, fail_on_errors=False)
             self.ipset_sets.pop(set_name, None)
@@ -840,6 +840,8 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
     def filter_defer_apply_on(self):
         if not self._defer_apply:
             self.iptables.defer_apply_on()
+            if self.enable_ipset:
+                self.ipset.defer_apply_on()
             self._pre_defer_filtered_ports = dict(self.filtered_ports)
             self._pre_defer_unfiltered_ports = dict(self.unfiltered_ports)
             self.pre_sg_members = dict(self.sg_members)
@@ -1000,15 +1002,32 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
     def filter_defer_apply_off(self):
         if self._defer_apply:
             self._defer_apply = False
-            self._remove_chains_apply(self._pre_defer_filtered_ports,
-                                      self._pre_defer_unfiltered_ports)
-            self._setup_chains_apply(self.filtered_ports,
-                                     self.unfiltered_ports)
-            self.iptables.defer_apply_off()
-            self._remove_conntrack_entries_from_sg_updates()
-            self._remove_unused_security_group_info()
-            self._pre_defer_filtered_ports = None
-            self._pre_defer_unfiltered_ports = None
+            try:
+                self._remove_chains_apply(self._pre_defer_filtered_ports,
+                                          self._pre_defer_unfiltered_ports)
+                self._setup_chains_apply(self.filtered_ports,
+                                         self.unfiltered_ports)
+                try:
+                    if self.enable_ipset:
+                        # the sets must be updated before the iptables rules
+                        # referencing them are applied
+                        self.ipset.defer_apply_off()
+                finally:
+                    # a failed ipset restore must not leave iptables deferred
+                    self.iptables.defer_apply_off()
+                self._remove_conntrack_entries_from_sg_updates()
+                # unused sets can only be destroyed once no iptables rule
+                # references them anymore
+                if self.enable_ipset:
+                    self.ipset.defer_apply_on()
+                try:
+                    self._remove_unused_security_group_info()
+                finally:
+                    if self.enable_ipset:
+                        self.ipset.defer_apply_off()
+            finally:
+                self._pre_defer_filtered_ports = None
+                self._pre_defer_unfiltered_ports = None
 
 
 class OVSHybridIptablesFirewallDriver(IptablesFirewallDriver):
@@ -24,6 +24,7 @@ import difflib
 import os
 import re
 import sys
+import time
 
 from neutron_lib import constants
 from neutron_lib import exceptions
@@ -131,16 +132,62 @@ class IptablesRule(object):
 
 
 class IptablesTable(object):
-    """An iptables table."""
+    """An iptables table.
+
+    Rules are stored per chain. Chains touched since the last successful
+    apply are flagged as dirty, so only their rules are rendered again.
+    """
 
     def __init__(self, binary_name=binary_name):
-        self.rules = []
+        # {(chain, wrap): [IptablesRule]}
+        self._rules_by_chain = collections.OrderedDict()
+        # {(chain, wrap): ([top rule strings], [bottom rule strings])}
+        self._rendered_rules = {}
+        self.dirty_chains = set()
+        self.rendered_chains_count = 0
+        self.rendered_rules_count = 0
         self.remove_rules = []
         self.chains = set()
         self.unwrapped_chains = set()
         self.remove_chains = set()
         self.wrap_name = binary_name[:16]
 
+    @property
+    def rules(self):
+        return [rule for rules in self._rules_by_chain.values()
+                for rule in rules]
+
+    def _mark_dirty(self, chain, wrap):
+        self.dirty_chains.add((chain, wrap))
+        self._rendered_rules.pop((chain, wrap), None)
+
+    def clear_dirty_chains(self):
+        self.dirty_chains.clear()
+
+    def get_full_chain_name(self, chain, wrap):
+        if wrap:
+            return '%s-%s' % (self.wrap_name, chain)
+        return chain
+
+    def get_chain_keys(self):
+        """Returns the (chain, wrap) keys of the chains with rules."""
+        return list(self._rules_by_chain)
+
+    def get_rendered_chain_rules(self, chain, wrap):
+        """Returns the top and bottom rule strings of a chain.
+
+        The strings are cached until the chain is modified.
+        """
+        rendered = self._rendered_rules.get((chain, wrap))
+        if rendered is None:
+            rules = self._rules_by_chain.get((chain, wrap), [])
+            rendered = ([str(rule) for rule in rules if rule.top],
+                        [str(rule) for rule in rules if not rule.top])
+            self._rendered_rules[(chain, wrap)] = rendered
+            self.rendered_chains_count += 1
+            self.rendered_rules_count += len(rules)
+        return rendered
+
     def add_chain(self, name, wrap=True):
         """Adds a named chain to the table.
 
@@ -158,6 +205,7 @@ class IptablesTable(object):
             self.chains.add(name)
         else:
             self.unwrapped_chains.add(name)
+        self._mark_dirty(name, wrap)
 
     def _select_chain_set(self, wrap):
         if wrap:
@@ -183,6 +231,7 @@ class IptablesTable(object):
             return
 
         chain_set.remove(name)
+        self._mark_dirty(name, wrap)
 
         if not wrap:
             # non-wrapped chains and rules need to be dealt with specially,
@@ -199,8 +248,16 @@ class IptablesTable(object):
 
         # Remove rules from list that have a matching chain name or
         # a matching jump chain
-        self.rules = [r for r in self.rules
-                      if r.chain != name and jump_snippet not in r.rule]
+        for key, rules in list(self._rules_by_chain.items()):
+            kept_rules = [r for r in rules
+                          if r.chain != name and jump_snippet not in r.rule]
+            if len(kept_rules) == len(rules):
+                continue
+            self._mark_dirty(*key)
+            if kept_rules:
+                self._rules_by_chain[key] = kept_rules
+            else:
+                del self._rules_by_chain[key]
 
     def add_rule(self, chain, rule, wrap=True, top=False, tag=None,
                  comment=None):
@@ -222,8 +279,10 @@ class IptablesTable(object):
             rule = ' '.join(
                 self._wrap_target_chain(e, wrap) for e in rule.split(' '))
 
-        self.rules.append(IptablesRule(chain, rule, wrap, top, self.wrap_name,
-                                       tag, comment))
+        self._rules_by_chain.setdefault((chain, wrap), []).append(
+            IptablesRule(chain, rule, wrap, top, self.wrap_name, tag,
+                         comment))
+        self._mark_dirty(chain, wrap)
 
     def _wrap_target_chain(self, s, wrap):
         if s.startswith('$'):
@@ -231,6 +290,15 @@ class IptablesTable(object):
 
         return s
 
+    def _remove_rule_from_chain(self, rule):
+        key = (rule.chain, rule.wrap)
+        rules = self._rules_by_chain.get(key, [])
+        # NOTE: this removes the first rule equal to the given one
+        rules.remove(rule)
+        if not rules:
+            del self._rules_by_chain[key]
+        self._mark_dirty(*key)
+
     def remove_rule(self, chain, rule, wrap=True, top=False, comment=None):
         """Remove a rule from a chain.
 
@@ -245,9 +313,9 @@ class IptablesTable(object):
                 rule = ' '.join(
                     self._wrap_target_chain(e, wrap) for e in rule.split(' '))
 
-            self.rules.remove(IptablesRule(chain, rule, wrap, top,
-                                           self.wrap_name,
-                                           comment=comment))
+            self._remove_rule_from_chain(
+                IptablesRule(chain, rule, wrap, top, self.wrap_name,
+                             comment=comment))
             if not wrap:
                 self.remove_rules.append(str(IptablesRule(chain, rule, wrap,
                                                           top, self.wrap_name,
@@ -260,21 +328,20 @@ class IptablesTable(object):
 
     def _get_chain_rules(self, chain, wrap):
         chain = get_chain_name(chain, wrap)
-        return [rule for rule in self.rules
-                if rule.chain == chain and rule.wrap == wrap]
+        return list(self._rules_by_chain.get((chain, wrap), []))
 
     def empty_chain(self, chain, wrap=True):
         """Remove all rules from a chain."""
-        chained_rules = self._get_chain_rules(chain, wrap)
-        for rule in chained_rules:
-            self.rules.remove(rule)
+        chain = get_chain_name(chain, wrap)
+        if self._rules_by_chain.pop((chain, wrap), None):
+            self._mark_dirty(chain, wrap)
 
     def clear_rules_by_tag(self, tag):
         if not tag:
             return
         rules = [rule for rule in self.rules if rule.tag == tag]
         for rule in rules:
-            self.rules.remove(rule)
+            self._remove_rule_from_chain(rule)
 
 
 class IptablesManager(object):
@@ -314,6 +381,13 @@ class IptablesManager(object):
         self.iptables_apply_deferred = False
         self.wrap_name = binary_name[:16]
         self.external_lock = external_lock
+        # last applied state of the tables, by command and table name, and
+        # time of the last iptables-save, used by the incremental apply mode
+        self._applied_state = {}
+        self._last_verified = {}
+        # number of chains and rules rendered again by the last apply
+        self.last_apply_stats = {'chains_regenerated': 0,
+                                 'rules_regenerated': 0}
 
         self.ipv4 = {'filter': IptablesTable(binary_name=self.wrap_name)}
         self.ipv6 = {'filter': IptablesTable(binary_name=self.wrap_name)}
@@ -465,7 +539,7 @@ class IptablesManager(object):
             if not cfg.CONF.AGENT.debug_iptables_rules:
                 return first
             LOG.debug('List of IPTables Rules applied: %s', '\n'.join(first))
-            second = self._apply_synchronized()
+            second = self._apply_synchronized(verify=True)
             if second:
                 msg = (_("IPTables Rules did not converge. Diff: %s") %
                        '\n'.join(second))
@@ -559,13 +633,17 @@ class IptablesManager(object):
                   "following set of iptables rules:\n%s",
                   '\n'.join(log_lines))
 
-    def _apply_synchronized(self):
+    def _apply_synchronized(self, verify=False):
         """Apply the current in-memory set of iptables rules.
 
         This will create a diff between the rules from the previous runs
         and replace them with the current set of rules.
         This happens atomically, thanks to iptables-restore.
 
+        If incremental apply is enabled and verify is False, the rules from
+        the previous run are taken from the in-memory copy of the last
+        applied state instead of iptables-save when possible.
+
         Returns a list of the changes that were sent to iptables-save.
         """
         s = [('iptables', self.ipv4)]
@@ -573,62 +651,190 @@ class IptablesManager(object):
             s += [('ip6tables', self.ipv6)]
         all_commands = []  # variable to keep track all commands for return val
         for cmd, tables in s:
-            args = ['%s-save' % (cmd,)]
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            try:
-                save_output = linux_utils.execute(args, run_as_root=True,
-                                                  privsep_exec=True)
-            except RuntimeError:
-                # We could be racing with a cron job deleting namespaces.
-                # It is useless to try to apply iptables rules over and
-                # over again in a endless loop if the namespace does not
-                # exist.
-                with excutils.save_and_reraise_exception() as ctx:
-                    if (self.namespace and not
-                            ip_lib.network_namespace_exists(self.namespace)):
-                        ctx.reraise = False
-                        LOG.error("Namespace %s was deleted during IPTables "
-                                  "operations.", self.namespace)
-                        return []
-            all_lines = save_output.split('\n')
-            commands = []
-            # Traverse tables in sorted order for predictable dump output
-            for table_name in sorted(tables):
-                table = tables[table_name]
-                # isolate the lines of the table we are modifying
-                start, end = self._find_table(all_lines, table_name)
-                old_rules = all_lines[start:end]
-                # generate the new table state we want
-                new_rules = self._modify_rules(old_rules, table, table_name)
-                # generate the iptables commands to get between the old state
-                # and the new state
-                changes = _generate_path_between_rules(old_rules, new_rules)
-                if changes:
-                    # if there are changes to the table, we put on the header
-                    # and footer that iptables-save needs
-                    commands += (['# Generated by iptables_manager'] +
-                                 ['*%s' % table_name] + changes +
-                                 ['COMMIT', '# Completed by iptables_manager'])
-            if not commands:
-                continue
+            commands = None
+            if not verify and self._can_apply_incrementally(cmd, tables):
+                commands = self._apply_tables_incrementally(cmd, tables)
+            if commands is None:
+                commands = self._apply_tables(cmd, tables)
+                if commands is None:
+                    return []
             all_commands += commands
 
-            # always end with a new line
-            commands.append('')
+        self._update_apply_stats()
+        LOG.debug("IPTablesManager.apply completed with success. %(cmds)d "
+                  "iptables commands were issued, %(chains)d chains and "
+                  "%(rules)d rules were regenerated",
+                  {'cmds': len(all_commands),
+                   'chains': self.last_apply_stats['chains_regenerated'],
+                   'rules': self.last_apply_stats['rules_regenerated']})
+        return all_commands
 
-            args = ['%s-restore' % (cmd,), '-n']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
+    def _update_apply_stats(self):
+        chains = rules = 0
+        for tables in (self.ipv4, self.ipv6):
+            for table in tables.values():
+                chains += table.rendered_chains_count
+                rules += table.rendered_rules_count
+                table.rendered_chains_count = 0
+                table.rendered_rules_count = 0
+        self.last_apply_stats = {'chains_regenerated': chains,
+                                 'rules_regenerated': rules}
+
+    def _can_apply_incrementally(self, cmd, tables):
+        if not cfg.CONF.AGENT.iptables_incremental_apply:
+            return False
+        if cmd not in self._applied_state:
+            return False
+        if (time.time() - self._last_verified.get(cmd, 0) >=
+                cfg.CONF.AGENT.iptables_verify_interval):
+            return False
+        # the removal of unwrapped chains and rules affects chains that are
+        # not owned by us
+        return not any(table.remove_chains or table.remove_rules
+                       for table in tables.values())
+
+    def _generate_restore_commands(self, tables, old_state):
+        """Generates the iptables-restore input to get from old_state.
+
+        Returns the commands and the new state of the tables.
+        """
+        commands = []
+        new_state = {}
+        # Traverse tables in sorted order for predictable dump output
+        for table_name in sorted(tables):
+            table = tables[table_name]
+            old_rules = old_state[table_name]
+            # generate the new table state we want
+            new_rules = self._modify_rules(old_rules, table, table_name)
+            new_state[table_name] = dict(_get_rules_by_chain(new_rules))
+            # generate the iptables commands to get between the old state
+            # and the new state
+            changes = _generate_path_between_rules(old_rules, new_rules)
+            if changes:
+                # if there are changes to the table, we put on the header
+                # and footer that iptables-save needs
+                commands += (['# Generated by iptables_manager'] +
+                             ['*%s' % table_name] + changes +
+                             ['COMMIT', '# Completed by iptables_manager'])
+        return commands, new_state
+
+    def _generate_dirty_chains_restore_commands(self, tables, old_state):
+        """Generates the iptables-restore input for the dirty chains only.
+
+        old_state is the last applied state of the tables, by table name and
+        chain name. Returns None if chains not owned by us are dirty.
+        """
+        commands = []
+        new_state = {}
+        for table_name in sorted(tables):
+            table = tables[table_name]
+            old_by_chain = old_state[table_name]
+            if not table.dirty_chains:
+                new_state[table_name] = old_by_chain
+                continue
+            if not all(wrap for _chain, wrap in table.dirty_chains):
+                return None
+            by_chain = dict(old_by_chain)
+            old_rules = []
+            new_rules = []
+            for chain, wrap in table.dirty_chains:
+                name = table.get_full_chain_name(chain, wrap)
+                if name in old_by_chain:
+                    old_rules += [':%s' % name] + old_by_chain[name]
+                if chain not in table.chains:
+                    by_chain.pop(name, None)
+                    continue
+                top_rules, bottom_rules = table.get_rendered_chain_rules(
+                    chain, wrap)
+                chain_rules = _remove_duplicated_rules(top_rules +
+                                                       bottom_rules)
+                new_rules += [':%s' % name] + chain_rules
+                by_chain[name] = chain_rules
+            new_state[table_name] = by_chain
+            changes = _generate_path_between_rules(old_rules, new_rules)
+            if changes:
+                commands += (['# Generated by iptables_manager'] +
+                             ['*%s' % table_name] + changes +
+                             ['COMMIT', '# Completed by iptables_manager'])
+        return commands, new_state
+
+    def _restore(self, cmd, commands):
+        args = ['%s-restore' % (cmd,), '-n']
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        # always end with a new line
+        return self._run_restore(args, commands + [''])
+
+    def _set_applied_state(self, cmd, tables, new_state):
+        self._applied_state[cmd] = new_state
+        for table in tables.values():
+            table.clear_dirty_chains()
 
-            err = self._run_restore(args, commands)
+    def _apply_tables_incrementally(self, cmd, tables):
+        """Applies the dirty chains using the last applied state.
+
+        Returns None if a full iptables-save and diff is needed, either
+        because chains not owned by us changed or because iptables-restore
+        failed.
+        """
+        result = self._generate_dirty_chains_restore_commands(
+            tables, self._applied_state[cmd])
+        if result is None:
+            LOG.debug("Chains not owned by %s changed, running %s-save",
+                      self.wrap_name, cmd)
+            return None
+        commands, new_state = result
+        if commands:
+            err = self._restore(cmd, commands)
+            if err:
+                LOG.warning("Incremental %(cmd)s-restore failed, falling "
+                            "back to %(cmd)s-save: %(err)s",
+                            {'cmd': cmd, 'err': err})
+                del self._applied_state[cmd]
+                return None
+        self._set_applied_state(cmd, tables, new_state)
+        return commands
+
+    def _apply_tables(self, cmd, tables):
+        """Applies the tables after diffing them with the iptables-save output.
+
+        Returns None if the namespace was deleted meanwhile.
+        """
+        args = ['%s-save' % (cmd,)]
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        try:
+            save_output = linux_utils.execute(args, run_as_root=True,
+                                              privsep_exec=True)
+        except RuntimeError:
+            # We could be racing with a cron job deleting namespaces.
+            # It is useless to try to apply iptables rules over and
+            # over again in a endless loop if the namespace does not
+            # exist.
+            with excutils.save_and_reraise_exception() as ctx:
+                if (self.namespace and not
+                        ip_lib.network_namespace_exists(self.namespace)):
+                    ctx.reraise = False
+                    LOG.error("Namespace %s was deleted during IPTables "
+                              "operations.", self.namespace)
+                    return None
+        self._last_verified[cmd] = time.time()
+        all_lines = save_output.split('\n')
+        old_state = {}
+        for table_name in tables:
+            # isolate the lines of the table we are modifying
+            start, end = self._find_table(all_lines, table_name)
+            old_state[table_name] = all_lines[start:end]
+        commands, new_state = self._generate_restore_commands(tables,
+                                                              old_state)
+        if commands:
+            err = self._restore(cmd, commands)
             if err:
-                self._log_restore_err(err, commands)
+                self._applied_state.pop(cmd, None)
+                self._log_restore_err(err, commands + [''])
                 raise err
-
-        LOG.debug("IPTablesManager.apply completed with success. %d iptables "
-                  "commands were issued", len(all_commands))
-        return all_commands
+        self._set_applied_state(cmd, tables, new_state)
+        return commands
 
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
@@ -664,7 +870,15 @@ class IptablesManager(object):
         # Sort the output chains here to make their order predictable.
         unwrapped_chains = sorted(table.unwrapped_chains)
         chains = sorted(table.chains)
-        rules = set(map(str, table.rules))
+        our_top_rules = []
+        our_bottom_rules = []
+        for chain, wrap in table.get_chain_keys():
+            # rule.top == True means we want this rule to be at the top.
+            top_rules, bottom_rules = table.get_rendered_chain_rules(chain,
+                                                                     wrap)
+            our_top_rules += top_rules
+            our_bottom_rules += bottom_rules
+        rules = set(our_top_rules) | set(our_bottom_rules)
 
         # we don't want to change any rules that don't belong to us so we start
         # the new_filter with these rules
@@ -685,17 +899,6 @@ class IptablesManager(object):
         our_chains += [':%s' % name for name in unwrapped_chains
                        if not any(':%s' % name in s for s in new_filter)]
 
-        our_top_rules = []
-        our_bottom_rules = []
-        for rule in table.rules:
-            rule_str = str(rule)
-
-            if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                our_top_rules += [rule_str]
-            else:
-                our_bottom_rules += [rule_str]
-
         our_chains_and_rules = our_chains + our_top_rules + our_bottom_rules
 
         # locate the position immediately after the existing chains to insert
@@ -838,6 +1041,18 @@ def _generate_path_between_rules(old_rules, new_rules):
     return statements
 
 
+def _remove_duplicated_rules(rules):
+    """Removes duplicated rules keeping the last occurrence of each one."""
+    seen_rules = set()
+    result = []
+    for rule in reversed(rules):
+        if rule not in seen_rules:
+            seen_rules.add(rule)
+            result.append(rule)
+    result.reverse()
+    return result
+
+
 def _get_rules_by_chain(rules):
     by_chain = collections.defaultdict(list)
     for line in rules:
@@ -14,6 +14,8 @@
 
 import hashlib
 import hmac
+import os
+import time
 import urllib
 
 import netaddr
@@ -34,6 +36,7 @@ import webob
 
 from neutron._i18n import _
 from neutron.agent.linux import utils as agent_utils
+from neutron.agent.metadata import port_index
 from neutron.agent import rpc as agent_rpc
 from neutron.common import cache_utils as cache
 from neutron.common import ipv6_utils
@@ -41,6 +44,9 @@ from neutron.conf.agent.metadata import config
 
 LOG = logging.getLogger(__name__)
 
+# minimum interval in seconds between two logs of the port index statistics
+PORT_INDEX_STATS_LOG_INTERVAL = 300
+
 MODE_MAP = {
     config.USER_MODE: 0o644,
     config.GROUP_MODE: 0o664,
@@ -82,6 +88,32 @@ class MetadataProxyHandler(object):
 
         self.plugin_rpc = MetadataPluginAPI(topics.PLUGIN)
         self.context = context.get_admin_context_without_session()
+        self._port_index = None
+        self._port_index_pid = None
+        self._port_index_stats_time = None
+
+    def _get_port_index(self):
+        """Returns the port index of this process, if it is enabled.
+
+        The index is created by each metadata worker process, its RPC
+        listeners are not inherited by the forked workers.
+        """
+        if not self.conf.metadata_port_index:
+            return None
+        if self._port_index_pid != os.getpid():
+            self._port_index = port_index.MetadataPortIndex()
+            self._port_index_pid = os.getpid()
+        return self._port_index
+
+    def _log_port_index_stats(self, index):
+        """Logs the lookup statistics of the port index periodically."""
+        now = time.monotonic()
+        if (self._port_index_stats_time is not None and
+                now - self._port_index_stats_time <
+                PORT_INDEX_STATS_LOG_INTERVAL):
+            return
+        self._port_index_stats_time = now
+        LOG.debug("Metadata port index statistics: %s", index.get_stats())
 
     @webob.dec.wsgify(RequestClass=webob.Request)
     def __call__(self, req):
@@ -169,6 +201,19 @@ class MetadataProxyHandler(object):
         :param skip_cache: when have to skip getting entry from cache
 
         """
+        index = None if skip_cache else self._get_port_index()
+        if index:
+            self._log_port_index_stats(index)
+            try:
+                ports = self._get_ports_from_index(
+                    index, remote_address, network_id, router_id,
+                    remote_mac)
+                if ports:
+                    return ports
+            except Exception:
+                LOG.exception("Failed to look up the ports of %s in the "
+                              "local port index", remote_address)
+
         if network_id:
             networks = (network_id,)
         elif router_id:
@@ -182,6 +227,18 @@ class MetadataProxyHandler(object):
                                                   skip_cache=skip_cache,
                                                   remote_mac=remote_mac)
 
+    @staticmethod
+    def _get_ports_from_index(index, remote_address, network_id=None,
+                              router_id=None, remote_mac=None):
+        if network_id:
+            networks = (network_id,)
+        elif router_id:
+            networks = index.get_router_networks(router_id)
+        else:
+            return []
+        return index.get_ports(networks, ip_address=remote_address,
+                               mac_address=remote_mac)
+
     def _get_instance_and_tenant_id(self, req, skip_cache=False):
         forwarded_for = req.headers.get('X-Forwarded-For')
         network_id = req.headers.get('X-Neutron-Network-ID')
@@ -0,0 +1,138 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+
+import netaddr
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib import constants
+from oslo_log import log as logging
+
+from neutron.agent import resource_cache
+from neutron.api.rpc.callbacks import resources
+from neutron.api.rpc.handlers import resources_rpc
+
+LOG = logging.getLogger(__name__)
+
+
+def _get_mac_key(mac_address):
+    return str(netaddr.EUI(str(mac_address),
+                           dialect=netaddr.mac_unix_expanded))
+
+
+class MetadataPortIndex(object):
+    """Local index of the ports used to identify the metadata requests.
+
+    The ports are kept by a remote resource cache, updated by the push
+    notifications of the server. The index maps the (network ID, fixed IP)
+    and (network ID, MAC address) pairs of the cached ports to their device
+    and project, so a request is matched to its instance without an RPC.
+
+    The ports of a network, or the interfaces of a router, are pulled from
+    the server in one call the first time they are looked up. With
+    rpc_scoped_resource_push, the index listens to the topics of the
+    networks it loaded, since the metadata agent has no bound port.
+    """
+
+    def __init__(self):
+        # {(network_id, ip or mac): set(port_ids)}
+        self._ports_by_address = collections.defaultdict(set)
+        # {port_id: (network_id, device_id, tenant_id, address keys)}
+        self._ports = {}
+        self._loaded_networks = set()
+        self._stats = collections.Counter()
+        self.rcache = resource_cache.RemoteResourceCache(
+            [resources.PORT],
+            indexes={resources.PORT: ('network_id', 'device_id')})
+        registry.subscribe(self._port_updated, resources.PORT,
+                           events.AFTER_UPDATE)
+        registry.subscribe(self._port_deleted, resources.PORT,
+                           events.AFTER_DELETE)
+        self.rcache.start_watcher()
+
+    def _port_updated(self, rtype, event, trigger, payload):
+        if trigger is not self.rcache:
+            return
+        port = payload.latest_state
+        self._remove_port(port.id)
+        keys = [(port.network_id, str(ip.ip_address))
+                for ip in port.fixed_ips or ()]
+        keys.append((port.network_id, _get_mac_key(port.mac_address)))
+        for key in keys:
+            self._ports_by_address[key].add(port.id)
+        self._ports[port.id] = (port.network_id, port.device_id,
+                                port.project_id, keys)
+
+    def _port_deleted(self, rtype, event, trigger, payload):
+        if trigger is self.rcache:
+            self._remove_port(payload.resource_id)
+
+    def _remove_port(self, port_id):
+        entry = self._ports.pop(port_id, None)
+        if entry is None:
+            return
+        for key in entry[3]:
+            port_ids = self._ports_by_address.get(key)
+            if port_ids is None:
+                continue
+            port_ids.discard(port_id)
+            if not port_ids:
+                del self._ports_by_address[key]
+
+    def _load_network(self, network_id):
+        if network_id in self._loaded_networks:
+            return
+        LOG.debug("Loading the ports of network %s in the metadata port "
+                  "index", network_id)
+        # subscribed to before the ports are pulled, so no update is missed
+        self.rcache.subscribe_to_scopes(
+            resources.PORT, resources_rpc.SCOPE_NETWORK, [network_id])
+        self.rcache.get_resources(resources.PORT,
+                                  {'network_id': (network_id, )})
+        self._loaded_networks.add(network_id)
+
+    def get_router_networks(self, router_id):
+        """Returns the networks of the interfaces of a router."""
+        interfaces = self.rcache.get_resources(
+            resources.PORT,
+            {'device_id': (router_id, ),
+             'device_owner': tuple(constants.ROUTER_INTERFACE_OWNERS)})
+        networks = tuple({port.network_id for port in interfaces})
+        self.rcache.subscribe_to_scopes(
+            resources.PORT, resources_rpc.SCOPE_NETWORK, networks)
+        return networks
+
+    def get_ports(self, networks, ip_address=None, mac_address=None):
+        """Returns the ports with an address on one of the networks.
+
+        The ports are looked up by MAC address if it is given, like the
+        server side filters. They are returned as dictionaries with the
+        'device_id' and 'tenant_id' keys.
+        """
+        address = (_get_mac_key(mac_address) if mac_address
+                   else str(netaddr.IPAddress(ip_address)))
+        port_ids = set()
+        for network_id in networks:
+            self._load_network(network_id)
+            port_ids |= self._ports_by_address.get((network_id, address),
+                                                   set())
+        self._stats['hits' if port_ids else 'misses'] += 1
+        return [{'device_id': self._ports[port_id][1],
+                 'tenant_id': self._ports[port_id][2]}
+                for port_id in port_ids]
+
+    def get_stats(self):
+        """Returns the lookup hits and misses and the number of ports."""
+        return {'hits': self._stats['hits'],
+                'misses': self._stats['misses'],
+                'ports': len(self._ports)}
@@ -12,55 +12,414 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import itertools
+import sys
+import time
+
 from neutron_lib.callbacks import events
 from neutron_lib.callbacks import registry
 from neutron_lib import context as n_ctx
 from neutron_lib import rpc as n_rpc
+from neutron_lib.utils import file as file_utils
+from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_reports.models import with_default_views
+from oslo_serialization import jsonutils
+from oslo_versionedobjects import base as obj_base
+from oslo_versionedobjects import fields as obj_fields
 
 from neutron._i18n import _
 from neutron.api.rpc.callbacks.consumer import registry as registry_rpc
 from neutron.api.rpc.callbacks import events as events_rpc
+from neutron.api.rpc.callbacks import resources
 from neutron.api.rpc.handlers import resources_rpc
 from neutron import objects
 
 LOG = logging.getLogger(__name__)
 objects.register_objects()
 
+# format of the files written by RemoteResourceCache.save_snapshot()
+SNAPSHOT_VERSION = 1
+# minimum interval in seconds between the warnings of a cache type holding
+# more referenced objects than its maximum size
+OVERSIZE_WARNING_INTERVAL = 600
+
+
+class FrozenResource(object):
+    """Compact read-only view of an OVO stored by the resource cache.
+
+    A subclass with one slot per field is generated for each OVO class by
+    freeze_resource(), so the views don't carry the per instance dictionary,
+    change tracking and context of the versioned objects. The fields are
+    read with attribute or item access, like on the objects they replace,
+    and nested objects are converted to views as well.
+    """
+    __slots__ = ()
+
+    # set on the subclasses generated by _get_frozen_resource_class
+    _obj_name = None
+    _obj_cls = None
+    _obj_fields = {}
+    _obj_extra_fields = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(_("%s objects are read-only") % self._obj_name)
+
+    def __delattr__(self, name):
+        raise AttributeError(_("%s objects are read-only") % self._obj_name)
+
+    def __getattr__(self, name):
+        # only called for the slots that are not set; the nullable fields
+        # that were not loaded on the OVO read as None.
+        field = self._obj_fields.get(name)
+        if field is not None and field.nullable:
+            return None
+        raise AttributeError(_("%(obj)s object has no attribute "
+                               "%(attr)s") % {'obj': self._obj_name,
+                                              'attr': name})
+
+    @classmethod
+    def obj_name(cls):
+        return cls._obj_name
+
+    def _is_set(self, name):
+        try:
+            object.__getattribute__(self, name)
+        except AttributeError:
+            return False
+        return True
+
+    def obj_attr_is_set(self, name):
+        return name in self._obj_fields and self._is_set(name)
+
+    def __iter__(self):
+        for name in self.__slots__:
+            if self._is_set(name):
+                yield name
+
+    keys = __iter__
+
+    def items(self):
+        for name in self:
+            yield name, getattr(self, name)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def get(self, key, value=None):
+        if self._is_set(key):
+            return getattr(self, key)
+        return value
+
+    def __eq__(self, other):
+        other = freeze_resource(other)
+        return (isinstance(other, FrozenResource) and
+                self._obj_name == other._obj_name and
+                dict(self.items()) == dict(other.items()))
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self._obj_name, ', '.join(
+            '%s=%r' % item for item in self.items()))
+
+    def to_dict(self):
+        """Returns the same dictionary as the to_dict() of the OVO."""
+        dict_ = {}
+        for name, value in self.items():
+            field = self._obj_fields.get(name)
+            if name == 'tenant_id' and 'project_id' in self._obj_fields:
+                if not self.obj_attr_is_set('project_id'):
+                    continue
+            if field is None:
+                dict_[name] = value
+            elif isinstance(field, obj_fields.ListOfObjectsField):
+                dict_[name] = [obj.to_dict() for obj in value]
+            elif isinstance(field, obj_fields.ObjectField):
+                dict_[name] = value.to_dict() if value else None
+            else:
+                dict_[name] = field.to_primitive(self, name, value)
+        return dict_
+
+
+_frozen_resource_classes = {}
+
+
+def _get_frozen_resource_class(obj_cls):
+    frozen_cls = _frozen_resource_classes.get(obj_cls)
+    if frozen_cls is None:
+        extra_fields = tuple(f for f in getattr(obj_cls, 'obj_extra_fields',
+                                                ())
+                             if f not in obj_cls.fields)
+        frozen_cls = type(
+            'Frozen%s' % obj_cls.obj_name(), (FrozenResource, ),
+            {'__slots__': tuple(obj_cls.fields) + extra_fields,
+             '_obj_name': obj_cls.obj_name(),
+             '_obj_cls': obj_cls,
+             '_obj_fields': obj_cls.fields,
+             '_obj_extra_fields': extra_fields})
+        _frozen_resource_classes[obj_cls] = frozen_cls
+    return frozen_cls
+
+
+def _freeze_value(value):
+    if isinstance(value, (obj_base.VersionedObject, FrozenResource)):
+        return freeze_resource(value)
+    if isinstance(value, (list, tuple, obj_base.ObjectListBase)):
+        return tuple(_freeze_value(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze_value(v) for v in value)
+    return value
+
+
+def freeze_resource(resource):
+    """Returns the compact read-only view of an OVO.
+
+    Values that are not versioned objects are returned unchanged.
+    """
+    if not isinstance(resource, obj_base.VersionedObject):
+        return resource
+    frozen_cls = _get_frozen_resource_class(type(resource))
+    frozen = object.__new__(frozen_cls)
+    for name in frozen_cls.__slots__:
+        if name in frozen_cls._obj_extra_fields:
+            try:
+                value = getattr(resource, name)
+            except (AttributeError, NotImplementedError):
+                continue
+        elif resource.obj_attr_is_set(name):
+            value = _freeze_value(getattr(resource, name))
+        else:
+            continue
+        object.__setattr__(frozen, name, value)
+    return frozen
+
+
+def _thaw_value(value):
+    if isinstance(value, FrozenResource):
+        return thaw_resource(value)
+    if isinstance(value, tuple):
+        return [_thaw_value(v) for v in value]
+    if isinstance(value, frozenset):
+        return {_thaw_value(v) for v in value}
+    return value
+
+
+def thaw_resource(resource):
+    """Returns an OVO with the fields of a view built by freeze_resource.
+
+    Values that are not views are returned unchanged.
+    """
+    if not isinstance(resource, FrozenResource):
+        return resource
+    obj = resource._obj_cls()
+    for name, value in resource.items():
+        if name in resource._obj_fields:
+            setattr(obj, name, _thaw_value(value))
+    obj.obj_reset_changes()
+    return obj
+
+
+def _get_memory_footprint(value, seen):
+    """Approximates the memory used by value and the objects it holds."""
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, FrozenResource):
+        size += sum(_get_memory_footprint(v, seen) for _k, v in value.items())
+    elif isinstance(value, dict):
+        size += sum(_get_memory_footprint(k, seen) +
+                    _get_memory_footprint(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_get_memory_footprint(v, seen) for v in value)
+    elif hasattr(value, '__dict__'):
+        size += _get_memory_footprint(vars(value), seen)
+    return size
+
 
 class RemoteResourceCache(object):
     """Retrieves and stashes logical resources in their OVO format.
 
     This is currently only compatible with OVO objects that have an ID.
+
+    Secondary indexes can be declared per resource type with the 'indexes'
+    argument, a dictionary of resource type to an iterable of field names.
+    They are used by get_resources() to avoid scanning every cached object
+    when one of the filters is on an indexed field.
+
+    The objects are stored and returned as FrozenResource views.
+
+    The number of objects cached per resource type can be bounded with the
+    'max_sizes' argument, a dictionary of resource type to maximum size.
+    Once a type exceeds its size, the least recently used objects whose IDs
+    are not returned by 'referenced_ids_func(rtype)' are evicted, along with
+    the satisfied server queries that returned them, so the next lookup
+    fetches them again from the server. The IDs of the deleted objects are
+    forgotten after 'deleted_ids_ttl' seconds, if set.
     """
-    def __init__(self, resource_types):
+    def __init__(self, resource_types, indexes=None, max_sizes=None,
+                 deleted_ids_ttl=0, referenced_ids_func=None):
         self.resource_types = resource_types
-        self._cache_by_type_and_id = {rt: {} for rt in self.resource_types}
-        self._deleted_ids_by_type = {rt: set() for rt in self.resource_types}
+        # the objects are kept in least recently used first order
+        self._cache_by_type_and_id = {rt: collections.OrderedDict()
+                                      for rt in self.resource_types}
+        # {rtype: {id: deletion time}}, oldest deletion first
+        self._deleted_ids_by_type = {rt: collections.OrderedDict()
+                                     for rt in self.resource_types}
         # track everything we've asked the server so we don't ask again
         self._satisfied_server_queries = set()
+        self._max_sizes = {rt: size for rt, size in (max_sizes or {}).items()
+                           if size and rt in self.resource_types}
+        self._deleted_ids_ttl = deleted_ids_ttl
+        self._referenced_ids_func = referenced_ids_func
+        self._evicted_counts = collections.Counter()
+        # {rtype: size of the cache left by an eviction that couldn't shrink
+        #         it to its maximum size}
+        self._oversizes = {}
+        # {rtype: time of the last oversize warning}
+        self._oversize_warnings = {}
+        self._pull_counts = collections.Counter()
         self._puller = resources_rpc.ResourcesPullRpcApi()
+        self._watcher = None
+        # {rtype: {field: {value: set(ids)}}}
+        self._indexes = {rt: {} for rt in self.resource_types}
+        self._index_stats = {rt: collections.Counter()
+                             for rt in self.resource_types}
+        for rtype, fields in (indexes or {}).items():
+            for field in fields:
+                self.add_index(rtype, field)
 
     def _type_cache(self, rtype):
         if rtype not in self.resource_types:
             raise RuntimeError(_("Resource cache not tracking %s") % rtype)
         return self._cache_by_type_and_id[rtype]
 
+    def add_index(self, rtype, field):
+        """Declares a secondary index on field for resources of rtype.
+
+        Objects already in the cache are indexed immediately. If the field
+        on the object is a list, the object is indexed under each value.
+        """
+        type_indexes = self._indexes.get(rtype)
+        if type_indexes is None:
+            raise RuntimeError(_("Resource cache not tracking %s") % rtype)
+        if field in type_indexes:
+            return
+        index = type_indexes[field] = collections.defaultdict(set)
+        for obj_id, resource in self._type_cache(rtype).items():
+            for value in self._get_index_values(resource, field):
+                index[value].add(obj_id)
+
+    def get_index_stats(self):
+        """Returns the index hit/miss counters of get_resources by type."""
+        return {rtype: {'hits': stats['hits'], 'misses': stats['misses']}
+                for rtype, stats in self._index_stats.items()}
+
+    @staticmethod
+    def _get_index_values(resource, field):
+        try:
+            value = getattr(resource, field)
+        except (AttributeError, NotImplementedError):
+            return set()
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return set(value)
+        return {value}
+
+    def _update_indexes(self, rtype, old, new):
+        for field, index in self._indexes[rtype].items():
+            old_values = (self._get_index_values(old, field) if old
+                          else set())
+            new_values = (self._get_index_values(new, field) if new
+                          else set())
+            obj_id = (new or old).id
+            for value in old_values - new_values:
+                ids = index.get(value)
+                if ids is None:
+                    continue
+                ids.discard(obj_id)
+                if not ids:
+                    del index[value]
+            for value in new_values - old_values:
+                index[value].add(obj_id)
+
+    def _get_indexed_candidates(self, rtype, filters):
+        """Returns the IDs of the objects that may match filters.
+
+        The most selective indexed filter is used. None is returned if none
+        of the filters is on an indexed field.
+        """
+        type_indexes = self._indexes[rtype]
+        candidates = None
+        for key, values in filters.items():
+            index = type_indexes.get(key)
+            if index is None:
+                continue
+            ids = set()
+            for value in values:
+                ids |= index.get(value, set())
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+        return candidates
+
     def start_watcher(self):
         self._watcher = RemoteResourceWatcher(self)
 
+    def subscribe_to_scopes(self, rtype, scope, scope_ids):
+        """Receives the scoped pushes of resources not local to this host.
+
+        Only used with rpc_scoped_resource_push, for instance to receive the
+        ports of the remote security groups.
+        """
+        if self._watcher:
+            self._watcher.subscribe_to_scopes(rtype, scope, scope_ids)
+
     def get_resource_by_id(self, rtype, obj_id, agent_restarted=False):
         """Returns None if it doesn't exist."""
         if obj_id in self._deleted_ids_by_type[rtype]:
             return None
         cached_item = self._type_cache(rtype).get(obj_id)
         if cached_item:
+            self._touch(rtype, (obj_id, ))
             return cached_item
         # try server in case object existed before agent start
         self._flood_cache_for_query(rtype, id=(obj_id, ),
                                     agent_restarted=agent_restarted)
         return self._type_cache(rtype).get(obj_id)
 
+    def fetch_missing_resources(self, rtype, obj_ids, chunk_size,
+                                agent_restarted=False):
+        """Pulls from the server the objects of obj_ids not in the cache.
+
+        The IDs that are neither cached, deleted nor already asked to the
+        server are requested in pulls of at most chunk_size IDs, so a
+        batch of cache misses costs a few server round trips instead of
+        one per object. The objects that don't exist on the server are
+        not cached and get_resource_by_id() returns None for them.
+
+        Returns the number of pulls sent to the server.
+        """
+        type_cache = self._type_cache(rtype)
+        deleted_ids = self._deleted_ids_by_type[rtype]
+        missing_ids = []
+        for obj_id in dict.fromkeys(obj_ids):
+            if (obj_id in type_cache or obj_id in deleted_ids or
+                    (rtype, ('id', (obj_id, ))) in
+                    self._satisfied_server_queries):
+                continue
+            missing_ids.append(obj_id)
+        pulls = 0
+        for i in range(0, len(missing_ids), chunk_size):
+            self._flood_cache_for_query(
+                rtype, id=tuple(missing_ids[i:i + chunk_size]),
+                agent_restarted=agent_restarted)
+            pulls += 1
+        return pulls
+
     def _flood_cache_for_query(self, rtype, agent_restarted=False,
                                **filter_kwargs):
         """Load info from server for first query.
@@ -77,17 +436,215 @@ class RemoteResourceCache(object):
         context = n_ctx.get_admin_context()
         resources = self._puller.bulk_pull(context, rtype,
                                            filter_kwargs=filter_kwargs)
+        self._pull_counts[rtype] += 1
         for resource in resources:
             if self._is_stale(rtype, resource):
                 # if the server was slow enough to respond the object may have
                 # been updated already and pushed to us in another thread.
                 LOG.debug("Ignoring stale update for %s: %s", rtype, resource)
                 continue
-            self.record_resource_update(context, rtype, resource,
-                                        agent_restarted=agent_restarted)
+            self._record_resource_update(context, rtype, resource,
+                                         agent_restarted=agent_restarted)
         LOG.debug("%s resources returned for queries %s", len(resources),
                   query_ids)
         self._satisfied_server_queries.update(query_ids)
+        # evict once the queries are recorded, so they are forgotten if any
+        # of the returned objects is evicted
+        self._evict_resources(rtype)
+
+    def get_memory_report(self):
+        """Returns the number and approximate size of the cached objects.
+
+        The report is a dictionary keyed by resource type with the number
+        of cached objects and the number of bytes they use, along with the
+        number of objects evicted, pulls sent to the server, deleted IDs and
+        satisfied server queries tracked.
+        """
+        report = {}
+        for rtype in self.resource_types:
+            type_cache = self._type_cache(rtype)
+            seen = set()
+            report[rtype] = {
+                'objects': len(type_cache),
+                'bytes': sum(_get_memory_footprint(r, seen)
+                             for r in type_cache.values()),
+                'deleted_ids': len(self._deleted_ids_by_type[rtype]),
+                'evicted': self._evicted_counts[rtype],
+                'server_pulls': self._pull_counts[rtype]}
+        report['satisfied_server_queries'] = len(
+            self._satisfied_server_queries)
+        return report
+
+    def get_memory_report_model(self):
+        """Guru Meditation Report section generator of the memory report."""
+        return with_default_views.ModelWithDefaultViews(
+            self.get_memory_report())
+
+    def save_snapshot(self, path):
+        """Writes the cached objects and the server queries to path.
+
+        The objects are saved as OVO primitives, along with the satisfied
+        server queries, so load_snapshot() can restore them after an agent
+        restart instead of pulling them all again from the server.
+        """
+        snapshot = {'version': SNAPSHOT_VERSION,
+                    'versions': {}, 'resources': {},
+                    'satisfied_server_queries': list(
+                        self._satisfied_server_queries)}
+        for rtype in self.resource_types:
+            snapshot['versions'][rtype] = resources.get_resource_cls(
+                rtype).VERSION
+            snapshot['resources'][rtype] = [
+                thaw_resource(resource).obj_to_primitive()
+                for resource in list(self._type_cache(rtype).values())]
+        file_utils.replace_file(path, jsonutils.dumps(snapshot),
+                                file_mode=0o600)
+        LOG.debug("Saved the resource cache snapshot %s", path)
+
+    def load_snapshot(self, path, chunk_size):
+        """Restores the cache saved by save_snapshot() in path.
+
+        The loaded objects are reconciled with the server: only the revision
+        numbers of the objects, and of the objects matching the restored
+        server queries, are requested, in chunks of at most chunk_size
+        values, and only the new objects and those whose revision changed
+        are pulled again. The objects no longer on the server are deleted.
+
+        The resource types saved with another object version are not
+        loaded. Returns False, without any object loaded, if the snapshot
+        can't be read or reconciled.
+        """
+        try:
+            with open(path) as snapshot_file:
+                snapshot = jsonutils.loads(snapshot_file.read())
+            if snapshot.get('version') != SNAPSHOT_VERSION:
+                raise ValueError(_("unsupported snapshot version %s") %
+                                 snapshot.get('version'))
+            loaded, queries = self._load_snapshot(snapshot)
+        except FileNotFoundError:
+            LOG.debug("No resource cache snapshot %s to load", path)
+            return False
+        except Exception:
+            LOG.exception("Ignoring the invalid resource cache snapshot %s",
+                          path)
+            return False
+        try:
+            stats = self._reconcile_snapshot(loaded, queries, chunk_size)
+        except Exception:
+            LOG.exception("Failed to reconcile the resource cache snapshot "
+                          "%s with the server, discarding it", path)
+            self._discard_snapshot(loaded, queries)
+            return False
+        LOG.info("Loaded the resource cache snapshot %(path)s: %(loaded)d "
+                 "objects loaded, %(pulled)d updated and %(deleted)d "
+                 "deleted with %(revision_pulls)d revision and %(pulls)d "
+                 "object pulls", dict(stats, path=path))
+        if self._watcher:
+            self._watcher.subscribe_to_local_network_topics()
+        return True
+
+    def _load_snapshot(self, snapshot):
+        """Adds the objects and server queries of a snapshot.
+
+        No event is published for the loaded objects. The objects already
+        in the cache, received since the agent started, are kept.
+        """
+        loaded = {}
+        for rtype, primitives in snapshot['resources'].items():
+            if rtype not in self.resource_types:
+                continue
+            obj_cls = resources.get_resource_cls(rtype)
+            if snapshot['versions'].get(rtype) != obj_cls.VERSION:
+                LOG.info("Not loading the %(rtype)s objects of the resource "
+                         "cache snapshot, saved with version %(version)s",
+                         {'rtype': rtype,
+                          'version': snapshot['versions'].get(rtype)})
+                continue
+            loaded[rtype] = [
+                freeze_resource(obj_cls.clean_obj_from_primitive(primitive))
+                for primitive in primitives]
+        queries = set()
+        for query in snapshot['satisfied_server_queries']:
+            if query[0] in loaded:
+                queries.add((query[0], ) + tuple(
+                    (key, tuple(values)) for key, values in query[1:]))
+
+        for rtype, type_loaded in loaded.items():
+            type_cache = self._type_cache(rtype)
+            for resource in type_loaded:
+                if (resource.id in type_cache or
+                        resource.id in self._deleted_ids_by_type[rtype]):
+                    continue
+                type_cache[resource.id] = resource
+                self._touch(rtype, (resource.id, ))
+                self._update_indexes(rtype, None, resource)
+        self._satisfied_server_queries |= queries
+        return loaded, queries
+
+    def _reconcile_snapshot(self, loaded, queries, chunk_size):
+        """Updates the objects loaded from a snapshot from the server."""
+        context = n_ctx.get_admin_context()
+        stats = collections.Counter(
+            loaded=sum(len(objs) for objs in loaded.values()))
+        for rtype, type_loaded in loaded.items():
+            # the IDs are checked along with the values of the other single
+            # field queries; the multiple field queries are checked alone
+            filter_values = collections.defaultdict(set)
+            filter_values['id'].update(resource.id for resource in type_loaded)
+            revision_filters = []
+            for query in queries:
+                if query[0] != rtype:
+                    continue
+                if len(query) == 2:
+                    key, values = query[1]
+                    filter_values[key].update(values)
+                else:
+                    revision_filters.append(dict(query[1:]))
+            for key, values in filter_values.items():
+                values = list(values)
+                for i in range(0, len(values), chunk_size):
+                    revision_filters.append(
+                        {key: tuple(values[i:i + chunk_size])})
+            revisions = {}
+            for filters in revision_filters:
+                revisions.update(self._puller.bulk_pull_revisions(
+                    context, rtype, filter_kwargs=filters))
+                stats['revision_pulls'] += 1
+
+            type_cache = self._type_cache(rtype)
+            deleted_ids = self._deleted_ids_by_type[rtype]
+            changed_ids = [
+                obj_id for obj_id, revision_number in revisions.items()
+                if obj_id not in deleted_ids and
+                (obj_id not in type_cache or
+                 type_cache[obj_id].revision_number != revision_number)]
+            for i in range(0, len(changed_ids), chunk_size):
+                objs = self._puller.bulk_pull(
+                    context, rtype,
+                    filter_kwargs={'id': tuple(changed_ids[i:i + chunk_size])})
+                self._pull_counts[rtype] += 1
+                stats['pulls'] += 1
+                for obj in objs:
+                    self._record_resource_update(context, rtype, obj)
+                    stats['pulled'] += 1
+            for resource in type_loaded:
+                # the objects received since they were loaded are kept
+                if (resource.id not in revisions and
+                        type_cache.get(resource.id) is resource):
+                    self.record_resource_delete(context, rtype, resource.id)
+                    stats['deleted'] += 1
+            self._evict_resources(rtype)
+        return stats
+
+    def _discard_snapshot(self, loaded, queries):
+        """Removes the objects and server queries loaded from a snapshot."""
+        for rtype, type_loaded in loaded.items():
+            type_cache = self._type_cache(rtype)
+            for resource in type_loaded:
+                if type_cache.get(resource.id) is resource:
+                    del type_cache[resource.id]
+                    self._update_indexes(rtype, resource, None)
+        self._satisfied_server_queries -= queries
 
     def _get_query_ids(self, rtype, filters):
         """Turns filters for a given rypte into a set of query IDs.
@@ -124,21 +681,36 @@ class RemoteResourceCache(object):
         self._flood_cache_for_query(rtype, **filters)
 
         def match(obj):
-            for key, values in filters.items():
-                for value in values:
-                    attr = getattr(obj, key)
-                    if isinstance(attr, (list, tuple, set)):
-                        # attribute is a list so we check if value is in
-                        # list
-                        if value in attr:
-                            break
-                    elif value == attr:
+            return self._match_filters(obj, filters)
+
+        candidates = self._get_indexed_candidates(rtype, filters)
+        if candidates is None:
+            self._index_stats[rtype]['misses'] += 1
+            result = self.match_resources_with_func(rtype, match)
+        else:
+            self._index_stats[rtype]['hits'] += 1
+            type_cache = self._type_cache(rtype)
+            result = [type_cache[obj_id] for obj_id in candidates
+                      if obj_id in type_cache and match(type_cache[obj_id])]
+        self._touch(rtype, (r.id for r in result))
+        return result
+
+    @staticmethod
+    def _match_filters(obj, filters):
+        for key, values in filters.items():
+            for value in values:
+                attr = getattr(obj, key)
+                if isinstance(attr, (list, tuple, set, frozenset)):
+                    # attribute is a list so we check if value is in
+                    # list
+                    if value in attr:
                         break
-                else:
-                    # no match found for this key
-                    return False
-            return True
-        return self.match_resources_with_func(rtype, match)
+                elif value == attr:
+                    break
+            else:
+                # no match found for this key
+                return False
+        return True
 
     def match_resources_with_func(self, rtype, matcher):
         """Returns a list of all resources satisfying func matcher."""
@@ -171,11 +743,20 @@ class RemoteResourceCache(object):
 
         Both creates and updates are handled in this function.
         """
+        self._record_resource_update(context, rtype, resource,
+                                     agent_restarted=agent_restarted)
+        self._evict_resources(rtype)
+
+    def _record_resource_update(self, context, rtype, resource,
+                                agent_restarted=False):
         if self._is_stale(rtype, resource):
             LOG.debug("Ignoring stale update for %s: %s", rtype, resource)
             return
+        resource = freeze_resource(resource)
         existing = self._type_cache(rtype).get(resource.id)
         self._type_cache(rtype)[resource.id] = resource
+        self._touch(rtype, (resource.id, ))
+        self._update_indexes(rtype, existing, resource)
         changed_fields = self._get_changed_fields(existing, resource)
         if not changed_fields:
             LOG.debug("Received resource %s update without any changes: %s",
@@ -203,13 +784,17 @@ class RemoteResourceCache(object):
         # deletions are final, record them so we never
         # accept new data for the same ID.
         LOG.debug("Resource %s deleted: %s", rtype, resource_id)
-        # TODO(kevinbenton): we need a way to expire items from the set at
-        # some TTL so it doesn't grow indefinitely with churn
+        self._expire_deleted_ids(rtype)
         if resource_id in self._deleted_ids_by_type[rtype]:
             LOG.debug("Skipped duplicate delete event for %s", resource_id)
             return
-        self._deleted_ids_by_type[rtype].add(resource_id)
+        self._deleted_ids_by_type[rtype][resource_id] = time.monotonic()
+        # the deleted ID is answered from the deleted IDs from now on
+        self._satisfied_server_queries.discard(
+            (rtype, ('id', (resource_id, ))))
         existing = self._type_cache(rtype).pop(resource_id, None)
+        if existing:
+            self._update_indexes(rtype, existing, None)
         # local notification for agent internals to subscribe to
         registry.publish(rtype, events.AFTER_DELETE, self,
                          payload=events.DBEventPayload(
@@ -217,6 +802,121 @@ class RemoteResourceCache(object):
                              resource_id=resource_id,
                              states=(existing,)))
 
+    def _expire_deleted_ids(self, rtype):
+        """Forgets the IDs of rtype deleted more than the TTL ago."""
+        if not self._deleted_ids_ttl:
+            return
+        deleted_ids = self._deleted_ids_by_type[rtype]
+        expiry = time.monotonic() - self._deleted_ids_ttl
+        while deleted_ids:
+            obj_id, deleted_at = next(iter(deleted_ids.items()))
+            if deleted_at > expiry:
+                break
+            del deleted_ids[obj_id]
+
+    def _touch(self, rtype, obj_ids):
+        """Marks the objects as the most recently used of their type."""
+        if rtype not in self._max_sizes:
+            return
+        type_cache = self._type_cache(rtype)
+        for obj_id in obj_ids:
+            type_cache.move_to_end(obj_id)
+
+    def _evict_resources(self, rtype):
+        """Evicts the least recently used objects of rtype over its size.
+
+        The cache is shrunk to 90% of the maximum size so the referenced IDs
+        are not computed on every update of a full cache. The objects
+        referenced by the agent are never evicted: if they are more than the
+        maximum size, the eviction is skipped until the cache grows by 10% of
+        the maximum size again.
+
+        NOTE: an evicted object can't be used to discard stale updates, if
+        it is pushed again the update is processed as a new object.
+        """
+        max_size = self._max_sizes.get(rtype)
+        type_cache = self._type_cache(rtype)
+        if not max_size or len(type_cache) <= max_size:
+            self._oversizes.pop(rtype, None)
+            return
+        margin = max(max_size // 10, 1)
+        if len(type_cache) <= self._oversizes.get(rtype, 0) + margin:
+            return
+        excess = len(type_cache) - max(max_size - margin, 1)
+        referenced_ids = (self._referenced_ids_func(rtype)
+                          if self._referenced_ids_func else set())
+        evicted = []
+        # the most recently used object is the one just updated
+        for obj_id, resource in itertools.islice(type_cache.items(),
+                                                 len(type_cache) - 1):
+            if len(evicted) == excess:
+                break
+            if obj_id not in referenced_ids:
+                evicted.append(resource)
+        for resource in evicted:
+            del type_cache[resource.id]
+            self._update_indexes(rtype, resource, None)
+        self._forget_server_queries(rtype, evicted)
+        self._evicted_counts[rtype] += len(evicted)
+        if len(type_cache) <= max_size:
+            self._oversizes.pop(rtype, None)
+            LOG.debug("Evicted %(count)d %(rtype)s objects from the resource "
+                      "cache", {'count': len(evicted), 'rtype': rtype})
+            return
+        self._oversizes[rtype] = len(type_cache)
+        now = time.monotonic()
+        last_warning = self._oversize_warnings.get(rtype)
+        log = LOG.debug
+        if (last_warning is None or
+                now - last_warning >= OVERSIZE_WARNING_INTERVAL):
+            self._oversize_warnings[rtype] = now
+            log = LOG.warning
+        log("Resource cache holds %(size)d %(rtype)s objects referenced by "
+            "this agent, more than its maximum size of %(max)d.",
+            {'size': len(type_cache), 'rtype': rtype, 'max': max_size})
+
+    def _forget_server_queries(self, rtype, resources):
+        """Forgets the satisfied server queries that returned resources.
+
+        The resources are no longer in the cache so these queries have to
+        be sent to the server again.
+        """
+        if not resources:
+            return
+        query_ids = [query_id for query_id in self._satisfied_server_queries
+                     if query_id[0] == rtype]
+        # the filter values of the resources, so only the queries sharing
+        # all their filter values with them are matched against each one
+        keys = {key for query_id in query_ids for key, _values in query_id[1:]}
+        values = set()
+        unhashed_keys = set()
+        for resource in resources:
+            for key in keys:
+                try:
+                    attr = getattr(resource, key)
+                    if isinstance(attr, (list, tuple, set, frozenset)):
+                        values.update((key, value) for value in attr)
+                    else:
+                        values.add((key, attr))
+                except (AttributeError, TypeError):
+                    unhashed_keys.add(key)
+        forgotten = set()
+        for query_id in query_ids:
+            if not all(key in unhashed_keys or
+                       any((key, value) in values for value in key_values)
+                       for key, key_values in query_id[1:]):
+                continue
+            filters = dict(query_id[1:])
+            for resource in resources:
+                try:
+                    matched = self._match_filters(resource, filters)
+                except AttributeError:
+                    matched = True
+                if matched:
+                    forgotten.add(query_id)
+                    break
+        self._satisfied_server_queries -= forgotten
+
     def _get_changed_fields(self, old, new):
         """Returns changed fields excluding update time and revision."""
         new = new.to_dict()
@@ -241,21 +941,93 @@ class RemoteResourceWatcher(object):
 
     All watched resources must be primary keyed on a field called 'id' and
     have a standard attr revision number.
+
+    With rpc_scoped_resource_push, the ports are received on the topic of
+    this host and on the topics of the networks of the ports bound to it,
+    subscribed to when these ports are first cached, instead of the topic
+    of all the agents, still used for the deleted ports without a known
+    scope. The consumers of the cache subscribe to the other scopes they
+    need, like the security groups used as remote groups.
     """
 
     def __init__(self, remote_resource_cache):
         self.rcache = remote_resource_cache
+        self._scoped_topics = set()
         self._init_rpc_listeners()
 
     def _init_rpc_listeners(self):
-        endpoints = [resources_rpc.ResourcesPushRpcCallback()]
+        self._endpoints = [resources_rpc.ResourcesPushRpcCallback()]
         self._connection = n_rpc.Connection()
         for rtype in self.rcache.resource_types:
             registry_rpc.register(self.resource_change_handler, rtype)
+            if (cfg.CONF.rpc_scoped_resource_push and
+                    rtype in resources_rpc.SCOPED_PUSH_RESOURCE_TYPES):
+                topic = resources_rpc.resource_type_scoped_topic(
+                    rtype, resources_rpc.SCOPE_HOST, cfg.CONF.host)
+                self._scoped_topics.add(topic)
+                self._connection.create_consumer(topic, self._endpoints,
+                                                 fanout=True)
+                registry.subscribe(self._subscribe_to_network_topic, rtype,
+                                   events.AFTER_UPDATE)
+            # with scoped pushes, the resources without a known scope are
+            # still pushed on the topic of all the agents
             topic = resources_rpc.resource_type_versioned_topic(rtype)
-            self._connection.create_consumer(topic, endpoints, fanout=True)
+            self._connection.create_consumer(topic, self._endpoints,
+                                             fanout=True)
         self._connection.consume_in_threads()
 
+    @staticmethod
+    def _is_local_port(port):
+        return any(b.host == cfg.CONF.host for b in port.bindings or ())
+
+    def _subscribe_to_network_topic(self, rtype, event, trigger, payload):
+        if trigger is self.rcache and self._is_local_port(
+                payload.latest_state):
+            self._add_scoped_topic(rtype, resources_rpc.SCOPE_NETWORK,
+                                   payload.latest_state.network_id)
+
+    def subscribe_to_local_network_topics(self):
+        """Listens to the pushes of the networks of the cached local ports.
+
+        Used when the ports are cached without an update event, like the
+        ports loaded from a snapshot.
+        """
+        if not cfg.CONF.rpc_scoped_resource_push:
+            return
+        for rtype in self.rcache.resource_types:
+            if rtype not in resources_rpc.SCOPED_PUSH_RESOURCE_TYPES:
+                continue
+            for port in self.rcache.match_resources_with_func(
+                    rtype, self._is_local_port):
+                self._add_scoped_topic(rtype, resources_rpc.SCOPE_NETWORK,
+                                       port.network_id)
+
+    def subscribe_to_scopes(self, rtype, scope, scope_ids):
+        """Listens to the pushes of resources of other scopes."""
+        if (not cfg.CONF.rpc_scoped_resource_push or
+                rtype not in resources_rpc.SCOPED_PUSH_RESOURCE_TYPES):
+            return
+        for scope_id in scope_ids:
+            self._add_scoped_topic(rtype, scope, scope_id)
+
+    def _add_scoped_topic(self, rtype, scope, scope_id):
+        """Listens to the pushes of a scope, like a network or a group.
+
+        The topics are kept for the life of the agent, so the updates
+        unbinding a port from this host, or removing it from a security
+        group, are still received.
+        """
+        topic = resources_rpc.resource_type_scoped_topic(
+            rtype, scope, scope_id)
+        if topic in self._scoped_topics:
+            return
+        self._scoped_topics.add(topic)
+        LOG.debug("Listening to the %(rtype)s pushes of %(scope)s "
+                  "%(scope_id)s", {'rtype': rtype, 'scope': scope,
+                                   'scope_id': scope_id})
+        self._connection.create_consumer(topic, self._endpoints, fanout=True)
+        self._connection.servers[-1].start()
+
     def resource_change_handler(self, context, rtype, resources, event_type):
         for r in resources:
             if event_type == events_rpc.DELETED:
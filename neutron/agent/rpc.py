@@ -29,14 +29,18 @@ from neutron_lib import rpc as lib_rpc
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging
+from oslo_reports import guru_meditation_report as gmr
 from oslo_serialization import jsonutils
+from oslo_service import loopingcall
 from oslo_utils import uuidutils
 
 from neutron.agent import resource_cache
 from neutron.api.rpc.callbacks import resources
+from neutron.conf.agent import common as agent_conf
 from neutron import objects
 
 LOG = logging.getLogger(__name__)
+agent_conf.register_resource_cache_opts()
 BINDING_DEACTIVATE = 'binding_deactivate'
 DeviceInfo = collections.namedtuple('DeviceInfo', 'mac pci_slot')
 
@@ -221,6 +225,14 @@ class CacheBackedPluginApi(PluginApi):
                       resources.SUBNET,
                       resources.ADDRESSGROUP]
 
+    # secondary indexes used by the agent side lookups, see
+    # SecurityGroupServerAPIShim
+    RESOURCE_INDEXES = {
+        resources.PORT: ('security_group_ids', 'network_id', 'device_owner'),
+        resources.SECURITYGROUPRULE: ('security_group_id',
+                                      'remote_address_group_id'),
+    }
+
     def __init__(self, *args, **kwargs):
         super(CacheBackedPluginApi, self).__init__(*args, **kwargs)
         self.remote_resource_cache = None
@@ -314,6 +326,12 @@ class CacheBackedPluginApi(PluginApi):
                                                     agent_id, host=None,
                                                     agent_restarted=False):
         result = {'devices': [], 'failed_devices': []}
+        try:
+            self._fetch_missing_device_resources(devices, agent_restarted)
+        except Exception:
+            # the devices are fetched one by one by get_device_details
+            LOG.exception("Failed to fetch the resources of %d devices",
+                          len(devices))
         for device in devices:
             try:
                 result['devices'].append(
@@ -324,6 +342,31 @@ class CacheBackedPluginApi(PluginApi):
                 result['failed_devices'].append(device)
         return result
 
+    def _fetch_missing_device_resources(self, devices, agent_restarted):
+        """Pulls the ports and networks of devices missing in the cache.
+
+        The missing ports, and then their missing networks, are requested
+        in chunks of several IDs, so get_device_details finds them in the
+        cache instead of pulling them one by one from the server.
+        """
+        rcache = self.remote_resource_cache
+        chunk_size = cfg.CONF.AGENT.resource_cache_pull_chunk_size
+        port_pulls = rcache.fetch_missing_resources(
+            resources.PORT, devices, chunk_size,
+            agent_restarted=agent_restarted)
+        network_ids = set()
+        for device in devices:
+            port_obj = rcache.get_resource_by_id(resources.PORT, device)
+            if port_obj:
+                network_ids.add(port_obj.network_id)
+        network_pulls = rcache.fetch_missing_resources(
+            resources.NETWORK, network_ids, chunk_size)
+        LOG.debug("Fetched the resources of %(devices)d devices with "
+                  "%(port_pulls)d port and %(network_pulls)d network pulls",
+                  {'devices': len(devices), 'port_pulls': port_pulls,
+                   'network_pulls': network_pulls})
+        return port_pulls + network_pulls
+
     def get_device_details(self, context, device, agent_id, host=None,
                            agent_restarted=False):
         port_obj = self.remote_resource_cache.get_resource_by_id(
@@ -394,9 +437,69 @@ class CacheBackedPluginApi(PluginApi):
     def _create_cache_for_l2_agent(self):
         """Create a push-notifications cache for L2 agent related resources."""
         objects.register_objects()
-        rcache = resource_cache.RemoteResourceCache(self.RESOURCE_TYPES)
+        indexes = {rtype: fields
+                   for rtype, fields in self.RESOURCE_INDEXES.items()
+                   if rtype in self.RESOURCE_TYPES}
+        rcache = resource_cache.RemoteResourceCache(
+            self.RESOURCE_TYPES, indexes=indexes,
+            max_sizes=cfg.CONF.AGENT.resource_cache_max_size,
+            deleted_ids_ttl=cfg.CONF.AGENT.resource_cache_deleted_ids_ttl,
+            referenced_ids_func=self._get_referenced_resource_ids)
         rcache.start_watcher()
+        gmr.TextGuruMeditation.register_section(
+            'Remote resource cache', rcache.get_memory_report_model)
         self.remote_resource_cache = rcache
+        self._start_cache_snapshots()
+
+    def _start_cache_snapshots(self):
+        """Loads the cache snapshot and saves the cache periodically."""
+        path = cfg.CONF.AGENT.resource_cache_snapshot_file
+        if not path:
+            return
+        self.remote_resource_cache.load_snapshot(
+            path, cfg.CONF.AGENT.resource_cache_pull_chunk_size)
+        interval = cfg.CONF.AGENT.resource_cache_snapshot_interval
+        if interval:
+            self._snapshot_loop = loopingcall.FixedIntervalLoopingCall(
+                self._save_cache_snapshot, path)
+            self._snapshot_loop.start(interval=interval,
+                                      initial_delay=interval)
+
+    def _save_cache_snapshot(self, path):
+        try:
+            self.remote_resource_cache.save_snapshot(path)
+        except Exception:
+            LOG.exception("Failed to save the resource cache snapshot %s",
+                          path)
+
+    def _get_referenced_resource_ids(self, rtype):
+        """Returns the IDs of the rtype resources used by the local ports.
+
+        These are the ports bound to this host, their networks, subnets,
+        security groups and rules, and the address groups of the rules.
+        """
+        rcache = self.remote_resource_cache
+        host = cfg.CONF.host
+        ports = rcache.match_resources_with_func(
+            resources.PORT,
+            lambda p: any(b.host == host for b in p.bindings or ()))
+        if rtype == resources.PORT:
+            return {p.id for p in ports}
+        if rtype == resources.NETWORK:
+            return {p.network_id for p in ports}
+        if rtype == resources.SUBNET:
+            return {ip.subnet_id for p in ports for ip in p.fixed_ips or ()}
+        sg_ids = {sg_id for p in ports for sg_id in p.security_group_ids}
+        if rtype == resources.SECURITYGROUP:
+            return sg_ids
+        rules = rcache.match_resources_with_func(
+            resources.SECURITYGROUPRULE,
+            lambda r: r.security_group_id in sg_ids)
+        if rtype == resources.SECURITYGROUPRULE:
+            return {r.id for r in rules}
+        if rtype == resources.ADDRESSGROUP:
+            return {r.remote_address_group_id for r in rules}
+        return set()
 
 
 # TODO(ralonsoh): move this method to neutron_lib.plugins.utils
@@ -19,6 +19,7 @@ from neutron_lib.agent import topics
 from neutron_lib import constants
 from neutron_lib import exceptions
 from neutron_lib import rpc as n_rpc
+from oslo_config import cfg
 from oslo_log import helpers as log_helpers
 from oslo_log import log as logging
 import oslo_messaging
@@ -29,9 +30,19 @@ from neutron.api.rpc.callbacks import exceptions as rpc_exc
 from neutron.api.rpc.callbacks.producer import registry as prod_registry
 from neutron.api.rpc.callbacks import resources
 from neutron.api.rpc.callbacks import version_manager
+from neutron.conf import service as service_conf
 from neutron.objects import base as obj_base
 
 LOG = logging.getLogger(__name__)
+service_conf.register_service_opts(service_conf.RPC_EXTRA_OPTS)
+
+# the resource types pushed on the host, network and security group scoped
+# topics when rpc_scoped_resource_push is enabled, the others are pushed to
+# all agents
+SCOPED_PUSH_RESOURCE_TYPES = (resources.PORT, )
+SCOPE_HOST = 'host'
+SCOPE_NETWORK = 'network'
+SCOPE_SECURITY_GROUP = 'security_group'
 
 
 class ResourcesRpcError(exceptions.NeutronException):
@@ -72,6 +83,34 @@ def resource_type_versioned_topic(resource_type, version=None):
                                             'version': version or cls.VERSION}
 
 
+def resource_type_scoped_topic(resource_type, scope, scope_id, version=None):
+    """Return the topic for a resource type limited to a host or network."""
+    return '%s.%s.%s' % (resource_type_versioned_topic(resource_type, version),
+                         scope, scope_id)
+
+
+def get_push_scopes(resource):
+    """Return the (scope, scope_id) pairs a resource is pushed to.
+
+    A port is pushed to the hosts it is bound to, including the inactive
+    bindings of a migration, to the network it is on and to its security
+    groups, for the agents using them as remote groups. No scope is
+    returned for the ID only objects of the deleted ports.
+    """
+    if not resource.obj_attr_is_set('network_id'):
+        return []
+    bindings = (resource.bindings if resource.obj_attr_is_set('bindings')
+                else ())
+    sg_ids = (resource.security_group_ids
+              if resource.obj_attr_is_set('security_group_ids') else None)
+    scopes = [(SCOPE_NETWORK, resource.network_id)]
+    scopes.extend((SCOPE_HOST, host)
+                  for host in sorted({b.host for b in bindings if b.host}))
+    scopes.extend((SCOPE_SECURITY_GROUP, sg_id)
+                  for sg_id in sorted(sg_ids or ()))
+    return scopes
+
+
 class ResourcesPullRpcApi(object):
     """Agent-side RPC (stub) for agent-to-plugin interaction.
 
@@ -115,6 +154,15 @@ class ResourcesPullRpcApi(object):
         return [resource_type_cls.clean_obj_from_primitive(primitive)
                 for primitive in primitives]
 
+    @log_helpers.log_method_call
+    def bulk_pull_revisions(self, context, resource_type, filter_kwargs=None):
+        """Returns the revision numbers of the matching resources by ID."""
+        _validate_resource_type(resource_type)
+        cctxt = self.client.prepare(version='1.2')
+        return cctxt.call(context, 'bulk_pull_revisions',
+                          resource_type=resource_type,
+                          filter_kwargs=filter_kwargs)
+
 
 class ResourcesPullRpcCallback(object):
     """Plugin-side RPC (implementation) for agent-to-plugin interaction.
@@ -127,9 +175,10 @@ class ResourcesPullRpcCallback(object):
     # History
     #   1.0 Initial version
     #   1.1 Added bulk_pull
+    #   1.2 Added bulk_pull_revisions
 
     target = oslo_messaging.Target(
-        version='1.1', namespace=constants.RPC_NAMESPACE_RESOURCES)
+        version='1.2', namespace=constants.RPC_NAMESPACE_RESOURCES)
 
     @oslo_messaging.expected_exceptions(rpc_exc.CallbackNotFound)
     def pull(self, context, resource_type, version, resource_id):
@@ -147,6 +196,14 @@ class ResourcesPullRpcCallback(object):
                 for obj in resource_type_cls.get_objects(context, _pager=None,
                                                          **filter_kwargs)]
 
+    def bulk_pull_revisions(self, context, resource_type, filter_kwargs=None):
+        filter_kwargs = filter_kwargs or {}
+        resource_type_cls = _resource_to_class(resource_type)
+        return {obj.id: obj.revision_number
+                for obj in resource_type_cls.get_objects(
+                    context, _pager=None, fields=['id', 'revision_number'],
+                    **filter_kwargs)}
+
 
 class ResourcesPushToServersRpcApi(object):
     """Publisher-side RPC (stub) for plugin-to-plugin fanout interaction.
@@ -226,11 +283,17 @@ class ResourcesPushRpcApi(object):
             resources_by_type[resource_type].append(resource)
         return resources_by_type
 
-    def push(self, context, resource_list, event_type):
+    def push(self, context, resource_list, event_type,
+             previous_scopes=None):
         """Push an event and list of resources to agents, batched per type.
         When a list of different resource types is passed to this method,
         the push will be sent as separate individual list pushes, one per
         resource type.
+
+        previous_scopes maps resource IDs to the (scope, scope_id) pairs
+        the resources had before the event, like the security groups a port
+        was removed from, so the agents of these scopes are notified too
+        when the pushes are scoped.
         """
 
         resources_by_type = self._classify_resources_by_type(resource_list)
@@ -242,12 +305,20 @@ class ResourcesPushRpcApi(object):
                  for obj in resources_by_type[t]]
              for t in resources_by_type})
         for resource_type, type_resources in resources_by_type.items():
-            self._push(context, resource_type, type_resources, event_type)
+            self._push(context, resource_type, type_resources, event_type,
+                       previous_scopes or {})
 
-    def _push(self, context, resource_type, resource_list, event_type):
+    def _push(self, context, resource_type, resource_list, event_type,
+              previous_scopes=None):
         """Push an event and list of resources of the same type to agents."""
         _validate_resource_type(resource_type)
 
+        if (cfg.CONF.rpc_scoped_resource_push and
+                resource_type in SCOPED_PUSH_RESOURCE_TYPES):
+            self._push_scoped(context, resource_type, resource_list,
+                              event_type, previous_scopes or {})
+            return
+
         for version in version_manager.get_resource_versions(resource_type):
             cctxt = self._prepare_object_fanout_context(
                 resource_list[0], version, rpc_version='1.1')
@@ -260,6 +331,38 @@ class ResourcesPushRpcApi(object):
                        resource_list=dehydrated_resources,
                        event_type=event_type)
 
+    def _push_scoped(self, context, resource_type, resource_list,
+                     event_type, previous_scopes):
+        """Push the resources on the topics of their scopes.
+
+        The scopes are the current and previous hosts, networks and
+        security groups of the resources. One message is sent per topic with
+        all the resources of the list pushed to it. The resources without a
+        known scope, like the ports deleted before their deletion event was
+        received, are pushed on the topic of all the agents.
+        """
+        for version in version_manager.get_resource_versions(resource_type):
+            resources_by_topic = collections.defaultdict(list)
+            for resource in resource_list:
+                dehydrated = resource.obj_to_primitive(target_version=version)
+                scopes = set(get_push_scopes(resource))
+                scopes.update(previous_scopes.get(resource.id, ()))
+                if not scopes:
+                    topic = resource_type_versioned_topic(resource_type,
+                                                          version)
+                    resources_by_topic[topic].append(dehydrated)
+                for scope, scope_id in sorted(scopes):
+                    topic = resource_type_scoped_topic(
+                        resource_type, scope, scope_id, version)
+                    resources_by_topic[topic].append(dehydrated)
+
+            for topic, dehydrated_resources in resources_by_topic.items():
+                cctxt = self.client.prepare(fanout=True, topic=topic,
+                                            version='1.1')
+                cctxt.cast(context, 'push',
+                           resource_list=dehydrated_resources,
+                           event_type=event_type)
+
 
 class ResourcesPushRpcCallback(object):
     """Agent-side RPC for plugin-to-agents interaction.
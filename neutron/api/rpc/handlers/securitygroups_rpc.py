@@ -16,6 +16,7 @@ import collections
 
 from neutron_lib.agent import topics
 from neutron_lib.callbacks import events
+from neutron_lib.callbacks import priority_group
 from neutron_lib.callbacks import registry
 from neutron_lib import constants
 from neutron_lib.plugins import directory
@@ -238,13 +239,30 @@ class SecurityGroupServerAPIShim(sg_rpc_base.SecurityGroupInfoAPIMixin):
     This provides the same methods as SecurityGroupServerRpcApi but it reads
     from the updates delivered to the push notifications cache rather than
     calling the server.
+
+    The IP and MAC addresses of the members of each security group are kept
+    up to date from the Port events of the cache, so they don't have to be
+    computed from the cached ports on every request.
     """
     def __init__(self, rcache):
         self.rcache = rcache
+        # {sg_id: Counter((ip, mac))}, several ports can share an address
+        self._sg_member_ips = collections.defaultdict(collections.Counter)
+        # {port_id: (sg_ids, member ips)} as added to _sg_member_ips
+        self._port_member_ips = {}
+        # remote groups whose member ports were loaded in the cache
+        self._loaded_remote_groups = set()
         registry.subscribe(self._clear_child_sg_rules, 'SecurityGroup',
                            events.AFTER_DELETE)
         registry.subscribe(self._add_child_sg_rules, 'SecurityGroup',
                            events.AFTER_UPDATE)
+        # the member IPs must be updated before the agent is notified
+        for event in (events.AFTER_UPDATE, events.AFTER_DELETE):
+            registry.subscribe(self._handle_port_member_ips, 'Port', event,
+                               priority=priority_group.PRIORITY_DEFAULT - 1)
+        for port in self.rcache.match_resources_with_func('Port',
+                                                          lambda p: True):
+            self._update_port_member_ips(port.id, port)
         # set this attr so agent can adjust the timeout of the client
         self.client = resources_rpc.ResourcesPullRpcApi().client
 
@@ -337,6 +355,44 @@ class SecurityGroupServerAPIShim(sg_rpc_base.SecurityGroupInfoAPIMixin):
         if sgs:
             self._sg_agent.security_groups_member_updated(sgs)
 
+    def _handle_port_member_ips(self, rtype, event, trigger, payload):
+        port = (payload.latest_state if event == events.AFTER_UPDATE
+                else None)
+        self._update_port_member_ips(payload.resource_id, port)
+
+    @staticmethod
+    def _get_port_member_ips(port):
+        allowed_ips = [(str(addr.ip_address), str(addr.mac_address))
+                       for addr in port.allowed_address_pairs]
+        return frozenset([(str(addr.ip_address), str(port.mac_address))
+                          for addr in port.fixed_ips] + allowed_ips)
+
+    def _update_port_member_ips(self, port_id, port):
+        """Updates the member IPs of the security groups of a port.
+
+        :param port: the current state of the port or None if it was deleted
+        """
+        old_sg_ids, old_ips = self._port_member_ips.pop(
+            port_id, (frozenset(), frozenset()))
+        new_sg_ids, new_ips = frozenset(), frozenset()
+        if port is not None:
+            new_sg_ids = frozenset(port.security_group_ids)
+            if new_sg_ids:
+                new_ips = self._get_port_member_ips(port)
+                self._port_member_ips[port_id] = (new_sg_ids, new_ips)
+        if (old_sg_ids, old_ips) == (new_sg_ids, new_ips):
+            return
+        for sg_id in old_sg_ids:
+            member_ips = self._sg_member_ips[sg_id]
+            member_ips.subtract(old_ips)
+            for ip in old_ips:
+                if member_ips[ip] <= 0:
+                    del member_ips[ip]
+            if not member_ips:
+                del self._sg_member_ips[sg_id]
+        for sg_id in new_sg_ids:
+            self._sg_member_ips[sg_id].update(new_ips)
+
     def _handle_address_group_event(self, rtype, event, trigger, payload):
         resource_id = payload.resource_id
         if event == events.AFTER_UPDATE:
@@ -376,18 +432,21 @@ class SecurityGroupServerAPIShim(sg_rpc_base.SecurityGroupInfoAPIMixin):
     def _select_ips_for_remote_group(self, context, remote_group_ids):
         if not remote_group_ids:
             return {}
-        ips_by_group = {rg: set() for rg in remote_group_ids}
-
-        filters = {'security_group_ids': tuple(remote_group_ids)}
-        for p in self.rcache.get_resources('Port', filters):
-            allowed_ips = [(str(addr.ip_address), str(addr.mac_address))
-                           for addr in p.allowed_address_pairs]
-            port_ips = [(str(addr.ip_address), str(p.mac_address))
-                        for addr in p.fixed_ips] + allowed_ips
-            for sg_id in p.security_group_ids:
-                if sg_id in ips_by_group:
-                    ips_by_group[sg_id].update(set(port_ips))
-        return ips_by_group
+        not_loaded = [rg for rg in remote_group_ids
+                      if rg not in self._loaded_remote_groups]
+        if not_loaded:
+            # with scoped pushes, the member ports on networks without a
+            # port of this host are only received on the group topics, so
+            # they are subscribed to before the ports are loaded.
+            self.rcache.subscribe_to_scopes(
+                'Port', resources_rpc.SCOPE_SECURITY_GROUP, not_loaded)
+            # the first query loads the member ports from the server, their
+            # addresses are added to the member IPs by the port events.
+            filters = {'security_group_ids': tuple(not_loaded)}
+            self.rcache.get_resources('Port', filters)
+            self._loaded_remote_groups.update(not_loaded)
+        return {rg: set(self._sg_member_ips.get(rg, ()))
+                for rg in remote_group_ids}
 
     def _select_ips_for_remote_address_group(self, context,
                                              remote_address_group_ids):
@@ -117,6 +117,42 @@ AGENT_STATE_OPTS = [
                 help=_('Log agent heartbeats')),
 ]
 
+RESOURCE_CACHE_OPTS = [
+    cfg.Opt('resource_cache_max_size',
+            type=cfg.types.Dict(value_type=cfg.types.Integer(min=0)),
+            default={},
+            help=_("Maximum number of objects kept per resource type by "
+                   "the agent remote resource cache, for instance "
+                   "'Port:20000,SecurityGroupRule:50000'. When the limit is "
+                   "exceeded, the least recently used objects not referenced "
+                   "by the ports bound to this host are evicted and fetched "
+                   "again from the server when needed. Resource types not "
+                   "listed, or with a value of 0, are not limited.")),
+    cfg.IntOpt('resource_cache_deleted_ids_ttl', default=3600, min=0,
+               help=_("Seconds the agent remote resource cache remembers the "
+                      "IDs of deleted resources, to reject late updates "
+                      "received for them. 0 means they are remembered for "
+                      "the life of the agent.")),
+    cfg.IntOpt('resource_cache_pull_chunk_size', default=100, min=1,
+               help=_("Maximum number of resource IDs requested from the "
+                      "server in a single pull when the agent remote "
+                      "resource cache fetches the resources missing for a "
+                      "batch of devices, for instance after an agent "
+                      "restart.")),
+    cfg.StrOpt('resource_cache_snapshot_file',
+               help=_("File where the agent periodically saves the contents "
+                      "of its remote resource cache, and loads them from "
+                      "when it starts. The loaded resources are reconciled "
+                      "with the server by their revision numbers, so only "
+                      "the resources changed while the agent was stopped "
+                      "are pulled again. Each agent of a host needs its own "
+                      "file. If not set, the cache is not saved.")),
+    cfg.IntOpt('resource_cache_snapshot_interval', default=300, min=0,
+               help=_("Seconds between the saves of the agent remote "
+                      "resource cache to 'resource_cache_snapshot_file'. 0 "
+                      "disables the periodic saves.")),
+]
+
 INTERFACE_DRIVER_OPTS = [
     cfg.StrOpt('interface_driver',
                help=_("The driver used to manage the virtual interface.")),
@@ -138,6 +174,20 @@ IPTABLES_OPTS = [
     cfg.BoolOpt('use_random_fully',
                 default=True,
                 help=_("Use random-fully in SNAT masquerade rules.")),
+    cfg.BoolOpt('iptables_incremental_apply', default=False,
+                help=_("Keep an in-memory copy of the last applied iptables "
+                       "state and, when only chains owned by the agent "
+                       "changed, apply the changes without running "
+                       "iptables-save first. A full iptables-save and diff "
+                       "is still done periodically, see "
+                       "'iptables_verify_interval', when changes affect "
+                       "chains not owned by the agent and when "
+                       "iptables-restore fails.")),
+    cfg.IntOpt('iptables_verify_interval', default=300, min=0,
+               help=_("Interval, in seconds, between full iptables-save "
+                      "verifications of the in-memory iptables state when "
+                      "'iptables_incremental_apply' is enabled. Use 0 to "
+                      "verify it on every apply.")),
 ]
 
 PROCESS_MONITOR_OPTS = [
@@ -229,6 +279,10 @@ def register_agent_state_opts_helper(conf):
     conf.register_opts(AGENT_STATE_OPTS, 'AGENT')
 
 
+def register_resource_cache_opts(conf=cfg.CONF):
+    conf.register_opts(RESOURCE_CACHE_OPTS, 'AGENT')
+
+
 def register_interface_driver_opts_helper(conf):
     conf.register_opts(INTERFACE_DRIVER_OPTS)
 
@@ -71,7 +71,22 @@ METADATA_PROXY_HANDLER_OPTS = [
                help=_("Client certificate for nova metadata api server.")),
     cfg.StrOpt('nova_client_priv_key',
                default='',
-               help=_("Private key of client certificate."))
+               help=_("Private key of client certificate.")),
+    cfg.BoolOpt('metadata_port_index',
+                default=False,
+                help=_("Identify the instances of the metadata requests "
+                       "with a local index of the ports, kept up to date by "
+                       "the port notifications of the server, instead of "
+                       "asking the server for each request. The ports of a "
+                       "network are pulled from the server the first time "
+                       "one of them is looked up, and the server is still "
+                       "asked when no port matches a request. Each metadata "
+                       "worker process keeps its own index and receives the "
+                       "port notifications on its own, so every worker "
+                       "deserializes and caches the updated ports of the "
+                       "deployment, or of the networks it looked up when "
+                       "'rpc_scoped_resource_push' is enabled. Use few "
+                       "workers with this option.")),
 ]
 
 
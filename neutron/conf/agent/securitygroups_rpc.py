@@ -42,7 +42,17 @@ security_group_opts = [
         default=[],
         help=_('Comma-separated list of ethertypes to be permitted, in '
                'hexadecimal (starting with "0x"). For example, "0x4008" '
-               'to permit InfiniBand.'))
+               'to permit InfiniBand.')),
+    cfg.BoolOpt(
+        'conntrack_netlink_flush',
+        default=False,
+        help=_('Delete the conntrack entries made obsolete by security group '
+               'changes through netlink instead of running one conntrack '
+               'command per fixed IP address. The entries of each zone are '
+               'listed once for all the pending updates and the matching '
+               'ones are deleted in a single call. Updates that cannot be '
+               'handled through netlink, such as those filtering on a mark '
+               'or in a namespace, still use the conntrack command.'))
 ]
 
 
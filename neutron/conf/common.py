@@ -110,6 +110,12 @@ core_opts = [
     cfg.IntOpt('send_events_interval', default=2,
                help=_('Number of seconds between sending events to nova if '
                       'there are any events to send.')),
+    cfg.IntOpt('send_events_max_batch_size', default=100, min=0,
+               help=_('Maximum number of events sent to nova, or ironic, in '
+                      'a single batch. When this number of events is queued '
+                      'they are sent without waiting for the end of the '
+                      '"send_events_interval". A value of 0 disables the '
+                      'limit.')),
     cfg.StrOpt('setproctitle', default='on',
                help=_("Set process name to match child worker role. "
                       "Available options are: 'off' - retains the previous "
@@ -121,6 +127,21 @@ core_opts = [
                help=_("Neutron IPAM (IP address management) driver to use. "
                       "By default, the reference implementation of the "
                       "Neutron IPAM driver is used.")),
+    cfg.BoolOpt('ipam_free_range_index', default=False,
+                help=_("If True, the internal IPAM driver keeps an index of "
+                       "the free address ranges of the subnets in memory, "
+                       "updated on each allocation and deallocation, instead "
+                       "of loading all the allocations of a subnet to "
+                       "generate an address. The index is built again from "
+                       "the database when it has no free address left or "
+                       "when it is older than "
+                       "'ipam_free_range_index_max_age'.")),
+    cfg.IntOpt('ipam_free_range_index_max_age', default=300, min=0,
+               help=_("Seconds after which the free address range index of "
+                      "a subnet is built again from the database, so the "
+                      "addresses released by other servers become "
+                      "available. 0 means it is only built again when it "
+                      "has no free address left.")),
     cfg.BoolOpt('vlan_transparent', default=False,
                 help=_('If True, then allow plugins that support it to '
                        'create VLAN transparent networks.')),
@@ -65,7 +65,33 @@ ml2_opts = [
     cfg.IntOpt('overlay_ip_version',
                default=4,
                help=_("IP version of all overlay (tunnel) network endpoints. "
-                      "Use a value of 4 for IPv4 or 6 for IPv6."))
+                      "Use a value of 4 for IPv4 or 6 for IPv6.")),
+    cfg.IntOpt('ovo_push_max_batch_size',
+               default=100, min=1,
+               help=_("Maximum number of resources of the same type that "
+                      "are retrieved from the database and pushed to the "
+                      "agents in a single batch by the OVO RPC notifier.")),
+    cfg.FloatOpt('ovo_push_max_linger',
+                 default=0.0, min=0.0,
+                 help=_("Maximum time, in seconds, the OVO RPC notifier waits "
+                        "for more resource changes to fill a batch before "
+                        "pushing it. The default value of 0 only batches the "
+                        "changes that are already queued, so the latency of "
+                        "single changes is not increased.")),
+    cfg.IntOpt('device_details_cache_size',
+               default=0, min=0,
+               help=_("Maximum number of device details entries cached by "
+                      "each RPC worker to answer the agents' "
+                      "get_devices_details_list_and_failed_devices calls. "
+                      "The entries are validated against the revision "
+                      "numbers of the port and its network before they are "
+                      "returned. Each RPC worker has its own cache and only "
+                      "the worker that handles a port status update keeps "
+                      "its entry, the entries of the other workers are "
+                      "rebuilt on their next request. The cache is "
+                      "therefore mostly useful with a single RPC worker, "
+                      "as the hit rate drops with the number of workers. "
+                      "The default value of 0 disables the cache.")),
 ]
 
 
@@ -104,6 +104,44 @@ ovn_opts = [
                       ' will sync the DB just like repair mode but it will'
                       ' additionally fix the Neutron DB resource from OVS to'
                       ' OVN.') % {'migrate': MIGRATE_MODE}),
+    cfg.IntOpt('neutron_sync_page_size',
+               default=1000,
+               min=0,
+               help=_('Number of Neutron resources fetched from the database '
+                      'in each query during the OVN_Northbound OVSDB '
+                      'synchronization. 0 means all the resources are '
+                      'fetched in a single query.')),
+    cfg.IntOpt('neutron_sync_batch_size',
+               default=1000,
+               min=0,
+               help=_('Maximum number of OVN_Northbound OVSDB commands '
+                      'applied in a single transaction by the '
+                      'synchronization, in repair mode. 0 means there is no '
+                      'limit.')),
+    cfg.IntOpt('inconsistencies_fix_batch_size',
+               default=0,
+               min=0,
+               help=_('Number of inconsistent resources of the same type '
+                      'fixed together by the maintenance task. Their Neutron '
+                      'objects are loaded with a single query and their '
+                      'fixes are applied in a single OVN_Northbound OVSDB '
+                      'transaction. If a batch fails, its resources are '
+                      'fixed one by one. 0 means the resources are always '
+                      'fixed one by one.')),
+    cfg.IntOpt('inconsistencies_fix_time_budget',
+               default=0,
+               min=0,
+               help=_('Maximum number of seconds spent by a run of the '
+                      'maintenance task fixing inconsistent resources. The '
+                      'resources not fixed in time are fixed by the next '
+                      'runs. 0 means there is no limit.')),
+    cfg.BoolOpt('neutron_sync_concurrent_phases',
+                default=False,
+                help=_('If True, the phases of the OVN_Northbound OVSDB '
+                       'synchronization that don\'t depend on each other, '
+                       'the ACLs, routers, DNS records and port QoS '
+                       'policies, are run concurrently once the networks '
+                       'and ports are synchronized.')),
     cfg.BoolOpt('ovn_l3_mode',
                 default=True,
                 deprecated_for_removal=True,
@@ -258,6 +296,26 @@ def get_ovn_neutron_sync_mode():
     return cfg.CONF.ovn.neutron_sync_mode
 
 
+def get_ovn_neutron_sync_page_size():
+    return cfg.CONF.ovn.neutron_sync_page_size
+
+
+def get_ovn_neutron_sync_batch_size():
+    return cfg.CONF.ovn.neutron_sync_batch_size
+
+
+def get_ovn_inconsistencies_fix_batch_size():
+    return cfg.CONF.ovn.inconsistencies_fix_batch_size
+
+
+def get_ovn_inconsistencies_fix_time_budget():
+    return cfg.CONF.ovn.inconsistencies_fix_time_budget
+
+
+def is_ovn_neutron_sync_concurrent_phases():
+    return cfg.CONF.ovn.neutron_sync_concurrent_phases
+
+
 def is_ovn_l3():
     return cfg.CONF.ovn.ovn_l3_mode
 
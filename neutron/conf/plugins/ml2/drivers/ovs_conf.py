@@ -124,6 +124,12 @@ ovs_opts = [
     cfg.IntOpt('of_request_timeout', default=300,
                help=_("Timeout in seconds to wait for a single "
                       "OpenFlow request.")),
+    cfg.IntOpt('of_max_outstanding_requests', default=64, min=1,
+               help=_("Maximum number of OpenFlow requests sent to the local "
+                      "switch without waiting for their replies when the "
+                      "agent programs the flows of many ports at once, for "
+                      "instance after an Open vSwitch restart. 1 sends the "
+                      "requests one at a time.")),
     cfg.IntOpt('of_inactivity_probe', default=10,
                help=_("The inactivity_probe interval in seconds for the local "
                       "switch connection to the controller. "
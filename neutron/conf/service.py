@@ -48,6 +48,17 @@ RPC_EXTRA_OPTS = [
                default=600,
                help=_('Maximum seconds to wait for a response from an RPC '
                       'call.')),
+    cfg.BoolOpt('rpc_scoped_resource_push',
+                default=False,
+                help=_('Push the port updates only to the agents of the '
+                       'hosts the ports are bound to, to the agents with '
+                       'ports on the same networks and to the agents using '
+                       'the security groups of the ports as remote groups, '
+                       'instead of every agent. A port update is sent as '
+                       'one message per host, network and security group. '
+                       'The other resource types are still pushed to every '
+                       'agent. It must be set on the servers and on all the '
+                       'agents using the remote resource cache.')),
 ]
 
 
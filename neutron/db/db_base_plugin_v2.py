@@ -60,6 +60,7 @@ from neutron.db import rbac_db_mixin as rbac_mixin
 from neutron.db import standardattrdescription_db as stattr_db
 from neutron.extensions import subnetpool_prefix_ops
 from neutron import ipam
+from neutron.ipam.drivers.neutrondb_ipam import free_ranges
 from neutron.ipam import exceptions as ipam_exc
 from neutron.ipam import subnet_alloc
 from neutron import neutron_plugin_base_v2
@@ -157,6 +158,8 @@ class NeutronDbPluginV2(db_base_plugin_common.DbBasePluginCommon,
 
     def __init__(self):
         self.set_ipam_backend()
+        if cfg.CONF.ipam_free_range_index:
+            free_ranges.register_db_events()
         if (cfg.CONF.notify_nova_on_port_status_changes or
                 cfg.CONF.notify_nova_on_port_data_changes):
             # Import nova conditionally to support the use case of Neutron
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import datetime
 
 from neutron_lib.db import api as db_api
@@ -23,6 +24,7 @@ from oslo_utils import timeutils
 import sqlalchemy as sa
 from sqlalchemy.orm import exc
 
+from neutron.common.ovn import constants as ovn_const
 from neutron.common.ovn import utils as ovn_utils
 from neutron.db.models import l3  # noqa
 from neutron.db.models import ovn as ovn_models
@@ -161,8 +163,31 @@ def get_revision_row(context, resource_uuid):
         pass
 
 
+@contextlib.contextmanager
+def defer_revision_bumps(context):
+    """Records the revision bumps done with a context in a block.
+
+    Yields the list of the (resource, resource_type, check_rev_cmd) tuples
+    bumped in the block, which are not written to the database.
+    check_rev_cmd is None for the unconditional bumps, otherwise the bump
+    must only be written if the command result is TXN_COMMITTED. It is used
+    when the OVN changes are nested in a transaction committed at the end
+    of the block, so the revisions are only bumped once OVN was updated.
+    """
+    bumps = []
+    context.ovn_deferred_revision_bumps = bumps
+    try:
+        yield bumps
+    finally:
+        del context.ovn_deferred_revision_bumps
+
+
 @db_api.retry_if_session_inactive()
 def bump_revision(context, resource, resource_type):
+    deferred_bumps = getattr(context, 'ovn_deferred_revision_bumps', None)
+    if deferred_bumps is not None:
+        deferred_bumps.append((resource, resource_type, None))
+        return
     revision_number = ovn_utils.get_revision_number(resource, resource_type)
     with db_api.CONTEXT_WRITER.using(context):
         # NOTE(ralonsoh): "resource" could be a dict or an OVO.
@@ -194,6 +219,20 @@ def bump_revision(context, resource, resource_type):
               'rev_num': revision_number})
 
 
+def bump_revision_if_committed(context, check_rev_cmd, resource,
+                               resource_type):
+    """Bumps the revision if the check revision command was committed.
+
+    If the bumps are deferred, the OVN transaction of the command may be
+    nested and not committed yet: the command is recorded with the bump.
+    """
+    deferred_bumps = getattr(context, 'ovn_deferred_revision_bumps', None)
+    if deferred_bumps is not None:
+        deferred_bumps.append((resource, resource_type, check_rev_cmd))
+    elif check_rev_cmd.result == ovn_const.TXN_COMMITTED:
+        bump_revision(context, resource, resource_type)
+
+
 def get_inconsistent_resources(context):
     """Get a list of inconsistent resources.
 
@@ -114,6 +114,19 @@ class IpamSubnetManager(object):
         return ipam_objs.IpamAllocation.get_objects(
             context, ipam_subnet_id=self._ipam_subnet_id, status=status)
 
+    def list_allocated_ips(self, context, ip_addresses):
+        """Return the given IP addresses allocated on the subnet.
+
+        :param context: neutron api request context
+        :param ip_addresses: the IP addresses to check
+        :returns: a set of netaddr.IPAddress
+        """
+        return {allocation.ip_address for allocation in
+                ipam_objs.IpamAllocation.get_objects(
+                    context, ipam_subnet_id=self._ipam_subnet_id,
+                    status=const.IPAM_ALLOCATION_STATUS_ALLOCATED,
+                    ip_address=list(ip_addresses))}
+
     def create_allocation(self, context, ip_address,
                           status=const.IPAM_ALLOCATION_STATUS_ALLOCATED):
         """Create an IP allocation entry.
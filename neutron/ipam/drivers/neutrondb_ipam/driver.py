@@ -20,6 +20,7 @@ import netaddr
 from neutron_lib.db import api as db_api
 from neutron_lib import exceptions as n_exc
 from neutron_lib.plugins import directory
+from oslo_config import cfg
 from oslo_db import exception as db_exc
 from oslo_log import log
 from oslo_utils import uuidutils
@@ -27,6 +28,7 @@ from oslo_utils import uuidutils
 from neutron._i18n import _
 from neutron.ipam import driver as ipam_base
 from neutron.ipam.drivers.neutrondb_ipam import db_api as ipam_db_api
+from neutron.ipam.drivers.neutrondb_ipam import free_ranges
 from neutron.ipam import exceptions as ipam_exc
 from neutron.ipam import requests as ipam_req
 from neutron.ipam import subnet_alloc
@@ -160,6 +162,9 @@ class NeutronDbSubnet(ipam_base.Subnet):
 
     def _generate_ips(self, context, prefer_next=False, num_addresses=1):
         """Generate a set of IPs from the set of available addresses."""
+        if cfg.CONF.ipam_free_range_index:
+            return self._generate_ips_from_index(context, prefer_next,
+                                                 num_addresses)
         allocated_ips = []
         requested_num_addresses = num_addresses
 
@@ -228,6 +233,108 @@ class NeutronDbSubnet(ipam_base.Subnet):
         raise ipam_exc.IpAddressGenerationFailure(
                   subnet_id=self.subnet_manager.neutron_id)
 
+    def _get_free_range_index(self, context, pools, rebuild=False):
+        def load_allocated_ips():
+            return [allocation.ip_address for allocation in
+                    self.subnet_manager.list_allocations(context)]
+
+        return free_ranges.get_index(
+            self.subnet_manager.neutron_id,
+            [(str(pool.first_ip), str(pool.last_ip)) for pool in pools],
+            load_allocated_ips, cfg.CONF.ipam_free_range_index_max_age,
+            rebuild=rebuild)
+
+    def _generate_ips_from_index(self, context, prefer_next=False,
+                                 num_addresses=1):
+        """Generate a set of IPs from the free range index of the subnet.
+
+        The generated addresses are marked as allocated in the index. As the
+        index of this process does not know about the allocations done by
+        the other servers and workers since it was built, the picked
+        addresses are checked against the database and the ones already
+        allocated are skipped. If the index has not enough free addresses
+        it is built again from the database before giving up.
+        """
+        ip_version = netaddr.IPNetwork(self._cidr).version
+        pools = self.subnet_manager.list_pools(context)
+        index, built = self._get_free_range_index(context, pools)
+        allocated_ips = []
+        while len(allocated_ips) < num_addresses:
+            picked_ips = self._pick_free_ips(
+                index, prefer_next, num_addresses - len(allocated_ips))
+            if picked_ips is None:
+                if built:
+                    for ip in allocated_ips:
+                        index.release(ip)
+                    raise ipam_exc.IpAddressGenerationFailure(
+                        subnet_id=self.subnet_manager.neutron_id)
+                index, built = self._get_free_range_index(context, pools,
+                                                          rebuild=True)
+                # Not allocated in the database yet.
+                for ip in allocated_ips:
+                    index.allocate(ip)
+                continue
+            used_ips = self.subnet_manager.list_allocated_ips(
+                context, [str(netaddr.IPAddress(ip, ip_version))
+                          for ip in picked_ips])
+            used_ips = {int(ip) for ip in used_ips}
+            # The used addresses stay marked as allocated in the index.
+            allocated_ips.extend(ip for ip in picked_ips
+                                 if ip not in used_ips)
+        return [str(netaddr.IPAddress(ip, ip_version))
+                for ip in allocated_ips]
+
+    @staticmethod
+    def _pick_free_ips(index, prefer_next, num_addresses):
+        """Pick addresses in the free ranges like _generate_ips does.
+
+        :returns: the list of the picked addresses, as integers, or None if
+            the pools have not enough free addresses.
+        """
+        allocated_ips = []
+        requested_num_addresses = num_addresses
+        with index.lock:
+            for free in index.free_ranges:
+                if free.size == 0:
+                    continue
+                allocated_num_addresses = min(free.size,
+                                              requested_num_addresses)
+                if prefer_next:
+                    picked_ips = list(free.iter_addresses(
+                        allocated_num_addresses))
+                else:
+                    window = min(free.size, MAX_WIN)
+                    if allocated_num_addresses > 1:
+                        window = min(free.size,
+                                     allocated_num_addresses * MULTIPLIER,
+                                     MAX_WIN_MULTI)
+                    if window < allocated_num_addresses:
+                        continue
+                    picked_ips = random.sample(
+                        list(free.iter_addresses(window)),
+                        allocated_num_addresses)
+                for ip in picked_ips:
+                    free.remove(ip)
+                allocated_ips.extend(picked_ips)
+                requested_num_addresses -= allocated_num_addresses
+                if not requested_num_addresses:
+                    return allocated_ips
+            # Not enough free addresses, give back the picked ones.
+            for ip in allocated_ips:
+                for free in index.free_ranges:
+                    if free.add(ip):
+                        break
+        return None
+
+    def _drop_free_range_index(self):
+        free_ranges.drop_index(self.subnet_manager.neutron_id)
+
+    def _release_on_rollback(self, ip_addresses):
+        if cfg.CONF.ipam_free_range_index:
+            free_ranges.release_on_rollback(self._context.session,
+                                            self.subnet_manager.neutron_id,
+                                            ip_addresses)
+
     def allocate(self, address_request):
         # NOTE(pbondar): Ipam driver is always called in context of already
         # running transaction, which is started on create_port or upper level.
@@ -241,6 +348,9 @@ class NeutronDbSubnet(ipam_base.Subnet):
             # Check availability of requested IP
             ip_address = str(address_request.address)
             self._verify_ip(self._context, ip_address)
+            index = free_ranges.peek_index(self.subnet_manager.neutron_id)
+            if index is not None:
+                index.allocate(ip_address)
         else:
             prefer_next = isinstance(address_request,
                                      ipam_req.PreferNextAddressRequest)
@@ -251,9 +361,11 @@ class NeutronDbSubnet(ipam_base.Subnet):
         # More states will be available in the future - e.g.: RECYCLABLE
         try:
             with db_api.CONTEXT_WRITER.using(self._context):
+                self._release_on_rollback([ip_address])
                 self.subnet_manager.create_allocation(self._context,
                                                       ip_address)
         except db_exc.DBReferenceError:
+            self._drop_free_range_index()
             raise n_exc.SubnetNotFound(
                 subnet_id=self.subnet_manager.neutron_id)
         return ip_address
@@ -270,10 +382,12 @@ class NeutronDbSubnet(ipam_base.Subnet):
         # Create IP allocation request objects
         try:
             with db_api.CONTEXT_WRITER.using(self._context):
+                self._release_on_rollback(allocated_ip_pool)
                 for ip_address in allocated_ip_pool:
                     self.subnet_manager.create_allocation(self._context,
                                                           ip_address)
         except db_exc.DBReferenceError:
+            self._drop_free_range_index()
             raise n_exc.SubnetNotFound(
                 subnet_id=self.subnet_manager.neutron_id)
         return allocated_ip_pool
@@ -283,6 +397,10 @@ class NeutronDbSubnet(ipam_base.Subnet):
         # delete IPAllocation objects at every deallocation. The only
         # operation it performs is to delete an IPAMAllocation entry.
         self.subnet_manager.delete_allocation(self._context, address)
+        if cfg.CONF.ipam_free_range_index:
+            free_ranges.release_on_commit(self._context.session,
+                                          self.subnet_manager.neutron_id,
+                                          [address])
 
     def _no_pool_changes(self, context, pools):
         """Check if pool updates in db are required."""
@@ -301,6 +419,7 @@ class NeutronDbSubnet(ipam_base.Subnet):
         self.create_allocation_pools(self.subnet_manager, self._context, pools,
                                      cidr)
         self._pools = pools
+        self._drop_free_range_index()
 
     def get_details(self):
         """Return subnet data as a SpecificSubnetRequest"""
@@ -372,6 +491,7 @@ class NeutronDbPool(subnet_alloc.SubnetAllocator):
         """
         count = ipam_db_api.IpamSubnetManager.delete(self._context,
                                                      subnet_id)
+        free_ranges.drop_index(subnet_id)
         if count < 1:
             LOG.error("IPAM subnet referenced to "
                       "Neutron subnet %s does not exist", subnet_id)
@@ -0,0 +1,252 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import threading
+import time
+
+import netaddr
+from neutron_lib.db import api as db_api
+from sqlalchemy.orm import session as se
+
+# In-process index of the free addresses of the IPAM subnets, used by the
+# Neutron DB IPAM driver to generate addresses without loading all the
+# allocations of a subnet. The database stays the reference: the index is
+# rebuilt from it when it is too old, when its pools changed or when it has
+# no free address left, and the picked addresses are checked against it.
+
+# {neutron_subnet_id: FreeRangeIndex}
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Key of the session info holding the index updates applied at the end of
+# the transaction, as a list of (on_commit, neutron_subnet_id, ip_addresses).
+_PENDING_RELEASES = 'ipam_free_range_pending_releases'
+
+
+class FreeRanges(object):
+    """The free addresses of an allocation pool, as sorted disjoint ranges.
+
+    The addresses are integers. The ranges are stored as two sorted lists of
+    their first and last addresses, so the range of an address is found
+    with a bisection.
+    """
+
+    def __init__(self, first, last, used=()):
+        self.first = first
+        self.last = last
+        self.size = 0
+        self._firsts = []
+        self._lasts = []
+        start = first
+        for ip in sorted(set(ip for ip in used if first <= ip <= last)):
+            if ip > start:
+                self._append(start, ip - 1)
+            start = ip + 1
+        if start <= last:
+            self._append(start, last)
+
+    def _append(self, first, last):
+        self._firsts.append(first)
+        self._lasts.append(last)
+        self.size += last - first + 1
+
+    def _find(self, ip):
+        """Returns the position of the range containing ip, or None."""
+        i = bisect.bisect_right(self._firsts, ip) - 1
+        if i >= 0 and ip <= self._lasts[i]:
+            return i
+        return None
+
+    def __contains__(self, ip):
+        return self._find(ip) is not None
+
+    def get_ranges(self):
+        return list(zip(self._firsts, self._lasts))
+
+    def iter_addresses(self, count):
+        """Yields the first count free addresses, in ascending order."""
+        for first, last in zip(self._firsts, self._lasts):
+            for ip in range(first, min(last, first + count - 1) + 1):
+                yield ip
+                count -= 1
+            if count <= 0:
+                return
+
+    def remove(self, ip):
+        """Marks ip as allocated, returns False if it was not free."""
+        i = self._find(ip)
+        if i is None:
+            return False
+        first, last = self._firsts[i], self._lasts[i]
+        if first == last:
+            del self._firsts[i]
+            del self._lasts[i]
+        elif ip == first:
+            self._firsts[i] = ip + 1
+        elif ip == last:
+            self._lasts[i] = ip - 1
+        else:
+            self._lasts[i] = ip - 1
+            self._firsts.insert(i + 1, ip + 1)
+            self._lasts.insert(i + 1, last)
+        self.size -= 1
+        return True
+
+    def add(self, ip):
+        """Marks ip as free, returns False if it was already free."""
+        if not self.first <= ip <= self.last:
+            return False
+        i = bisect.bisect_right(self._firsts, ip) - 1
+        if i >= 0 and ip <= self._lasts[i]:
+            return False
+        merge_prev = i >= 0 and self._lasts[i] == ip - 1
+        merge_next = (i + 1 < len(self._firsts) and
+                      self._firsts[i + 1] == ip + 1)
+        if merge_prev and merge_next:
+            self._lasts[i] = self._lasts[i + 1]
+            del self._firsts[i + 1]
+            del self._lasts[i + 1]
+        elif merge_prev:
+            self._lasts[i] = ip
+        elif merge_next:
+            self._firsts[i + 1] = ip
+        else:
+            self._firsts.insert(i + 1, ip)
+            self._lasts.insert(i + 1, ip)
+        self.size += 1
+        return True
+
+
+class FreeRangeIndex(object):
+    """The free ranges of the allocation pools of a subnet."""
+
+    def __init__(self, pools, allocated_ips):
+        """Builds the index.
+
+        :param pools: list of (first_ip, last_ip) strings of the pools.
+        :param allocated_ips: the allocated IP addresses of the subnet.
+        """
+        self.pools = tuple(pools)
+        used = [int(netaddr.IPAddress(ip)) for ip in allocated_ips]
+        self.free_ranges = [
+            FreeRanges(int(netaddr.IPAddress(first)),
+                       int(netaddr.IPAddress(last)), used)
+            for first, last in self.pools]
+        self.created_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def get_age(self):
+        return time.monotonic() - self.created_at
+
+    def allocate(self, ip_address):
+        ip = int(netaddr.IPAddress(ip_address))
+        with self.lock:
+            for free in self.free_ranges:
+                if free.remove(ip):
+                    return True
+        return False
+
+    def release(self, ip_address):
+        ip = int(netaddr.IPAddress(ip_address))
+        with self.lock:
+            for free in self.free_ranges:
+                if free.add(ip):
+                    return True
+        return False
+
+
+def get_index(subnet_id, pools, load_allocated_ips, max_age, rebuild=False):
+    """Returns the free range index of a subnet, built if needed.
+
+    :param subnet_id: the neutron subnet identifier.
+    :param pools: list of (first_ip, last_ip) strings of the subnet pools.
+    :param load_allocated_ips: called with no arguments to fetch the
+        allocated IP addresses of the subnet when the index is built.
+    :param max_age: seconds after which the index is built again, 0 to
+        never expire it.
+    :param rebuild: build the index even if a valid one exists.
+    :returns: a tuple of the index and whether it was built by this call.
+    """
+    pools = tuple(pools)
+    index = _indexes.get(subnet_id)
+    if (not rebuild and index is not None and index.pools == pools and
+            not (max_age and index.get_age() > max_age)):
+        return index, False
+    index = FreeRangeIndex(pools, load_allocated_ips())
+    with _indexes_lock:
+        _indexes[subnet_id] = index
+    return index, True
+
+
+def peek_index(subnet_id):
+    """Returns the free range index of a subnet if it was built."""
+    return _indexes.get(subnet_id)
+
+
+def drop_index(subnet_id):
+    with _indexes_lock:
+        _indexes.pop(subnet_id, None)
+
+
+def _release(subnet_id, ip_addresses):
+    index = _indexes.get(subnet_id)
+    if index is not None:
+        for ip_address in ip_addresses:
+            index.release(ip_address)
+
+
+def _add_pending_release(session, on_commit, subnet_id, ip_addresses):
+    if not session.in_transaction():
+        if on_commit:
+            _release(subnet_id, ip_addresses)
+        return
+    session.info.setdefault(_PENDING_RELEASES, []).append(
+        (on_commit, subnet_id, list(ip_addresses)))
+
+
+def release_on_commit(session, subnet_id, ip_addresses):
+    """Frees the addresses in the index once the transaction is committed.
+
+    Used for the deallocated addresses, which must not be generated again
+    if the deallocation is rolled back.
+    """
+    _add_pending_release(session, True, subnet_id, ip_addresses)
+
+
+def release_on_rollback(session, subnet_id, ip_addresses):
+    """Frees the addresses in the index if the transaction is rolled back.
+
+    Used for the allocated addresses, which are marked as used in the index
+    when they are generated.
+    """
+    _add_pending_release(session, False, subnet_id, ip_addresses)
+
+
+def _apply_pending_releases(session, committed):
+    for on_commit, subnet_id, ip_addresses in session.info.pop(
+            _PENDING_RELEASES, ()):
+        if on_commit == committed:
+            _release(subnet_id, ip_addresses)
+
+
+def _after_commit(session):
+    _apply_pending_releases(session, True)
+
+
+def _after_rollback(session):
+    _apply_pending_releases(session, False)
+
+
+def register_db_events():
+    db_api.sqla_listen(se.Session, 'after_commit', _after_commit)
+    db_api.sqla_listen(se.Session, 'after_rollback', _after_rollback)
@@ -10,60 +10,202 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import os
 import threading
+import time
 
-import eventlet
+from oslo_log import log as logging
 
 from neutron.common import utils
 
+LOG = logging.getLogger(__name__)
+# minimum interval in seconds between two logs of the notifier statistics
+STATS_LOG_INTERVAL = 300
+
+
+def _get_event_key(event):
+    """Returns a hashable key identifying identical events.
+
+    Dictionaries, lists and sets are converted recursively. Events that
+    can't be hashed get a unique key, so they are never deduplicated.
+    """
+    def freeze(value):
+        if isinstance(value, dict):
+            return frozenset((k, freeze(v)) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return tuple(freeze(v) for v in value)
+        if isinstance(value, (set, frozenset)):
+            return frozenset(freeze(v) for v in value)
+        return value
+
+    try:
+        key = freeze(event)
+        hash(key)
+    except TypeError:
+        return object()
+    return key
+
+
+def _get_batch_size_bucket(size):
+    """Returns the smallest power of two not lower than size."""
+    bucket = 1
+    while bucket < size:
+        bucket *= 2
+    return bucket
+
 
 class BatchNotifier(object):
-    def __init__(self, batch_interval, callback):
-        self._pending_events = eventlet.Queue()
+    """Sends the queued events to a callback in batches.
+
+    A single worker thread, started with the first queued event, sends the
+    pending events as soon as one of these conditions is met:
+
+    * 'max_batch_size' events are pending, if a maximum size is set.
+    * The oldest pending event has waited 'batch_interval' seconds.
+    * No batch was sent in the last 'batch_interval' seconds, so an event
+      queued after an idle period is sent without delay.
+
+    An event identical to one that is already pending replaces it, so it is
+    only sent once, in the position of its last occurrence.
+
+    The statistics returned by get_stats() are logged at debug level after
+    a batch is sent, at most every STATS_LOG_INTERVAL seconds.
+    """
+
+    def __init__(self, batch_interval, callback, max_batch_size=None):
         self.callback = callback
         self.batch_interval = batch_interval
+        self.max_batch_size = max_batch_size
+        self._pending_events = collections.OrderedDict()
+        self._oldest_event_time = None
+        self._last_batch_time = None
+        # events queued since the worker started sending the last batch
+        self._new_events = 0
         self._mutex = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker_pid = None
+        self._stats_log_time = None
+        self._stats = {'queued_events': 0,
+                       'deduplicated_events': 0,
+                       'sent_events': 0,
+                       'batches': 0,
+                       'failed_batches': 0,
+                       'batch_sizes': collections.Counter(),
+                       'last_batch_time': 0.0,
+                       'max_batch_time': 0.0,
+                       'total_batch_time': 0.0}
 
     def queue_event(self, event):
         """Called to queue sending an event with the next batch of events.
 
-        Sending events individually, as they occur, has been problematic as it
-        can result in a flood of sends.  Previously, there was a loopingcall
-        thread that would send batched events on a periodic interval.  However,
-        maintaining a persistent thread in the loopingcall was also
-        problematic.
-
-        This replaces the loopingcall with a mechanism that creates a
-        short-lived thread on demand whenever an event is queued. That thread
-        will check if the lock is released, send all queued events and then
-        sleep for 'batch_interval' seconds. If at the end of this sleep time,
-        other threads have added new events to the event queue, the same thread
-        will process them.
-
-        At the same time, other threads will be able to add new events to the
-        queue and will spawn new "synced_send" threads to process them. But if
-        the mutex is locked, the spawned thread will end immediately.
-
         :param event: the event that occurred.
         """
         if not event:
             return
 
-        self._pending_events.put(event)
+        key = _get_event_key(event)
+        with self._mutex:
+            self._stats['queued_events'] += 1
+            if self._pending_events.pop(key, None) is not None:
+                self._stats['deduplicated_events'] += 1
+            self._pending_events[key] = event
+            if self._oldest_event_time is None:
+                self._oldest_event_time = time.monotonic()
+            self._new_events += 1
+            pending = len(self._pending_events)
+            batch_full = self._is_batch_full()
+            start_worker = self._worker_pid != os.getpid()
+            if start_worker:
+                # (re)start the worker in this process, it isn't inherited
+                # by the forked processes.
+                self._worker_pid = os.getpid()
+
+        if start_worker:
+            utils.spawn_n(self._run)
+        if pending == 1 or batch_full:
+            self._wakeup.set()
 
-        def synced_send():
-            if not self._mutex.locked():
-                with self._mutex:
-                    while not self._pending_events.empty():
-                        self._notify()
-                        # sleeping after send while holding the lock allows
-                        # subsequent events to batch up
-                        eventlet.sleep(self.batch_interval)
+    def _is_batch_full(self):
+        return bool(self.max_batch_size and
+                    self._new_events >= self.max_batch_size)
+
+    def _get_send_delay(self):
+        """Returns the seconds to wait before sending the pending events.
+
+        None is returned if there are no pending events.
+        """
+        with self._mutex:
+            if not self._pending_events:
+                return None
+            if self._is_batch_full():
+                return 0
+            send_time = self._oldest_event_time
+            if self._last_batch_time is not None:
+                send_time = max(send_time,
+                                self._last_batch_time + self.batch_interval)
+            return send_time - time.monotonic()
 
-        utils.spawn_n(synced_send)
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._get_send_delay()
+            if delay is None or delay > 0:
+                self._wakeup.wait(delay)
+                continue
+            with self._mutex:
+                self._last_batch_time = time.monotonic()
+                self._new_events = 0
+            try:
+                self._notify()
+            except Exception:
+                LOG.exception("Failed to send a batch of events with %s",
+                              self.callback)
 
     def _notify(self):
-        batched_events = []
-        while not self._pending_events.empty():
-            batched_events.append(self._pending_events.get())
-        self.callback(batched_events)
+        with self._mutex:
+            batched_events = list(self._pending_events.values())
+            self._pending_events.clear()
+            self._oldest_event_time = None
+        if not batched_events:
+            return
+
+        start = time.monotonic()
+        try:
+            self.callback(batched_events)
+        except Exception:
+            self._stats['failed_batches'] += 1
+            raise
+        finally:
+            self._record_batch(len(batched_events), time.monotonic() - start)
+
+    def _record_batch(self, size, duration):
+        stats = self._stats
+        stats['batches'] += 1
+        stats['sent_events'] += size
+        stats['batch_sizes'][_get_batch_size_bucket(size)] += 1
+        stats['last_batch_time'] = duration
+        stats['max_batch_time'] = max(stats['max_batch_time'], duration)
+        stats['total_batch_time'] += duration
+        LOG.debug("Sent a batch of %(size)d events in %(time).3f seconds, "
+                  "%(pending)d events pending",
+                  {'size': size, 'time': duration,
+                   'pending': len(self._pending_events)})
+        now = time.monotonic()
+        if (self._stats_log_time is None or
+                now - self._stats_log_time >= STATS_LOG_INTERVAL):
+            self._stats_log_time = now
+            LOG.debug("Batch notifier statistics of %(callback)s: %(stats)s",
+                      {'callback': self.callback, 'stats': self.get_stats()})
+
+    def get_stats(self):
+        """Returns the queue depth, batch sizes and send time statistics.
+
+        'batch_sizes' is a dictionary of batch size buckets, the powers of
+        two, to the number of batches whose size is in the bucket. The batch
+        times are the seconds spent by the callback sending the batches.
+        """
+        with self._mutex:
+            stats = dict(self._stats, queue_depth=len(self._pending_events))
+        stats['batch_sizes'] = dict(stats['batch_sizes'])
+        return stats
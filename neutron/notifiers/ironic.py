@@ -49,7 +49,8 @@ class Notifier(object):
 
     def __init__(self):
         self.batch_notifier = batch_notifier.BatchNotifier(
-            cfg.CONF.send_events_interval, self.send_events)
+            cfg.CONF.send_events_interval, self.send_events,
+            max_batch_size=cfg.CONF.send_events_max_batch_size)
         self.irclient = self._get_ironic_client()
 
     def _get_session(self, group):
@@ -77,7 +77,8 @@ class Notifier(object):
             ext for ext in nova_client.discover_extensions(NOVA_API_VERSION)
             if ext.name == "server_external_events"]
         self.batch_notifier = batch_notifier.BatchNotifier(
-            cfg.CONF.send_events_interval, self.send_events)
+            cfg.CONF.send_events_interval, self.send_events,
+            max_batch_size=cfg.CONF.send_events_max_batch_size)
 
     @contextlib.contextmanager
     def context_enabled(self, enabled):
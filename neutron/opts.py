@@ -123,7 +123,8 @@ def list_agent_opts():
              neutron.conf.agent.common.AGENT_STATE_OPTS,
              neutron.conf.agent.common.IPTABLES_OPTS,
              neutron.conf.agent.common.PROCESS_MONITOR_OPTS,
-             neutron.conf.agent.common.AVAILABILITY_ZONE_OPTS)
+             neutron.conf.agent.common.AVAILABILITY_ZONE_OPTS,
+             neutron.conf.agent.common.RESOURCE_CACHE_OPTS)
          ),
         ('DEFAULT',
          itertools.chain(
@@ -19,12 +19,14 @@ from neutron_lib.callbacks import registry
 from neutron_lib.callbacks import resources
 from neutron_lib import constants as n_const
 from neutron_lib.db import api as db_api
+from neutron_lib.db import standard_attr
 from neutron_lib import exceptions as nlib_exc
 from neutron_lib.plugins import directory
 from oslo_db import exception as db_exc
 from oslo_log import log
 from oslo_utils import uuidutils
 from sqlalchemy import or_
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm import exc
 
 from neutron._i18n import _
@@ -317,6 +319,34 @@ def get_port_db_objects(context, port_ids):
     return result
 
 
+@db_api.CONTEXT_READER
+def get_port_and_network_revisions(context, port_ids):
+    """Returns the revision numbers of the ports and of their networks.
+
+    return format is a dictionary keyed by port ID with a tuple of
+    (network_id, port revision number, network revision number) for values.
+    Ports that are not present are not included.
+    """
+    if not port_ids:
+        return {}
+    port_attr = aliased(standard_attr.StandardAttribute)
+    network_attr = aliased(standard_attr.StandardAttribute)
+    query = (context.session.query(models_v2.Port.id,
+                                   models_v2.Port.network_id,
+                                   port_attr.revision_number,
+                                   network_attr.revision_number).
+             join(port_attr,
+                  models_v2.Port.standard_attr_id == port_attr.id).
+             join(models_v2.Network,
+                  models_v2.Port.network_id == models_v2.Network.id).
+             join(network_attr,
+                  models_v2.Network.standard_attr_id == network_attr.id).
+             filter(models_v2.Port.id.in_(port_ids)))
+    return {port_id: (network_id, port_revision, network_revision)
+            for port_id, network_id, port_revision, network_revision
+            in query}
+
+
 @db_api.CONTEXT_READER
 def is_dhcp_active_on_any_subnet(context, subnet_ids):
     if not subnet_ids:
@@ -14,6 +14,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import contextlib
 import functools
 import random
 
@@ -40,11 +42,140 @@ LOG = logging.getLogger(__name__)
 BUNDLE_ID_WIDTH = 1 << 32
 COOKIE_DEFAULT = object()
 
+FlowModelEntry = collections.namedtuple(
+    'FlowModelEntry', 'table_id priority match cookie instructions')
+
 
 class ActiveBundleRunning(exceptions.NeutronException):
     message = _("Another active bundle 0x%(bundle_id)x is running")
 
 
+def _freeze_match_value(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_match_value(v) for v in value)
+    return value
+
+
+def _get_match_fields(match):
+    return {name: _freeze_match_value(value) for name, value in match.items()}
+
+
+class FlowModel(object):
+    """In memory model of the flows installed by the agent on a bridge.
+
+    The flows are keyed by table, priority and match, like on the switch.
+    Only the flows installed with the native OpenFlow methods are tracked;
+    as the flows modified with ovs-ofctl can't be tracked, the flows they
+    may have changed are dropped from the model.
+    """
+
+    def __init__(self):
+        # {table_id: {(priority, match fields): FlowModelEntry}}
+        self._tables = collections.defaultdict(dict)
+
+    @staticmethod
+    def get_key(priority, match):
+        return priority, frozenset(_get_match_fields(match).items())
+
+    def __len__(self):
+        return sum(len(flows) for flows in self._tables.values())
+
+    def __iter__(self):
+        for flows in self._tables.values():
+            for entry in flows.values():
+                yield entry
+
+    def __contains__(self, flow):
+        return (self.get_key(flow.priority, flow.match) in
+                self._tables.get(flow.table_id, {}))
+
+    def add(self, table_id, priority, match, cookie, instructions):
+        self._tables[table_id][self.get_key(priority, match)] = (
+            FlowModelEntry(table_id, priority, match, cookie, instructions))
+
+    def remove(self, table_id, priority, match, cookie, cookie_mask,
+               strict):
+        """Removes the flows deleted by a flow delete request.
+
+        The delete request matches the flows that have every field of its
+        match. When its value is masked, the field is matched regardless of
+        the value, so the model never keeps a flow deleted from the switch.
+        """
+        table_ids = ([table_id] if table_id in self._tables
+                     else [] if table_id is not None
+                     else list(self._tables))
+        if strict:
+            key = self.get_key(priority, match)
+        else:
+            fields = _get_match_fields(match)
+        for tid in table_ids:
+            flows = self._tables[tid]
+            if strict:
+                entries = [flows[key]] if key in flows else []
+            else:
+                entries = [e for e in flows.values()
+                           if self._match_covers(fields, e.match)]
+            for entry in entries:
+                if entry.cookie & cookie_mask == cookie & cookie_mask:
+                    del flows[self.get_key(entry.priority, entry.match)]
+
+    @staticmethod
+    def _match_covers(fields, match):
+        flow_fields = _get_match_fields(match)
+        for name, value in fields.items():
+            if name not in flow_fields:
+                return False
+            if not isinstance(value, tuple) and flow_fields[name] != value:
+                return False
+        return True
+
+    def remove_table(self, table_id=None):
+        """Forgets the flows of a table, or of all of them if not given."""
+        if table_id is None:
+            self._tables.clear()
+        else:
+            self._tables.pop(table_id, None)
+
+    def remove_cookies(self, cookies):
+        """Forgets the flows whose cookie is not one of cookies."""
+        for flows in self._tables.values():
+            for key, entry in list(flows.items()):
+                if entry.cookie not in cookies:
+                    del flows[key]
+
+
+class RequestPipeline(object):
+    """Sends OpenFlow requests without waiting for the previous replies.
+
+    Up to 'depth' requests are outstanding at a time. The requests are
+    queued to the os-ken app in the order they are spawned, so the switch
+    receives them in this order. The errors are raised by wait(), once
+    every request got its reply.
+    """
+
+    def __init__(self, depth):
+        self._pool = eventlet.GreenPool(depth)
+        self._errors = []
+
+    def spawn(self, func, *args, **kwargs):
+        self._pool.spawn_n(self._run, func, *args, **kwargs)
+
+    def _run(self, func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            self._errors.append(e)
+
+    def wait(self):
+        self._pool.waitall()
+        errors, self._errors = self._errors, []
+        if errors:
+            if len(errors) > 1:
+                LOG.error("%d pipelined OpenFlow requests failed",
+                          len(errors))
+            raise errors[0]
+
+
 class OpenFlowSwitchMixin(object):
     """Mixin to provide common convenient routines for an openflow switch.
 
@@ -62,8 +193,60 @@ class OpenFlowSwitchMixin(object):
     def __init__(self, *args, **kwargs):
         self._app = kwargs.pop('os_ken_app')
         self.active_bundles = set()
+        # the request pipelines, shared with the clones of the bridge
+        self._pipelines = []
+        # shared with the clones of the bridge
+        self.flow_model = FlowModel()
         super(OpenFlowSwitchMixin, self).__init__(*args, **kwargs)
 
+    @staticmethod
+    def _update_flow_model(active_bundle, func, *args):
+        """Updates the flow model now or when the bundle is committed."""
+        if active_bundle is None:
+            func(*args)
+        else:
+            active_bundle['flow_model_updates'].append(
+                functools.partial(func, *args))
+
+    def _remove_ofctl_flows_from_model(self, action, kwargs):
+        """Removes from the model the flows changed by an ovs-ofctl request.
+
+        The ovs-ofctl match is not parsed, so every flow the request may
+        change is removed: the model can forget a flow still on the switch,
+        which is then installed again, but never keeps a changed one.
+        """
+        if action == 'del' and kwargs:
+            cookie = kwargs.get('cookie', self._default_cookie)
+            if cookie == ovs_lib.COOKIE_ANY:
+                cookie, cookie_mask = 0, 0
+            else:
+                cookie, _sep, cookie_mask = str(cookie).partition('/')
+                cookie = int(cookie, 0)
+                cookie_mask = (int(cookie_mask, 0) & ovs_lib.UINT64_BITMASK
+                               if cookie_mask else ovs_lib.UINT64_BITMASK)
+            self.flow_model.remove(kwargs.get('table'), None, {}, cookie,
+                                   cookie_mask, False)
+        elif action == 'add':
+            # a new flow replaces the one with the same priority and match,
+            # ovs-ofctl adds the flows in the table 0 by default
+            self.flow_model.remove_table(kwargs.get('table', 0))
+        else:
+            self.flow_model.remove_table(kwargs.get('table'))
+
+    def do_action_flows(self, action, kwargs_list, use_bundle=False):
+        # keep the order with the pipelined requests
+        self.wait_pipelined_requests()
+        # the flows changed with ovs-ofctl are not tracked
+        for kwargs in kwargs_list:
+            self._remove_ofctl_flows_from_model(action, kwargs)
+        return super(OpenFlowSwitchMixin, self).do_action_flows(
+            action, kwargs_list, use_bundle=use_bundle)
+
+    def remove_all_flows(self):
+        self.wait_pipelined_requests()
+        self.flow_model.remove_table()
+        super(OpenFlowSwitchMixin, self).remove_all_flows()
+
     def _get_dp_by_dpid(self, dpid_int):
         """Get os-ken datapath object for the switch."""
         timeout_sec = cfg.CONF.OVS.of_connect_timeout
@@ -90,8 +273,52 @@ class OpenFlowSwitchMixin(object):
     def _send_msg_retry(app, msg, reply_cls, reply_multi):
         return ofctl_api.send_msg(app, msg, reply_cls, reply_multi)
 
+    @contextlib.contextmanager
+    def pipelined(self):
+        """Pipelines the OpenFlow requests sent in the context.
+
+        The requests without reply, like flow mods, are sent without
+        waiting for the reply of the previous ones. The requests with a
+        reply, and the flows changed with ovs-ofctl, first wait for the
+        pending requests. Exiting the context waits for all of them and
+        raises the first error, if any.
+        """
+        if self._pipelines:
+            # already pipelined by an outer context
+            yield self
+            return
+        pipeline = RequestPipeline(cfg.CONF.OVS.of_max_outstanding_requests)
+        self._pipelines.append(pipeline)
+        try:
+            yield self
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._pipelines.remove(pipeline)
+                try:
+                    pipeline.wait()
+                except Exception:
+                    pass
+        else:
+            self._pipelines.remove(pipeline)
+            pipeline.wait()
+
+    def wait_pipelined_requests(self):
+        for pipeline in self._pipelines:
+            pipeline.wait()
+
     def _send_msg(self, msg, reply_cls=None, reply_multi=False,
                   active_bundle=None):
+        if self._pipelines:
+            if reply_cls is None and not reply_multi:
+                self._pipelines[-1].spawn(
+                    self._send_msg_and_wait, msg, active_bundle=active_bundle)
+                return None
+            self.wait_pipelined_requests()
+        return self._send_msg_and_wait(msg, reply_cls, reply_multi,
+                                       active_bundle)
+
+    def _send_msg_and_wait(self, msg, reply_cls=None, reply_multi=False,
+                           active_bundle=None):
         timeout_sec = cfg.CONF.OVS.of_request_timeout
         timeout = eventlet.Timeout(seconds=timeout_sec)
         if active_bundle is not None:
@@ -163,6 +390,10 @@ class OpenFlowSwitchMixin(object):
                               out_group=ofp.OFPG_ANY,
                               out_port=ofp.OFPP_ANY)
         self._send_msg(msg, active_bundle=active_bundle)
+        self._update_flow_model(
+            active_bundle, self.flow_model.remove,
+            None if table_id == ofp.OFPTT_ALL else table_id, priority, match,
+            cookie, cookie_mask, strict)
 
     def dump_flows(self, table_id=None):
         (dp, ofp, ofpp) = self._get_dp()
@@ -177,20 +408,40 @@ class OpenFlowSwitchMixin(object):
             flows += rep.body
         return flows
 
-    def _dump_and_clean(self, table_id=None):
-        cookies = set([f.cookie for f in self.dump_flows(table_id)]) - \
-                      self.reserved_cookies
-        for c in cookies:
-            LOG.warning("Deleting flow with cookie 0x%(cookie)x",
-                        {'cookie': c})
-            self.uninstall_flows(cookie=c, cookie_mask=ovs_lib.UINT64_BITMASK)
-
     def cleanup_flows(self):
-        LOG.info("Reserved cookies for %s: %s", self.br_name,
-                 self.reserved_cookies)
+        """Reconciles the flows of the switch with the flow model.
 
-        for table_id in self.of_tables:
-            self._dump_and_clean(table_id)
+        The flows of all the tables are dumped once. The flows whose cookie
+        is not reserved are deleted, and the flows of the model missing on
+        the switch are installed again, in a single bundle.
+        """
+        reserved_cookies = self.reserved_cookies
+        LOG.info("Reserved cookies for %s: %s", self.br_name,
+                 reserved_cookies)
+        of_tables = set(self.of_tables)
+        flows = [f for f in self.dump_flows() if f.table_id in of_tables]
+        stale_cookies = set(f.cookie for f in flows) - reserved_cookies
+        self.flow_model.remove_cookies(reserved_cookies)
+        installed = FlowModel()
+        for flow in flows:
+            installed.add(flow.table_id, flow.priority, flow.match,
+                          flow.cookie, None)
+        missing = [entry for entry in self.flow_model
+                   if entry.table_id in of_tables and entry not in installed]
+        if not stale_cookies and not missing:
+            return
+        LOG.info("Deleting the flows with %(stale)d stale cookies and "
+                 "installing %(missing)d missing flows on %(br)s",
+                 {'stale': len(stale_cookies), 'missing': len(missing),
+                  'br': self.br_name})
+        with self.bundled() as br:
+            for c in stale_cookies:
+                LOG.warning("Deleting flow with cookie 0x%(cookie)x",
+                            {'cookie': c})
+                br.uninstall_flows(cookie=c,
+                                   cookie_mask=ovs_lib.UINT64_BITMASK)
+            for entry in missing:
+                br.install_flow_model_entry(entry)
 
     def install_goto_next(self, table_id, active_bundle=None):
         self.install_goto(table_id=table_id, dest_table_id=table_id + 1,
@@ -237,13 +488,21 @@ class OpenFlowSwitchMixin(object):
                 ofp, instructions)
             instructions = ofproto_parser.ofp_instruction_from_jsondict(
                 dp, jsonlist)
+        self.install_flow_model_entry(
+            FlowModelEntry(table_id, priority, match, self.default_cookie,
+                           instructions),
+            active_bundle=active_bundle)
+
+    def install_flow_model_entry(self, entry, active_bundle=None):
+        (dp, _ofp, ofpp) = self._get_dp()
         msg = ofpp.OFPFlowMod(dp,
-                              table_id=table_id,
-                              cookie=self.default_cookie,
-                              match=match,
-                              priority=priority,
-                              instructions=instructions)
+                              table_id=entry.table_id,
+                              cookie=entry.cookie,
+                              match=entry.match,
+                              priority=entry.priority,
+                              instructions=entry.instructions)
         self._send_msg(msg, active_bundle=active_bundle)
+        self._update_flow_model(active_bundle, self.flow_model.add, *entry)
 
     def install_apply_actions(self, actions,
                               table_id=0, priority=0,
@@ -267,6 +526,8 @@ class BundledOpenFlowBridge(object):
         self.br = br
         self.active_bundle = None
         self.bundle_flags = 0
+        # flow model updates applied when the bundle is committed
+        self.flow_model_updates = []
         if not atomic and not ordered:
             return
         (dp, ofp, ofpp) = self.br._get_dp()
@@ -281,7 +542,8 @@ class BundledOpenFlowBridge(object):
             if self.active_bundle is None:
                 return under
             return functools.partial(under, active_bundle=dict(
-                id=self.active_bundle, bundle_flags=self.bundle_flags))
+                id=self.active_bundle, bundle_flags=self.bundle_flags,
+                flow_model_updates=self.flow_model_updates))
         raise AttributeError(_("Only install_* or uninstall_* methods "
                                "can be used"))
 
@@ -311,7 +573,13 @@ class BundledOpenFlowBridge(object):
 
     def __exit__(self, type, value, traceback):
         (dp, ofp, ofpp) = self.br._get_dp()
-        if type is None:
+        # the bundle is discarded if a pipelined add failed
+        pipeline_error = None
+        try:
+            self.br.wait_pipelined_requests()
+        except Exception as e:
+            pipeline_error = e
+        if type is None and pipeline_error is None:
             ctrl_type = ofp.ONF_BCT_COMMIT_REQUEST
             expected_reply = ofp.ONF_BCT_COMMIT_REPLY
         else:
@@ -331,7 +599,13 @@ class BundledOpenFlowBridge(object):
                 # in active_bundles so that we will never use it again.
                 raise RuntimeError(_("Unexpected reply type %d") % reply.type)
             self.br.active_bundles.remove(self.active_bundle)
+            if ctrl_type == ofp.ONF_BCT_COMMIT_REQUEST:
+                for update in self.flow_model_updates:
+                    update()
         finally:
             # It is possible the bundle is kept open, but this must be
             # cleared or all subsequent __enter__ will fail.
             self.active_bundle = None
+            self.flow_model_updates = []
+        if type is None and pipeline_error is not None:
+            raise pipeline_error
@@ -15,6 +15,7 @@
 
 import base64
 import collections
+import contextlib
 import functools
 import hashlib
 import signal
@@ -41,6 +42,7 @@ from os_vif.objects import vif as vif_obj
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging
+from oslo_reports import guru_meditation_report as gmr
 from oslo_service import loopingcall
 from oslo_service import systemd
 from oslo_utils import netutils
@@ -351,6 +353,12 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
             'agent_type': n_const.AGENT_TYPE_OVS,
             'start_flag': True}
 
+        # latency histograms of the rpc_loop phases, reported in the Guru
+        # Meditation Report, with their 99th percentile in the agent state
+        self.phase_timings = utils.PhaseTimings()
+        gmr.TextGuruMeditation.register_section(
+            'rpc_loop phase timings', self.phase_timings.get_report_model)
+
         report_interval = agent_conf.report_interval
         if report_interval:
             heartbeat = loopingcall.FixedIntervalLoopingCall(
@@ -390,6 +398,10 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
             self.int_br_device_count)
         self.agent_state.get('configurations')['in_distributed_mode'] = (
             self.dvr_agent.in_distributed_mode())
+        # the configurations are stored in a column of 4095 characters,
+        # the other statistics are only in the Guru Meditation Report
+        self.agent_state.get('configurations')['rpc_loop_phase_p99'] = (
+            self.phase_timings.get_percentile(99))
 
         try:
             agent_status = self.state_rpc.report_state(self.context,
@@ -2063,6 +2075,22 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
         if failed_devices:
             LOG.debug("Port down failed for %s", failed_devices)
 
+    @contextlib.contextmanager
+    def _pipelined_bridges(self):
+        """Pipelines the OpenFlow requests sent to the agent bridges.
+
+        The flows of the ports are sent to br-int, br-tun and the physical
+        bridges without waiting for each reply; the context exits once the
+        switch replied to all of them, before the ports are reported up.
+        """
+        bridges = [self.int_br] + list(self.phys_brs.values())
+        if self.enable_tunneling:
+            bridges.append(self.tun_br)
+        with contextlib.ExitStack() as stack:
+            for bridge in bridges:
+                stack.enter_context(bridge.pipelined())
+            yield
+
     def process_network_ports(self, port_info, provisioning_needed):
         failed_devices = {'added': set(), 'removed': set()}
         # TODO(salv-orlando): consider a solution for ensuring notifications
@@ -2110,11 +2138,14 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
                       're_added': len(re_added),
                       'elapsed': time.time() - start})
         if devices_added_updated:
-            (skipped_devices, binding_no_activated_devices,
-             need_binding_devices, failed_devices['added'],
-             devices_not_in_datapath, migrating_devices) = (
-                self.treat_devices_added_or_updated(
-                    devices_added_updated, provisioning_needed, re_added))
+            with self.phase_timings.measure('treat_devices_added_or_updated'):
+                with self._pipelined_bridges():
+                    (skipped_devices, binding_no_activated_devices,
+                     need_binding_devices, failed_devices['added'],
+                     devices_not_in_datapath, migrating_devices) = (
+                        self.treat_devices_added_or_updated(
+                            devices_added_updated, provisioning_needed,
+                            re_added))
             LOG.info("process_network_ports - iteration:%(iter_num)d - "
                      "treat_devices_added_or_updated completed. "
                      "Skipped %(num_skipped)d and no activated binding "
@@ -2137,21 +2168,28 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
         added_ports = (port_info.get('added', set()) - skipped_devices -
                        binding_no_activated_devices - migrating_devices)
         self._add_port_tag_info(need_binding_devices)
-        self.process_install_ports_egress_flows(need_binding_devices)
-        added_to_datapath = added_ports - devices_not_in_datapath
-        self.sg_agent.setup_port_filters(added_to_datapath,
-                                         port_info.get('updated', set()))
+        with self._pipelined_bridges():
+            with self.phase_timings.measure('install_ports_egress_flows'):
+                self.process_install_ports_egress_flows(need_binding_devices)
+            added_to_datapath = added_ports - devices_not_in_datapath
+            with self.phase_timings.measure('setup_port_filters'):
+                self.sg_agent.setup_port_filters(
+                    added_to_datapath, port_info.get('updated', set()))
 
         LOG.info("process_network_ports - iteration:%(iter_num)d - "
                  "agent port security group processed in %(elapsed).3f",
                  {'iter_num': self.iter_num,
                   'elapsed': time.time() - start})
-        failed_devices['added'] |= self._bind_devices(need_binding_devices)
+        with self.phase_timings.measure('bind_devices'):
+            failed_devices['added'] |= self._bind_devices(
+                need_binding_devices)
 
         if 'removed' in port_info and port_info['removed']:
             start = time.time()
-            failed_devices['removed'] |= self.treat_devices_removed(
-                port_info['removed'])
+            with self.phase_timings.measure('treat_devices_removed'):
+                with self._pipelined_bridges():
+                    failed_devices['removed'] |= self.treat_devices_removed(
+                        port_info['removed'])
             LOG.info("process_network_ports - iteration:%(iter_num)d - "
                      "treat_devices_removed completed in %(elapsed).3f",
                      {'iter_num': self.iter_num,
@@ -2400,6 +2438,7 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
     def loop_count_and_wait(self, start_time, port_stats):
         # sleep till end of polling interval
         elapsed = time.time() - start_time
+        self.phase_timings.record('iteration', elapsed)
         LOG.info("Agent rpc_loop - iteration:%(iter_num)d "
                  "completed. Processed ports statistics: "
                  "%(port_stats)s. Elapsed:%(elapsed).3f",
@@ -2644,7 +2683,8 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
             # Notify the plugin of tunnel IP
             if self.enable_tunneling and tunnel_sync:
                 try:
-                    tunnel_sync = self.tunnel_sync()
+                    with self.phase_timings.measure('tunnel_sync'):
+                        tunnel_sync = self.tunnel_sync()
                 except Exception:
                     LOG.exception("Error while configuring tunnel endpoints")
                     tunnel_sync = True
@@ -2677,17 +2717,19 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
                     self.updated_ports = set()
                     activated_bindings_copy = self.activated_bindings
                     self.activated_bindings = set()
-                    (port_info, ancillary_port_info, consecutive_resyncs,
-                     ports_not_ready_yet) = (self.process_port_info(
-                            start, polling_manager, sync, ovs_restarted,
-                            ports, ancillary_ports, updated_ports_copy,
-                            consecutive_resyncs, ports_not_ready_yet,
-                            failed_devices, failed_ancillary_devices))
+                    with self.phase_timings.measure('process_port_info'):
+                        (port_info, ancillary_port_info, consecutive_resyncs,
+                         ports_not_ready_yet) = (self.process_port_info(
+                                start, polling_manager, sync, ovs_restarted,
+                                ports, ancillary_ports, updated_ports_copy,
+                                consecutive_resyncs, ports_not_ready_yet,
+                                failed_devices, failed_ancillary_devices))
                     sync = False
-                    self.process_deleted_ports(port_info)
-                    self.process_deactivated_bindings(port_info)
-                    self.process_activated_bindings(port_info,
-                                                    activated_bindings_copy)
+                    with self.phase_timings.measure('process_deleted_ports'):
+                        self.process_deleted_ports(port_info)
+                        self.process_deactivated_bindings(port_info)
+                        self.process_activated_bindings(
+                            port_info, activated_bindings_copy)
                     ofport_changed_ports = self.update_stale_ofport_rules()
                     if ofport_changed_ports:
                         port_info.setdefault('updated', set()).update(
@@ -2706,15 +2748,19 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
                                   port_info)
                         provisioning_needed = (
                                 ovs_restarted or bridges_recreated)
-                        failed_devices = self.process_network_ports(
-                            port_info, provisioning_needed)
+                        with self.phase_timings.measure(
+                                'process_network_ports'):
+                            failed_devices = self.process_network_ports(
+                                port_info, provisioning_needed)
                         LOG.info("Agent rpc_loop - iteration:%(iter_num)d - "
                                  "ports processed. Elapsed:%(elapsed).3f",
                                  {'iter_num': self.iter_num,
                                   'elapsed': time.time() - start})
 
                     if need_clean_stale_flow:
-                        self.cleanup_stale_flows()
+                        with self.phase_timings.measure(
+                                'cleanup_stale_flows'):
+                            self.cleanup_stale_flows()
                         need_clean_stale_flow = False
                         LOG.info("Agent rpc_loop - iteration:%(iter_num)d - "
                                  "cleanup stale flows. Elapsed:%(elapsed).3f",
@@ -2724,9 +2770,11 @@ class OVSNeutronAgent(l2population_rpc.L2populationRpcCallBackTunnelMixin,
                     ports = port_info['current']
 
                     if self.ancillary_brs:
-                        failed_ancillary_devices = (
-                            self.process_ancillary_network_ports(
-                                ancillary_port_info))
+                        with self.phase_timings.measure(
+                                'process_ancillary_network_ports'):
+                            failed_ancillary_devices = (
+                                self.process_ancillary_network_ports(
+                                    ancillary_port_info))
                         LOG.info("Agent rpc_loop - iteration: "
                                  "%(iter_num)d - ancillary ports "
                                  "processed. Elapsed:%(elapsed).3f",
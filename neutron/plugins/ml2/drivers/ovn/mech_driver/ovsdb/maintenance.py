@@ -16,6 +16,7 @@
 import abc
 import copy
 import inspect
+import itertools
 import re
 import threading
 
@@ -45,6 +46,8 @@ LOG = log.getLogger(__name__)
 
 INCONSISTENCY_TYPE_CREATE_UPDATE = 'create/update'
 INCONSISTENCY_TYPE_DELETE = 'delete'
+FIX_DBG_LOG_MSG = ('Maintenance task: Fixing resource %(res_uuid)s '
+                   '(type: %(res_type)s) at %(type_)s')
 
 
 class MaintenanceThread(object):
@@ -145,6 +148,7 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
         self._resources_func_map = {
             ovn_const.TYPE_NETWORKS: {
                 'neutron_get': self._ovn_client._plugin.get_network,
+                'neutron_get_all': self._ovn_client._plugin.get_networks,
                 'ovn_get': self._nb_idl.get_lswitch,
                 'ovn_create': self._ovn_client.create_network,
                 'ovn_update': self._ovn_client.update_network,
@@ -152,6 +156,7 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
             },
             ovn_const.TYPE_PORTS: {
                 'neutron_get': self._ovn_client._plugin.get_port,
+                'neutron_get_all': self._ovn_client._plugin.get_ports,
                 'ovn_get': self._nb_idl.get_lswitch_port,
                 'ovn_create': self._ovn_client.create_port,
                 'ovn_update': self._ovn_client.update_port,
@@ -159,6 +164,8 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
             },
             ovn_const.TYPE_FLOATINGIPS: {
                 'neutron_get': self._ovn_client._l3_plugin.get_floatingip,
+                'neutron_get_all':
+                    self._ovn_client._l3_plugin.get_floatingips,
                 'ovn_get': self._nb_idl.get_floatingip_in_nat_or_lb,
                 'ovn_create': self._create_floatingip_and_pf,
                 'ovn_update': self._update_floatingip_and_pf,
@@ -166,6 +173,7 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
             },
             ovn_const.TYPE_ROUTERS: {
                 'neutron_get': self._ovn_client._l3_plugin.get_router,
+                'neutron_get_all': self._ovn_client._l3_plugin.get_routers,
                 'ovn_get': self._nb_idl.get_lrouter,
                 'ovn_create': self._ovn_client.create_router,
                 'ovn_update': self._ovn_client.update_router,
@@ -173,6 +181,8 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
             },
             ovn_const.TYPE_SECURITY_GROUPS: {
                 'neutron_get': self._ovn_client._plugin.get_security_group,
+                'neutron_get_all':
+                    self._ovn_client._plugin.get_security_groups,
                 'ovn_get': self._nb_idl.get_port_group,
                 'ovn_create': self._ovn_client.create_security_group,
                 'ovn_delete': self._ovn_client.delete_security_group,
@@ -180,6 +190,8 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
             ovn_const.TYPE_SECURITY_GROUP_RULES: {
                 'neutron_get':
                     self._ovn_client._plugin.get_security_group_rule,
+                'neutron_get_all':
+                    self._ovn_client._plugin.get_security_group_rules,
                 'ovn_get': self._nb_idl.get_acl_by_id,
                 'ovn_create': self._ovn_client.create_security_group_rule,
                 'ovn_delete': self._ovn_client.delete_security_group_rule,
@@ -187,6 +199,7 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
             ovn_const.TYPE_ROUTER_PORTS: {
                 'neutron_get':
                     self._ovn_client._plugin.get_port,
+                'neutron_get_all': self._ovn_client._plugin.get_ports,
                 'ovn_get': self._nb_idl.get_lrouter_port,
                 'ovn_create': self._create_lrouter_port,
                 'ovn_update': self._ovn_client.update_router_port,
@@ -213,17 +226,22 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
                 LOG.exception(
                     'Unknown error while executing "%s"', func.__name__)
 
-    def _fix_create_update(self, context, row):
+    @staticmethod
+    def _log_resource_not_found(row):
+        LOG.warning('Skip fixing resource %(res_uuid)s (type: '
+                    '%(res_type)s). Resource does not exist in Neutron '
+                    'database anymore', {'res_uuid': row.resource_uuid,
+                                         'res_type': row.resource_type})
+
+    def _fix_create_update(self, context, row, n_obj=None):
         res_map = self._resources_func_map[row.resource_type]
-        try:
-            # Get the latest version of the resource in Neutron DB
-            n_obj = res_map['neutron_get'](context, row.resource_uuid)
-        except n_exc.NotFound:
-            LOG.warning('Skip fixing resource %(res_uuid)s (type: '
-                        '%(res_type)s). Resource does not exist in Neutron '
-                        'database anymore', {'res_uuid': row.resource_uuid,
-                                             'res_type': row.resource_type})
-            return
+        if n_obj is None:
+            try:
+                # Get the latest version of the resource in Neutron DB
+                n_obj = res_map['neutron_get'](context, row.resource_uuid)
+            except n_exc.NotFound:
+                self._log_resource_not_found(row)
+                return
 
         ovn_obj = res_map['ovn_get'](row.resource_uuid)
 
@@ -264,12 +282,14 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
         else:
             res_map['ovn_delete'](context, row.resource_uuid)
 
-    def _fix_create_update_subnet(self, context, row):
-        # Get the lasted version of the port in Neutron DB
-        sn_db_obj = self._ovn_client._plugin.get_subnet(
-            context, row.resource_uuid)
-        n_db_obj = self._ovn_client._plugin.get_network(
-            context, sn_db_obj['network_id'])
+    def _fix_create_update_subnet(self, context, row, sn_db_obj=None,
+                                  n_db_obj=None):
+        if sn_db_obj is None:
+            # Get the lasted version of the port in Neutron DB
+            sn_db_obj = self._ovn_client._plugin.get_subnet(
+                context, row.resource_uuid)
+            n_db_obj = self._ovn_client._plugin.get_network(
+                context, sn_db_obj['network_id'])
 
         if row.revision_number == ovn_const.INITIAL_REV_NUM:
             self._ovn_client.create_subnet(context, sn_db_obj, n_db_obj)
@@ -352,33 +372,25 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
                                               delete_inconsistencies)
         self._sync_timer.restart()
 
-        dbg_log_msg = ('Maintenance task: Fixing resource %(res_uuid)s '
-                       '(type: %(res_type)s) at %(type_)s')
         # Fix the create/update resources inconsistencies
-        for row in create_update_inconsistencies:
-            LOG.debug(dbg_log_msg, {'res_uuid': row.resource_uuid,
-                                    'res_type': row.resource_type,
-                                    'type_': INCONSISTENCY_TYPE_CREATE_UPDATE})
-            try:
-                # NOTE(lucasagomes): The way to fix subnets is bit
-                # different than other resources. A subnet in OVN language
-                # is just a DHCP rule but, this rule only exist if the
-                # subnet in Neutron has the "enable_dhcp" attribute set
-                # to True. So, it's possible to have a consistent subnet
-                # resource even when it does not exist in the OVN database.
-                if row.resource_type == ovn_const.TYPE_SUBNETS:
-                    self._fix_create_update_subnet(admin_context, row)
-                else:
-                    self._fix_create_update(admin_context, row)
-            except Exception:
-                LOG.exception('Maintenance task: Failed to fix resource '
-                              '%(res_uuid)s (type: %(res_type)s)',
-                              {'res_uuid': row.resource_uuid,
-                               'res_type': row.resource_type})
+        batch_size = ovn_conf.get_ovn_inconsistencies_fix_batch_size()
+        if batch_size:
+            fixed = self._fix_create_update_in_batches(
+                admin_context, create_update_inconsistencies, batch_size)
+        else:
+            fixed = 0
+            for row in create_update_inconsistencies:
+                if self._fix_time_budget_exhausted():
+                    break
+                self._fix_create_update_inconsistency(admin_context, row)
+                fixed += 1
 
         # Fix the deleted resources inconsistencies
         for row in delete_inconsistencies:
-            LOG.debug(dbg_log_msg, {'res_uuid': row.resource_uuid,
+            if self._fix_time_budget_exhausted():
+                break
+            fixed += 1
+            LOG.debug(FIX_DBG_LOG_MSG, {'res_uuid': row.resource_uuid,
                                     'res_type': row.resource_type,
                                     'type_': INCONSISTENCY_TYPE_DELETE})
             try:
@@ -397,9 +409,130 @@ class DBInconsistenciesPeriodics(SchemaAwarePeriodicsBase):
                                'res_type': row.resource_type})
 
         self._sync_timer.stop()
+        remaining = (len(create_update_inconsistencies) +
+                     len(delete_inconsistencies) - fixed)
+        if remaining:
+            LOG.info('Maintenance task: Fixing time budget exhausted, '
+                     '%d inconsistencies left for the next runs', remaining)
         LOG.info('Maintenance task: Synchronization finished '
                  '(took %.2f seconds)', self._sync_timer.elapsed())
 
+    def _fix_time_budget_exhausted(self):
+        budget = ovn_conf.get_ovn_inconsistencies_fix_time_budget()
+        return bool(budget and self._sync_timer.elapsed() >= budget)
+
+    def _fix_create_update_inconsistency(self, context, row):
+        LOG.debug(FIX_DBG_LOG_MSG, {'res_uuid': row.resource_uuid,
+                                    'res_type': row.resource_type,
+                                    'type_': INCONSISTENCY_TYPE_CREATE_UPDATE})
+        try:
+            # NOTE(lucasagomes): The way to fix subnets is bit
+            # different than other resources. A subnet in OVN language
+            # is just a DHCP rule but, this rule only exist if the
+            # subnet in Neutron has the "enable_dhcp" attribute set
+            # to True. So, it's possible to have a consistent subnet
+            # resource even when it does not exist in the OVN database.
+            if row.resource_type == ovn_const.TYPE_SUBNETS:
+                self._fix_create_update_subnet(context, row)
+            else:
+                self._fix_create_update(context, row)
+        except Exception:
+            LOG.exception('Maintenance task: Failed to fix resource '
+                          '%(res_uuid)s (type: %(res_type)s)',
+                          {'res_uuid': row.resource_uuid,
+                           'res_type': row.resource_type})
+
+    def _fix_create_update_in_batches(self, context, rows, batch_size):
+        """Fixes the create/update inconsistencies in batches.
+
+        The rows are sorted by resource type, each batch holds rows of a
+        single type so their Neutron objects are loaded with one query.
+
+        :returns: the number of rows processed before the fixing time
+                  budget was exhausted.
+        """
+        fixed = 0
+        for resource_type, type_rows in itertools.groupby(
+                rows, key=lambda row: row.resource_type):
+            type_rows = list(type_rows)
+            for i in range(0, len(type_rows), batch_size):
+                if self._fix_time_budget_exhausted():
+                    return fixed
+                batch = type_rows[i:i + batch_size]
+                self._fix_create_update_batch(context, resource_type, batch)
+                fixed += len(batch)
+        return fixed
+
+    def _get_neutron_objects(self, context, resource_type, resource_uuids):
+        """Returns the Neutron objects of the resources, by id.
+
+        The subnets are returned with their network, as a tuple. The
+        resources not found are missing from the result.
+        """
+        filters = {'id': resource_uuids}
+        if resource_type != ovn_const.TYPE_SUBNETS:
+            res_map = self._resources_func_map[resource_type]
+            return {n_obj['id']: n_obj for n_obj in
+                    res_map['neutron_get_all'](context, filters=filters)}
+
+        plugin = self._ovn_client._plugin
+        subnets = plugin.get_subnets(context, filters=filters)
+        networks = {net['id']: net for net in plugin.get_networks(
+            context, filters={'id': list({sn['network_id']
+                                          for sn in subnets})})}
+        return {sn['id']: (sn, networks[sn['network_id']])
+                for sn in subnets if sn['network_id'] in networks}
+
+    def _fix_create_update_batch(self, context, resource_type, rows):
+        """Fixes rows of the same resource type in a single transaction.
+
+        The revision numbers are only bumped once the OVN transaction is
+        committed, so a row is not marked as consistent if the OVN changes
+        are lost. If the batch fails, the rows are fixed one by one.
+        """
+        LOG.debug('Maintenance task: Fixing %(count)d resources (type: '
+                  '%(res_type)s) at %(type_)s',
+                  {'count': len(rows), 'res_type': resource_type,
+                   'type_': INCONSISTENCY_TYPE_CREATE_UPDATE})
+        try:
+            n_objs = self._get_neutron_objects(
+                context, resource_type, [row.resource_uuid for row in rows])
+            with revision_numbers_db.defer_revision_bumps(context) as bumps, \
+                    self._nb_idl.transaction(check_error=True):
+                for row in rows:
+                    n_obj = n_objs.get(row.resource_uuid)
+                    if n_obj is None:
+                        self._log_resource_not_found(row)
+                    elif resource_type == ovn_const.TYPE_SUBNETS:
+                        self._fix_create_update_subnet(
+                            context, row, sn_db_obj=n_obj[0],
+                            n_db_obj=n_obj[1])
+                    else:
+                        self._fix_create_update(context, row, n_obj=n_obj)
+        except Exception:
+            LOG.exception('Maintenance task: Failed to fix %(count)d '
+                          'resources (type: %(res_type)s) in a batch, '
+                          'fixing them one by one',
+                          {'count': len(rows), 'res_type': resource_type})
+            for row in rows:
+                self._fix_create_update_inconsistency(context, row)
+            return
+        for resource, bump_type, check_rev_cmd in bumps:
+            # the update paths only bump if their revision check passed
+            if (check_rev_cmd is not None and
+                    check_rev_cmd.result != ovn_const.TXN_COMMITTED):
+                continue
+            try:
+                revision_numbers_db.bump_revision(context, resource,
+                                                  bump_type)
+            except Exception:
+                # the resource is fixed again by the next run
+                LOG.exception('Maintenance task: Failed to bump the '
+                              'revision number of resource %(res_uuid)s '
+                              '(type: %(res_type)s)',
+                              {'res_uuid': resource['id'],
+                               'res_type': bump_type})
+
     def _create_lrouter_port(self, context, port):
         router_id = port['device_id']
         iface_info = self._ovn_client._l3_plugin._add_neutron_router_interface(
@@ -687,8 +687,8 @@ class OVNClient(object):
                 # We need to remove the old entries
                 self.add_txns_to_remove_port_dns_records(txn, port_object)
 
-        if check_rev_cmd.result == ovn_const.TXN_COMMITTED:
-            db_rev.bump_revision(context, port, ovn_const.TYPE_PORTS)
+        db_rev.bump_revision_if_committed(
+            context, check_rev_cmd, port, ovn_const.TYPE_PORTS)
 
     def _delete_port(self, port_id, port_object=None):
         ovn_port = self._nb_idl.lookup('Logical_Switch_Port', port_id)
@@ -1001,9 +1001,8 @@ class OVNClient(object):
             floatingip['id'], floatingip, ovn_const.TYPE_FLOATINGIPS)
         with self._nb_idl.transaction(check_error=True) as txn:
             txn.add(check_rev_cmd)
-        if check_rev_cmd.result == ovn_const.TXN_COMMITTED:
-            db_rev.bump_revision(
-                context, floatingip, ovn_const.TYPE_FLOATINGIPS)
+        db_rev.bump_revision_if_committed(
+            context, check_rev_cmd, floatingip, ovn_const.TYPE_FLOATINGIPS)
 
     def create_floatingip(self, context, floatingip):
         try:
@@ -1048,9 +1047,8 @@ class OVNClient(object):
 
             self._qos_driver.update_floatingip(txn, floatingip)
 
-        if check_rev_cmd.result == ovn_const.TXN_COMMITTED:
-            db_rev.bump_revision(
-                context, floatingip, ovn_const.TYPE_FLOATINGIPS)
+        db_rev.bump_revision_if_committed(
+            context, check_rev_cmd, floatingip, ovn_const.TYPE_FLOATINGIPS)
 
         if fip_status:
             self._l3_plugin.update_floatingip_status(
@@ -1360,9 +1358,8 @@ class OVNClient(object):
                 self.update_router_routes(
                     context, router_id, added, removed, txn=txn)
 
-            if check_rev_cmd.result == ovn_const.TXN_COMMITTED:
-                db_rev.bump_revision(context, new_router,
-                                     ovn_const.TYPE_ROUTERS)
+            db_rev.bump_revision_if_committed(
+                context, check_rev_cmd, new_router, ovn_const.TYPE_ROUTERS)
 
             if added_gw_port:
                 db_rev.bump_revision(context, added_gw_port,
@@ -1598,9 +1595,8 @@ class OVNClient(object):
             self._update_lrouter_port(context, port, if_exists=if_exists,
                                       txn=txn)
 
-        if check_rev_cmd.result == ovn_const.TXN_COMMITTED:
-            db_rev.bump_revision(
-                context, port, ovn_const.TYPE_ROUTER_PORTS)
+        db_rev.bump_revision_if_committed(
+            context, check_rev_cmd, port, ovn_const.TYPE_ROUTER_PORTS)
 
     def _delete_lrouter_port(self, context, port_id, router_id=None, txn=None):
         """Delete a logical router port."""
@@ -1882,8 +1878,8 @@ class OVNClient(object):
 
             self._qos_driver.update_network(txn, network, original_network)
 
-        if check_rev_cmd.result == ovn_const.TXN_COMMITTED:
-            db_rev.bump_revision(context, network, ovn_const.TYPE_NETWORKS)
+        db_rev.bump_revision_if_committed(
+            context, check_rev_cmd, network, ovn_const.TYPE_NETWORKS)
 
     def _add_subnet_dhcp_options(self, subnet, network,
                                  ovn_dhcp_options=None):
@@ -2160,8 +2156,8 @@ class OVNClient(object):
                                                  txn_n)
         else:
             self._modify_subnet_dhcp_options(subnet, ovn_subnet, network, txn)
-        if check_rev_cmd.result == ovn_const.TXN_COMMITTED:
-            db_rev.bump_revision(context, subnet, ovn_const.TYPE_SUBNETS)
+        db_rev.bump_revision_if_committed(
+            context, check_rev_cmd, subnet, ovn_const.TYPE_SUBNETS)
 
     def delete_subnet(self, context, subnet_id):
         with self._nb_idl.transaction(check_error=True) as txn:
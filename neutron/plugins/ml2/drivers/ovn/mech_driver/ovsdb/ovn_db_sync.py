@@ -11,9 +11,12 @@
 #    under the License.
 
 import abc
+import collections
 from datetime import datetime
 import itertools
+import time
 
+import eventlet
 from eventlet import greenthread
 from neutron_lib.api.definitions import l3
 from neutron_lib.api.definitions import segment as segment_def
@@ -44,6 +47,50 @@ SYNC_MODE_LOG = 'log'
 SYNC_MODE_REPAIR = 'repair'
 
 
+class BatchedTransaction(object):
+    """Applies OVN commands in transactions of a bounded size.
+
+    The commands are queued by add() and applied in a single transaction
+    when the context exits. If a batch size is set, checkpoint() applies
+    the queued commands once there are at least that many of them. It is
+    called between the commands of two resources, so the commands of a
+    resource are always applied in the same transaction.
+    """
+
+    def __init__(self, ovn_api, batch_size, stats=None):
+        self._ovn_api = ovn_api
+        self._batch_size = batch_size
+        self._commands = []
+        self._stats = stats if stats is not None else collections.Counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._commands = []
+
+    def add(self, command):
+        self._commands.append(command)
+        return command
+
+    def checkpoint(self):
+        if self._batch_size and len(self._commands) >= self._batch_size:
+            self.commit()
+
+    def commit(self):
+        if not self._commands:
+            return
+        commands, self._commands = self._commands, []
+        with self._ovn_api.transaction(check_error=True) as txn:
+            for command in commands:
+                txn.add(command)
+        self._stats['commands'] += len(commands)
+        self._stats['transactions'] += 1
+
+
 class OvnDbSynchronizer(object, metaclass=abc.ABCMeta):
 
     def __init__(self, core_plugin, ovn_api, ovn_driver):
@@ -73,6 +120,7 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
         super(OvnNbSynchronizer, self).__init__(
             core_plugin, ovn_api, ovn_driver)
         self.mode = mode
+        self._phase_stats = {}
         self.l3_plugin = directory.get_plugin(plugin_constants.L3)
         self.pf_plugin = directory.get_plugin(plugin_constants.PORTFORWARDING)
         if not self.pf_plugin:
@@ -98,15 +146,111 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
             return
         LOG.debug("Starting OVN-Northbound DB sync process")
 
+        self._phase_stats = {}
         ctx = context.get_admin_context()
 
-        self.sync_port_groups(ctx)
-        self.sync_networks_ports_and_dhcp_opts(ctx)
-        self.sync_port_dns_records(ctx)
-        self.sync_acls(ctx)
-        self.sync_routers_and_rports(ctx)
-        self.sync_port_qos_policies(ctx)
-        self.sync_fip_qos_policies(ctx)
+        # The ports are added to the port groups, the networks and ports
+        # must be in sync before the other phases.
+        self._run_phases(ctx, [self.sync_port_groups])
+        self._run_phases(ctx, [self.sync_networks_ports_and_dhcp_opts])
+        independent_phases = [
+            [self.sync_port_dns_records],
+            [self.sync_acls],
+            [self.sync_routers_and_rports, self.sync_fip_qos_policies],
+            [self.sync_port_qos_policies]]
+        if ovn_conf.is_ovn_neutron_sync_concurrent_phases():
+            errors = []
+            pool = eventlet.GreenPool(len(independent_phases))
+            for phases in independent_phases:
+                # Each green thread needs its own database session.
+                pool.spawn(self._run_phases, context.get_admin_context(),
+                           phases, errors=errors)
+            pool.waitall()
+            if errors:
+                raise errors[0]
+        else:
+            self._run_phases(ctx, itertools.chain(*independent_phases))
+
+        for phase, stats in self._phase_stats.items():
+            LOG.info("OVN-Northbound DB sync phase %(phase)s finished in "
+                     "%(duration).3f seconds, %(commands)d commands applied "
+                     "in %(transactions)d transactions",
+                     dict(stats, phase=phase))
+
+    def _run_phases(self, ctx, phases, errors=None):
+        """Runs the phases in order.
+
+        The exception of a failed phase is raised, unless an errors list is
+        given: the exception is then appended to it and the remaining phases
+        are run, so the concurrent phases are not interrupted.
+        """
+        for phase in phases:
+            stats = self._get_phase_stats(phase.__name__)
+            start = time.monotonic()
+            try:
+                phase(ctx)
+            except Exception as e:
+                if errors is None:
+                    raise
+                LOG.exception("OVN-Northbound DB sync phase %s failed",
+                              phase.__name__)
+                errors.append(e)
+            finally:
+                stats['duration'] = time.monotonic() - start
+
+    def _get_phase_stats(self, phase):
+        return self._phase_stats.setdefault(
+            phase, collections.Counter(duration=0.0, commands=0,
+                                       transactions=0))
+
+    def get_phase_stats(self):
+        """Returns the duration and OVN commands applied of each phase.
+
+        The statistics of the last synchronization are returned, as a
+        dictionary of the phase names to dictionaries with the 'duration',
+        in seconds, 'commands' and 'transactions' keys.
+        """
+        return {phase: dict(stats)
+                for phase, stats in self._phase_stats.items()}
+
+    def _batched_transaction(self, phase):
+        return BatchedTransaction(
+            self.ovn_api, ovn_conf.get_ovn_neutron_sync_batch_size(),
+            self._get_phase_stats(phase))
+
+    @staticmethod
+    def _get_resources_paged(get_resources, ctx, filters=None):
+        """Yields the resources returned by get_resources, page by page.
+
+        The resources are fetched by pages of 'neutron_sync_page_size'
+        resources, sorted by id, so a full sync doesn't load all of them
+        with a single query.
+        """
+        page_size = ovn_conf.get_ovn_neutron_sync_page_size()
+        if not page_size:
+            yield from get_resources(ctx, filters=filters)
+            return
+        marker = None
+        while True:
+            page = get_resources(ctx, filters=filters, sorts=[('id', True)],
+                                 limit=page_size, marker=marker)
+            yield from page
+            if len(page) < page_size:
+                return
+            marker = page[-1]['id']
+
+    def _get_segments_by_network(self, ctx, network_ids):
+        """Returns the segments of the networks, grouped by network id."""
+        segments = collections.defaultdict(list)
+        network_ids = list(network_ids)
+        chunk_size = (ovn_conf.get_ovn_neutron_sync_page_size() or
+                      len(network_ids) or 1)
+        for i in range(0, len(network_ids), chunk_size):
+            for segment in self.segments_plugin.get_segments(
+                    ctx, filters={'network_id':
+                                  network_ids[i:i + chunk_size]}):
+                segments[segment['network_id']].append(segment)
+        return segments
 
     def _create_port_in_ovn(self, ctx, port):
         # Remove any old ACLs for the port to avoid creating duplicate ACLs.
@@ -144,7 +288,8 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
         @return: acl_list-dict
         """
         lswitch_names = set([])
-        for network in self.core_plugin.get_networks(context):
+        for network in self._get_resources_paged(
+                self.core_plugin.get_networks, context):
             lswitch_names.add(network['id'])
         acl_dict, ignore1, ignore2 = (
             self.ovn_api.get_acls_for_lswitches(lswitch_names))
@@ -191,38 +336,37 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
             LOG.debug('Port-Group-SYNC: transaction started @ %s',
                       str(datetime.now()))
             if add_pgs:
-                db_ports = self.core_plugin.get_ports(ctx)
                 ovn_ports = set(p.name for p in
                                 self.ovn_api.lsp_list().execute())
-            with self.ovn_api.transaction(check_error=True) as txn:
-                pg = ovn_const.OVN_DROP_PORT_GROUP_NAME
+            with self._batched_transaction('sync_port_groups') as txn:
+                drop_pg = ovn_const.OVN_DROP_PORT_GROUP_NAME
                 # Process default drop port group first
-                if pg in add_pgs:
-                    txn.add(self.ovn_api.pg_add(name=pg, acls=[]))
-                    add_pgs.remove(pg)
-                    # Add ports to the drop port group. Only add those that
-                    # already exists in OVN. The rest will be added during the
-                    # ports sync operation later.
-                    for n_port in db_ports:
-                        if ((utils.is_security_groups_enabled(n_port) or
-                                utils.is_port_security_enabled(n_port)) and
-                                n_port['id'] in ovn_ports):
-                            txn.add(self.ovn_api.pg_add_ports(
-                                pg, n_port['id']))
-
-                for pg in add_pgs:
+                if drop_pg in add_pgs:
+                    txn.add(self.ovn_api.pg_add(name=drop_pg, acls=[]))
+                for pg in sorted(add_pgs - {drop_pg}):
                     # If it's a security group PG, add the ext id
                     ext_ids = {ovn_const.OVN_SG_EXT_ID_KEY: neutron_sgs[pg]}
                     txn.add(self.ovn_api.pg_add(name=pg, acls=[],
                                                 external_ids=ext_ids))
-                    # Add the ports belonging to the SG to this port group
-                    for n_port in db_ports:
-                        if (neutron_sgs[pg] in n_port['security_groups'] and
-                                n_port['id'] in ovn_ports):
-                            txn.add(self.ovn_api.pg_add_ports(
-                                pg, n_port['id']))
+                # Add the ports to the added port groups, page by page. Only
+                # add those that already exists in OVN. The rest will be added
+                # during the ports sync operation later.
+                db_ports = (self._get_resources_paged(
+                    self.core_plugin.get_ports, ctx) if add_pgs else ())
+                for n_port in db_ports:
+                    if n_port['id'] not in ovn_ports:
+                        continue
+                    port_pgs = {utils.ovn_port_group_name(sg_id)
+                                for sg_id in n_port['security_groups']}
+                    if (utils.is_security_groups_enabled(n_port) or
+                            utils.is_port_security_enabled(n_port)):
+                        port_pgs.add(drop_pg)
+                    for pg in sorted(port_pgs & add_pgs):
+                        txn.add(self.ovn_api.pg_add_ports(pg, n_port['id']))
+                        txn.checkpoint()
                 for pg in remove_pgs:
                     txn.add(self.ovn_api.pg_del(pg))
+                    txn.checkpoint()
             LOG.debug('Port-Group-SYNC: transaction finished @ %s',
                       str(datetime.now()))
 
@@ -297,13 +441,14 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                          'remove': num_acls_to_remove})
 
         if self.mode == SYNC_MODE_REPAIR:
-            with self.ovn_api.transaction(check_error=True) as txn:
+            with self._batched_transaction('sync_acls') as txn:
                 for acla in neutron_acls:
                     LOG.warning('ACL found in Neutron but not in '
                                 'OVN DB for port group %s', acla['port_group'])
                     txn.add(self.ovn_api.pg_acl_add(**acla, may_exist=True))
+                    txn.checkpoint()
 
-            with self.ovn_api.transaction(check_error=True) as txn:
+            with self._batched_transaction('sync_acls') as txn:
                 for aclr in ovn_acls:
                     LOG.warning('ACLs found in OVN DB but not in '
                                 'Neutron for port group %s',
@@ -312,6 +457,7 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                                                     aclr['direction'],
                                                     aclr['priority'],
                                                     aclr['match']))
+                    txn.checkpoint()
                 for aclr in ovn_acls_from_ls:
                     # Remove all the ACLs from any Logical Switch if they have
                     # any. Elements are (lswitch_name, list_of_acls).
@@ -319,6 +465,7 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                         LOG.warning('Removing ACLs from OVN from Logical '
                                     'Switch %s', aclr[0])
                         txn.add(self.ovn_api.acl_del(aclr[0]))
+                        txn.checkpoint()
 
         LOG.debug('ACL-SYNC: finished @ %s', str(datetime.now()))
 
@@ -967,13 +1114,15 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
     def sync_networks_ports_and_dhcp_opts(self, ctx):
         LOG.debug('OVN-NB Sync networks, ports and DHCP options started')
         db_networks = {}
-        for net in self.core_plugin.get_networks(ctx):
+        for net in self._get_resources_paged(self.core_plugin.get_networks,
+                                             ctx):
             db_networks[utils.ovn_name(net['id'])] = net
 
         # Ignore the floating ip ports with device_owner set to
         # constants.DEVICE_OWNER_FLOATINGIP
         db_ports = {port['id']: port for port in
-                    self.core_plugin.get_ports(ctx) if not
+                    self._get_resources_paged(self.core_plugin.get_ports,
+                                              ctx) if not
                     utils.is_lsp_ignored(port)}
 
         ovn_all_dhcp_options = self.ovn_api.get_all_dhcp_options()
@@ -981,6 +1130,9 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
 
         ports_need_sync_dhcp_opts = []
         lswitches = self.ovn_api.get_all_logical_switches_with_ports()
+        db_segments_by_network = self._get_segments_by_network(
+            ctx, [db_networks[lswitch['name']]['id'] for lswitch in lswitches
+                  if lswitch['name'] in db_networks])
         del_lswitchs_list = []
         del_lports_list = []
         add_provnet_ports_list = []
@@ -996,8 +1148,7 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                         del_lports_list.append({'port': lport,
                                                 'lswitch': lswitch['name']})
                 db_network = db_networks[lswitch['name']]
-                db_segments = self.segments_plugin.get_segments(
-                    ctx, filters={'network_id': [db_network['id']]})
+                db_segments = db_segments_by_network[db_network['id']]
                 segments_provnet_port_names = []
                 for db_segment in db_segments:
                     physnet = db_segment.get(segment_def.PHYSICAL_NETWORK)
@@ -1063,7 +1214,8 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                     LOG.warning("Create port in OVN NB failed for"
                                 " port %s", port['id'])
 
-        with self.ovn_api.transaction(check_error=True) as txn:
+        with self._batched_transaction(
+                'sync_networks_ports_and_dhcp_opts') as txn:
             for lswitch in del_lswitchs_list:
                 LOG.warning("Network found in OVN but not in "
                             "Neutron, network_id=%s", lswitch['name'])
@@ -1071,6 +1223,7 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                     LOG.debug('Deleting the network %s from OVN NB DB',
                               lswitch['name'])
                     txn.add(self.ovn_api.ls_del(lswitch['name']))
+                    txn.checkpoint()
 
             for provnet_port_info in add_provnet_ports_list:
                 network = provnet_port_info['network']
@@ -1085,6 +1238,7 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                               utils.ovn_provnet_port_name(segment['id']))
                     self._ovn_client.create_provnet_port(
                         network['id'], segment, txn=txn)
+                    txn.checkpoint()
 
             for provnet_port_info in del_provnet_ports_list:
                 network = provnet_port_info['network']
@@ -1101,6 +1255,7 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                     txn.add(self.ovn_api.delete_lswitch_port(
                         lport_name=lport,
                         lswitch_name=lswitch))
+                    txn.checkpoint()
 
             for lport_info in del_lports_list:
                 LOG.warning("Port found in OVN but not in "
@@ -1123,6 +1278,7 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
                         txn.add(self.ovn_api.delete_dhcp_options(
                                 ovn_all_dhcp_options['ports_v6'].pop(
                                     lport_info['port'])['uuid']))
+                    txn.checkpoint()
 
         self._sync_port_dhcp_options(ctx, ports_need_sync_dhcp_opts,
                                      ovn_all_dhcp_options['ports_v4'],
@@ -1135,10 +1291,11 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
         LOG.debug('OVN-NB Sync port dns records')
         # Ignore the floating ip ports with device_owner set to
         # constants.DEVICE_OWNER_FLOATINGIP
-        db_ports = [port for port in
-                    self.core_plugin.get_ports(ctx) if not
+        db_ports = (port for port in
+                    self._get_resources_paged(self.core_plugin.get_ports,
+                                              ctx) if not
                     port.get('device_owner', '').startswith(
-                        constants.DEVICE_OWNER_FLOATINGIP)]
+                        constants.DEVICE_OWNER_FLOATINGIP))
         dns_records = {}
         for port in db_ports:
             if self._ovn_client.is_dns_required_for_port(port):
@@ -1233,11 +1390,13 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
         LOG.debug('Port QoS policies migration task started')
         ovn_qos_ext = ovn_qos.OVNClientQosExtension(nb_idl=self.ovn_api)
         with db_api.CONTEXT_READER.using(ctx), \
-                self.ovn_api.transaction(check_error=True) as txn:
-            for port in self.core_plugin.get_ports(ctx):
+                self._batched_transaction('sync_port_qos_policies') as txn:
+            for port in self._get_resources_paged(self.core_plugin.get_ports,
+                                                  ctx):
                 if not ovn_qos_ext.port_effective_qos_policy_id(port)[0]:
                     continue
                 ovn_qos_ext.create_port(txn, port)
+                txn.checkpoint()
 
         LOG.debug('Port QoS policies migration task finished')
 
@@ -1246,11 +1405,12 @@ class OvnNbSynchronizer(OvnDbSynchronizer):
         LOG.debug('Floating IP QoS policies migration task started')
         ovn_qos_ext = ovn_qos.OVNClientQosExtension(nb_idl=self.ovn_api)
         with db_api.CONTEXT_READER.using(ctx), \
-                self.ovn_api.transaction(check_error=True) as txn:
+                self._batched_transaction('sync_fip_qos_policies') as txn:
             for fip in self.l3_plugin.get_floatingips(ctx):
                 if not fip.get('qos_policy_id'):
                     continue
                 ovn_qos_ext.create_floatingip(txn, fip)
+                txn.checkpoint()
 
         LOG.debug('Floating IP QoS policies migration task finished')
 
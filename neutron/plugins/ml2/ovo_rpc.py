@@ -15,14 +15,17 @@ import atexit
 import queue
 import signal
 import threading
+import time
 import traceback
 import weakref
 
+from neutron_lib.api.definitions import portbindings
 from neutron_lib.callbacks import events
 from neutron_lib.callbacks import registry
 from neutron_lib.callbacks import resources
 from neutron_lib import context as n_ctx
 from neutron_lib.db import api as db_api
+from oslo_config import cfg
 from oslo_log import log as logging
 
 from neutron.api.rpc.callbacks import events as rpc_events
@@ -51,6 +54,10 @@ class _ObjectChangeHandler(object):
         self._obj_class = object_class
         self._resource_push_api = resource_push_api
         self._resources_to_push = queue.Queue()
+        # {resource_id: set((scope, scope_id))} of the states of the events
+        # not dispatched yet, only recorded for the scoped pushes
+        self._previous_scopes = {}
+        self._previous_scopes_lock = threading.Lock()
         self._semantic_warned = False
         for event in (events.AFTER_CREATE, events.AFTER_UPDATE,
                       events.AFTER_DELETE):
@@ -101,41 +108,118 @@ class _ObjectChangeHandler(object):
                 payload.context, resource, event):
             return
         resource_id = payload.resource_id
+        self._record_previous_scopes(resource_id, payload)
         # we preserve the context so we can trace a receive on the agent back
         # to the server-side event that triggered it
         self._resources_to_push.put((resource_id, payload.context.to_dict()))
 
+    def _record_previous_scopes(self, resource_id, payload):
+        """Records the scopes of the port before the event.
+
+        The ports are pushed on the topics of their current scopes, so the
+        agents of the network, hosts and security groups a port was removed
+        from, or of a deleted port, would not be notified otherwise.
+        """
+        if (self._resource != resources.PORT or
+                not cfg.CONF.rpc_scoped_resource_push or not payload.states or
+                not isinstance(payload.states[0], dict)):
+            return
+        port = payload.states[0]
+        scopes = set()
+        if port.get('network_id'):
+            scopes.add((resources_rpc.SCOPE_NETWORK, port['network_id']))
+        if port.get(portbindings.HOST_ID):
+            scopes.add((resources_rpc.SCOPE_HOST, port[portbindings.HOST_ID]))
+        scopes.update((resources_rpc.SCOPE_SECURITY_GROUP, sg_id)
+                      for sg_id in port.get('security_groups') or ())
+        with self._previous_scopes_lock:
+            self._previous_scopes.setdefault(resource_id, set()).update(
+                scopes)
+
+    def _pop_previous_scopes(self, resource_ids):
+        with self._previous_scopes_lock:
+            return {resource_id: self._previous_scopes.pop(resource_id)
+                    for resource_id in resource_ids
+                    if resource_id in self._previous_scopes}
+
+    def _get_batch(self):
+        """Waits for a queued event and drains a batch of them.
+
+        The batch is bounded by the ovo_push_max_batch_size option and, once
+        the first event is received, more events are waited for up to
+        ovo_push_max_linger seconds.
+        """
+        batch = [self._resources_to_push.get(timeout=self.MAX_IDLE_FOR)]
+        max_size = cfg.CONF.ml2.ovo_push_max_batch_size
+        deadline = time.monotonic() + cfg.CONF.ml2.ovo_push_max_linger
+        while len(batch) < max_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(
+                        self._resources_to_push.get(timeout=timeout))
+                else:
+                    batch.append(self._resources_to_push.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch_batch(self, batch):
+        # the objects of the whole batch are retrieved with one query and
+        # pushed at once, whatever the requests that triggered the events
+        request_ids = {}
+        resource_ids = {}
+        for resource_id, context_dict in batch:
+            # dicts keep the order of the events while removing duplicates
+            request_ids[context_dict.get('request_id')] = None
+            resource_ids[resource_id] = None
+        resource_ids = list(resource_ids)
+        # the request IDs are logged so a receive on the agent can still be
+        # traced back to the server-side events that triggered it
+        LOG.debug("Dispatching %(count)d %(res)s events of requests "
+                  "%(requests)s", {'count': len(resource_ids),
+                                   'res': self._resource,
+                                   'requests': list(request_ids)})
+        context = n_ctx.get_admin_context()
+        # attempt to get regardless of event type so concurrent delete
+        # after create/update is the same code-path as a delete event
+        with db_api.get_context_manager().independent.reader.using(context):
+            objs = self._obj_class.get_objects(context, id=resource_ids)
+        found_ids = {obj.id for obj in objs}
+        # construct fake objects with the right ID so we can have a
+        # payload for the delete message.
+        deleted = [self._obj_class(id=resource_id)
+                   for resource_id in resource_ids
+                   if resource_id not in found_ids]
+        kwargs = {}
+        previous_scopes = self._pop_previous_scopes(resource_ids)
+        if previous_scopes:
+            kwargs['previous_scopes'] = previous_scopes
+        # CREATE events are always treated as UPDATE events to ensure
+        # listeners are written to handle out-of-order messages
+        if objs:
+            self._resource_push_api.push(context, objs, rpc_events.UPDATED,
+                                         **kwargs)
+        if deleted:
+            self._resource_push_api.push(context, deleted, rpc_events.DELETED,
+                                         **kwargs)
+
     def dispatch_events(self):
-        # TODO(kevinbenton): now that we are batching these, convert to a
-        # single get_objects call for all of them
         LOG.debug('Thread %(name)s started', {'name': self._worker.name})
         while not self._stop.is_set():
             try:
-                resource_id, context_dict = self._resources_to_push.get(
-                    timeout=self.MAX_IDLE_FOR)
-                context = n_ctx.Context.from_dict(context_dict)
-                # attempt to get regardless of event type so concurrent delete
-                # after create/update is the same code-path as a delete event
-                with db_api.get_context_manager().independent.reader.using(
-                        context):
-                    obj = self._obj_class.get_object(context, id=resource_id)
-                # CREATE events are always treated as UPDATE events to ensure
-                # listeners are written to handle out-of-order messages
-                if obj is None:
-                    rpc_event = rpc_events.DELETED
-                    # construct a fake object with the right ID so we can
-                    # have a payload for the delete message.
-                    obj = self._obj_class(id=resource_id)
-                else:
-                    rpc_event = rpc_events.UPDATED
-                self._resource_push_api.push(context, [obj], rpc_event)
-                self._resources_to_push.task_done()
+                batch = self._get_batch()
             except queue.Empty:
-                pass
+                continue
+            try:
+                self._dispatch_batch(batch)
             except Exception as e:
                 LOG.exception(
                     "Exception while dispatching %(res)s events: %(e)s",
                     {'res': self._resource, 'e': e})
+            finally:
+                for _item in batch:
+                    self._resources_to_push.task_done()
         LOG.debug('Thread %(name)s finished with %(msgs)s unsent messages',
                   {'name': self._worker.name,
                    'msgs': self._resources_to_push.unfinished_tasks})
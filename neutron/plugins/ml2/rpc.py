@@ -13,10 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+
 from neutron_lib.agent import topics
 from neutron_lib.api.definitions import port_security as psec
 from neutron_lib.api.definitions import portbindings
 from neutron_lib.api.definitions import uplink_status_propagation as usp
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
 from neutron_lib.callbacks import resources
 from neutron_lib import constants as n_const
 from neutron_lib.plugins import directory
@@ -40,6 +44,164 @@ from neutron.plugins.ml2.drivers import type_tunnel
 
 LOG = log.getLogger(__name__)
 
+# Port attributes that can change without modifying the device details.
+_DEVICE_DETAILS_IGNORED_PORT_ATTRS = frozenset(
+    ['status', 'revision_number', 'updated_at'])
+
+DeviceDetailsCacheEntry = collections.namedtuple(
+    'DeviceDetailsCacheEntry',
+    ['port_id', 'network_id', 'port_revision', 'network_revision',
+     'status', 'binding_host', 'details'])
+
+
+@registry.has_registry_receivers
+class DeviceDetailsCache(object):
+    """Size bounded cache of the device details returned to the agents.
+
+    The entries are keyed by the device and the host of the requesting agent
+    and are only returned while the revision numbers of the port and of its
+    network match the ones the details were built from, so a cached entry is
+    never stale, even if the resources were updated by another server
+    process. The port and network update notifications received by this
+    process are used to drop the entries early.
+
+    The status only updates of a port are only known by the process that
+    handled them, which keeps its entries. The status updates handled by the
+    other processes change the revision number of the port, so their entries
+    are rebuilt on the next request.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._keys_by_port = collections.defaultdict(set)
+        self._keys_by_network = collections.defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_entries(self, context, devices, host):
+        """Returns the valid cached details of the devices.
+
+        The result is a dictionary keyed by device with the cache entries for
+        values. Devices without a valid entry are not included.
+        """
+        if not self._entries:
+            self.misses += len(devices)
+            return {}
+        candidates = {}
+        for device in devices:
+            entry = self._entries.get((device, host))
+            if entry:
+                candidates[device] = entry
+        if not candidates:
+            self.misses += len(devices)
+            return {}
+        revisions = ml2_db.get_port_and_network_revisions(
+            context, {entry.port_id for entry in candidates.values()})
+        result = {}
+        for device, entry in candidates.items():
+            if revisions.get(entry.port_id) != (entry.network_id,
+                                                entry.port_revision,
+                                                entry.network_revision):
+                self._remove((device, host))
+                continue
+            self._entries.move_to_end((device, host))
+            result[device] = entry
+        self.hits += len(result)
+        self.misses += len(devices) - len(result)
+        return result
+
+    def store(self, device, host, port_context, details):
+        """Caches the details built for a device from its port context."""
+        port = port_context.current
+        # The status of distributed ports is tracked per host and the
+        # incomplete details of unbound ports are always recomputed.
+        if ('network_id' not in details or
+                port['device_owner'] == n_const.DEVICE_OWNER_DVR_INTERFACE):
+            return
+        network = port_context.network.current
+        revision_numbers = (port.get('revision_number'),
+                            network.get('revision_number'))
+        if None in revision_numbers:
+            return
+        key = (device, host)
+        self._remove(key)
+        self._entries[key] = DeviceDetailsCacheEntry(
+            port_id=port['id'], network_id=port['network_id'],
+            port_revision=revision_numbers[0],
+            network_revision=revision_numbers[1],
+            status=port['status'], binding_host=port_context.host,
+            details=details)
+        self._keys_by_port[port['id']].add(key)
+        self._keys_by_network[port['network_id']].add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_port.clear()
+        self._keys_by_network.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if not entry:
+            return
+        for index, index_key in ((self._keys_by_port, entry.port_id),
+                                 (self._keys_by_network, entry.network_id)):
+            keys = index.get(index_key)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del index[index_key]
+
+    def invalidate_port(self, port_id):
+        for key in list(self._keys_by_port.get(port_id, ())):
+            self._remove(key)
+
+    def invalidate_network(self, network_id):
+        for key in list(self._keys_by_network.get(network_id, ())):
+            self._remove(key)
+
+    def _restamp_port(self, port):
+        """Updates the entries of a port after a status only change."""
+        for key in self._keys_by_port.get(port['id'], ()):
+            self._entries[key] = self._entries[key]._replace(
+                port_revision=port['revision_number'],
+                status=port['status'])
+
+    @registry.receives(resources.PORT, [events.AFTER_UPDATE])
+    def _handle_port_update(self, resource, event, trigger, payload):
+        if not self._keys_by_port.get(payload.resource_id):
+            return
+        original, updated = payload.states[0], payload.latest_state
+        ignored = _DEVICE_DETAILS_IGNORED_PORT_ATTRS
+        if (isinstance(original, dict) and isinstance(updated, dict) and
+                updated.get('revision_number') is not None and
+                {k: v for k, v in original.items() if k not in ignored} ==
+                {k: v for k, v in updated.items() if k not in ignored}):
+            # The status update done after the details are returned to the
+            # agent must not invalidate them.
+            self._restamp_port(updated)
+            return
+        self.invalidate_port(payload.resource_id)
+
+    @registry.receives(resources.PORT, [events.AFTER_DELETE])
+    def _handle_port_delete(self, resource, event, trigger, payload):
+        self.invalidate_port(payload.resource_id)
+
+    @registry.receives(resources.NETWORK,
+                       [events.AFTER_UPDATE, events.AFTER_DELETE])
+    def _handle_network_change(self, resource, event, trigger, payload):
+        self.invalidate_network(payload.resource_id)
+
 
 class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
 
@@ -68,6 +230,8 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
 
     def __init__(self, notifier, type_manager):
         self.setup_tunnel_callback_mixin(notifier, type_manager)
+        self.device_details_cache = DeviceDetailsCache(
+            cfg.CONF.ml2.device_details_cache_size)
         super(RpcCallbacks, self).__init__()
 
     def _get_new_status(self, host, port_context):
@@ -78,6 +242,15 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
             if port['status'] != new_status:
                 return new_status
 
+    @staticmethod
+    def _get_cached_new_status(host, entry):
+        if not host or host == entry.binding_host:
+            new_status = (n_const.PORT_STATUS_BUILD
+                          if entry.details['admin_state_up']
+                          else n_const.PORT_STATUS_DOWN)
+            if entry.status != new_status:
+                return new_status
+
     @staticmethod
     def _get_request_details(kwargs):
         return (kwargs.get('agent_id'),
@@ -205,10 +378,21 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
         devices_to_fetch = kwargs.pop('devices', [])
         plugin = directory.get_plugin()
         host = kwargs.get('host')
-        bound_contexts = plugin.get_bound_ports_contexts(rpc_context,
-                                                         devices_to_fetch,
-                                                         host)
+        cache = self.device_details_cache
+        cached_entries = {}
+        if cache.enabled and devices_to_fetch:
+            cached_entries = cache.get_entries(rpc_context, devices_to_fetch,
+                                               host)
+        devices_to_query = [device for device in devices_to_fetch
+                            if device not in cached_entries]
+        bound_contexts = {}
+        if devices_to_query or not cached_entries:
+            bound_contexts = plugin.get_bound_ports_contexts(
+                rpc_context, devices_to_query, host)
         for device in devices_to_fetch:
+            if device in cached_entries:
+                devices.append(dict(cached_entries[device].details))
+                continue
             if not bound_contexts.get(device):
                 # unbound bound
                 LOG.debug("Device %(device)s requested by agent "
@@ -218,18 +402,31 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
                 devices.append({'device': device})
                 continue
             try:
-                devices.append(self._get_device_details(
-                               rpc_context,
-                               agent_id=kwargs.get('agent_id'),
-                               host=host,
-                               device=device,
-                               port_context=bound_contexts[device]))
+                details = self._get_device_details(
+                    rpc_context,
+                    agent_id=kwargs.get('agent_id'),
+                    host=host,
+                    device=device,
+                    port_context=bound_contexts[device])
+                devices.append(details)
+                if cache.enabled:
+                    cache.store(device, host, bound_contexts[device],
+                                dict(details))
             except Exception:
                 LOG.exception("Failed to get details for device %s",
                               device)
                 failed_devices.append(device)
+        if cached_entries:
+            LOG.debug("Returning the cached details of %(cached)d of "
+                      "%(total)d devices requested by agent %(agent_id)s",
+                      {'cached': len(cached_entries),
+                       'total': len(devices_to_fetch),
+                       'agent_id': kwargs.get('agent_id')})
         new_status_map = {ctxt.current['id']: self._get_new_status(host, ctxt)
                           for ctxt in bound_contexts.values() if ctxt}
+        for entry in cached_entries.values():
+            new_status_map[entry.port_id] = self._get_cached_new_status(
+                host, entry)
         # filter out any without status changes
         new_status_map = {p: s for p, s in new_status_map.items() if s}
         try:
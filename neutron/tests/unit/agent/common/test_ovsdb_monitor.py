@@ -111,3 +111,105 @@ class TestSimpleInterfaceMonitor(base.BaseTestCase):
             self.monitor.process_events()
             self.assertIn(expected_dev,
                           self.monitor.new_events['modified'])
+
+
+class TestIdlInterfaceMonitor(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestIdlInterfaceMonitor, self).setUp()
+        self.idl = mock.Mock()
+        self.idl.is_connected.return_value = True
+        self.interfaces = {}
+        self.bridges = {}
+        self.idl.tables = {
+            'Interface': mock.Mock(rows=self.interfaces),
+            'Bridge': mock.Mock(rows=self.bridges)}
+
+    def _make_iface(self, name, ofport=None, external_ids=None):
+        iface = mock.Mock(ofport=[ofport] if ofport else [],
+                          external_ids=external_ids or {})
+        iface.name = name
+        return iface
+
+    def _make_bridge(self, name, ifaces):
+        bridge = mock.Mock(ports=[mock.Mock(interfaces=[iface])
+                                  for iface in ifaces])
+        bridge.name = name
+        self.bridges[name] = bridge
+
+    def test_start_reports_existing_interfaces(self):
+        self.interfaces['uuid1'] = self._make_iface('tap1', 5, {'a': 'b'})
+        monitor = ovsdb_monitor.IdlInterfaceMonitor(self.idl)
+        monitor.start(block=True)
+        self.idl.notify_handler.watch_event.assert_called_once_with(
+            monitor._row_event)
+        self.assertTrue(monitor.has_updates)
+        self.assertEqual(
+            {'added': [{'name': 'tap1', 'ofport': 5,
+                        'external_ids': {'a': 'b'}}],
+             'removed': [], 'modified': []},
+            monitor.get_events())
+        self.assertFalse(monitor.has_updates)
+
+    def test_record_events(self):
+        monitor = ovsdb_monitor.IdlInterfaceMonitor(self.idl)
+        monitor.start()
+        tap1 = self._make_iface('tap1')
+        monitor.record_event('create', ovsdb_monitor._get_interface_device(
+            tap1))
+        # the ofport set after the creation is reported with the added
+        # device
+        tap1.ofport = [7]
+        monitor.record_event('update', ovsdb_monitor._get_interface_device(
+            tap1))
+        tap2 = self._make_iface('tap2', 8)
+        monitor.record_event('update', ovsdb_monitor._get_interface_device(
+            tap2))
+        monitor.record_event('delete', ovsdb_monitor._get_interface_device(
+            self._make_iface('tap3', 9)))
+        self.assertEqual(
+            {'added': [{'name': 'tap1', 'ofport': 7, 'external_ids': {}}],
+             'modified': [{'name': 'tap2', 'ofport': 8, 'external_ids': {}}],
+             'removed': [{'name': 'tap3', 'ofport': 9, 'external_ids': {}}]},
+            monitor.get_events())
+
+    def test_events_ignored_when_stopped(self):
+        monitor = ovsdb_monitor.IdlInterfaceMonitor(self.idl)
+        monitor.start()
+        monitor.stop()
+        self.idl.notify_handler.unwatch_event.assert_called_once_with(
+            monitor._row_event)
+        self.assertFalse(monitor.is_active())
+        monitor.record_event('create', ovsdb_monitor._get_interface_device(
+            self._make_iface('tap1')))
+        self.assertFalse(monitor.has_updates)
+
+    def test_row_event_matches_relevant_updates(self):
+        row_event = ovsdb_monitor.IdlInterfaceMonitor(self.idl)._row_event
+        row = mock.Mock()
+        self.assertTrue(row_event.match_fn('create', row, None))
+        self.assertTrue(row_event.match_fn('update', row,
+                                           mock.Mock(spec=['ofport'])))
+        self.assertFalse(row_event.match_fn('update', row,
+                                            mock.Mock(spec=['statistics'])))
+
+    def test_filter_events_by_bridge(self):
+        tap1 = self._make_iface('tap1', 1)
+        tap2 = self._make_iface('tap2', 2)
+        self._make_bridge('br-int', [tap1])
+        self._make_bridge('br-other', [tap2])
+        monitor = ovsdb_monitor.IdlInterfaceMonitor(
+            self.idl, bridge_names=['br-int'])
+        monitor.start()
+        for tap in (tap1, tap2):
+            monitor.record_event(
+                'create', ovsdb_monitor._get_interface_device(tap))
+        self.assertEqual(['tap1'],
+                         [d['name'] for d in monitor.get_events()['added']])
+        # the removed interfaces are no longer in the bridges
+        self.bridges.clear()
+        for tap in (tap1, tap2):
+            monitor.record_event(
+                'delete', ovsdb_monitor._get_interface_device(tap))
+        self.assertEqual(['tap1'],
+                         [d['name'] for d in monitor.get_events()['removed']])
@@ -15,6 +15,7 @@
 from unittest import mock
 
 from neutron.agent.common import base_polling
+from neutron.agent.common import ovsdb_monitor
 from neutron.agent.common import polling
 from neutron.agent.ovsdb.native import helpers
 from neutron.tests import base
@@ -120,3 +121,11 @@ class TestInterfacePollingMinimizer(base.BaseTestCase):
     def test__is_polling_required_returns_when_updates_are_present(self):
         with self.mock_has_updates(True):
             self.assertTrue(self.pm._is_polling_required())
+
+    def test_monitor_with_native_ovsdb_connection(self):
+        ovs = mock.Mock()
+        pm = polling.InterfacePollingMinimizer(ovs=ovs,
+                                               bridge_names=['br-int'])
+        self.assertIsInstance(pm._monitor, ovsdb_monitor.IdlInterfaceMonitor)
+        self.assertEqual(ovs.ovsdb.idl_monitor, pm._monitor._idl)
+        self.assertEqual(['br-int'], pm._monitor._bridge_names)
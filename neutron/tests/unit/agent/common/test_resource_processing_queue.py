@@ -14,6 +14,7 @@
 #
 
 import datetime
+from unittest import mock
 
 from oslo_utils import uuidutils
 
@@ -110,3 +111,86 @@ class TestExclusiveResourceProcessor(base.BaseTestCase):
         self.assertFalse(update.hit_retry_limit())
         rpqueue.add(update)
         self.assertTrue(update.hit_retry_limit())
+
+
+class TestResourceProcessingQueue(base.BaseTestCase):
+
+    def test_each_update_to_next_resource_coalesces_updates(self):
+        rpqueue = queue.ResourceProcessingQueue()
+        id1, id2 = _uuid(), _uuid()
+        with mock.patch.object(queue.time, 'time', return_value=100.0):
+            updates = [queue.ResourceUpdate(id1, PRIORITY_RPC),
+                       queue.ResourceUpdate(id2, PRIORITY_RPC),
+                       queue.ResourceUpdate(id1, PRIORITY_RPC + 1)]
+        for update in updates:
+            rpqueue.add(update)
+
+        with mock.patch.object(queue.time, 'time', return_value=102.5):
+            processed = [update for rp, update
+                         in rpqueue.each_update_to_next_resource()]
+        self.assertEqual([updates[0], updates[2]], processed)
+        stats = rpqueue.get_stats()
+        self.assertEqual(1, stats['depth'])
+        self.assertEqual(1, stats['coalesced_updates'])
+        self.assertEqual(2.5, stats['wait_time_p99'])
+
+        processed = [update for rp, update
+                     in rpqueue.each_update_to_next_resource()]
+        self.assertEqual([updates[1]], processed)
+        self.assertEqual(0, rpqueue.get_stats()['depth'])
+        self.assertEqual({}, rpqueue._queued_ids)
+
+    def test_pop_queued_updates_holds_queue_mutex(self):
+        rpqueue = queue.ResourceProcessingQueue()
+        rpqueue._queue.mutex = mock.MagicMock()
+        id1, id2 = _uuid(), _uuid()
+        for update_id in (id1, id2, id1):
+            rpqueue.add(queue.ResourceUpdate(update_id, PRIORITY_RPC))
+        self.assertEqual(2, len(rpqueue._pop_queued_updates(id1)))
+        rpqueue._queue.mutex.__enter__.assert_called_once_with()
+        self.assertEqual([id2], [u.id for u in rpqueue._queue.queue])
+
+
+class TestResourceProcessingWorkers(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestResourceProcessingWorkers, self).setUp()
+        self.spawn_n = mock.patch.object(queue.eventlet, 'spawn_n').start()
+        self.process = mock.Mock()
+        self.workers = queue.ResourceProcessingWorkers(self.process, 2)
+
+    def test_resize_before_start(self):
+        self.workers.resize(4)
+        self.assertEqual(4, self.workers.size)
+        self.spawn_n.assert_not_called()
+        self.workers.start()
+        self.assertEqual(4, self.spawn_n.call_count)
+
+    def test_resize(self):
+        self.workers.start()
+        self.workers.resize(3)
+        self.assertEqual(3, self.spawn_n.call_count)
+        self.workers.resize(1)
+        self.assertEqual(3, self.spawn_n.call_count)
+
+    def test_run_exits_when_shrunk(self):
+        self.workers.start()
+
+        def process():
+            if self.process.call_count == 3:
+                self.workers.resize(1)
+        self.process.side_effect = process
+        self.workers._run()
+        self.assertEqual(3, self.process.call_count)
+        self.assertEqual(1, self.workers._running)
+
+    def test_run_survives_errors(self):
+        self.workers.start()
+
+        def process():
+            if self.process.call_count == 1:
+                raise ValueError()
+            self.workers.resize(1)
+        self.process.side_effect = process
+        self.workers._run()
+        self.assertEqual(2, self.process.call_count)
@@ -197,3 +197,47 @@ class TestDefaultRpHypervisors(base.BaseTestCase):
                 default_hypervisor='defaulthost',
             )
         )
+
+
+class TestPhaseTimings(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPhaseTimings, self).setUp()
+        self.timings = utils.PhaseTimings(window=10)
+
+    def test_get_summary(self):
+        for duration in range(1, 21):
+            self.timings.record('phase', duration / 100.0)
+        self.timings.record('other', 2)
+        summary = self.timings.get_summary()
+        # the percentiles are computed on the last 10 durations
+        self.assertEqual({'count': 20, 'max': 0.2, 'p50': 0.15,
+                          'p90': 0.19, 'p99': 0.2}, summary['phase'])
+        self.assertEqual({'count': 1, 'max': 2, 'p50': 2, 'p90': 2,
+                          'p99': 2}, summary['other'])
+
+    def test_get_percentile(self):
+        for duration in range(1, 21):
+            self.timings.record('phase', duration / 100.0)
+        self.timings.record('other', 2)
+        self.assertEqual({'phase': 0.19, 'other': 2},
+                         self.timings.get_percentile(90))
+
+    def test_get_report(self):
+        for duration in (0.005, 0.01, 0.3, 75):
+            self.timings.record('phase', duration)
+        report = self.timings.get_report()['phase']
+        self.assertEqual(18.829, report['mean'])
+        self.assertEqual(2, report['histogram']['<=0.01'])
+        self.assertEqual(1, report['histogram']['<=0.5'])
+        self.assertEqual(1, report['histogram']['>60'])
+        self.assertEqual(4, sum(report['histogram'].values()))
+        self.assertIn('phase', self.timings.get_report_model().to_text())
+
+    def test_measure(self):
+        with mock.patch.object(utils.time, 'monotonic',
+                               side_effect=[10, 12.5]):
+            with testlib_api.ExpectedException(ValueError):
+                with self.timings.measure('phase'):
+                    raise ValueError()
+        self.assertEqual(2.5, self.timings.get_summary()['phase']['max'])
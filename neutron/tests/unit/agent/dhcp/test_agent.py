@@ -330,6 +330,17 @@ class TestDhcpAgent(base.BaseTestCase):
                                             mock.ANY,
                                             mock.ANY)
 
+    def test_call_driver_bulk_reload_allocations(self):
+        network = mock.Mock()
+        network.id = '1'
+        cfg.CONF.set_override('bulk_reload_interval', 1)
+        dhcp = dhcp_agent.DhcpAgent(cfg.CONF)
+        self.assertFalse(dhcp._bulk_reload_event.is_set())
+        self.assertTrue(dhcp.call_driver('reload_allocations', network))
+        self.driver.assert_not_called()
+        self.assertEqual({'1': True}, dhcp._network_bulk_allocations)
+        self.assertTrue(dhcp._bulk_reload_event.is_set())
+
     def _test_call_driver_failure(self, exc=None,
                                   trace_level='exception', expected_sync=True):
         network = mock.Mock()
@@ -1360,6 +1371,65 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
                                                         prio=True)
         self.schedule_resync.assert_not_called()
 
+    def test_port_create_end_coalesces_reloads(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        self.cache.get_port_by_id.return_value = None
+        for port in (fake_port1, fake_port2):
+            payload = dict(port=copy.deepcopy(port))
+            self.dhcp.port_create_end(None, payload)
+        with mock.patch.object(
+                self.dhcp, 'update_isolated_metadata_proxy') as ump:
+            self.dhcp._process_resource_update()
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network)
+        ump.assert_called_once_with(fake_network)
+        self.assertEqual({fake_port1.id, fake_port2.id},
+                         self.dhcp.dhcp_prio_ready_ports)
+        self.assertEqual({}, self.dhcp._pending_reloads)
+        self.assertEqual(0, self.dhcp._queue.get_stats()['depth'])
+
+    def test_deferred_reload_waits_for_sync(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        pending = dhcp_agent.PendingNetworkReload()
+        pending.request(fake_port1.id)
+        self.dhcp._pending_reloads[fake_network.id] = pending
+        syncing = eventlet.event.Event()
+        sync_done = eventlet.event.Event()
+
+        def sync():
+            with dhcp_agent._SYNC_STATE_LOCK.write_lock():
+                syncing.send()
+                sync_done.wait()
+
+        sync_thread = eventlet.spawn(sync)
+        syncing.wait()
+        reload_thread = eventlet.spawn(self.dhcp._reload_pending_network,
+                                       fake_network.id)
+        eventlet.sleep(0.1)
+        self.call_driver.assert_not_called()
+        sync_done.send()
+        sync_thread.wait()
+        reload_thread.wait()
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network)
+        self.assertEqual({fake_port1.id}, self.dhcp.dhcp_ready_ports)
+
+    def test_port_create_end_marks_ready_after_reload(self):
+        self.cache.get_network_by_id.return_value = fake_network
+        self.cache.get_port_by_id.return_value = None
+
+        def check_not_ready(action, network):
+            self.assertEqual(set(), self.dhcp.dhcp_prio_ready_ports)
+            return True
+
+        self.call_driver.side_effect = check_not_ready
+        self.dhcp.port_create_end(None,
+                                  dict(port=copy.deepcopy(fake_port2)))
+        self.dhcp._process_resource_update()
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network)
+        self.assertEqual({fake_port2.id}, self.dhcp.dhcp_prio_ready_ports)
+
     def test_port_update_change_ip_on_port(self):
         payload = dict(port=fake_port1, priority=FAKE_PRIORITY)
         self.cache.get_network_by_id.return_value = fake_network
@@ -1291,6 +1291,7 @@ class TestDnsmasq(TestBase):
             ip_lib, 'get_devices_with_ip')
         self.mock_get_devices_with_ip = self._mock_get_devices_with_ip.start()
         self.addCleanup(self._stop_mocks)
+        self.addCleanup(dhcp.Dnsmasq._hosts_models.clear)
 
     def _stop_mocks(self):
         self._mock_get_devices_with_ip.stop()
@@ -2488,6 +2489,88 @@ class TestDnsmasq(TestBase):
         dnsmasq._release_lease.assert_called_once_with(
             mac2, ip2, constants.IP_VERSION_4, None, 'server_id', mac2)
 
+    def test_release_unused_leases_stale_leases(self):
+        dnsmasq = self._get_dnsmasq(FakeDualNetwork())
+        ip1 = '192.168.0.2'
+        mac1 = '00:00:80:aa:bb:cc'
+        ip2 = '192.168.0.3'
+        mac2 = '00:00:80:cc:bb:aa'
+        dnsmasq._read_hosts_file_leases = mock.Mock()
+        dnsmasq._read_leases_file_leases = mock.Mock(
+            side_effect=[{ip1: {'iaid': mac1,
+                                'client_id': None,
+                                'server_id': 'server_id'},
+                          ip2: {'iaid': mac2,
+                                'client_id': None,
+                                'server_id': 'server_id'}},
+                         {ip1: {'iaid': mac1,
+                                'client_id': None,
+                                'server_id': 'server_id'}}])
+        dnsmasq._release_lease = mock.Mock()
+
+        dnsmasq._release_unused_leases({(ip2, mac2, None)})
+
+        dnsmasq._read_hosts_file_leases.assert_not_called()
+        dnsmasq._release_lease.assert_called_once_with(
+            mac2, ip2, constants.IP_VERSION_4, None, 'server_id', mac2)
+
+    def test_release_unused_leases_no_stale_leases(self):
+        dnsmasq = self._get_dnsmasq(FakeDualNetwork())
+        dnsmasq._read_hosts_file_leases = mock.Mock()
+        dnsmasq._read_leases_file_leases = mock.Mock()
+
+        dnsmasq._release_unused_leases(set())
+
+        dnsmasq._read_hosts_file_leases.assert_not_called()
+        dnsmasq._read_leases_file_leases.assert_not_called()
+
+    def test__update_hosts_model(self):
+        network = FakeV4Network()
+        port1, port2 = FakePort1(), FakePort2()
+        port1.revision_number = port2.revision_number = 1
+        network.ports = [port1, port2]
+        with mock.patch.object(dhcp.Dnsmasq, '_render_host_entry',
+                               autospec=True,
+                               side_effect=dhcp.Dnsmasq._render_host_entry
+                               ) as render:
+            self.assertIsNone(self._get_dnsmasq(network)._update_hosts_model())
+            self.assertEqual(2, render.call_count)
+
+            # unchanged ports are not rendered again
+            network.ports = [port1]
+            self.assertEqual(
+                {('192.168.0.3', '00:00:f3:aa:bb:cc', None)},
+                self._get_dnsmasq(network)._update_hosts_model())
+            self.assertEqual(2, render.call_count)
+
+            port1.revision_number = 2
+            port1.fixed_ips = [
+                FakeIPAllocation('192.168.0.5',
+                                 'dddddddd-dddd-dddd-dddd-dddddddddddd')]
+            self.assertEqual(
+                {('192.168.0.2', '00:00:80:aa:bb:cc', None)},
+                self._get_dnsmasq(network)._update_hosts_model())
+            self.assertEqual(3, render.call_count)
+
+        model = dhcp.Dnsmasq._hosts_models[network.id]
+        self.assertEqual(
+            ['00:00:80:aa:bb:cc,host-192-168-0-5.openstacklocal,'
+             '192.168.0.5\n'],
+            list(model.get_hosts_lines()))
+
+    def test__update_hosts_model_render_key_changed(self):
+        network = FakeV4Network()
+        network.ports[0].revision_number = 1
+        with mock.patch.object(dhcp.Dnsmasq, '_render_host_entry',
+                               autospec=True,
+                               side_effect=dhcp.Dnsmasq._render_host_entry
+                               ) as render:
+            self._get_dnsmasq(network)._update_hosts_model()
+            self.conf.set_override('dns_domain', 'example.org')
+            self.assertEqual(
+                set(), self._get_dnsmasq(network)._update_hosts_model())
+            self.assertEqual(2, render.call_count)
+
     def test_release_unused_leases_one_lease_with_client_id(self):
         dnsmasq = self._get_dnsmasq(FakeDualNetwork())
 
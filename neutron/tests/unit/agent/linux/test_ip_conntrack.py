@@ -14,7 +14,10 @@
 
 from unittest import mock
 
+from oslo_config import cfg
+
 from neutron.agent.linux import ip_conntrack
+from neutron.privileged.agent.linux import netlink_lib
 from neutron.tests import base
 
 
@@ -41,6 +44,95 @@ class IPConntrackTestCase(base.BaseTestCase):
         self.assertEqual(1, len(self.execute.mock_calls))
 
 
+class IPConntrackNetlinkTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IPConntrackNetlinkTestCase, self).setUp()
+        cfg.CONF.set_override('conntrack_netlink_flush', True,
+                              group='SECURITYGROUP')
+        self.execute = mock.Mock()
+        self.mgr = ip_conntrack.IpConntrackManager(
+            lambda table: ['test --physdev-in tapdevice -j CT --zone 100'],
+            {}, {}, self.execute, zone_per_port=True)
+        self.list_entries = mock.patch.object(
+            netlink_lib, 'list_entries').start()
+        self.delete_entries = mock.patch.object(
+            netlink_lib, 'delete_entries').start()
+        self.dev_info = {'device': 'tapdevice',
+                         'fixed_ips': ['1.2.3.4', 'fd00::4']}
+        self.entries = [
+            (4, 'tcp', 10, 22, '10.0.0.1', '1.2.3.4', 100),
+            (4, 'udp', 10, 53, '10.0.0.2', '1.2.3.4', 100),
+            (4, 'icmp', 8, 0, '1.2.3.4', '10.0.0.1', 1, 100),
+            (6, 'tcp', 10, 22, 'fd00::1', 'fd00:0::4', 100),
+        ]
+        self.list_entries.return_value = self.entries
+
+    def test_use_netlink(self):
+        self.assertTrue(self.mgr.use_netlink)
+        mgr = ip_conntrack.IpConntrackManager(
+            lambda table: [], {}, {}, self.execute, namespace='ns')
+        self.assertFalse(mgr.use_netlink)
+
+    def test_process_queue_batches_updates(self):
+        self.mgr.delete_conntrack_state_by_rule(
+            [self.dev_info], {'ethertype': 'IPv4', 'direction': 'ingress',
+                              'protocol': 'tcp'})
+        self.mgr.delete_conntrack_state_by_rule(
+            [self.dev_info], {'ethertype': 'IPv6', 'direction': 'ingress',
+                              'protocol': '6'})
+        self.mgr._process_queue()
+        self.assertTrue(self.mgr._queue.empty())
+        self.list_entries.assert_called_once_with(100)
+        self.delete_entries.assert_called_once_with(
+            [self.entries[0], self.entries[3]])
+        self.execute.assert_not_called()
+
+    def test_process_queue_remote_ips(self):
+        self.mgr.delete_conntrack_state_by_remote_ips(
+            [self.dev_info], 'IPv4', ['10.0.0.1'])
+        self.mgr._process_queue()
+        self.list_entries.assert_called_once_with(100)
+        self.delete_entries.assert_called_once_with(
+            [self.entries[0], self.entries[2]])
+
+    def test_process_queue_any_protocol(self):
+        self.mgr.delete_conntrack_state_by_rule(
+            [self.dev_info], {'ethertype': 'IPv4', 'direction': 'ingress',
+                              'protocol': 0})
+        self.mgr._process_queue()
+        self.delete_entries.assert_called_once_with(self.entries[:2])
+
+    def test_process_queue_no_matching_entries(self):
+        self.mgr.delete_conntrack_state_by_rule(
+            [self.dev_info], {'ethertype': 'IPv4', 'direction': 'egress',
+                              'protocol': 'udp'})
+        self.mgr._process_queue()
+        self.list_entries.assert_called_once_with(100)
+        self.delete_entries.assert_not_called()
+
+    def test_process_queue_unsupported_update_uses_command(self):
+        self.mgr.delete_conntrack_state_by_rule(
+            [self.dev_info], {'ethertype': 'IPv4', 'direction': 'ingress',
+                              'protocol': 'sctp'})
+        self.mgr.delete_conntrack_state_by_remote_ips(
+            [self.dev_info], 'IPv4', ['10.0.0.1'], mark=1)
+        self.mgr._process_queue()
+        self.list_entries.assert_not_called()
+        self.assertEqual(3, len(self.execute.mock_calls))
+
+    def test_process_queue_netlink_failure_uses_command(self):
+        self.list_entries.side_effect = RuntimeError
+        self.mgr.delete_conntrack_state_by_rule(
+            [self.dev_info], {'ethertype': 'IPv4', 'direction': 'ingress'})
+        self.mgr._process_queue()
+        self.delete_entries.assert_not_called()
+        self.execute.assert_called_once_with(
+            ['conntrack', '-D', '-f', 'ipv4', '-d', '1.2.3.4', '-w', 100],
+            run_as_root=True, privsep_exec=True, check_exit_code=True,
+            extra_ok_codes=[1])
+
+
 class OvsIPConntrackTestCase(IPConntrackTestCase):
 
     def setUp(self):
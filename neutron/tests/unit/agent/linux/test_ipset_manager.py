@@ -162,3 +162,71 @@ class IpsetManagerTestCase(BaseIpsetManagerTest):
         self.expect_destroy()
         self.ipset.destroy(TEST_SET_ID, ETHERTYPE)
         self.verify_mock_calls()
+
+
+class IpsetManagerDeferApplyTestCase(BaseIpsetManagerTest):
+
+    def _expect_restore(self, lines, check_exit_code=True):
+        return mock.call(['ipset', 'restore', '-exist'],
+                         process_input='\n'.join(lines), run_as_root=True,
+                         check_exit_code=check_exit_code, privsep_exec=True)
+
+    def test_defer_apply_single_restore(self):
+        other_set_name = self.ipset.get_name('other_sgid', ETHERTYPE)
+        with self.ipset.defer_apply():
+            self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[0:1])
+            self.ipset.set_members('other_sgid', ETHERTYPE, FAKE_IPS[1:2])
+            self.execute.assert_not_called()
+        self.execute.assert_called_once_with(
+            ['ipset', 'restore', '-exist'], process_input=mock.ANY,
+            run_as_root=True, check_exit_code=True, privsep_exec=True)
+        self.assertEqual(
+            ['create %s hash:net family inet' % TEST_SET_NAME,
+             'create %s hash:net family inet' % TEST_SET_NAME_NEW,
+             'add %s 10.0.0.1/32' % TEST_SET_NAME_NEW,
+             'swap %s %s' % (TEST_SET_NAME_NEW, TEST_SET_NAME),
+             'destroy %s' % TEST_SET_NAME_NEW,
+             'create %s hash:net family inet' % other_set_name,
+             'create %s-n hash:net family inet' % other_set_name,
+             'add %s-n 10.0.0.2/32' % other_set_name,
+             'swap %s-n %s' % (other_set_name, other_set_name),
+             'destroy %s-n' % other_set_name],
+            self.execute.call_args[1]['process_input'].split('\n'))
+        self.assertTrue(self.ipset.set_name_exists(TEST_SET_NAME))
+        self.assertTrue(self.ipset.set_name_exists(other_set_name))
+
+    def test_defer_apply_add_and_del_members(self):
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[0:2])
+        self.execute.reset_mock()
+        with self.ipset.defer_apply():
+            self.ipset.set_members(TEST_SET_ID, ETHERTYPE,
+                                   FAKE_IPS[1:2] + FAKE_IPS[2:3])
+        self.assertEqual(
+            [self._expect_restore(['add %s 10.0.0.3/32' % TEST_SET_NAME,
+                                   'del %s 10.0.0.1/32' % TEST_SET_NAME])],
+            self.execute.mock_calls)
+
+    def test_defer_apply_no_ops(self):
+        with self.ipset.defer_apply():
+            pass
+        self.execute.assert_not_called()
+
+    def test_defer_apply_failure_forgets_sets(self):
+        self.execute.side_effect = RuntimeError
+        self.ipset.defer_apply_on()
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[0:1])
+        self.assertRaises(RuntimeError, self.ipset.defer_apply_off)
+        self.assertFalse(self.ipset.set_name_exists(TEST_SET_NAME))
+
+    def test_defer_apply_destroy_failure_destroys_one_by_one(self):
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[0:1])
+        self.execute.reset_mock()
+        self.execute.side_effect = [RuntimeError, None]
+        with self.ipset.defer_apply():
+            self.ipset.destroy(TEST_SET_ID, ETHERTYPE)
+        self.execute.assert_has_calls([
+            self._expect_restore(['destroy %s' % TEST_SET_NAME]),
+            mock.call(['ipset', 'destroy', TEST_SET_NAME],
+                      process_input=None, run_as_root=True,
+                      check_exit_code=False, privsep_exec=True)])
+        self.assertFalse(self.ipset.set_name_exists(TEST_SET_NAME))
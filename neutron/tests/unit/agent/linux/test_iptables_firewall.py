@@ -2333,6 +2333,37 @@ class IptablesFirewallEnhancedIpsetTestCase(BaseIptablesFirewallTestCase):
 
         self.firewall.ipset.assert_has_calls(calls, True)
 
+    def test_filter_defer_apply_batches_ipset_operations(self):
+        manager = mock.Mock()
+        manager.attach_mock(self.firewall.ipset, 'ipset')
+        manager.attach_mock(self.iptables_inst, 'iptables')
+        self.firewall.filter_defer_apply_on()
+        self.firewall.update_security_group_members(
+            'fake_sgid', {'IPv4': ['10.0.0.1']})
+        self.firewall.filter_defer_apply_off()
+        defer_calls = [c for c in manager.mock_calls
+                       if c[0].endswith(('defer_apply_on',
+                                         'defer_apply_off'))]
+        self.assertEqual([mock.call.iptables.defer_apply_on(),
+                          mock.call.ipset.defer_apply_on(),
+                          mock.call.ipset.defer_apply_off(),
+                          mock.call.iptables.defer_apply_off(),
+                          mock.call.ipset.defer_apply_on(),
+                          mock.call.ipset.defer_apply_off()],
+                         defer_calls)
+
+    def test_filter_defer_apply_off_ipset_restore_failure(self):
+        self.firewall.filter_defer_apply_on()
+        self.firewall.update_security_group_members(
+            'fake_sgid', {'IPv4': ['10.0.0.1']})
+        self.firewall.ipset.defer_apply_off.side_effect = RuntimeError
+        self.assertRaises(RuntimeError,
+                          self.firewall.filter_defer_apply_off)
+        self.iptables_inst.defer_apply_off.assert_called_once_with()
+        self.assertFalse(self.firewall._defer_apply)
+        self.assertIsNone(self.firewall._pre_defer_filtered_ports)
+        self.assertIsNone(self.firewall._pre_defer_unfiltered_ports)
+
     def test_sg_rule_expansion_with_remote_ips(self):
         other_ips = [('10.0.0.2', 'fa:16:3e:aa:bb:c1'),
                      ('10.0.0.3', 'fa:16:3e:aa:bb:c2'),
@@ -427,6 +427,58 @@ class IptablesManagerBaseTestCase(base.BaseTestCase):
         self._extend_with_ip6tables_filter_end(expected_calls, filter_dump)
 
 
+class IptablesTableTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IptablesTableTestCase, self).setUp()
+        self.table = iptables_manager.IptablesTable(binary_name='bn')
+        self.table.add_chain('foo')
+        self.table.add_chain('bar')
+        self.table.add_rule('foo', '-j DROP')
+        self.table.add_rule('bar', '-j $foo', tag='t')
+        self.table.add_rule('INPUT', '-j $bar', wrap=False)
+        self.table.clear_dirty_chains()
+
+    def test_rules(self):
+        self.assertEqual(
+            ['-A bn-foo -j DROP', '-A bn-bar -j bn-foo', '-A INPUT -j bn-bar'],
+            [str(rule) for rule in self.table.rules])
+
+    def test_add_and_remove_rule_marks_chain_dirty(self):
+        foo, input_chain = ('foo', True), ('INPUT', False)
+        self.table.add_rule('foo', '-j ACCEPT')
+        self.assertEqual({foo}, self.table.dirty_chains)
+        self.table.clear_dirty_chains()
+        self.table.remove_rule('INPUT', '-j $bar', wrap=False)
+        self.assertEqual({input_chain}, self.table.dirty_chains)
+
+    def test_remove_chain_marks_jumping_chains_dirty(self):
+        foo, bar = ('foo', True), ('bar', True)
+        self.table.remove_chain('foo')
+        self.assertEqual({foo, bar}, self.table.dirty_chains)
+        self.assertEqual(['-A INPUT -j bn-bar'],
+                         [str(rule) for rule in self.table.rules])
+
+    def test_empty_chain_and_clear_rules_by_tag(self):
+        foo, bar = ('foo', True), ('bar', True)
+        self.table.empty_chain('foo')
+        self.assertEqual({foo}, self.table.dirty_chains)
+        self.table.clear_rules_by_tag('t')
+        self.assertEqual({foo, bar}, self.table.dirty_chains)
+        self.assertEqual(['-A INPUT -j bn-bar'],
+                         [str(rule) for rule in self.table.rules])
+
+    def test_get_rendered_chain_rules_is_cached(self):
+        self.table.add_rule('foo', '-j ACCEPT', top=True)
+        expected = (['-A bn-foo -j ACCEPT'], ['-A bn-foo -j DROP'])
+        self.assertEqual(expected,
+                         self.table.get_rendered_chain_rules('foo', True))
+        self.assertEqual(expected,
+                         self.table.get_rendered_chain_rules('foo', True))
+        self.assertEqual(1, self.table.rendered_chains_count)
+        self.assertEqual(2, self.table.rendered_rules_count)
+
+
 class IptablesManagerStateFulTestCase(IptablesManagerBaseTestCase):
     use_ipv6 = False
 
@@ -1351,6 +1403,104 @@ class IptablesManagerStateFulTestCaseEmptyCustomBinaryNameIPv6(
     use_ipv6 = True
 
 
+class IptablesManagerIncrementalApplyTestCase(IptablesManagerBaseTestCase):
+
+    def setUp(self):
+        super(IptablesManagerIncrementalApplyTestCase, self).setUp()
+        cfg.CONF.set_override('iptables_incremental_apply', True, 'AGENT')
+        self.execute.return_value = ''
+        self.iptables = iptables_manager.IptablesManager()
+        # first apply always runs iptables-save
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+    def _called_binaries(self):
+        return [c[0][0][0] for c in self.execute.call_args_list]
+
+    def test_apply_wrapped_chain_changes_without_save(self):
+        self.iptables.ipv4['filter'].add_chain('filter')
+        self.iptables.ipv4['filter'].add_rule('filter', '-j DROP')
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j $filter')
+        commands = self.iptables.apply()
+        self.assertEqual(['iptables-restore'], self._called_binaries())
+        self.assertEqual(
+            ['# Generated by iptables_manager', '*filter',
+             ':%(bn)s-filter - [0:0]' % IPTABLES_ARG,
+             '-I %(bn)s-INPUT 1 -j %(bn)s-filter' % IPTABLES_ARG,
+             '-I %(bn)s-filter 1 -j DROP' % IPTABLES_ARG,
+             'COMMIT', '# Completed by iptables_manager'], commands)
+
+        self.execute.reset_mock()
+        self.iptables.ipv4['filter'].remove_chain('filter')
+        commands = self.iptables.apply()
+        self.assertEqual(['iptables-restore'], self._called_binaries())
+        self.assertEqual(
+            ['# Generated by iptables_manager', '*filter',
+             '-D %(bn)s-INPUT 1' % IPTABLES_ARG,
+             '-D %(bn)s-filter 1' % IPTABLES_ARG,
+             '-X %(bn)s-filter' % IPTABLES_ARG,
+             'COMMIT', '# Completed by iptables_manager'], commands)
+
+    def test_apply_no_changes(self):
+        self.assertEqual([], self.iptables.apply())
+        self.execute.assert_not_called()
+
+    def test_apply_regenerates_dirty_chains_only(self):
+        self.iptables.ipv4['filter'].add_chain('filter')
+        self.iptables.ipv4['filter'].add_rule('filter', '-j DROP')
+        self.iptables.apply()
+        self.assertEqual({'chains_regenerated': 1, 'rules_regenerated': 1},
+                         self.iptables.last_apply_stats)
+
+        self.execute.reset_mock()
+        self.iptables.ipv4['filter'].add_rule('filter', '-j ACCEPT',
+                                              top=True)
+        commands = self.iptables.apply()
+        self.assertEqual(
+            ['# Generated by iptables_manager', '*filter',
+             '-I %(bn)s-filter 1 -j ACCEPT' % IPTABLES_ARG,
+             'COMMIT', '# Completed by iptables_manager'], commands)
+        self.assertEqual({'chains_regenerated': 1, 'rules_regenerated': 2},
+                         self.iptables.last_apply_stats)
+        self.assertEqual(set(), self.iptables.ipv4['filter'].dirty_chains)
+
+    def test_apply_unwrapped_chain_changes_runs_save(self):
+        self.iptables.ipv4['filter'].add_rule('FORWARD', '-j DROP',
+                                              wrap=False)
+        self.iptables.apply()
+        self.assertEqual(['iptables-save', 'iptables-restore'],
+                         self._called_binaries())
+
+    def test_apply_verify_interval_runs_save(self):
+        cfg.CONF.set_override('iptables_verify_interval', 0, 'AGENT')
+        self.iptables.ipv4['filter'].add_chain('filter')
+        self.iptables.apply()
+        self.assertEqual(['iptables-save', 'iptables-restore'],
+                         self._called_binaries())
+
+    def test_apply_restore_failure_falls_back_to_save(self):
+        def restore_fails_once(*args, **kwargs):
+            if 'iptables-restore' in args[0]:
+                self.execute.side_effect = None
+                raise RuntimeError()
+            return ''
+        self.execute.side_effect = restore_fails_once
+        self.iptables.ipv4['filter'].add_chain('filter')
+        self.iptables.apply()
+        self.assertEqual(
+            ['iptables-restore', 'iptables-save', 'iptables-restore'],
+            self._called_binaries())
+        self.assertIn(':%(bn)s-filter - [0:0]' % IPTABLES_ARG,
+                      self.execute.call_args_list[2][1]['process_input'])
+
+    def test_apply_incremental_apply_disabled(self):
+        cfg.CONF.set_override('iptables_incremental_apply', False, 'AGENT')
+        self.iptables.ipv4['filter'].add_chain('filter')
+        self.iptables.apply()
+        self.assertEqual(['iptables-save', 'iptables-restore'],
+                         self._called_binaries())
+
+
 class IptablesManagerStateLessTestCase(base.BaseTestCase):
 
     def setUp(self):
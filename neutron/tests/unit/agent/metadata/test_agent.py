@@ -485,6 +485,80 @@ class TestMetadataProxyHandlerNewCache(TestMetadataProxyHandlerBase,
     fake_conf_fixture = NewCacheConfFixture(fake_conf)
 
 
+class TestMetadataProxyHandlerPortIndex(TestMetadataProxyHandlerBase):
+    def setUp(self):
+        super(TestMetadataProxyHandlerPortIndex, self).setUp()
+        self.fake_conf_fixture.config(metadata_port_index=True)
+        self.index_class = mock.patch.object(
+            agent.port_index, 'MetadataPortIndex').start()
+        self.index = self.index_class.return_value
+        self.handler.plugin_rpc.get_ports.return_value = [
+            {'device_id': 'rpc_device', 'tenant_id': 'rpc_tenant'}]
+        self.index_ports = [{'device_id': 'device', 'tenant_id': 'tenant'}]
+
+    def test_get_ports_network_id(self):
+        self.index.get_ports.return_value = self.index_ports
+        self.assertEqual(self.index_ports,
+                         self.handler._get_ports('1.2.3.4', network_id='net'))
+        self.index.get_ports.assert_called_once_with(
+            ('net',), ip_address='1.2.3.4', mac_address=None)
+        self.handler.plugin_rpc.get_ports.assert_not_called()
+
+    def test_get_ports_router_id(self):
+        self.index.get_router_networks.return_value = ('net1', 'net2')
+        self.index.get_ports.return_value = self.index_ports
+        self.assertEqual(self.index_ports,
+                         self.handler._get_ports('1.2.3.4', router_id='r1',
+                                                 remote_mac='mac'))
+        self.index.get_router_networks.assert_called_once_with('r1')
+        self.index.get_ports.assert_called_once_with(
+            ('net1', 'net2'), ip_address='1.2.3.4', mac_address='mac')
+        self.handler.plugin_rpc.get_ports.assert_not_called()
+
+    def test_get_ports_falls_back_to_rpc(self):
+        self.index.get_ports.return_value = []
+        self.assertEqual('rpc_device', self.handler._get_ports(
+            '1.2.3.4', network_id='net')[0]['device_id'])
+        self.index.get_ports.side_effect = RuntimeError
+        self.assertEqual('rpc_device', self.handler._get_ports(
+            '1.2.3.5', network_id='net')[0]['device_id'])
+        self.assertEqual(2, self.handler.plugin_rpc.get_ports.call_count)
+
+    def test_get_ports_skip_cache(self):
+        self.handler._get_ports('1.2.3.4', network_id='net', skip_cache=True)
+        self.index_class.assert_not_called()
+        self.handler.plugin_rpc.get_ports.assert_called_once_with(
+            mock.ANY, {'network_id': ('net',),
+                       'fixed_ips': {'ip_address': ['1.2.3.4']}})
+
+    def test_port_index_created_per_process(self):
+        with mock.patch.object(agent.os, 'getpid', return_value=1):
+            index = self.handler._get_port_index()
+            self.assertIs(index, self.handler._get_port_index())
+        with mock.patch.object(agent.os, 'getpid', return_value=2):
+            self.handler._get_port_index()
+        self.assertEqual(2, self.index_class.call_count)
+
+    def test_port_index_disabled(self):
+        self.fake_conf_fixture.config(metadata_port_index=False)
+        self.assertIsNone(self.handler._get_port_index())
+        self.index_class.assert_not_called()
+
+    def test_get_ports_logs_port_index_stats(self):
+        self.index.get_ports.return_value = self.index_ports
+        self.index.get_stats.return_value = {'hits': 1, 'misses': 0,
+                                             'ports': 1}
+        with mock.patch.object(agent.time, 'monotonic', return_value=1000):
+            self.handler._get_ports('1.2.3.4', network_id='net')
+            self.handler._get_ports('1.2.3.4', network_id='net')
+        self.assertEqual(1, self.index.get_stats.call_count)
+        with mock.patch.object(
+                agent.time, 'monotonic',
+                return_value=1000 + agent.PORT_INDEX_STATS_LOG_INTERVAL):
+            self.handler._get_ports('1.2.3.4', network_id='net')
+        self.assertEqual(2, self.index.get_stats.call_count)
+
+
 class TestUnixDomainMetadataProxy(base.BaseTestCase):
     def setUp(self):
         super(TestUnixDomainMetadataProxy, self).setUp()
@@ -0,0 +1,134 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+import netaddr
+from neutron_lib import constants
+from neutron_lib import context
+from oslo_config import cfg
+from oslo_utils import uuidutils
+
+from neutron.agent.metadata import port_index
+from neutron.agent import resource_cache
+from neutron.api.rpc.callbacks import events as events_rpc
+from neutron.api.rpc.handlers import resources_rpc
+from neutron.objects import ports
+from neutron.tests import base
+
+
+class MetadataPortIndexTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(MetadataPortIndexTestCase, self).setUp()
+        mock.patch.object(resource_cache.RemoteResourceCache,
+                          'start_watcher').start()
+        self.index = port_index.MetadataPortIndex()
+        self.puller = mock.patch.object(self.index.rcache, '_puller').start()
+        self.puller.bulk_pull.return_value = []
+        self.ctx = context.get_admin_context()
+        self.network_id = uuidutils.generate_uuid()
+
+    def _make_port(self, ip_address, mac_address='fa:16:3e:00:00:01',
+                   device_owner='compute:nova', device_id='vm',
+                   network_id=None, revision_number=1):
+        port_id = uuidutils.generate_uuid()
+        network_id = network_id or self.network_id
+        return ports.Port(
+            id=port_id, network_id=network_id, device_id=device_id,
+            device_owner=device_owner, project_id='project',
+            revision_number=revision_number,
+            mac_address=netaddr.EUI(mac_address),
+            fixed_ips=[ports.IPAllocation(
+                port_id=port_id, subnet_id=uuidutils.generate_uuid(),
+                network_id=network_id,
+                ip_address=netaddr.IPAddress(ip_address))])
+
+    def _record(self, port):
+        self.index.rcache.record_resource_update(self.ctx, 'Port', port)
+
+    def test_get_ports(self):
+        self._record(self._make_port('10.0.0.3'))
+        expected = [{'device_id': 'vm', 'tenant_id': 'project'}]
+        self.assertEqual(expected,
+                         self.index.get_ports([self.network_id], '10.0.0.3'))
+        self.assertEqual(
+            expected, self.index.get_ports([self.network_id], None,
+                                           mac_address='FA-16-3E-00-00-01'))
+        self.assertEqual([], self.index.get_ports([self.network_id],
+                                                  '10.0.0.4'))
+        self.assertEqual(
+            [], self.index.get_ports([uuidutils.generate_uuid()], '10.0.0.3'))
+        self.assertEqual({'hits': 2, 'misses': 2, 'ports': 1},
+                         self.index.get_stats())
+
+    def test_get_ports_pulls_network_once(self):
+        self.puller.bulk_pull.return_value = [self._make_port('10.0.0.3')]
+        for _ in range(2):
+            self.assertEqual(
+                1, len(self.index.get_ports([self.network_id], '10.0.0.3')))
+        self.puller.bulk_pull.assert_called_once_with(
+            mock.ANY, 'Port', filter_kwargs={'network_id': (self.network_id,)})
+
+    @mock.patch.object(resource_cache.n_rpc, 'Connection')
+    def test_scoped_push_subscribes_to_loaded_networks(
+            self, connection_class):
+        cfg.CONF.set_override('rpc_scoped_resource_push', True)
+        connection = connection_class.return_value
+        self.index.rcache._watcher = resource_cache.RemoteResourceWatcher(
+            self.index.rcache)
+        connection.create_consumer.reset_mock()
+        self.index.get_ports([self.network_id], '10.0.0.3')
+        self.index.get_ports([self.network_id], '10.0.0.4')
+        connection.create_consumer.assert_called_once_with(
+            resources_rpc.resource_type_scoped_topic(
+                'Port', resources_rpc.SCOPE_NETWORK, self.network_id),
+            mock.ANY, fanout=True)
+
+        # a port pushed on the network topic updates the index
+        self.index.rcache._watcher.resource_change_handler(
+            self.ctx, 'Port', [self._make_port('10.0.0.3')],
+            events_rpc.UPDATED)
+        self.assertEqual(
+            1, len(self.index.get_ports([self.network_id], '10.0.0.3')))
+
+    def test_port_update_and_delete(self):
+        port = self._make_port('10.0.0.3')
+        self._record(port)
+        updated = self._make_port('10.0.0.5', revision_number=2)
+        updated.id = port.id
+        updated.fixed_ips[0].port_id = port.id
+        self._record(updated)
+        self.assertEqual([], self.index.get_ports([self.network_id],
+                                                  '10.0.0.3'))
+        self.assertEqual(
+            1, len(self.index.get_ports([self.network_id], '10.0.0.5')))
+        self.index.rcache.record_resource_delete(self.ctx, 'Port', port.id)
+        self.assertEqual([], self.index.get_ports([self.network_id],
+                                                  '10.0.0.5'))
+        self.assertEqual(0, self.index.get_stats()['ports'])
+
+    def test_get_router_networks(self):
+        router_id = uuidutils.generate_uuid()
+        other_network_id = uuidutils.generate_uuid()
+        self._record(self._make_port(
+            '10.0.0.1', device_id=router_id,
+            device_owner=constants.DEVICE_OWNER_ROUTER_INTF))
+        self._record(self._make_port(
+            '10.0.1.1', device_id=router_id, network_id=other_network_id,
+            device_owner=constants.DEVICE_OWNER_DVR_INTERFACE))
+        self._record(self._make_port(
+            '172.24.4.1', device_id=router_id,
+            network_id=uuidutils.generate_uuid(),
+            device_owner=constants.DEVICE_OWNER_ROUTER_GW))
+        self.assertCountEqual([self.network_id, other_network_id],
+                              self.index.get_router_networks(router_id))
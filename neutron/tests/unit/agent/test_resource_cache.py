@@ -12,14 +12,21 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
 from unittest import mock
 
+import netaddr
 from neutron_lib.callbacks import events
 from neutron_lib.callbacks import registry
 from neutron_lib import context
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+from oslo_utils import uuidutils
 
 from neutron.agent import resource_cache
 from neutron.api.rpc.callbacks import events as events_rpc
+from neutron.api.rpc.handlers import resources_rpc
+from neutron.objects import ports
 from neutron.tests import base
 
 
@@ -100,6 +107,29 @@ class RemoteResourceCacheTestCase(base.BaseTestCase):
         self.assertEqual(
              5, self.rcache.get_resource_by_id('goose', 1).revision_number)
 
+    def test_fetch_missing_resources(self):
+        self.rcache.record_resource_update(self.ctx, 'goose', self.goose)
+        self.rcache.record_resource_delete(self.ctx, 'goose', 2)
+        self._pullmock.bulk_pull.side_effect = lambda ctx, rtype, **kw: [
+            OVOLikeThing(i) for i in kw['filter_kwargs']['id'] if i != 7]
+        pulls = self.rcache.fetch_missing_resources(
+            'goose', [1, 2, 3, 4, 5, 6, 7, 3], 2)
+        self.assertEqual(3, pulls)
+        self._pullmock.bulk_pull.assert_has_calls([
+            mock.call(mock.ANY, 'goose', filter_kwargs={'id': (3, 4)}),
+            mock.call(mock.ANY, 'goose', filter_kwargs={'id': (5, 6)}),
+            mock.call(mock.ANY, 'goose', filter_kwargs={'id': (7, )})])
+        self.assertEqual(3, self.rcache.get_memory_report()['goose'][
+            'server_pulls'])
+
+        # the objects returned and missing are not pulled again
+        self._pullmock.bulk_pull.reset_mock()
+        self.assertEqual(
+            0, self.rcache.fetch_missing_resources('goose', range(1, 8), 2))
+        self.assertEqual(6, self.rcache.get_resource_by_id('goose', 6).id)
+        self.assertIsNone(self.rcache.get_resource_by_id('goose', 7))
+        self._pullmock.bulk_pull.assert_not_called()
+
     def test_get_resources(self):
         geese = [OVOLikeThing(3, size='large'), OVOLikeThing(5, size='medium'),
                  OVOLikeThing(4, size='large'), OVOLikeThing(6, size='small')]
@@ -112,6 +142,52 @@ class RemoteResourceCacheTestCase(base.BaseTestCase):
         self.assertCountEqual([geese[3]],
                               self.rcache.get_resources('goose', is_small))
 
+    def test_get_resources_with_index(self):
+        self.rcache.add_index('goose', 'size')
+        self.rcache.add_index('goose', 'tags')
+        geese = [OVOLikeThing(3, size='large', tags=['a', 'b']),
+                 OVOLikeThing(5, size='medium', tags=['b']),
+                 OVOLikeThing(4, size='large', tags=[]),
+                 OVOLikeThing(6, size='small', tags=['a'])]
+        for goose in geese:
+            self.rcache.record_resource_update(self.ctx, 'goose', goose)
+        self.assertCountEqual(
+            [geese[0], geese[2]],
+            self.rcache.get_resources('goose', {'size': ('large', )}))
+        self.assertCountEqual(
+            [geese[0], geese[3]],
+            self.rcache.get_resources('goose', {'tags': ('a', )}))
+        self.assertCountEqual(
+            [geese[0]],
+            self.rcache.get_resources('goose', {'tags': ('a', ),
+                                                'size': ('large', )}))
+        # the index follows updates and deletes
+        self.rcache.record_resource_update(
+            self.ctx, 'goose',
+            OVOLikeThing(3, size='small', tags=['b'], revision_number=11))
+        self.rcache.record_resource_delete(self.ctx, 'goose', 6)
+        self.assertCountEqual(
+            [geese[2]],
+            self.rcache.get_resources('goose', {'size': ('large', )}))
+        self.assertEqual(
+            [], self.rcache.get_resources('goose', {'tags': ('a', )}))
+        self.assertEqual({'hits': 5, 'misses': 0},
+                         self.rcache.get_index_stats()['goose'])
+        self.rcache.get_resources('goose', {'id': (3, )})
+        self.assertEqual({'hits': 5, 'misses': 1},
+                         self.rcache.get_index_stats()['goose'])
+
+    def test_add_index_indexes_existing_resources(self):
+        geese = [OVOLikeThing(3, size='large'), OVOLikeThing(5, size='medium')]
+        for goose in geese:
+            self.rcache.record_resource_update(self.ctx, 'goose', goose)
+        self.rcache.add_index('goose', 'size')
+        self.assertEqual(
+            [geese[1]],
+            self.rcache.get_resources('goose', {'size': ('medium', )}))
+        self.assertEqual(1, self.rcache.get_index_stats()['goose']['hits'])
+        self.assertRaises(RuntimeError, self.rcache.add_index, 'swan', 'size')
+
     def test_match_resources_with_func(self):
         geese = [OVOLikeThing(3, size='large'), OVOLikeThing(5, size='medium'),
                  OVOLikeThing(4, size='xlarge'), OVOLikeThing(6, size='small')]
@@ -204,3 +280,439 @@ class RemoteResourceCacheTestCase(base.BaseTestCase):
         for goose in geese:
             self.assertIsNone(
                 self.rcache.get_resource_by_id('goose', goose.id))
+
+    @mock.patch.object(resource_cache.n_rpc, 'Connection')
+    def test_watcher_scoped_push_topics(self, connection_class):
+        cfg.CONF.set_override('rpc_scoped_resource_push', True)
+        cfg.CONF.set_override('host', 'host1')
+        connection = connection_class.return_value
+        rcache = resource_cache.RemoteResourceCache(['Port', 'Network'])
+        rcache.start_watcher()
+        connection.create_consumer.assert_has_calls([
+            mock.call(resources_rpc.resource_type_scoped_topic(
+                'Port', 'host', 'host1'), mock.ANY, fanout=True),
+            mock.call(resources_rpc.resource_type_versioned_topic('Port'),
+                      mock.ANY, fanout=True),
+            mock.call(resources_rpc.resource_type_versioned_topic('Network'),
+                      mock.ANY, fanout=True)])
+        connection.create_consumer.reset_mock()
+
+        def make_port(network_id, host):
+            port_id = uuidutils.generate_uuid()
+            return ports.Port(
+                id=port_id, network_id=network_id, revision_number=1,
+                bindings=[ports.PortBinding(port_id=port_id, host=host,
+                                            vif_type='ovs',
+                                            vnic_type='normal', profile={},
+                                            status='ACTIVE')])
+
+        network_id = uuidutils.generate_uuid()
+        rcache.record_resource_update(
+            self.ctx, 'Port', make_port(uuidutils.generate_uuid(), 'host2'))
+        connection.create_consumer.assert_not_called()
+        rcache.record_resource_update(self.ctx, 'Port',
+                                      make_port(network_id, 'host1'))
+        rcache.record_resource_update(self.ctx, 'Port',
+                                      make_port(network_id, 'host1'))
+        network_topic = resources_rpc.resource_type_scoped_topic(
+            'Port', 'network', network_id)
+        connection.create_consumer.assert_called_once_with(
+            network_topic, mock.ANY, fanout=True)
+        server = connection.servers.__getitem__.return_value
+        server.start.assert_called_once_with()
+
+        # a new watcher subscribes to the networks of the cached ports
+        connection.create_consumer.reset_mock()
+        with mock.patch.object(resource_cache.RemoteResourceWatcher,
+                               '_init_rpc_listeners'):
+            watch = resource_cache.RemoteResourceWatcher(rcache)
+        watch._connection = connection
+        watch._endpoints = []
+        watch.subscribe_to_local_network_topics()
+        connection.create_consumer.assert_called_once_with(
+            network_topic, [], fanout=True)
+
+        # the other scopes are subscribed to on demand, once
+        connection.create_consumer.reset_mock()
+        sg_id = uuidutils.generate_uuid()
+        rcache.subscribe_to_scopes('Port', 'security_group', [sg_id])
+        rcache.subscribe_to_scopes('Port', 'security_group', [sg_id])
+        rcache.subscribe_to_scopes('Network', 'security_group', [sg_id])
+        connection.create_consumer.assert_called_once_with(
+            resources_rpc.resource_type_scoped_topic(
+                'Port', 'security_group', sg_id), mock.ANY, fanout=True)
+
+    def _get_bounded_cache(self, referenced_ids=()):
+        rcache = resource_cache.RemoteResourceCache(
+            ['duck', 'goose'], indexes={'goose': ('size', )},
+            max_sizes={'goose': 10, 'swan': 5},
+            referenced_ids_func=lambda rtype: set(referenced_ids))
+        pullmock = mock.patch.object(rcache, '_puller').start()
+        for i in range(10):
+            rcache.record_resource_update(self.ctx, 'goose',
+                                          OVOLikeThing(i, size='large'))
+        return rcache, pullmock
+
+    def test_eviction_of_least_recently_used(self):
+        rcache, _pullmock = self._get_bounded_cache()
+        # goose 0 becomes the most recently used one
+        self.assertEqual(0, rcache.get_resource_by_id('goose', 0).id)
+        rcache.record_resource_update(self.ctx, 'goose',
+                                      OVOLikeThing(10, size='large'))
+        # shrunk to 90% of the maximum size
+        self.assertEqual([3, 4, 5, 6, 7, 8, 9, 0, 10],
+                         [g.id for g in rcache.match_resources_with_func(
+                             'goose', lambda g: True)])
+        self.assertEqual(2, rcache.get_memory_report()['goose']['evicted'])
+        self.assertEqual(
+            {3, 4, 5, 6, 7, 8, 9, 0, 10},
+            {g.id for g in rcache.get_resources('goose',
+                                                {'size': ('large', )})})
+        # the unbounded types are not affected
+        for i in range(20):
+            rcache.record_resource_update(self.ctx, 'duck', OVOLikeThing(i))
+        self.assertEqual(20, rcache.get_memory_report()['duck']['objects'])
+
+    def test_eviction_keeps_referenced_resources(self):
+        rcache, _pullmock = self._get_bounded_cache(referenced_ids=(0, 1, 2))
+        rcache.record_resource_update(self.ctx, 'goose', OVOLikeThing(10))
+        self.assertEqual(
+            {0, 1, 2, 5, 6, 7, 8, 9, 10},
+            {g.id for g in rcache.match_resources_with_func(
+                'goose', lambda g: True)})
+
+    def test_evicted_resources_are_fetched_again(self):
+        rcache, pullmock = self._get_bounded_cache()
+        pullmock.bulk_pull.return_value = []
+        rcache.get_resources('goose', {'size': ('large', )})
+        rcache.get_resources('goose', {'size': ('small', )})
+        rcache.record_resource_update(self.ctx, 'goose',
+                                      OVOLikeThing(10, size='large'))
+        # geese 0 and 1 were evicted, the query that returned them is
+        # forgotten while the query for the small geese is still satisfied
+        self.assertEqual({('goose', ('size', ('small', )))},
+                         rcache._satisfied_server_queries)
+        pullmock.bulk_pull.reset_mock()
+        pullmock.bulk_pull.return_value = [OVOLikeThing(0, size='large')]
+        self.assertEqual(0, rcache.get_resource_by_id('goose', 0).id)
+        pullmock.bulk_pull.assert_called_once_with(
+            mock.ANY, 'goose', filter_kwargs={'id': (0, )})
+        self.assertEqual(
+            {0, 2, 3, 4, 5, 6, 7, 8, 9, 10},
+            {g.id for g in rcache.get_resources('goose',
+                                                {'size': ('large', )})})
+
+    def test_eviction_skipped_until_referenced_resources_grow(self):
+        referenced_ids = set(range(20))
+        referenced_ids_func = mock.Mock(return_value=referenced_ids)
+        rcache = resource_cache.RemoteResourceCache(
+            ['goose'], max_sizes={'goose': 10},
+            referenced_ids_func=referenced_ids_func)
+        with mock.patch.object(resource_cache, 'LOG') as log:
+            for i in range(11):
+                rcache.record_resource_update(self.ctx, 'goose',
+                                              OVOLikeThing(i))
+            self.assertEqual(1, referenced_ids_func.call_count)
+            self.assertEqual(1, log.warning.call_count)
+            # skipped until the cache grows by 10% of its maximum size
+            rcache.record_resource_update(self.ctx, 'goose', OVOLikeThing(11))
+            self.assertEqual(1, referenced_ids_func.call_count)
+            rcache.record_resource_update(self.ctx, 'goose', OVOLikeThing(12))
+            self.assertEqual(2, referenced_ids_func.call_count)
+            # the warning is rate limited
+            self.assertEqual(1, log.warning.call_count)
+            with mock.patch.object(
+                    resource_cache.time, 'monotonic',
+                    return_value=(time.monotonic() +
+                                  resource_cache.OVERSIZE_WARNING_INTERVAL)):
+                rcache.record_resource_update(self.ctx, 'goose',
+                                              OVOLikeThing(13))
+                rcache.record_resource_update(self.ctx, 'goose',
+                                              OVOLikeThing(14))
+            self.assertEqual(2, log.warning.call_count)
+            # the unreferenced objects are evicted on the next pass
+            referenced_ids.clear()
+            for i in range(15, 17):
+                rcache.record_resource_update(self.ctx, 'goose',
+                                              OVOLikeThing(i))
+        self.assertEqual(9, rcache.get_memory_report()['goose']['objects'])
+        self.assertNotIn('goose', rcache._oversizes)
+
+    def test_evicted_resources_forget_matching_queries_only(self):
+        rcache, _pullmock = self._get_bounded_cache()
+        rcache._satisfied_server_queries.update(
+            rcache._get_query_ids('goose', {'size': ('large', 'small')}) |
+            rcache._get_query_ids('goose', {'id': (1, 5)}) |
+            rcache._get_query_ids('goose', {'id': (0, ),
+                                            'size': ('small', )}))
+        with mock.patch.object(rcache, '_match_filters',
+                               wraps=rcache._match_filters) as match:
+            rcache.record_resource_update(self.ctx, 'goose',
+                                          OVOLikeThing(10, size='large'))
+        # only the queries sharing the values of geese 0 and 1 are matched
+        self.assertEqual(3, match.call_count)
+        self.assertEqual(
+            {('goose', ('size', ('small', ))), ('goose', ('id', (5, ))),
+             ('goose', ('id', (0, )), ('size', ('small', )))},
+            rcache._satisfied_server_queries)
+
+    def test_deleted_ids_expire(self):
+        rcache = resource_cache.RemoteResourceCache(['goose'],
+                                                    deleted_ids_ttl=60)
+        with mock.patch.object(resource_cache.time, 'monotonic',
+                               return_value=1000):
+            rcache.record_resource_delete(self.ctx, 'goose', 3)
+        with mock.patch.object(resource_cache.time, 'monotonic',
+                               return_value=1030):
+            rcache.record_resource_delete(self.ctx, 'goose', 4)
+        self.assertEqual([3, 4], list(rcache._deleted_ids_by_type['goose']))
+        with mock.patch.object(resource_cache.time, 'monotonic',
+                               return_value=1070):
+            rcache.record_resource_delete(self.ctx, 'goose', 5)
+        self.assertEqual([4, 5], list(rcache._deleted_ids_by_type['goose']))
+        self.assertFalse(rcache._is_stale('goose', OVOLikeThing(3)))
+
+    def test_record_resource_delete_forgets_id_query(self):
+        self._pullmock.bulk_pull.return_value = [self.goose]
+        self.rcache.get_resource_by_id('goose', 1)
+        self.assertIn(('goose', ('id', (1, ))),
+                      self.rcache._satisfied_server_queries)
+        self.rcache.record_resource_delete(self.ctx, 'goose', 1)
+        self.assertNotIn(('goose', ('id', (1, ))),
+                         self.rcache._satisfied_server_queries)
+        self.assertIsNone(self.rcache.get_resource_by_id('goose', 1))
+        self.assertEqual(1, self._pullmock.bulk_pull.call_count)
+
+
+class FrozenResourceTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(FrozenResourceTestCase, self).setUp()
+        self.sg_ids = {uuidutils.generate_uuid(), uuidutils.generate_uuid()}
+        network_id = uuidutils.generate_uuid()
+        port_id = uuidutils.generate_uuid()
+        self.port = ports.Port(
+            id=port_id, network_id=network_id,
+            mac_address=netaddr.EUI('fa:16:3e:00:00:01'),
+            admin_state_up=True, status='ACTIVE', device_id='vm',
+            device_owner='compute:nova', project_id='project',
+            revision_number=3,
+            security_group_ids=self.sg_ids,
+            fixed_ips=[ports.IPAllocation(
+                port_id=port_id, subnet_id=uuidutils.generate_uuid(),
+                network_id=network_id,
+                ip_address=netaddr.IPAddress('10.0.0.1'))],
+            bindings=[ports.PortBinding(port_id=port_id, host='host1',
+                                        vif_type='ovs', vnic_type='normal',
+                                        profile={'key': 'value'},
+                                        status='ACTIVE')])
+        self.frozen = resource_cache.freeze_resource(self.port)
+
+    def test_thaw_resource(self):
+        thawed = resource_cache.thaw_resource(self.frozen)
+        self.assertIsInstance(thawed, ports.Port)
+        self.assertIsInstance(thawed.bindings[0], ports.PortBinding)
+        self.assertEqual(self.sg_ids, thawed.security_group_ids)
+        self.assertFalse(thawed.obj_what_changed())
+        self.assertEqual(self.frozen, resource_cache.freeze_resource(thawed))
+        self.assertEqual('value', resource_cache.thaw_resource('value'))
+
+    def test_fields(self):
+        self.assertEqual('Port', self.frozen.obj_name())
+        self.assertEqual(self.port.id, self.frozen.id)
+        self.assertEqual(self.port.id, self.frozen['id'])
+        self.assertEqual('project', self.frozen.tenant_id)
+        self.assertEqual(frozenset(self.sg_ids),
+                         self.frozen.security_group_ids)
+        self.assertEqual('10.0.0.1',
+                         str(self.frozen.fixed_ips[0].ip_address))
+        self.assertEqual('host1', self.frozen.bindings[0]['host'])
+        self.assertEqual({'key': 'value'},
+                         self.frozen.get('bindings')[0].profile)
+        self.assertIsNone(self.frozen.security)
+        self.assertFalse(self.frozen.obj_attr_is_set('security'))
+        self.assertEqual('default', self.frozen.get('security', 'default'))
+        self.assertRaises(AttributeError, getattr, self.frozen, 'unknown')
+
+    def test_read_only(self):
+        self.assertRaises(AttributeError, setattr, self.frozen, 'status',
+                          'DOWN')
+        self.assertRaises(AttributeError, setattr, self.frozen, 'other', 1)
+        self.assertRaises(AttributeError, delattr, self.frozen, 'status')
+
+    def test_no_instance_dict(self):
+        self.assertFalse(hasattr(self.frozen, '__dict__'))
+        self.assertFalse(hasattr(self.frozen.bindings[0], '__dict__'))
+
+    def test_to_dict(self):
+        port_dict = self.port.to_dict()
+        frozen_dict = self.frozen.to_dict()
+        self.assertEqual(set(port_dict['security_group_ids']),
+                         set(frozen_dict.pop('security_group_ids')))
+        del port_dict['security_group_ids']
+        self.assertEqual(port_dict, frozen_dict)
+
+    def test_equality(self):
+        self.assertEqual(self.frozen, resource_cache.freeze_resource(
+            self.port))
+        self.assertEqual(self.frozen, self.port)
+        self.assertNotEqual(self.frozen, resource_cache.freeze_resource(
+            ports.Port(id=self.port.id)))
+
+    def test_freeze_is_idempotent(self):
+        self.assertIs(self.frozen,
+                      resource_cache.freeze_resource(self.frozen))
+        thing = OVOLikeThing(1)
+        self.assertIs(thing, resource_cache.freeze_resource(thing))
+
+    def test_cache_stores_frozen_resources(self):
+        rcache = resource_cache.RemoteResourceCache(
+            ['Port'], indexes={'Port': ['security_group_ids']})
+        mock.patch.object(rcache, '_puller').start()
+        rcache.record_resource_update(context.get_admin_context(), 'Port',
+                                      self.port)
+        cached = rcache.get_resource_by_id('Port', self.port.id)
+        self.assertIsInstance(cached, resource_cache.FrozenResource)
+        sg_id = sorted(self.sg_ids)[0]
+        self.assertEqual(
+            [cached],
+            rcache.get_resources('Port', {'security_group_ids': (sg_id, )}))
+        self.assertEqual(
+            [cached],
+            rcache.match_resources_with_func(
+                'Port', lambda p: sg_id in p.security_group_ids))
+
+    def test_get_memory_report(self):
+        rcache = resource_cache.RemoteResourceCache(['Port', 'Network'])
+        rcache.record_resource_update(context.get_admin_context(), 'Port',
+                                      self.port)
+        rcache.record_resource_delete(context.get_admin_context(), 'Port',
+                                      'deleted')
+        report = rcache.get_memory_report()
+        self.assertEqual(1, report['Port']['objects'])
+        self.assertGreater(report['Port']['bytes'], 0)
+        self.assertEqual(1, report['Port']['deleted_ids'])
+        self.assertEqual({'objects': 0, 'bytes': 0, 'deleted_ids': 0,
+                          'evicted': 0, 'server_pulls': 0},
+                         report['Network'])
+        self.assertEqual(0, report['satisfied_server_queries'])
+        self.assertIn('Port', rcache.get_memory_report_model().to_text())
+
+
+class RemoteResourceCacheSnapshotTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(RemoteResourceCacheSnapshotTestCase, self).setUp()
+        self.ctx = context.get_admin_context()
+        self.path = self.get_temp_file_path('resource_cache.json')
+        self.network_id = uuidutils.generate_uuid()
+        self.ports = [self._make_port() for _ in range(3)]
+        self.rcache = self._create_cache()
+        self.rcache._puller.bulk_pull.return_value = self.ports
+        self.rcache.get_resources('Port', {'network_id': (self.network_id, )})
+        self.rcache.save_snapshot(self.path)
+
+    def _make_port(self, port_id=None, revision_number=1):
+        return ports.Port(
+            id=port_id or uuidutils.generate_uuid(),
+            network_id=self.network_id,
+            mac_address=netaddr.EUI('fa:16:3e:00:00:01'),
+            admin_state_up=True, status='ACTIVE', device_id='vm',
+            device_owner='compute:nova', revision_number=revision_number,
+            security_group_ids={uuidutils.generate_uuid()}, fixed_ips=[],
+            bindings=[])
+
+    def _create_cache(self):
+        rcache = resource_cache.RemoteResourceCache(
+            ['Port', 'Network'], indexes={'Port': ('network_id', )})
+        mock.patch.object(rcache, '_puller').start()
+        return rcache
+
+    def _mock_server(self, rcache, server_ports):
+        def get_ports(filters):
+            return [p for p in server_ports
+                    if all(getattr(p, k) in v for k, v in filters.items())]
+
+        rcache._puller.bulk_pull.side_effect = (
+            lambda ctx, rtype, filter_kwargs: get_ports(filter_kwargs))
+        rcache._puller.bulk_pull_revisions.side_effect = (
+            lambda ctx, rtype, filter_kwargs: {
+                p.id: p.revision_number for p in get_ports(filter_kwargs)})
+
+    def test_load_snapshot_reconciles_with_server(self):
+        unchanged, updated, deleted = self.ports
+        created = self._make_port()
+        rcache = self._create_cache()
+        self._mock_server(rcache, [
+            unchanged, self._make_port(updated.id, revision_number=2),
+            created])
+        deleted_ids = []
+        registry.subscribe(
+            lambda r, e, t, payload: deleted_ids.append(payload.resource_id),
+            'Port', events.AFTER_DELETE)
+
+        self.assertTrue(rcache.load_snapshot(self.path, 100))
+        self.assertEqual(2, rcache._puller.bulk_pull_revisions.call_count)
+        rcache._puller.bulk_pull.assert_called_once_with(
+            mock.ANY, 'Port', filter_kwargs={'id': mock.ANY})
+        self.assertCountEqual(
+            (updated.id, created.id),
+            rcache._puller.bulk_pull.call_args[1]['filter_kwargs']['id'])
+        self.assertEqual([deleted.id], deleted_ids)
+        self.assertEqual(
+            1, rcache.get_resource_by_id('Port', unchanged.id).revision_number)
+        self.assertEqual(
+            2, rcache.get_resource_by_id('Port', updated.id).revision_number)
+        self.assertIsNone(rcache.get_resource_by_id('Port', deleted.id))
+        # the restored query is not sent to the server again
+        self.assertCountEqual(
+            [unchanged.id, updated.id, created.id],
+            [p.id for p in rcache.get_resources(
+                'Port', {'network_id': (self.network_id, )})])
+        self.assertEqual(1, rcache._puller.bulk_pull.call_count)
+
+    def test_load_snapshot_revision_chunks(self):
+        rcache = self._create_cache()
+        self._mock_server(rcache, self.ports)
+        self.assertTrue(rcache.load_snapshot(self.path, 2))
+        # two chunks of port IDs and the network_id query
+        self.assertEqual(3, rcache._puller.bulk_pull_revisions.call_count)
+        rcache._puller.bulk_pull.assert_not_called()
+        self.assertEqual(3, rcache.get_memory_report()['Port']['objects'])
+
+    def test_load_snapshot_keeps_newer_objects(self):
+        rcache = self._create_cache()
+        newer = self._make_port(self.ports[0].id, revision_number=5)
+        rcache.record_resource_update(self.ctx, 'Port', newer)
+        self._mock_server(rcache, [newer] + self.ports[1:])
+        self.assertTrue(rcache.load_snapshot(self.path, 100))
+        self.assertEqual(5, rcache.get_resource_by_id(
+            'Port', newer.id).revision_number)
+        rcache._puller.bulk_pull.assert_not_called()
+
+    def test_load_snapshot_missing_file(self):
+        rcache = self._create_cache()
+        self.assertFalse(rcache.load_snapshot(
+            self.get_temp_file_path('missing.json'), 100))
+        rcache._puller.bulk_pull_revisions.assert_not_called()
+
+    def test_load_snapshot_other_object_version(self):
+        with open(self.path) as snapshot_file:
+            snapshot = jsonutils.loads(snapshot_file.read())
+        snapshot['versions']['Port'] = '0.1'
+        with open(self.path, 'w') as snapshot_file:
+            snapshot_file.write(jsonutils.dumps(snapshot))
+        rcache = self._create_cache()
+        self.assertTrue(rcache.load_snapshot(self.path, 100))
+        rcache._puller.bulk_pull_revisions.assert_not_called()
+        self.assertEqual(0, rcache.get_memory_report()['Port']['objects'])
+        self.assertEqual(
+            0, rcache.get_memory_report()['satisfied_server_queries'])
+
+    def test_load_snapshot_reconcile_failure(self):
+        rcache = self._create_cache()
+        rcache._puller.bulk_pull_revisions.side_effect = RuntimeError
+        self.assertFalse(rcache.load_snapshot(self.path, 100))
+        report = rcache.get_memory_report()
+        self.assertEqual(0, report['Port']['objects'])
+        self.assertEqual(0, report['satisfied_server_queries'])
+        self.assertEqual(
+            [], rcache.get_resources('Port', {'network_id': ('other', )}))
@@ -21,15 +21,19 @@ from neutron_lib.agent import topics as lib_topics
 from neutron_lib.callbacks import events
 from neutron_lib.callbacks import resources
 from neutron_lib import constants
+from neutron_lib import context
 from neutron_lib import rpc as n_rpc
 from oslo_config import cfg
 from oslo_context import context as oslo_context
 from oslo_serialization import jsonutils
 from oslo_utils import uuidutils
 
+from neutron.agent import resource_cache
 from neutron.agent import rpc
+from neutron.api.rpc.callbacks import resources as rpc_resources
 from neutron.objects import network
 from neutron.objects import ports
+from neutron.objects import securitygroup
 from neutron.tests import base
 
 
@@ -368,15 +372,72 @@ class TestCacheBackedPluginApi(base.BaseTestCase):
                 self.assertTrue(entry[constants.NO_ACTIVE_BINDING])
                 self.assertNotIn('migrating_to', entry)
 
+    def test_get_devices_details_list_and_failed_devices_pulls_in_chunks(
+            self):
+        cfg.CONF.set_override('resource_cache_pull_chunk_size', 2,
+                              group='AGENT')
+        rcache = resource_cache.RemoteResourceCache(
+            rpc.CacheBackedPluginApi.RESOURCE_TYPES)
+        self._api.remote_resource_cache = rcache
+        port_ids = [uuidutils.generate_uuid() for _ in range(3)]
+        pulled = {
+            rpc_resources.PORT: {
+                port_id: ports.Port(
+                    id=port_id, network_id=self._network_id,
+                    bindings=self._port.bindings,
+                    binding_levels=self._port.binding_levels)
+                for port_id in port_ids},
+            rpc_resources.NETWORK: {self._network_id: self._network}}
+
+        def bulk_pull(context, rtype, filter_kwargs):
+            return [pulled[rtype][obj_id] for obj_id in filter_kwargs['id']
+                    if obj_id in pulled[rtype]]
+
+        missing_id = uuidutils.generate_uuid()
+        with mock.patch.object(rcache, '_puller') as puller, \
+                mock.patch.object(self._api, 'get_device_details',
+                                  return_value={}) as get_details:
+            puller.bulk_pull.side_effect = bulk_pull
+            result = self._api.get_devices_details_list_and_failed_devices(
+                mock.ANY, port_ids + [missing_id], mock.ANY, 'host1')
+        puller.bulk_pull.assert_has_calls([
+            mock.call(mock.ANY, rpc_resources.PORT,
+                      filter_kwargs={'id': tuple(port_ids[:2])}),
+            mock.call(mock.ANY, rpc_resources.PORT,
+                      filter_kwargs={'id': (port_ids[2], missing_id)}),
+            mock.call(mock.ANY, rpc_resources.NETWORK,
+                      filter_kwargs={'id': (self._network_id, )})])
+        self.assertEqual(3, puller.bulk_pull.call_count)
+        self.assertEqual(4, get_details.call_count)
+        self.assertEqual([], result['failed_devices'])
+        for port_id in port_ids:
+            self.assertEqual(port_id, rcache.get_resource_by_id(
+                rpc_resources.PORT, port_id).id)
+        self.assertIsNone(
+            rcache.get_resource_by_id(rpc_resources.PORT, missing_id))
+        self.assertEqual(3, puller.bulk_pull.call_count)
+
+    def test_get_devices_details_list_and_failed_devices_fetch_error(self):
+        rcache = self._api.remote_resource_cache
+        rcache.fetch_missing_resources.side_effect = RuntimeError
+        rcache.get_resource_by_id.side_effect = [self._port, self._network]
+        result = self._api.get_devices_details_list_and_failed_devices(
+            mock.ANY, [self._port_id], mock.ANY, 'host1')
+        self.assertEqual([], result['failed_devices'])
+        self.assertEqual(self._port_id, result['devices'][0]['port_id'])
+
     @mock.patch('neutron.agent.resource_cache.RemoteResourceCache')
     def test_initialization_with_default_resources(self, rcache_class):
         rcache_obj = mock.MagicMock()
         rcache_class.return_value = rcache_obj
 
-        rpc.CacheBackedPluginApi(lib_topics.PLUGIN)
+        api = rpc.CacheBackedPluginApi(lib_topics.PLUGIN)
 
         rcache_class.assert_called_once_with(
-            rpc.CacheBackedPluginApi.RESOURCE_TYPES)
+            rpc.CacheBackedPluginApi.RESOURCE_TYPES,
+            indexes=rpc.CacheBackedPluginApi.RESOURCE_INDEXES,
+            max_sizes={}, deleted_ids_ttl=3600,
+            referenced_ids_func=api._get_referenced_resource_ids)
         rcache_obj.start_watcher.assert_called_once_with()
 
     @mock.patch('neutron.agent.resource_cache.RemoteResourceCache')
@@ -388,8 +449,60 @@ class TestCacheBackedPluginApi(base.BaseTestCase):
         class CustomCacheBackedPluginApi(rpc.CacheBackedPluginApi):
             RESOURCE_TYPES = [resources.PORT, CUSTOM]
 
-        CustomCacheBackedPluginApi(lib_topics.PLUGIN)
+        api = CustomCacheBackedPluginApi(lib_topics.PLUGIN)
 
         rcache_class.assert_called_once_with(
-            CustomCacheBackedPluginApi.RESOURCE_TYPES)
+            CustomCacheBackedPluginApi.RESOURCE_TYPES,
+            indexes={}, max_sizes={}, deleted_ids_ttl=3600,
+            referenced_ids_func=api._get_referenced_resource_ids)
         rcache_obj.start_watcher.assert_called_once_with()
+
+    @mock.patch.object(rpc.loopingcall, 'FixedIntervalLoopingCall')
+    @mock.patch('neutron.agent.resource_cache.RemoteResourceCache')
+    def test_initialization_with_cache_snapshots(self, rcache_class,
+                                                 loop_class):
+        cfg.CONF.set_override('resource_cache_snapshot_file', '/cache.json',
+                              group='AGENT')
+        rcache_obj = rcache_class.return_value
+
+        api = rpc.CacheBackedPluginApi(lib_topics.PLUGIN)
+
+        rcache_obj.load_snapshot.assert_called_once_with('/cache.json', 100)
+        loop_class.assert_called_once_with(api._save_cache_snapshot,
+                                           '/cache.json')
+        loop_class.return_value.start.assert_called_once_with(
+            interval=300, initial_delay=300)
+        rcache_obj.save_snapshot.side_effect = IOError
+        api._save_cache_snapshot('/cache.json')
+        rcache_obj.save_snapshot.assert_called_once_with('/cache.json')
+
+    def test__get_referenced_resource_ids(self):
+        cfg.CONF.set_override('host', 'host1')
+        rcache = resource_cache.RemoteResourceCache(
+            rpc.CacheBackedPluginApi.RESOURCE_TYPES)
+        self._api.remote_resource_cache = rcache
+        ctx = context.get_admin_context()
+        sg_id = list(self._port.security_group_ids)[0]
+        remote_port_id = uuidutils.generate_uuid()
+        remote_port = ports.Port(
+            id=remote_port_id, network_id=uuidutils.generate_uuid(),
+            security_group_ids=set([uuidutils.generate_uuid()]),
+            fixed_ips=[], bindings=[ports.PortBinding(
+                port_id=remote_port_id, host='host2', profile={},
+                vif_type='vif_type', vnic_type='vnic_type')])
+        rule = securitygroup.SecurityGroupRule(
+            id=uuidutils.generate_uuid(), security_group_id=sg_id,
+            remote_address_group_id=uuidutils.generate_uuid())
+        for rtype, resource in ((rpc_resources.PORT, self._port),
+                                (rpc_resources.PORT, remote_port),
+                                (rpc_resources.SECURITYGROUPRULE, rule)):
+            rcache.record_resource_update(ctx, rtype, resource)
+
+        get_ids = self._api._get_referenced_resource_ids
+        self.assertEqual({self._port_id}, get_ids(rpc_resources.PORT))
+        self.assertEqual({self._network_id}, get_ids(rpc_resources.NETWORK))
+        self.assertEqual({sg_id}, get_ids(rpc_resources.SECURITYGROUP))
+        self.assertEqual({rule.id}, get_ids(rpc_resources.SECURITYGROUPRULE))
+        self.assertEqual({rule.remote_address_group_id},
+                         get_ids(rpc_resources.ADDRESSGROUP))
+        self.assertEqual(set(), get_ids(rpc_resources.SUBNET))
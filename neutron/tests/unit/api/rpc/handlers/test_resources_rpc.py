@@ -18,6 +18,7 @@ from unittest import mock
 from neutron_lib.agent import topics
 from neutron_lib import context
 from neutron_lib.objects import common_types
+from oslo_config import cfg
 from oslo_utils import uuidutils
 from oslo_versionedobjects import fields as obj_fields
 import testtools
@@ -26,6 +27,7 @@ from neutron.api.rpc.callbacks import resources
 from neutron.api.rpc.callbacks import version_manager
 from neutron.api.rpc.handlers import resources_rpc
 from neutron.objects import base as objects_base
+from neutron.objects import ports
 from neutron.tests import base
 from neutron.tests.unit.objects import test_base as objects_test_base
 
@@ -169,6 +171,18 @@ class ResourcesPullRpcApiTestCase(ResourcesRpcBaseTestCase):
             version=TEST_VERSION, filter_kwargs=filter_kwargs)
         self.assertEqual(expected_objs, result)
 
+    def test_bulk_pull_revisions(self):
+        self.cctxt_mock.call.return_value = {'id1': 1, 'id2': 3}
+        filter_kwargs = {'id': ('id1', 'id2')}
+        result = self.rpc.bulk_pull_revisions(
+            self.context, FakeResource.obj_name(),
+            filter_kwargs=filter_kwargs)
+        self.rpc.client.prepare.assert_called_once_with(version='1.2')
+        self.cctxt_mock.call.assert_called_once_with(
+            self.context, 'bulk_pull_revisions', resource_type='FakeResource',
+            filter_kwargs=filter_kwargs)
+        self.assertEqual({'id1': 1, 'id2': 3}, result)
+
     def test_pull_resource_not_found(self):
         resource_dict = _create_test_dict()
         resource_id = resource_dict['id']
@@ -239,6 +253,19 @@ class ResourcesPullRpcCallbackTestCase(ResourcesRpcBaseTestCase):
                 version=TEST_VERSION, filter_kwargs={'id': r1.id})
             self.assertEqual([r1.obj_to_primitive()], objs)
 
+    def test_bulk_pull_revisions(self):
+        resource_objs = [mock.Mock(id='id1', revision_number=1),
+                         mock.Mock(id='id2', revision_number=3)]
+        with mock.patch.object(FakeResource, 'get_objects',
+                               return_value=resource_objs) as get_objs:
+            revisions = self.callbacks.bulk_pull_revisions(
+                self.context, resource_type=FakeResource.obj_name(),
+                filter_kwargs={'id': ('id1', 'id2')})
+        get_objs.assert_called_once_with(
+            self.context, _pager=None, fields=['id', 'revision_number'],
+            id=('id1', 'id2'))
+        self.assertEqual({'id1': 1, 'id2': 3}, revisions)
+
     @mock.patch.object(FakeResource, 'obj_to_primitive')
     def test_pull_backports_to_older_version(self, to_prim_mock):
         with mock.patch.object(resources_rpc.prod_registry, 'pull',
@@ -301,6 +328,91 @@ class ResourcesPushRpcApiTestCase(ResourcesRpcBaseTestCase):
                            for resource in self.resource_objs2],
             event_type=TEST_EVENT)
 
+    def test_push_scoped(self):
+        cfg.CONF.set_override('rpc_scoped_resource_push', True)
+        scopes = {self.resource_objs[0].id: [('network', 'net1'),
+                                             ('host', 'host1')],
+                  self.resource_objs[1].id: [('network', 'net1')]}
+        with mock.patch.object(resources_rpc, 'SCOPED_PUSH_RESOURCE_TYPES',
+                               ('FakeResource', )), \
+                mock.patch.object(resources_rpc, 'get_push_scopes',
+                                  side_effect=lambda r: scopes[r.id]):
+            self.rpc.push(self.context, self.resource_objs, TEST_EVENT)
+
+        topic = resources_rpc.resource_type_versioned_topic(
+            'FakeResource', TEST_VERSION)
+        self.rpc.client.prepare.assert_has_calls([
+            mock.call(fanout=True, topic=topic + '.network.net1',
+                      version='1.1'),
+            mock.call(fanout=True, topic=topic + '.host.host1',
+                      version='1.1')], any_order=True)
+        self.cctxt_mock.cast.assert_has_calls([
+            mock.call(self.context, 'push',
+                      resource_list=[resource.obj_to_primitive()
+                                     for resource in self.resource_objs],
+                      event_type=TEST_EVENT),
+            mock.call(self.context, 'push',
+                      resource_list=[self.resource_objs[0].obj_to_primitive()],
+                      event_type=TEST_EVENT)], any_order=True)
+        self.assertEqual(2, self.cctxt_mock.cast.call_count)
+
+    def test_push_scoped_global_resource_type(self):
+        cfg.CONF.set_override('rpc_scoped_resource_push', True)
+        self.rpc.push(self.context, self.resource_objs, TEST_EVENT)
+        self.rpc.client.prepare.assert_called_once_with(
+            fanout=True, topic=resources_rpc.resource_type_versioned_topic(
+                'FakeResource', TEST_VERSION), version='1.1')
+
+    def test_push_scoped_previous_and_unknown_scopes(self):
+        cfg.CONF.set_override('rpc_scoped_resource_push', True)
+        scopes = {self.resource_objs[0].id: [('network', 'net1')],
+                  self.resource_objs[1].id: []}
+        previous_scopes = {self.resource_objs[0].id: {
+            ('security_group', 'sg1'), ('network', 'net1')}}
+        with mock.patch.object(resources_rpc, 'SCOPED_PUSH_RESOURCE_TYPES',
+                               ('FakeResource', )), \
+                mock.patch.object(resources_rpc, 'get_push_scopes',
+                                  side_effect=lambda r: scopes[r.id]):
+            self.rpc.push(self.context, self.resource_objs, TEST_EVENT,
+                          previous_scopes=previous_scopes)
+
+        topic = resources_rpc.resource_type_versioned_topic(
+            'FakeResource', TEST_VERSION)
+        self.rpc.client.prepare.assert_has_calls([
+            mock.call(fanout=True, topic=topic + '.network.net1',
+                      version='1.1'),
+            mock.call(fanout=True, topic=topic + '.security_group.sg1',
+                      version='1.1'),
+            mock.call(fanout=True, topic=topic, version='1.1')],
+            any_order=True)
+        self.assertEqual(3, self.cctxt_mock.cast.call_count)
+        self.cctxt_mock.cast.assert_any_call(
+            self.context, 'push',
+            resource_list=[self.resource_objs[1].obj_to_primitive()],
+            event_type=TEST_EVENT)
+
+    def test_get_push_scopes(self):
+        port_id = uuidutils.generate_uuid()
+        network_id = uuidutils.generate_uuid()
+        sg_ids = sorted([uuidutils.generate_uuid(),
+                         uuidutils.generate_uuid()])
+        port = ports.Port(
+            id=port_id, network_id=network_id,
+            security_group_ids=set(sg_ids),
+            bindings=[ports.PortBinding(port_id=port_id, host='host2'),
+                      ports.PortBinding(port_id=port_id, host='host1'),
+                      ports.PortBinding(port_id=port_id, host='')])
+        self.assertEqual(
+            [('network', network_id), ('host', 'host1'), ('host', 'host2'),
+             ('security_group', sg_ids[0]), ('security_group', sg_ids[1])],
+            resources_rpc.get_push_scopes(port))
+        self.assertEqual(
+            [('network', network_id)],
+            resources_rpc.get_push_scopes(ports.Port(network_id=network_id)))
+        # the scopes of a deleted port are unknown
+        self.assertEqual([], resources_rpc.get_push_scopes(
+            ports.Port(id=port_id)))
+
 
 class ResourcesPushRpcCallbackTestCase(ResourcesRpcBaseTestCase):
     """Tests the agent-side of the RPC interface."""
@@ -16,13 +16,17 @@ from unittest import mock
 
 import netaddr
 from neutron_lib import context
+from oslo_config import cfg
 from oslo_utils import uuidutils
 
 from neutron.agent import resource_cache
+from neutron.api.rpc.callbacks import events as events_rpc
 from neutron.api.rpc.callbacks import resources
+from neutron.api.rpc.handlers import resources_rpc
 from neutron.api.rpc.handlers import securitygroups_rpc
 from neutron import objects
 from neutron.objects import address_group
+from neutron.objects.port.extensions import allowedaddresspairs
 from neutron.objects.port.extensions import port_security as psec
 from neutron.objects import ports
 from neutron.objects import securitygroup
@@ -83,6 +87,7 @@ class SecurityGroupServerAPIShimTestCase(base.BaseTestCase):
     def _make_port_ovo(self, ip, **kwargs):
         attrs = {'id': uuidutils.generate_uuid(),
                  'network_id': uuidutils.generate_uuid(),
+                 'mac_address': netaddr.EUI('fa:16:3e:00:00:01'),
                  'security_group_ids': set(),
                  'device_owner': 'compute:None',
                  'allowed_address_pairs': []}
@@ -198,6 +203,115 @@ class SecurityGroupServerAPIShimTestCase(base.BaseTestCase):
         self.sg_agent.security_groups_member_updated.assert_called_with(
             {s1.id})
 
+    def test_select_ips_for_remote_group_incremental(self):
+        s1 = self._make_security_group_ovo()
+        s2 = self._make_security_group_ovo()
+        mac = 'fa:16:3e:aa:bb:c1'
+        p1 = self._make_port_ovo(ip='1.1.1.1', mac_address=netaddr.EUI(mac),
+                                 security_group_ids={s1.id})
+        p2 = self._make_port_ovo(
+            ip='2.2.2.2', mac_address=netaddr.EUI(mac),
+            security_group_ids={s1.id, s2.id}, revision_number=1,
+            allowed_address_pairs=[allowedaddresspairs.AllowedAddressPair(
+                ip_address=netaddr.IPNetwork('10.0.0.1'),
+                mac_address=netaddr.EUI(mac))])
+        member_1 = ('1.1.1.1', str(netaddr.EUI(mac)))
+        member_2 = ('2.2.2.2', str(netaddr.EUI(mac)))
+        aap = ('10.0.0.1/32', str(netaddr.EUI(mac)))
+        with mock.patch.object(self.rcache, 'get_resources') as get_res:
+            ips = self.shim._select_ips_for_remote_group(
+                self.ctx, [s1.id, s2.id])
+            self.shim._select_ips_for_remote_group(self.ctx, [s1.id, s2.id])
+        # the member ports are only requested from the cache once
+        get_res.assert_called_once_with(
+            'Port', {'security_group_ids': (s1.id, s2.id)})
+        self.assertEqual({s1.id: {member_1, member_2, aap},
+                          s2.id: {member_2, aap}}, ips)
+
+        # p2 leaves s1 and changes its IP address
+        p2_updated = ports.Port(
+            self.ctx, id=p2.id, network_id=p2.network_id,
+            mac_address=netaddr.EUI(mac), security_group_ids={s2.id},
+            device_owner='compute:None', allowed_address_pairs=[],
+            revision_number=2,
+            fixed_ips=[ports.IPAllocation(
+                port_id=p2.id, subnet_id=uuidutils.generate_uuid(),
+                network_id=p2.network_id, ip_address='3.3.3.3')])
+        self.rcache.record_resource_update(self.ctx, 'Port', p2_updated)
+        member_3 = ('3.3.3.3', str(netaddr.EUI(mac)))
+        self.assertEqual(
+            {s1.id: {member_1}, s2.id: {member_3}},
+            self.shim._select_ips_for_remote_group(self.ctx, [s1.id, s2.id]))
+
+        self.rcache.record_resource_delete(self.ctx, 'Port', p1.id)
+        self.rcache.record_resource_delete(self.ctx, 'Port', p2.id)
+        self.assertEqual(
+            {s1.id: set(), s2.id: set()},
+            self.shim._select_ips_for_remote_group(self.ctx, [s1.id, s2.id]))
+        self.assertEqual({}, dict(self.shim._sg_member_ips))
+
+    @mock.patch.object(resource_cache.n_rpc, 'Connection')
+    def test_remote_group_member_on_other_network_scoped_push(
+            self, connection_class):
+        cfg.CONF.set_override('rpc_scoped_resource_push', True)
+        connection = connection_class.return_value
+        self.rcache.start_watcher()
+        remote_sg = self._make_security_group_ovo()
+        self.assertEqual(
+            {remote_sg.id: set()},
+            self.shim._select_ips_for_remote_group(self.ctx, [remote_sg.id]))
+        # the ports of the remote group are received on its topic
+        connection.create_consumer.assert_called_with(
+            resources_rpc.resource_type_scoped_topic(
+                'Port', resources_rpc.SCOPE_SECURITY_GROUP, remote_sg.id),
+            mock.ANY, fanout=True)
+
+        # a member on a network without a port of this host is pushed
+        mac = 'fa:16:3e:aa:bb:c1'
+        member = self._make_port_ovo(
+            ip='1.1.1.1', mac_address=netaddr.EUI(mac),
+            security_group_ids={remote_sg.id}, revision_number=1)
+        self.sg_agent.security_groups_member_updated.assert_called_with(
+            {remote_sg.id})
+        self.sg_agent.security_groups_member_updated.reset_mock()
+        member_updated = ports.Port(
+            self.ctx, id=member.id, network_id=member.network_id,
+            mac_address=netaddr.EUI(mac), security_group_ids={remote_sg.id},
+            device_owner='compute:None', allowed_address_pairs=[],
+            revision_number=2,
+            fixed_ips=[ports.IPAllocation(
+                port_id=member.id, subnet_id=uuidutils.generate_uuid(),
+                network_id=member.network_id, ip_address='2.2.2.2')])
+        self.rcache._watcher.resource_change_handler(
+            self.ctx, 'Port', [member_updated], events_rpc.UPDATED)
+        self.sg_agent.security_groups_member_updated.assert_called_once_with(
+            {remote_sg.id})
+        self.assertEqual(
+            {remote_sg.id: {('2.2.2.2', str(netaddr.EUI(mac)))}},
+            self.shim._select_ips_for_remote_group(self.ctx, [remote_sg.id]))
+
+    def test_select_ips_for_remote_group_shared_address(self):
+        s1 = self._make_security_group_ovo()
+        mac = 'fa:16:3e:aa:bb:c1'
+        p1 = self._make_port_ovo(ip='1.1.1.1', mac_address=netaddr.EUI(mac),
+                                 security_group_ids={s1.id})
+        self._make_port_ovo(ip='1.1.1.1', mac_address=netaddr.EUI(mac),
+                            security_group_ids={s1.id})
+        self.rcache.record_resource_delete(self.ctx, 'Port', p1.id)
+        self.assertEqual(
+            {s1.id: {('1.1.1.1', str(netaddr.EUI(mac)))}},
+            self.shim._select_ips_for_remote_group(self.ctx, [s1.id]))
+
+    def test_member_ips_of_ports_cached_before_shim(self):
+        s1 = self._make_security_group_ovo()
+        mac = 'fa:16:3e:aa:bb:c1'
+        self._make_port_ovo(ip='1.1.1.1', mac_address=netaddr.EUI(mac),
+                            security_group_ids={s1.id})
+        shim = securitygroups_rpc.SecurityGroupServerAPIShim(self.rcache)
+        self.assertEqual(
+            {s1.id: {('1.1.1.1', str(netaddr.EUI(mac)))}},
+            shim._select_ips_for_remote_group(self.ctx, [s1.id]))
+
     def test_get_secgroup_ids_for_address_group(self):
         ag = self._make_address_group_ovo()
         sg1 = self._make_security_group_ovo(remote_address_group_id=ag.id)
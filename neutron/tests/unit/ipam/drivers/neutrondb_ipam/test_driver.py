@@ -18,11 +18,15 @@ from unittest import mock
 import netaddr
 from neutron_lib import constants
 from neutron_lib import context
+from neutron_lib.db import api as db_api
 from neutron_lib import exceptions as n_exc
 from neutron_lib.plugins import directory
+from oslo_config import cfg
 from oslo_utils import uuidutils
+import testtools
 
 from neutron.ipam.drivers.neutrondb_ipam import driver
+from neutron.ipam.drivers.neutrondb_ipam import free_ranges
 from neutron.ipam import exceptions as ipam_exc
 from neutron.ipam import requests as ipam_req
 from neutron.objects import ipam as ipam_obj
@@ -478,3 +482,126 @@ class TestNeutronDbIpamSubnet(testlib_api.SqlTestCase,
         pools = [netaddr.IPRange('192.168.10.20', '192.168.10.41'),
                  netaddr.IPRange('192.168.10.50', '192.168.10.60')]
         self.assertTrue(self._test__no_pool_changes(pools))
+
+
+class TestNeutronDbIpamSubnetFreeRangeIndex(TestNeutronDbIpamSubnet):
+    """Runs the Neutron DB IPAM subnet tests with the free range index."""
+
+    def setUp(self):
+        super(TestNeutronDbIpamSubnetFreeRangeIndex, self).setUp()
+        cfg.CONF.set_override('ipam_free_range_index', True)
+        # The plugin was loaded before the option was set.
+        free_ranges.register_db_events()
+        self.addCleanup(free_ranges._indexes.clear)
+
+    def _is_free(self, ipam_subnet, ip_address):
+        index = free_ranges.peek_index(ipam_subnet.subnet_manager.neutron_id)
+        ip = int(netaddr.IPAddress(ip_address))
+        return any(ip in free for free in index.free_ranges)
+
+    def test_allocate_does_not_list_allocations(self):
+        ipam_subnet = self._create_and_allocate_ipam_subnet(
+            '10.0.0.0/24')[0]
+        ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+        with mock.patch.object(ipam_subnet.subnet_manager,
+                               'list_allocations') as list_allocations:
+            ip_addresses = [ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+                            for _ in range(10)]
+        list_allocations.assert_not_called()
+        self.assertEqual(10, len(set(ip_addresses)))
+
+    def test_deallocated_address_is_reused(self):
+        ipam_subnet = self._create_and_allocate_ipam_subnet(
+            '192.168.0.0/29')[0]
+        ip_addresses = ipam_subnet.bulk_allocate(
+            ipam_req.BulkAddressRequest(5))
+        ipam_subnet.deallocate(ip_addresses[2])
+        self.assertEqual(
+            ip_addresses[2],
+            ipam_subnet.allocate(ipam_req.AnyAddressRequest))
+
+    def test_allocate_rebuilds_exhausted_index(self):
+        ipam_subnet, subnet = self._create_and_allocate_ipam_subnet(
+            '192.168.0.0/30')
+        ip_address = ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+        # Released by another server, the index does not know about it
+        ipam_subnet.subnet_manager.delete_allocation(self.ctx, ip_address)
+        self.assertEqual(ip_address,
+                         ipam_subnet.allocate(ipam_req.AnyAddressRequest))
+
+    def test_allocate_skips_address_allocated_by_other_server(self):
+        ipam_subnet = self._create_and_allocate_ipam_subnet(
+            '192.168.0.0/24')[0]
+        self.assertEqual(
+            '192.168.0.2',
+            ipam_subnet.allocate(ipam_req.PreferNextAddressRequest()))
+        index = free_ranges.peek_index(ipam_subnet.subnet_manager.neutron_id)
+        # Allocated by another server, the index does not know about it
+        with db_api.CONTEXT_WRITER.using(self.ctx):
+            ipam_subnet.subnet_manager.create_allocation(self.ctx,
+                                                         '192.168.0.3')
+        with mock.patch.object(ipam_subnet.subnet_manager,
+                               'list_allocations') as list_allocations:
+            self.assertEqual(
+                '192.168.0.4',
+                ipam_subnet.allocate(ipam_req.PreferNextAddressRequest()))
+        list_allocations.assert_not_called()
+        self.assertIs(
+            index,
+            free_ranges.peek_index(ipam_subnet.subnet_manager.neutron_id))
+        self.assertFalse(self._is_free(ipam_subnet, '192.168.0.3'))
+
+    def test_allocate_rolled_back_releases_address(self):
+        ipam_subnet = self._create_and_allocate_ipam_subnet(
+            '10.0.0.0/24')[0]
+        ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+        with testtools.ExpectedException(ValueError):
+            with db_api.CONTEXT_WRITER.using(self.ctx):
+                ip_address = ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+                self.assertFalse(self._is_free(ipam_subnet, ip_address))
+                raise ValueError()
+        self.assertTrue(self._is_free(ipam_subnet, ip_address))
+
+    def test_deallocate_releases_address_on_commit(self):
+        ipam_subnet = self._create_and_allocate_ipam_subnet(
+            '10.0.0.0/24')[0]
+        ip_address = ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+        with db_api.CONTEXT_WRITER.using(self.ctx):
+            ipam_subnet.deallocate(ip_address)
+            self.assertFalse(self._is_free(ipam_subnet, ip_address))
+        self.assertTrue(self._is_free(ipam_subnet, ip_address))
+
+    def test_deallocate_rolled_back_keeps_address_used(self):
+        ipam_subnet = self._create_and_allocate_ipam_subnet(
+            '10.0.0.0/24')[0]
+        ip_address = ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+        with testtools.ExpectedException(ValueError):
+            with db_api.CONTEXT_WRITER.using(self.ctx):
+                ipam_subnet.deallocate(ip_address)
+                raise ValueError()
+        self.assertFalse(self._is_free(ipam_subnet, ip_address))
+
+    def test_allocate_rebuilds_expired_index(self):
+        cfg.CONF.set_override('ipam_free_range_index_max_age', 10)
+        ipam_subnet = self._create_and_allocate_ipam_subnet(
+            '10.0.0.0/24')[0]
+        ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+        index = free_ranges.peek_index(ipam_subnet.subnet_manager.neutron_id)
+        with mock.patch.object(index, 'get_age', return_value=11):
+            ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+        self.assertIsNot(
+            index,
+            free_ranges.peek_index(ipam_subnet.subnet_manager.neutron_id))
+
+    def test_update_allocation_pools_drops_index(self):
+        ipam_subnet = self._create_and_allocate_ipam_subnet(
+            '10.0.0.0/24')[0]
+        ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+        ipam_subnet.update_allocation_pools(
+            [netaddr.IPRange('10.0.0.100', '10.0.0.110')],
+            netaddr.IPNetwork('10.0.0.0/24'))
+        self.assertIsNone(
+            free_ranges.peek_index(ipam_subnet.subnet_manager.neutron_id))
+        ip_address = ipam_subnet.allocate(ipam_req.AnyAddressRequest)
+        self.assertIn(netaddr.IPAddress(ip_address),
+                      netaddr.IPRange('10.0.0.100', '10.0.0.110'))
@@ -0,0 +1,102 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+from neutron.ipam.drivers.neutrondb_ipam import free_ranges
+from neutron.tests import base
+
+
+class TestFreeRanges(base.BaseTestCase):
+
+    def test_init(self):
+        free = free_ranges.FreeRanges(10, 20, used=[5, 10, 14, 15, 20, 30])
+        self.assertEqual([(11, 13), (16, 19)], free.get_ranges())
+        self.assertEqual(7, free.size)
+
+    def test_remove(self):
+        free = free_ranges.FreeRanges(10, 20)
+        self.assertTrue(free.remove(15))
+        self.assertTrue(free.remove(10))
+        self.assertTrue(free.remove(20))
+        self.assertFalse(free.remove(15))
+        self.assertFalse(free.remove(21))
+        self.assertEqual([(11, 14), (16, 19)], free.get_ranges())
+        self.assertEqual(8, free.size)
+        self.assertNotIn(15, free)
+        self.assertIn(16, free)
+
+    def test_add(self):
+        free = free_ranges.FreeRanges(10, 20, used=[12, 13, 14, 16])
+        self.assertTrue(free.add(13))
+        self.assertEqual([(10, 11), (13, 13), (15, 15), (17, 20)],
+                         free.get_ranges())
+        self.assertTrue(free.add(12))
+        self.assertTrue(free.add(14))
+        self.assertEqual([(10, 15), (17, 20)], free.get_ranges())
+        self.assertFalse(free.add(14))
+        self.assertFalse(free.add(21))
+        self.assertEqual(10, free.size)
+
+    def test_iter_addresses(self):
+        free = free_ranges.FreeRanges(10, 20, used=[11, 12])
+        self.assertEqual([10, 13, 14], list(free.iter_addresses(3)))
+        self.assertEqual(9, len(list(free.iter_addresses(100))))
+
+
+class TestFreeRangeIndex(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestFreeRangeIndex, self).setUp()
+        self.addCleanup(free_ranges._indexes.clear)
+        self.pools = [('10.0.0.2', '10.0.0.10'), ('10.0.0.20', '10.0.0.30')]
+
+    def test_allocate_release(self):
+        index = free_ranges.FreeRangeIndex(self.pools, ['10.0.0.5'])
+        self.assertEqual([8, 11], [f.size for f in index.free_ranges])
+        self.assertTrue(index.allocate('10.0.0.25'))
+        self.assertFalse(index.allocate('10.0.0.5'))
+        self.assertTrue(index.release('10.0.0.5'))
+        self.assertFalse(index.release('10.0.0.15'))
+        self.assertEqual([9, 10], [f.size for f in index.free_ranges])
+
+    def test_get_index(self):
+        load = mock.Mock(return_value=['10.0.0.3'])
+        index, built = free_ranges.get_index('subnet', self.pools, load, 0)
+        self.assertTrue(built)
+        same_index, built = free_ranges.get_index('subnet', self.pools,
+                                                  load, 0)
+        self.assertFalse(built)
+        self.assertIs(index, same_index)
+        load.assert_called_once_with()
+        self.assertIs(index, free_ranges.peek_index('subnet'))
+
+    def test_get_index_pools_changed(self):
+        load = mock.Mock(return_value=[])
+        index = free_ranges.get_index('subnet', self.pools, load, 0)[0]
+        new_index, built = free_ranges.get_index(
+            'subnet', self.pools[:1], load, 0)
+        self.assertTrue(built)
+        self.assertIsNot(index, new_index)
+
+    def test_get_index_expired(self):
+        load = mock.Mock(return_value=[])
+        index = free_ranges.get_index('subnet', self.pools, load, 10)[0]
+        with mock.patch.object(index, 'get_age', return_value=11):
+            self.assertTrue(
+                free_ranges.get_index('subnet', self.pools, load, 10)[1])
+
+    def test_drop_index(self):
+        free_ranges.get_index('subnet', self.pools,
+                              mock.Mock(return_value=[]), 0)
+        free_ranges.drop_index('subnet')
+        self.assertIsNone(free_ranges.peek_index('subnet'))
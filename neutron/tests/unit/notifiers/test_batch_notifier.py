@@ -36,19 +36,39 @@ class TestBatchNotifier(base.BaseTestCase):
     def test_queue_event_no_event(self):
         spawn_n = self.spawn_n_p.start()
         self.notifier.queue_event(None)
-        self.assertEqual(0, len(self.notifier._pending_events.queue))
+        self.assertEqual(0, len(self.notifier._pending_events))
         self.assertEqual(0, spawn_n.call_count)
 
     def test_queue_event_first_event(self):
         spawn_n = self.spawn_n_p.start()
         self.notifier.queue_event(mock.Mock())
-        self.assertEqual(1, len(self.notifier._pending_events.queue))
+        self.assertEqual(1, len(self.notifier._pending_events))
         self.assertEqual(1, spawn_n.call_count)
 
+    def test_queue_event_single_worker(self):
+        spawn_n = self.spawn_n_p.start()
+        for i in range(10):
+            self.notifier.queue_event('Event %s' % i)
+        self.assertEqual(10, len(self.notifier._pending_events))
+        self.assertEqual(1, spawn_n.call_count)
+
+    def test_queue_event_deduplicates(self):
+        self.spawn_n_p.start()
+        events = ['Event 1', {'name': 'event', 'tags': ['a']}, 'Event 2',
+                  {'name': 'event', 'tags': ['a']}, 'Event 1']
+        for event in events:
+            self.notifier.queue_event(event)
+        self.assertEqual(['Event 2', {'name': 'event', 'tags': ['a']},
+                          'Event 1'],
+                         list(self.notifier._pending_events.values()))
+        stats = self.notifier.get_stats()
+        self.assertEqual(5, stats['queued_events'])
+        self.assertEqual(2, stats['deduplicated_events'])
+        self.assertEqual(3, stats['queue_depth'])
+
     def test_queue_event_multiple_events_notify_method(self):
         def _batch_notifier_dequeue():
-            while not self.notifier._pending_events.empty():
-                self.notifier._pending_events.get()
+            self.notifier._pending_events.clear()
 
         c_mock = mock.patch.object(self.notifier, '_notify',
                                    side_effect=_batch_notifier_dequeue).start()
@@ -57,12 +77,11 @@ class TestBatchNotifier(base.BaseTestCase):
             self.notifier.queue_event('Event %s' % i)
             eventlet.sleep(0)  # yield to let coro execute
 
-        utils.wait_until_true(self.notifier._pending_events.empty,
+        utils.wait_until_true(lambda: not self.notifier._pending_events,
                               timeout=5)
-        # Called twice: when the first thread calls "synced_send" and then,
-        # in the same loop, when self._pending_events is not empty(). All
-        # self.notifier.queue_event calls are done in just one
-        # "batch_interval" (2 secs).
+        # Called twice: the first event is sent as soon as it is queued and
+        # the next ones, queued in the same "batch_interval" (2 secs), are
+        # sent together at the end of the interval.
         self.assertEqual(2, c_mock.call_count)
 
     def test_queue_event_multiple_events_callback_method(self):
@@ -71,8 +90,59 @@ class TestBatchNotifier(base.BaseTestCase):
             self.notifier.queue_event('Event %s' % i)
             eventlet.sleep(0)  # yield to let coro execute
 
-        utils.wait_until_true(self.notifier._pending_events.empty,
+        utils.wait_until_true(lambda: not self.notifier._pending_events,
                               timeout=5)
         expected = ['Event %s' % i for i in range(events)]
         # Check the events have been handled in the same input order.
         self.assertEqual(expected, list(self._received_events.queue))
+
+    def test_queue_event_max_batch_size(self):
+        batches = []
+        notifier = batch_notifier.BatchNotifier(60, batches.append,
+                                                max_batch_size=5)
+        for i in range(11):
+            notifier.queue_event('Event %s' % i)
+            eventlet.sleep(0)  # yield to let coro execute
+
+        # The first event is sent right away, the next ones as soon as
+        # there are 5 of them, without waiting for the 60 secs interval.
+        utils.wait_until_true(lambda: len(batches) == 3, timeout=5)
+        self.assertEqual([1, 5, 5], [len(batch) for batch in batches])
+        stats = notifier.get_stats()
+        self.assertEqual(3, stats['batches'])
+        self.assertEqual(11, stats['sent_events'])
+        self.assertEqual({1: 1, 8: 2}, stats['batch_sizes'])
+        self.assertEqual(0, stats['queue_depth'])
+
+    def test_queue_event_callback_failure(self):
+        callback = mock.Mock(side_effect=[Exception, None])
+        notifier = batch_notifier.BatchNotifier(0.1, callback)
+        notifier.queue_event('Event 1')
+        utils.wait_until_true(lambda: callback.call_count == 1, timeout=5)
+        notifier.queue_event('Event 2')
+        utils.wait_until_true(lambda: callback.call_count == 2, timeout=5)
+        callback.assert_called_with(['Event 2'])
+        stats = notifier.get_stats()
+        self.assertEqual(2, stats['batches'])
+        self.assertEqual(1, stats['failed_batches'])
+
+    def test_record_batch_logs_stats(self):
+        with mock.patch.object(batch_notifier, 'LOG') as log, \
+                mock.patch.object(batch_notifier.time, 'monotonic',
+                                  return_value=1000):
+            self.notifier._record_batch(3, 0.5)
+            self.notifier._record_batch(2, 0.25)
+        stats_logs = [c for c in log.debug.call_args_list
+                      if 'stats' in c[0][1]]
+        self.assertEqual(1, len(stats_logs))
+        self.assertEqual(1, stats_logs[0][0][1]['stats']['batches'])
+        with mock.patch.object(batch_notifier, 'LOG') as log, \
+                mock.patch.object(
+                    batch_notifier.time, 'monotonic',
+                    return_value=1000 + batch_notifier.STATS_LOG_INTERVAL):
+            self.notifier._record_batch(1, 0.5)
+        stats = log.debug.call_args[0][1]['stats']
+        self.assertEqual(3, stats['batches'])
+        self.assertEqual(6, stats['sent_events'])
+        self.assertEqual({1: 1, 2: 1, 4: 1}, stats['batch_sizes'])
+        self.assertEqual(1.25, stats['total_batch_time'])
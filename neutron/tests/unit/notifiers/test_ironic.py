@@ -186,8 +186,8 @@ class TestIronicNotifier(base.BaseTestCase):
                 mock.Mock(), states=(original_port, port,)))
 
         self.assertEqual(
-            2, len(self.ironic_notifier.batch_notifier._pending_events.queue))
-        self.assertEqual(2, mock_spawn_n.call_count)
+            2, len(self.ironic_notifier.batch_notifier._pending_events))
+        self.assertEqual(1, mock_spawn_n.call_count)
 
     @mock.patch.object(os_exc, 'raise_from_response', return_value=None)
     @mock.patch.object(connection.Connection, 'baremetal', autospec=True)
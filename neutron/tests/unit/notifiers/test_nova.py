@@ -303,19 +303,16 @@ class TestNovaNotify(base.BaseTestCase):
         self.nova_notifier._waiting_to_send = True
         self.nova_notifier.send_network_change(
             'update_floatingip', original_obj, returned_obj)
-        self.assertEqual(
-            2, len(self.nova_notifier.batch_notifier._pending_events.queue))
+        pending_events = list(
+            self.nova_notifier.batch_notifier._pending_events.values())
+        self.assertEqual(2, len(pending_events))
 
         returned_obj_non = {'floatingip': {'port_id': None}}
         event_dis = self.nova_notifier.create_port_changed_event(
             'update_floatingip', original_obj, returned_obj_non)
         event_assoc = self.nova_notifier.create_port_changed_event(
             'update_floatingip', original_obj, returned_obj)
-        self.assertEqual(
-            self.nova_notifier.batch_notifier._pending_events.get(), event_dis)
-        self.assertEqual(
-            self.nova_notifier.batch_notifier._pending_events.get(),
-            event_assoc)
+        self.assertEqual([event_dis, event_assoc], pending_events)
 
     def test_delete_port_notify(self):
         device_id = '32102d7b-1cf4-404d-b50a-97aae1f55f87'
@@ -378,10 +375,8 @@ class TestNovaNotify(base.BaseTestCase):
         self.nova_notifier.notify_port_active_direct(port)
 
         self.assertEqual(
-            1, len(self.nova_notifier.batch_notifier._pending_events.queue))
-        self.assertEqual(
-            expected_event,
-            self.nova_notifier.batch_notifier._pending_events.get())
+            [expected_event],
+            list(self.nova_notifier.batch_notifier._pending_events.values()))
 
     def test_notify_concurrent_enable_flag_update(self):
         # This test assumes Neutron server uses eventlet.
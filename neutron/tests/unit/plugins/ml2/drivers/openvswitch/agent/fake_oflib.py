@@ -25,6 +25,9 @@ class _Eq(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(repr(self))
+
 
 class _Value(_Eq):
     def __or__(self, b):
@@ -64,6 +67,9 @@ def _mkcls(name):
         def __getattr__(self, name):
             return self._kwargs[name]
 
+        def items(self):
+            return self._kwargs.items()
+
         def __repr__(self):
             args = list(map(repr, self._args))
             kwargs = sorted(['%s=%s' % (x, y) for x, y in
@@ -14,7 +14,9 @@ from unittest import mock
 
 from os_ken.ofproto import ofproto_v1_3
 from os_ken.ofproto import ofproto_v1_3_parser
+import testtools
 
+from neutron.agent.common import ovs_lib
 from neutron.plugins.ml2.drivers.openvswitch.agent.openflow.native \
     import ofswitch
 from neutron.tests import base
@@ -28,7 +30,8 @@ class FakeReply(object):
 class TestBundledOpenFlowBridge(base.BaseTestCase):
     def setUp(self):
         super(TestBundledOpenFlowBridge, self).setUp()
-        br = mock.Mock(spec=['install_instructions', 'foo'])
+        br = mock.Mock(spec=['install_instructions', 'foo',
+                             'wait_pipelined_requests'])
         br._get_dp = lambda: (mock.Mock(), ofproto_v1_3, ofproto_v1_3_parser)
         br.active_bundles = set()
         self.br = ofswitch.BundledOpenFlowBridge(br, False, False)
@@ -82,6 +85,21 @@ class TestBundledOpenFlowBridge(base.BaseTestCase):
         self.assertEqual(ofproto_v1_3.ONF_BCT_DISCARD_REQUEST,
                          args[0].type)
 
+    def test_bundle_context_with_pipelined_error(self):
+        self.br.br._send_msg = mock.Mock(side_effect=[
+            FakeReply(ofproto_v1_3.ONF_BCT_OPEN_REPLY),
+            FakeReply(ofproto_v1_3.ONF_BCT_DISCARD_REPLY)])
+        self.br.br.wait_pipelined_requests.side_effect = RuntimeError
+        update = mock.Mock()
+        with testtools.ExpectedException(RuntimeError):
+            with self.br:
+                self.br.flow_model_updates.append(update)
+        self.assertIsNone(self.br.active_bundle)
+        update.assert_not_called()
+        args, kwargs = self.br.br._send_msg.call_args_list[1]
+        self.assertEqual(ofproto_v1_3.ONF_BCT_DISCARD_REQUEST,
+                         args[0].type)
+
     def test_bundle_context_with_error(self):
         self.assertIsNone(self.br.active_bundle)
         self.br.br._send_msg = mock.Mock(side_effect=[
@@ -105,3 +123,110 @@ class TestBundledOpenFlowBridge(base.BaseTestCase):
         args, kwargs = self.br.br._send_msg.call_args_list[1]
         self.assertEqual(ofproto_v1_3.ONF_BCT_COMMIT_REQUEST,
                          args[0].type)
+
+
+class TestFlowModel(base.BaseTestCase):
+    def setUp(self):
+        super(TestFlowModel, self).setUp()
+        self.model = ofswitch.FlowModel()
+        ofpp = ofproto_v1_3_parser
+        self.match1 = ofpp.OFPMatch(in_port=1, vlan_vid=(0x1000, 0x1000))
+        self.match2 = ofpp.OFPMatch(in_port=2)
+        self.model.add(0, 10, self.match1, 0x1, [])
+        self.model.add(0, 10, self.match2, 0x2, [])
+        self.model.add(1, 0, ofpp.OFPMatch(), 0x1, [])
+
+    def _flow(self, table_id, priority, match):
+        return mock.Mock(table_id=table_id, priority=priority, match=match)
+
+    def test_add_replaces_same_flow(self):
+        self.model.add(0, 10, ofproto_v1_3_parser.OFPMatch(
+            in_port=1, vlan_vid=(0x1000, 0x1000)), 0x3, [])
+        self.assertEqual(3, len(self.model))
+        self.assertIn(self._flow(0, 10, self.match1), self.model)
+        self.assertNotIn(self._flow(0, 11, self.match1), self.model)
+
+    def test_remove_strict(self):
+        self.model.remove(0, 10, self.match1, 0, 0, True)
+        self.assertNotIn(self._flow(0, 10, self.match1), self.model)
+        self.assertEqual(2, len(self.model))
+
+    def test_remove_non_strict(self):
+        self.model.remove(None, None, ofproto_v1_3_parser.OFPMatch(
+            vlan_vid=(0x1000, 0x1fff)), 0, 0, False)
+        self.assertEqual(2, len(self.model))
+        self.assertNotIn(self._flow(0, 10, self.match1), self.model)
+
+    def test_remove_by_cookie(self):
+        self.model.remove(None, None, ofproto_v1_3_parser.OFPMatch(),
+                          0x1, (1 << 64) - 1, False)
+        self.assertEqual([0x2], [e.cookie for e in self.model])
+
+    def test_remove_table(self):
+        self.model.remove_table(0)
+        self.assertEqual([1], [e.table_id for e in self.model])
+        self.model.remove_table()
+        self.assertEqual(0, len(self.model))
+
+    def test_remove_cookies(self):
+        self.model.remove_cookies({0x2})
+        self.assertEqual([0x2], [e.cookie for e in self.model])
+
+
+class FakeOVSBridge(object):
+    def __init__(self):
+        self._default_cookie = 0x1
+        self.ofctl_calls = []
+
+    def do_action_flows(self, action, kwargs_list, use_bundle=False):
+        self.ofctl_calls.append((action, kwargs_list))
+
+
+class FakeOpenFlowSwitch(ofswitch.OpenFlowSwitchMixin, FakeOVSBridge):
+    pass
+
+
+class TestOpenFlowSwitchFlowModel(base.BaseTestCase):
+    def setUp(self):
+        super(TestOpenFlowSwitchFlowModel, self).setUp()
+        self.br = FakeOpenFlowSwitch(os_ken_app=mock.Mock())
+        ofpp = ofproto_v1_3_parser
+        self.br.flow_model.add(0, 10, ofpp.OFPMatch(in_port=1), 0x1, [])
+        self.br.flow_model.add(0, 10, ofpp.OFPMatch(in_port=2), 0x2, [])
+        self.br.flow_model.add(1, 10, ofpp.OFPMatch(in_port=1), 0x1, [])
+        self.br.flow_model.add(1, 10, ofpp.OFPMatch(in_port=2), 0x2, [])
+
+    def _get_flows(self):
+        return sorted((e.table_id, e.cookie) for e in self.br.flow_model)
+
+    def test_delete_flows_by_cookie(self):
+        self.br.do_action_flows('del', [{'cookie': 0x2, 'reg5': 3}])
+        self.assertEqual([(0, 0x1), (1, 0x1)], self._get_flows())
+        self.assertEqual([('del', [{'cookie': 0x2, 'reg5': 3}])],
+                         self.br.ofctl_calls)
+
+    def test_delete_flows_default_cookie_in_table(self):
+        self.br.do_action_flows('del', [{'table': 1, 'in_port': 1}])
+        self.assertEqual([(0, 0x1), (0, 0x2), (1, 0x2)], self._get_flows())
+
+    def test_delete_flows_cookie_any(self):
+        self.br.do_action_flows('del', [
+            {'table': 0, 'cookie': ovs_lib.COOKIE_ANY, 'in_port': 1}])
+        self.assertEqual([(1, 0x1), (1, 0x2)], self._get_flows())
+
+    def test_delete_flows_masked_cookie(self):
+        self.br.do_action_flows('del', [{'cookie': '0x3/0x1'}])
+        self.assertEqual([(0, 0x2), (1, 0x2)], self._get_flows())
+
+    def test_delete_all_flows(self):
+        self.br.do_action_flows('del', [{}])
+        self.assertEqual([], self._get_flows())
+
+    def test_add_flow_forgets_table(self):
+        self.br.do_action_flows(
+            'add', [{'priority': 10, 'in_port': 1, 'actions': 'drop'}])
+        self.assertEqual([(1, 0x1), (1, 0x2)], self._get_flows())
+
+    def test_mod_flow_forgets_all_tables(self):
+        self.br.do_action_flows('mod', [{'in_port': 1, 'actions': 'drop'}])
+        self.assertEqual([], self._get_flows())
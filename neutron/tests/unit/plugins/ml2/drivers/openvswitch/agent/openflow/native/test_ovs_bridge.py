@@ -15,6 +15,8 @@
 
 from unittest import mock
 
+import testtools
+
 from neutron.agent.common import ovs_lib
 from neutron.plugins.ml2.drivers.openvswitch.agent.openflow.native \
     import ofswitch
@@ -56,3 +58,29 @@ class OVSAgentBridgeTestCase(ovs_test_base.OVSOSKenTestBase):
         br = self.br_int_cls('br-int')
         with mock.patch.object(br, 'get_datapath_id', return_value=None):
             self.assertRaises(RuntimeError, br._get_dp)
+
+    def test_pipelined_send_msg(self):
+        br = self.br_int_cls('br-int')
+        with mock.patch.object(br, '_send_msg_and_wait',
+                               return_value='reply') as send:
+            with br.pipelined():
+                self.assertIsNone(br._send_msg('msg1'))
+                self.assertIsNone(br._send_msg('msg2', active_bundle='b'))
+                self.assertEqual('reply',
+                                 br._send_msg('msg3', reply_cls='cls'))
+            send.assert_has_calls([
+                mock.call('msg1', active_bundle=None),
+                mock.call('msg2', active_bundle='b'),
+                mock.call('msg3', 'cls', False, None)])
+            self.assertEqual([], br._pipelines)
+
+    def test_pipelined_send_msg_error(self):
+        br = self.br_int_cls('br-int')
+        with mock.patch.object(br, '_send_msg_and_wait',
+                               side_effect=[None, RuntimeError, None]) as send:
+            with testtools.ExpectedException(RuntimeError):
+                with br.pipelined():
+                    for msg in ('msg1', 'msg2', 'msg3'):
+                        br._send_msg(msg)
+            self.assertEqual(3, send.call_count)
+            self.assertEqual([], br._pipelines)
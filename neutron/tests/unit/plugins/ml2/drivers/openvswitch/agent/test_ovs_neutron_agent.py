@@ -1267,6 +1267,10 @@ class TestOvsNeutronAgent(object):
                 self.agent.agent_state["configurations"]["devices"],
                 self.agent.int_br_device_count
             )
+            self.assertEqual(
+                self.agent.phase_timings.get_percentile(99),
+                self.agent.agent_state["configurations"][
+                    "rpc_loop_phase_p99"])
             self.agent._report_state()
             report_st.assert_called_with(self.agent.context,
                                          self.agent.agent_state, True)
@@ -2877,7 +2881,8 @@ class TestOvsNeutronAgentOSKen(TestOvsNeutronAgent,
         with mock.patch.object(self.agent.int_br,
                                'dump_flows') as dump_flows,\
                 mock.patch.object(self.agent.int_br,
-                                  'uninstall_flows') as uninstall_flows:
+                                  'bundled') as bundled:
+            br = bundled.return_value.__enter__.return_value
             self.agent.int_br.set_agent_uuid_stamp(1234)
             fake_flows = [
                 # mock os_ken.ofproto.ofproto_v1_3_parser.OFPFlowStats
@@ -2886,21 +2891,20 @@ class TestOvsNeutronAgentOSKen(TestOvsNeutronAgent,
                 mock.Mock(cookie=9029, table_id=2),
                 mock.Mock(cookie=1234, table_id=3),
             ]
+            for flow in fake_flows:
+                flow.match.items.return_value = []
             dump_flows.return_value = fake_flows
             self.agent.iter_num = 3
             self.agent.cleanup_stale_flows()
 
-            dump_flows_expected = [
-                mock.call(tid) for tid in constants.INT_BR_ALL_TABLES]
-            dump_flows.assert_has_calls(dump_flows_expected)
-
+            dump_flows.assert_called_once_with()
             expected = [mock.call(cookie=17185,
                                   cookie_mask=uint64_max),
                         mock.call(cookie=9029,
                                   cookie_mask=uint64_max)]
-            uninstall_flows.assert_has_calls(expected, any_order=True)
-            self.assertEqual(len(constants.INT_BR_ALL_TABLES) * len(expected),
-                             len(uninstall_flows.mock_calls))
+            br.uninstall_flows.assert_has_calls(expected, any_order=True)
+            self.assertEqual(len(expected),
+                             len(br.uninstall_flows.mock_calls))
 
 
 class AncillaryBridgesTest(object):
@@ -26,6 +26,7 @@ from neutron.common.ovn import utils
 from neutron.conf.plugins.ml2.drivers.ovn import ovn_conf
 from neutron.db import ovn_revision_numbers_db
 from neutron.plugins.ml2.drivers.ovn.mech_driver.ovsdb import maintenance
+from neutron.plugins.ml2.drivers.ovn.mech_driver.ovsdb import ovn_client
 from neutron.plugins.ml2.drivers.ovn.mech_driver.ovsdb import ovn_db_sync
 from neutron.tests.unit import fake_resources as fakes
 from neutron.tests.unit.plugins.ml2 import test_security_group as test_sg
@@ -102,6 +103,169 @@ class TestDBInconsistenciesPeriodics(testlib_api.SqlTestCaseLight,
         self.periodic.check_for_inconsistencies()
         mock_fix_net.assert_called_once_with(mock.ANY, fake_row)
 
+    @mock.patch.object(maintenance.DBInconsistenciesPeriodics,
+                       '_fix_create_update_batch')
+    @mock.patch.object(ovn_revision_numbers_db, 'get_inconsistent_resources')
+    def test_check_for_inconsistencies_batched(self, mock_get_incon_res,
+                                               mock_fix_batch):
+        cfg.CONF.set_override('inconsistencies_fix_batch_size', 2, 'ovn')
+        net_rows = [mock.Mock(resource_type=constants.TYPE_NETWORKS)
+                    for _ in range(3)]
+        port_rows = [mock.Mock(resource_type=constants.TYPE_PORTS)
+                     for _ in range(2)]
+        mock_get_incon_res.return_value = net_rows + port_rows
+        self.periodic.check_for_inconsistencies()
+        mock_fix_batch.assert_has_calls([
+            mock.call(mock.ANY, constants.TYPE_NETWORKS, net_rows[:2]),
+            mock.call(mock.ANY, constants.TYPE_NETWORKS, net_rows[2:]),
+            mock.call(mock.ANY, constants.TYPE_PORTS, port_rows)])
+        self.assertEqual(3, mock_fix_batch.call_count)
+
+    @mock.patch.object(maintenance.DBInconsistenciesPeriodics,
+                       '_fix_create_update')
+    @mock.patch.object(ovn_revision_numbers_db, 'get_inconsistent_resources')
+    def test_check_for_inconsistencies_time_budget(self, mock_get_incon_res,
+                                                   mock_fix):
+        fake_rows = [mock.Mock(resource_type=constants.TYPE_NETWORKS)
+                     for _ in range(3)]
+        mock_get_incon_res.return_value = fake_rows
+        with mock.patch.object(self.periodic, '_fix_time_budget_exhausted',
+                               side_effect=[False, True]):
+            self.periodic.check_for_inconsistencies()
+        mock_fix.assert_called_once_with(mock.ANY, fake_rows[0])
+
+    def test__fix_time_budget_exhausted(self):
+        self.assertFalse(self.periodic._fix_time_budget_exhausted())
+        cfg.CONF.set_override('inconsistencies_fix_time_budget', 10, 'ovn')
+        with mock.patch.object(self.periodic._sync_timer, 'elapsed',
+                               return_value=10):
+            self.assertTrue(self.periodic._fix_time_budget_exhausted())
+
+    def test__fix_create_update_batch(self):
+        net2 = dict(self.net, id='net2')
+        rows = [mock.Mock(resource_uuid=net_id,
+                          resource_type=constants.TYPE_NETWORKS)
+                for net_id in (self.net['id'], 'net2', 'missing')]
+        plugin = self.fake_ovn_client._plugin
+        plugin.get_networks.return_value = [self.net, net2]
+        self.fake_ovn_client._nb_idl.get_lswitch.return_value = None
+        self.periodic._fix_create_update_batch(
+            self.ctx, constants.TYPE_NETWORKS, rows)
+        plugin.get_networks.assert_called_once_with(
+            self.ctx, filters={'id': [self.net['id'], 'net2', 'missing']})
+        plugin.get_network.assert_not_called()
+        self.fake_ovn_client._nb_idl.transaction.assert_called_once_with(
+            check_error=True)
+        self.fake_ovn_client.create_network.assert_has_calls([
+            mock.call(self.ctx, self.net), mock.call(self.ctx, net2)])
+        self.assertEqual(2, self.fake_ovn_client.create_network.call_count)
+
+    @mock.patch.object(maintenance.DBInconsistenciesPeriodics,
+                       '_fix_create_update_inconsistency')
+    def test__fix_create_update_batch_failure(self, mock_fix):
+        rows = [mock.Mock(resource_uuid=self.net['id'],
+                          resource_type=constants.TYPE_NETWORKS)]
+        self.fake_ovn_client._plugin.get_networks.return_value = [self.net]
+        self.fake_ovn_client._nb_idl.get_lswitch.return_value = None
+        self.fake_ovn_client.create_network.side_effect = RuntimeError
+        self.periodic._fix_create_update_batch(
+            self.ctx, constants.TYPE_NETWORKS, rows)
+        mock_fix.assert_called_once_with(self.ctx, rows[0])
+
+    def _setup_batch_revision_bump(self):
+        with db_api.CONTEXT_WRITER.using(self.ctx):
+            ovn_revision_numbers_db.create_initial_revision(
+                self.ctx, self.net['id'], constants.TYPE_NETWORKS,
+                revision_number=-1)
+        rows = [mock.Mock(resource_uuid=self.net['id'],
+                          resource_type=constants.TYPE_NETWORKS)]
+        self.fake_ovn_client._plugin.get_networks.return_value = [
+            dict(self.net, revision_number=5)]
+        self.fake_ovn_client._nb_idl.get_lswitch.return_value = None
+        # like OVNClient, the revision is bumped in the nested transaction
+        self.fake_ovn_client.create_network.side_effect = (
+            lambda ctx, net: ovn_revision_numbers_db.bump_revision(
+                ctx, net, constants.TYPE_NETWORKS))
+        return rows
+
+    def _get_net_revision(self):
+        return ovn_revision_numbers_db.get_revision_row(
+            self.ctx, self.net['id']).revision_number
+
+    def test__fix_create_update_batch_bumps_after_commit(self):
+        rows = self._setup_batch_revision_bump()
+        revisions_at_commit = []
+        txn = self.fake_ovn_client._nb_idl.transaction.return_value
+        txn.__exit__.side_effect = lambda *args: revisions_at_commit.append(
+            self._get_net_revision())
+        self.periodic._fix_create_update_batch(
+            self.ctx, constants.TYPE_NETWORKS, rows)
+        self.assertEqual([-1], revisions_at_commit)
+        self.assertEqual(5, self._get_net_revision())
+
+    @mock.patch.object(maintenance.DBInconsistenciesPeriodics,
+                       '_fix_create_update_inconsistency')
+    def test__fix_create_update_batch_commit_failure_no_bump(self, mock_fix):
+        rows = self._setup_batch_revision_bump()
+        txn = self.fake_ovn_client._nb_idl.transaction.return_value
+        txn.__exit__.side_effect = RuntimeError
+        self.periodic._fix_create_update_batch(
+            self.ctx, constants.TYPE_NETWORKS, rows)
+        self.assertEqual(-1, self._get_net_revision())
+        mock_fix.assert_called_once_with(self.ctx, rows[0])
+
+    def _test_fix_create_update_batch_update_path(self, ovn_revision):
+        with db_api.CONTEXT_WRITER.using(self.ctx):
+            ovn_revision_numbers_db.create_initial_revision(
+                self.ctx, self.net['id'], constants.TYPE_NETWORKS,
+                revision_number=1)
+        rows = [mock.Mock(resource_uuid=self.net['id'],
+                          resource_type=constants.TYPE_NETWORKS)]
+        nb_idl = mock.MagicMock()
+        client = ovn_client.OVNClient(nb_idl, mock.Mock())
+        client._l3_plugin_property = mock.Mock()
+        periodic = maintenance.DBInconsistenciesPeriodics(client)
+        periodic._resources_func_map[constants.TYPE_NETWORKS][
+            'neutron_get_all'] = mock.Mock(
+                return_value=[dict(self.net, revision_number=5)])
+        nb_idl.get_lswitch.return_value = mock.Mock(
+            external_ids={constants.OVN_REV_NUM_EXT_ID_KEY: '1'}, ports=[])
+        check_rev_cmd = mock.Mock(result=None)
+        nb_idl.check_revision_number.return_value = check_rev_cmd
+        # like ovsdbapp, the nested transactions are the outer one, which
+        # runs the check revision command when it is committed
+        txn_depth = []
+
+        def txn_enter():
+            txn_depth.append(None)
+            return nb_idl.transaction.return_value
+
+        def txn_exit(*args):
+            txn_depth.pop()
+            if not txn_depth and ovn_revision <= 5:
+                check_rev_cmd.result = constants.TXN_COMMITTED
+
+        txn = nb_idl.transaction.return_value
+        txn.__enter__.side_effect = txn_enter
+        txn.__exit__.side_effect = txn_exit
+        with mock.patch.object(client, '_qos_driver'), \
+                mock.patch.object(client, 'is_external_ports_supported',
+                                  return_value=False):
+            periodic._fix_create_update_batch(
+                self.ctx, constants.TYPE_NETWORKS, rows)
+        nb_idl.db_set.assert_called_once_with(
+            'Logical_Switch', utils.ovn_name(self.net['id']), mock.ANY,
+            mock.ANY)
+        return self._get_net_revision()
+
+    def test__fix_create_update_batch_update_path_bumps(self):
+        self.assertEqual(
+            5, self._test_fix_create_update_batch_update_path(1))
+
+    def test__fix_create_update_batch_update_path_not_committed(self):
+        self.assertEqual(
+            1, self._test_fix_create_update_batch_update_path(6))
+
     def _test_migrate_to_port_groups_helper(self, a_sets, migration_expected,
                                             never_again):
         self.fake_ovn_client._nb_idl.get_address_sets.return_value = a_sets
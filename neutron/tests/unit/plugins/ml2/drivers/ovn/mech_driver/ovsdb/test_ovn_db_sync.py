@@ -16,13 +16,16 @@ import collections
 from unittest import mock
 
 from neutron_lib import constants as const
+from oslo_config import cfg
 
 from neutron.common.ovn import acl
 from neutron.common.ovn import constants as ovn_const
+from neutron.common.ovn import utils
 from neutron.plugins.ml2.drivers.ovn.mech_driver.ovsdb import impl_idl_ovn
 from neutron.plugins.ml2.drivers.ovn.mech_driver.ovsdb import ovn_client
 from neutron.plugins.ml2.drivers.ovn.mech_driver.ovsdb import ovn_db_sync
 from neutron.services.ovn_l3 import plugin as ovn_plugin
+from neutron.tests import base
 from neutron.tests.unit.plugins.ml2.drivers.ovn.mech_driver import \
     test_mech_driver
 
@@ -386,7 +389,7 @@ class TestOvnNbSyncML2(test_mech_driver.OVNMechanismDriverTestCase):
         def get_segments(self, filters):
             segs = []
             for segment in self.segments:
-                if segment['network_id'] == filters['network_id'][0]:
+                if segment['network_id'] in filters['network_id']:
                     segs.append(segment)
             return segs
 
@@ -555,6 +558,9 @@ class TestOvnNbSyncML2(test_mech_driver.OVNMechanismDriverTestCase):
 
         ovn_nb_synchronizer.do_sync()
 
+        # The segments of all the networks are fetched at once
+        ovn_nb_synchronizer.segments_plugin.get_segments.assert_called_once()
+
         create_port_groups_calls = [mock.call(**a)
                                     for a in add_port_groups_list]
         self.assertEqual(
@@ -1106,6 +1112,171 @@ class TestOvnNbSyncML2(test_mech_driver.OVNMechanismDriverTestCase):
                                                        expected_added,
                                                        expected_deleted)
 
+    def _mock_sync_phases(self, ovn_nb_synchronizer):
+        phases = ['sync_port_groups', 'sync_networks_ports_and_dhcp_opts',
+                  'sync_port_dns_records', 'sync_acls',
+                  'sync_routers_and_rports', 'sync_port_qos_policies',
+                  'sync_fip_qos_policies']
+        manager = mock.Mock()
+        for phase in phases:
+            phase_mock = getattr(manager, phase)
+            phase_mock.__name__ = phase
+            setattr(ovn_nb_synchronizer, phase, phase_mock)
+        return manager, phases
+
+    def test_ovn_nb_sync_phases(self):
+        ovn_nb_synchronizer = ovn_db_sync.OvnNbSynchronizer(
+            self.plugin, self.mech_driver.nb_ovn, self.mech_driver.sb_ovn,
+            'repair', self.mech_driver)
+        manager, phases = self._mock_sync_phases(ovn_nb_synchronizer)
+        ovn_nb_synchronizer.do_sync()
+        self.assertEqual(['sync_port_groups',
+                          'sync_networks_ports_and_dhcp_opts',
+                          'sync_port_dns_records', 'sync_acls',
+                          'sync_routers_and_rports', 'sync_fip_qos_policies',
+                          'sync_port_qos_policies'],
+                         [c[0] for c in manager.method_calls])
+        stats = ovn_nb_synchronizer.get_phase_stats()
+        self.assertEqual(set(phases), set(stats))
+        self.assertEqual({'duration', 'commands', 'transactions'},
+                         set(stats['sync_acls']))
+
+    def test_ovn_nb_sync_concurrent_phases(self):
+        cfg.CONF.set_override('neutron_sync_concurrent_phases', True,
+                              group='ovn')
+        ovn_nb_synchronizer = ovn_db_sync.OvnNbSynchronizer(
+            self.plugin, self.mech_driver.nb_ovn, self.mech_driver.sb_ovn,
+            'repair', self.mech_driver)
+        manager, phases = self._mock_sync_phases(ovn_nb_synchronizer)
+        manager.sync_acls.side_effect = RuntimeError
+        # the failure is raised once all the phases are run
+        self.assertRaises(RuntimeError, ovn_nb_synchronizer.do_sync)
+        called = [c[0] for c in manager.method_calls]
+        self.assertEqual(['sync_port_groups',
+                          'sync_networks_ports_and_dhcp_opts'], called[:2])
+        self.assertEqual(set(phases), set(called))
+        self.assertLess(called.index('sync_routers_and_rports'),
+                        called.index('sync_fip_qos_policies'))
+
+    def test_ovn_nb_sync_phases_failure(self):
+        ovn_nb_synchronizer = ovn_db_sync.OvnNbSynchronizer(
+            self.plugin, self.mech_driver.nb_ovn, self.mech_driver.sb_ovn,
+            'repair', self.mech_driver)
+        manager, _phases = self._mock_sync_phases(ovn_nb_synchronizer)
+        manager.sync_acls.side_effect = RuntimeError
+        self.assertRaises(RuntimeError, ovn_nb_synchronizer.do_sync)
+        self.assertEqual(['sync_port_groups',
+                          'sync_networks_ports_and_dhcp_opts',
+                          'sync_port_dns_records', 'sync_acls'],
+                         [c[0] for c in manager.method_calls])
+
+    def test_sync_port_groups_adds_ports(self):
+        ovn_nb_synchronizer = ovn_db_sync.OvnNbSynchronizer(
+            self.plugin, self.mech_driver.nb_ovn, self.mech_driver.sb_ovn,
+            'repair', self.mech_driver)
+        ovn_api = mock.MagicMock()
+        ovn_api.db_list_rows.return_value.execute.return_value = []
+        lsps = [mock.Mock() for _ in range(2)]
+        lsps[0].name, lsps[1].name = 'p1', 'p2'
+        ovn_api.lsp_list.return_value.execute.return_value = lsps
+        db_ports = [
+            {'id': 'p1', 'security_groups': ['sg1'],
+             'port_security_enabled': True},
+            {'id': 'p2', 'security_groups': [],
+             'port_security_enabled': False},
+            {'id': 'p3', 'security_groups': ['sg1'],
+             'port_security_enabled': True}]
+        sg_pg = utils.ovn_port_group_name('sg1')
+        drop_pg = ovn_const.OVN_DROP_PORT_GROUP_NAME
+        with mock.patch.object(ovn_nb_synchronizer, 'ovn_api', ovn_api), \
+                mock.patch.object(ovn_nb_synchronizer.core_plugin,
+                                  'get_security_groups',
+                                  return_value=[{'id': 'sg1'}]), \
+                mock.patch.object(ovn_nb_synchronizer,
+                                  '_get_resources_paged',
+                                  return_value=iter(db_ports)), \
+                mock.patch.object(ovn_nb_synchronizer,
+                                  '_batched_transaction') as batched_txn:
+            ovn_nb_synchronizer.sync_port_groups(mock.Mock())
+        txn = batched_txn.return_value.__enter__.return_value
+        self.assertEqual(
+            [mock.call(ovn_api.pg_add.return_value)] * 2 +
+            [mock.call(ovn_api.pg_add_ports.return_value)] * 2,
+            txn.add.call_args_list)
+        self.assertEqual([mock.call(name=drop_pg, acls=[]),
+                          mock.call(name=sg_pg, acls=[], external_ids={
+                              ovn_const.OVN_SG_EXT_ID_KEY: 'sg1'})],
+                         ovn_api.pg_add.call_args_list)
+        # only the ports in OVN are added, to their port groups
+        self.assertEqual(sorted([mock.call(drop_pg, 'p1'),
+                                 mock.call(sg_pg, 'p1')]),
+                         sorted(ovn_api.pg_add_ports.call_args_list))
+
+    def test_get_resources_paged(self):
+        cfg.CONF.set_override('neutron_sync_page_size', 2, group='ovn')
+        resources = [{'id': i} for i in range(5)]
+
+        def get_resources(ctx, filters=None, sorts=None, limit=None,
+                          marker=None):
+            start = 0 if marker is None else marker + 1
+            return resources[start:start + limit]
+
+        get_resources = mock.Mock(side_effect=get_resources)
+        self.assertEqual(resources, list(
+            ovn_db_sync.OvnNbSynchronizer._get_resources_paged(
+                get_resources, mock.sentinel.ctx)))
+        self.assertEqual(3, get_resources.call_count)
+        get_resources.assert_called_with(
+            mock.sentinel.ctx, filters=None, sorts=[('id', True)], limit=2,
+            marker=3)
+
+    def test_get_resources_paged_no_page_size(self):
+        cfg.CONF.set_override('neutron_sync_page_size', 0, group='ovn')
+        get_resources = mock.Mock(return_value=[{'id': 1}])
+        self.assertEqual([{'id': 1}], list(
+            ovn_db_sync.OvnNbSynchronizer._get_resources_paged(
+                get_resources, mock.sentinel.ctx, filters={'a': 'b'})))
+        get_resources.assert_called_once_with(mock.sentinel.ctx,
+                                              filters={'a': 'b'})
+
+
+class TestBatchedTransaction(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestBatchedTransaction, self).setUp()
+        self.ovn_api = mock.MagicMock()
+        self.txn = self.ovn_api.transaction.return_value.__enter__.\
+            return_value
+
+    def test_checkpoint(self):
+        stats = collections.Counter()
+        with ovn_db_sync.BatchedTransaction(self.ovn_api, 2, stats) as txn:
+            for cmd in range(5):
+                txn.add(cmd)
+                txn.checkpoint()
+            self.assertEqual(4, self.txn.add.call_count)
+        self.assertEqual([mock.call(cmd) for cmd in range(5)],
+                         self.txn.add.call_args_list)
+        self.assertEqual(3, self.ovn_api.transaction.call_count)
+        self.assertEqual({'commands': 5, 'transactions': 3}, stats)
+
+    def test_no_batch_size(self):
+        with ovn_db_sync.BatchedTransaction(self.ovn_api, 0) as txn:
+            for cmd in range(5):
+                txn.add(cmd)
+                txn.checkpoint()
+        self.ovn_api.transaction.assert_called_once_with(check_error=True)
+        self.assertEqual(5, self.txn.add.call_count)
+
+    def test_exception_discards_commands(self):
+        def add_and_fail():
+            with ovn_db_sync.BatchedTransaction(self.ovn_api, 10) as txn:
+                txn.add(mock.sentinel.cmd)
+                raise ValueError()
+
+        self.assertRaises(ValueError, add_and_fail)
+        self.ovn_api.transaction.assert_not_called()
+
 
 class TestOvnSbSyncML2(test_mech_driver.OVNMechanismDriverTestCase):
 
@@ -280,6 +280,24 @@ class Ml2DBTestCase(testlib_api.SqlTestCase):
         port = ml2_db.get_port(self.ctx, port_id)
         self.assertIsNone(port)
 
+    def test_get_port_and_network_revisions(self):
+        network_id = uuidutils.generate_uuid()
+        port_id = uuidutils.generate_uuid()
+        self._setup_neutron_network(network_id)
+        port = self._setup_neutron_port(network_id, port_id)
+        network = network_obj.Network.get_object(self.ctx, id=network_id)
+
+        revisions = ml2_db.get_port_and_network_revisions(
+            self.ctx, [port_id, 'unknown'])
+        self.assertEqual(
+            {port_id: (network_id, port.revision_number,
+                       network.revision_number)},
+            revisions)
+
+    def test_get_port_and_network_revisions_no_ports(self):
+        self.assertEqual({},
+                         ml2_db.get_port_and_network_revisions(self.ctx, []))
+
     def test_generating_multiple_mac_addresses(self):
         mac_regex = "^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$"
 
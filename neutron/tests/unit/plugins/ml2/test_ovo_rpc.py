@@ -13,15 +13,20 @@
 
 from unittest import mock
 
+from neutron_lib.api.definitions import portbindings
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import resources
 from neutron_lib import context
 from neutron_lib.db import api as db_api
 from neutron_lib.plugins import directory
+from oslo_config import cfg
 
 from neutron.objects import address_group
 from neutron.objects import network
 from neutron.objects import securitygroup
 from neutron.objects import subnet
 from neutron.plugins.ml2 import ovo_rpc
+from neutron.tests import base
 from neutron.tests.unit.plugins.ml2 import test_plugin
 
 
@@ -32,7 +37,8 @@ class OVOServerRpcInterfaceTestCase(test_plugin.Ml2PluginV2TestCase):
         self.plugin = directory.get_plugin()
         self.ctx = context.get_admin_context()
         self.received = []
-        receive = lambda s, ctx, obs, evt: self.received.append((obs[0], evt))
+        receive = lambda s, ctx, obs, evt: self.received.extend(
+            (ob, evt) for ob in obs)
         mock.patch('neutron.api.rpc.handlers.resources_rpc.'
                    'ResourcesPushRpcApi.push', new=receive).start()
         # base case blocks the handler
@@ -58,6 +64,14 @@ class OVOServerRpcInterfaceTestCase(test_plugin.Ml2PluginV2TestCase):
         self.fail("Could not find OVO %s with ID %s or event %s in %s" %
                   (ovotype, oid, event, self.received))
 
+    def _get_last_object_received(self, ovotype, oid, event):
+        self.plugin.ovo_notifier.wait()
+        for obj, evt in reversed(self.received):
+            if isinstance(obj, ovotype) and obj.id == oid and evt == event:
+                return obj
+        self.fail("Could not find OVO %s with ID %s or event %s in %s" %
+                  (ovotype, oid, event, self.received))
+
     def test_network_lifecycle(self):
         with self.network() as n:
             self._assert_object_received(network.Network,
@@ -115,26 +129,113 @@ class OVOServerRpcInterfaceTestCase(test_plugin.Ml2PluginV2TestCase):
             self.assertEqual([], self.received)
 
     def test_address_group_lifecycle(self):
+        # several changes of the same address group may be coalesced in a
+        # single push, so only the latest state received is checked
         ag = self.plugin.create_address_group(self.ctx,
             {'address_group': {'project_id': self._tenant_id,
                                'name': 'an-address-group',
                                'description': 'An address group',
                                'addresses': ['10.0.0.1/32',
                                              '2001:db8::/32']}})
-        self._assert_object_received(
-            address_group.AddressGroup, ag['id'], 'updated', 2)
+        obj = self._get_last_object_received(
+            address_group.AddressGroup, ag['id'], 'updated')
+        self.assertEqual(2, len(obj.addresses))
         self.plugin.update_address_group(self.ctx, ag['id'],
             {'address_group': {'name': 'an-address-group-other-name'}})
-        self._assert_object_received(
-            address_group.AddressGroup, ag['id'], 'updated', 3)
+        obj = self._get_last_object_received(
+            address_group.AddressGroup, ag['id'], 'updated')
+        self.assertEqual('an-address-group-other-name', obj.name)
         self.plugin.add_addresses(self.ctx, ag['id'],
             {'addresses': ['10.0.0.2/32']})
-        self._assert_object_received(
-            address_group.AddressGroup, ag['id'], 'updated', 4)
+        obj = self._get_last_object_received(
+            address_group.AddressGroup, ag['id'], 'updated')
+        self.assertEqual(3, len(obj.addresses))
         self.plugin.remove_addresses(self.ctx, ag['id'],
             {'addresses': ['10.0.0.1/32']})
-        self._assert_object_received(
-            address_group.AddressGroup, ag['id'], 'updated', 5)
+        obj = self._get_last_object_received(
+            address_group.AddressGroup, ag['id'], 'updated')
+        self.assertEqual(2, len(obj.addresses))
         self.plugin.delete_address_group(self.ctx, ag['id'])
         self._assert_object_received(
             address_group.AddressGroup, ag['id'], 'deleted')
+
+
+class ObjectChangeHandlerTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(ObjectChangeHandlerTestCase, self).setUp()
+        mock.patch.object(ovo_rpc.threading, 'Thread').start()
+        mock.patch.object(db_api, 'get_context_manager').start()
+        self.obj_class = mock.Mock()
+        self.push_api = mock.Mock()
+        self.handler = ovo_rpc._ObjectChangeHandler(
+            'fake_resource', self.obj_class, self.push_api)
+        self.ctx = context.get_admin_context()
+
+    def _queue(self, resource_id, ctx=None):
+        ctx = ctx or self.ctx
+        self.handler._resources_to_push.put((resource_id, ctx.to_dict()))
+
+    def test__get_batch_bounded_by_max_batch_size(self):
+        cfg.CONF.set_override('ovo_push_max_batch_size', 3, 'ml2')
+        for resource_id in range(5):
+            self._queue(resource_id)
+        self.assertEqual(
+            [0, 1, 2], [item[0] for item in self.handler._get_batch()])
+        self.assertEqual(
+            [3, 4], [item[0] for item in self.handler._get_batch()])
+
+    def test__dispatch_batch_single_get_objects_and_push(self):
+        objs = [mock.Mock(id='a'), mock.Mock(id='b')]
+        self.obj_class.get_objects.return_value = objs
+        for resource_id in ('a', 'b', 'a', 'c'):
+            self._queue(resource_id)
+        self.handler._dispatch_batch(self.handler._get_batch())
+        self.obj_class.get_objects.assert_called_once_with(
+            mock.ANY, id=['a', 'b', 'c'])
+        self.obj_class.assert_called_once_with(id='c')
+        self.push_api.push.assert_has_calls([
+            mock.call(mock.ANY, objs, 'updated'),
+            mock.call(mock.ANY, [self.obj_class.return_value], 'deleted')])
+        self.assertEqual(2, self.push_api.push.call_count)
+
+    def test__dispatch_batch_merges_requests(self):
+        self.obj_class.get_objects.side_effect = lambda ctx, id: [
+            mock.Mock(id=resource_id) for resource_id in id]
+        other_ctx = context.get_admin_context()
+        self._queue('a')
+        self._queue('b', other_ctx)
+        self._queue('c')
+        with mock.patch.object(ovo_rpc.LOG, 'debug') as log_debug:
+            self.handler._dispatch_batch(self.handler._get_batch())
+        self.obj_class.get_objects.assert_called_once_with(
+            mock.ANY, id=['a', 'b', 'c'])
+        self.assertEqual(1, self.push_api.push.call_count)
+        push_ctx = self.push_api.push.call_args[0][0]
+        self.assertTrue(push_ctx.is_admin)
+        self.assertEqual(['a', 'b', 'c'],
+                         [o.id for o in self.push_api.push.call_args[0][1]])
+        self.assertEqual([self.ctx.request_id, other_ctx.request_id],
+                         log_debug.call_args[0][1]['requests'])
+
+    def test__dispatch_batch_previous_port_scopes(self):
+        cfg.CONF.set_override('rpc_scoped_resource_push', True)
+        handler = ovo_rpc._ObjectChangeHandler(
+            resources.PORT, self.obj_class, self.push_api)
+        self.obj_class.get_objects.return_value = []
+        original = {'id': 'a', 'network_id': 'net1',
+                    portbindings.HOST_ID: 'host1',
+                    'security_groups': ['sg1']}
+        payload = events.DBEventPayload(
+            self.ctx, resource_id='a',
+            states=(original, dict(original, security_groups=['sg2'])))
+        mock.patch.object(handler, '_is_session_semantic_violated',
+                          return_value=False).start()
+        handler.handle_event(resources.PORT, events.AFTER_UPDATE, self,
+                             payload)
+        handler._dispatch_batch(handler._get_batch())
+        self.push_api.push.assert_called_once_with(
+            mock.ANY, [self.obj_class.return_value], 'deleted',
+            previous_scopes={'a': {('network', 'net1'), ('host', 'host1'),
+                                   ('security_group', 'sg1')}})
+        self.assertEqual({}, handler._previous_scopes)
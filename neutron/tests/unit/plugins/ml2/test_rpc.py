@@ -22,6 +22,7 @@ from unittest import mock
 
 from neutron_lib.agent import topics
 from neutron_lib.api.definitions import portbindings
+from neutron_lib.callbacks import events
 from neutron_lib.callbacks import resources
 from neutron_lib import constants
 from neutron_lib.plugins import constants as plugin_constants
@@ -340,6 +341,161 @@ class RpcCallbacksTestCase(base.BaseTestCase):
         self.assertEqual(expected, res)
 
 
+class DeviceDetailsCacheTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(DeviceDetailsCacheTestCase, self).setUp()
+        cfg.CONF.set_override('device_details_cache_size', 10, group='ml2')
+        self.callbacks = plugin_rpc.RpcCallbacks(mock.Mock(), mock.Mock())
+        self.cache = self.callbacks.device_details_cache
+        self.plugin = mock.MagicMock()
+        directory.add_plugin(plugin_constants.CORE, self.plugin)
+        self.revisions = {}
+        mock.patch.object(
+            ml2_db, 'get_port_and_network_revisions',
+            side_effect=lambda ctx, port_ids: {
+                p: self.revisions[p] for p in port_ids
+                if p in self.revisions}).start()
+        self.contexts = {}
+        self.plugin.get_bound_ports_contexts.side_effect = (
+            lambda ctx, devices, host: {d: self.contexts.get(d)
+                                        for d in devices})
+
+    def _add_port(self, port_id, network_id='net1', status='ACTIVE',
+                  host='host1', device_owner='compute:nova'):
+        port = {'id': port_id, 'network_id': network_id,
+                'mac_address': 'fa:16:3e:00:00:01', 'admin_state_up': True,
+                'status': status, 'fixed_ips': [],
+                'device_owner': device_owner,
+                'allowed_address_pairs': [], 'revision_number': 1,
+                portbindings.HOST_ID: host, portbindings.PROFILE: {}}
+        port_context = mock.Mock(current=port, host=host,
+                                 bottom_bound_segment={
+                                     'network_type': 'vxlan',
+                                     'segmentation_id': 100,
+                                     'physical_network': None})
+        port_context.network.current = {'id': network_id,
+                                        'revision_number': 5}
+        port_context.network._network = {'mtu': 1450}
+        self.contexts[port_id] = port_context
+        self.revisions[port_id] = (network_id, 1, 5)
+        return port_context
+
+    def _get_details(self, devices, host='host1'):
+        return self.callbacks.get_devices_details_list_and_failed_devices(
+            'fake_context', devices=devices, agent_id='agent', host=host)
+
+    def test_details_served_from_cache(self):
+        self._add_port('port1')
+        self._add_port('port2')
+        first = self._get_details(['port1', 'port2'])
+        self.plugin.get_bound_ports_contexts.reset_mock()
+        second = self._get_details(['port1', 'port2'])
+        self.assertEqual(first, second)
+        self.assertFalse(self.plugin.get_bound_ports_contexts.called)
+        self.assertEqual(2, self.cache.hits)
+
+    def test_cache_miss_on_revision_change(self):
+        self._add_port('port1')
+        self._add_port('port2')
+        self._get_details(['port1', 'port2'])
+        self.revisions['port2'] = ('net1', 2, 5)
+        self.plugin.get_bound_ports_contexts.reset_mock()
+        res = self._get_details(['port1', 'port2'])
+        self.plugin.get_bound_ports_contexts.assert_called_once_with(
+            'fake_context', ['port2'], 'host1')
+        self.assertEqual(['port1', 'port2'],
+                         [d['device'] for d in res['devices']])
+
+    def test_cache_entries_per_host(self):
+        self._add_port('port1')
+        self._get_details(['port1'])
+        res = self._get_details(['port1'], host='host2')
+        self.assertIn(constants.NO_ACTIVE_BINDING, res['devices'][0])
+        self.assertEqual(1, len(self.cache))
+
+    def test_unbound_and_dvr_ports_not_cached(self):
+        port_context = self._add_port('port1')
+        port_context.bottom_bound_segment = None
+        self._add_port('port2',
+                       device_owner=constants.DEVICE_OWNER_DVR_INTERFACE)
+        self._get_details(['port1', 'port2', 'port3'])
+        self.assertEqual(0, len(self.cache))
+
+    def test_cached_new_status(self):
+        self._add_port('port1', host='host1')
+        self._get_details(['port1'])
+        self.plugin.update_port_statuses.reset_mock()
+        self._get_details(['port1'])
+        self.plugin.update_port_statuses.assert_called_once_with(
+            'fake_context', {'port1': constants.PORT_STATUS_BUILD}, 'host1')
+
+    def test_size_bounded(self):
+        cache = plugin_rpc.DeviceDetailsCache(2)
+        for port_id in ('port1', 'port2', 'port3'):
+            cache.store(port_id, 'host1', self._add_port(port_id),
+                        {'network_id': 'net1'})
+        self.assertEqual(2, len(cache))
+        self.assertEqual({'port2', 'port3'},
+                         set(cache.get_entries('ctx', ['port1', 'port2',
+                                                       'port3'], 'host1')))
+
+    @staticmethod
+    def _get_update_payload(original, updated):
+        return events.DBEventPayload('ctx', resource_id=updated['id'],
+                                     states=(original, updated))
+
+    def test_port_update_invalidates(self):
+        port = self._add_port('port1').current
+        self._get_details(['port1'])
+        updated = dict(port, admin_state_up=False, revision_number=2)
+        self.cache._handle_port_update(
+            resources.PORT, events.AFTER_UPDATE, None,
+            self._get_update_payload(port, updated))
+        self.assertEqual(0, len(self.cache))
+
+    def test_port_status_update_restamps(self):
+        port = self._add_port('port1').current
+        self._get_details(['port1'])
+        updated = dict(port, status='BUILD', revision_number=2)
+        self.cache._handle_port_update(
+            resources.PORT, events.AFTER_UPDATE, None,
+            self._get_update_payload(port, updated))
+        self.revisions['port1'] = ('net1', 2, 5)
+        entries = self.cache.get_entries('ctx', ['port1'], 'host1')
+        self.assertEqual('BUILD', entries['port1'].status)
+        self.assertEqual(2, entries['port1'].port_revision)
+
+    def test_port_status_update_by_other_process(self):
+        self._add_port('port1')
+        self._get_details(['port1'])
+        # the status was updated by another server process, no event was
+        # received by this cache
+        self.revisions['port1'] = ('net1', 2, 5)
+        self.contexts['port1'].current = dict(
+            self.contexts['port1'].current, revision_number=2)
+        self.plugin.get_bound_ports_contexts.reset_mock()
+        self._get_details(['port1'])
+        self.plugin.get_bound_ports_contexts.assert_called_once_with(
+            'fake_context', ['port1'], 'host1')
+        self.assertEqual(0, self.cache.hits)
+        self.assertEqual(2, self.cache.misses)
+        # the rebuilt entry is valid again
+        self.assertEqual(2, self.cache.get_entries(
+            'ctx', ['port1'], 'host1')['port1'].port_revision)
+
+    def test_network_update_invalidates(self):
+        self._add_port('port1', network_id='net1')
+        self._add_port('port2', network_id='net2')
+        self._get_details(['port1', 'port2'])
+        self.cache._handle_network_change(
+            resources.NETWORK, events.AFTER_UPDATE, None,
+            self._get_update_payload({'id': 'net1'}, {'id': 'net1'}))
+        self.assertEqual(
+            {'port2'},
+            set(self.cache.get_entries('ctx', ['port1', 'port2'], 'host1')))
+
+
 class RpcApiTestCase(base.BaseTestCase):
 
     def _test_rpc_api(self, rpcapi, topic, method, rpc_method, **kwargs):